@@ -18,6 +18,7 @@
 
 import collections
 import functools
+import itertools
 import logging
 import math
 import operator
@@ -105,6 +106,159 @@ def combine_timeseries(ts1, ts2):
     return ts[index]
 
 
+def _bit_length(x):
+    """Return the number of bits needed to represent each uint64 of `x`."""
+    length = numpy.minimum(numpy.frexp(x.astype(numpy.float64))[1], 64)
+    # The float conversion can round up to the next power of two
+    shifts = numpy.maximum(length - 1, 0).astype(numpy.uint64)
+    return length - ((length > 0) & ((x >> shifts) == 0))
+
+
+def _pack_bits(values, lengths):
+    """Pack the `lengths' lowest bits of each uint64 of `values'.
+
+    Bits are written most significant first and the result is padded with
+    zeros up to the next byte.
+    """
+    total = int(lengths.sum())
+    if not total:
+        return b""
+    offsets = (numpy.cumsum(lengths) - lengths)[lengths > 0]
+    values = values[lengths > 0]
+    lengths = lengths[lengths > 0]
+    words = offsets // 64
+    shifts = (offsets % 64).astype(numpy.uint64)
+    lengths = lengths.astype(numpy.uint64)
+    # Each value spans at most two 64 bits words: the head goes in the word the
+    # value starts in and the tail, if any, in the next one.
+    heads = (values << (numpy.uint64(64) - lengths)) >> shifts
+    spill = shifts + lengths > 64
+    tails = values[spill] << (
+        numpy.uint64(128) - lengths[spill] - shifts[spill])
+    all_words = numpy.empty(len(words) + len(tails), dtype=numpy.int64)
+    all_values = numpy.empty(len(all_words), dtype=numpy.uint64)
+    heads_idx = numpy.arange(len(words)) + numpy.cumsum(spill) - spill
+    tails_idx = heads_idx[spill] + 1
+    all_words[heads_idx] = words
+    all_words[tails_idx] = words[spill] + 1
+    all_values[heads_idx] = heads
+    all_values[tails_idx] = tails
+    starts = numpy.flatnonzero(numpy.diff(all_words, prepend=-1))
+    packed = numpy.bitwise_or.reduceat(all_values, starts).astype('>u8')
+    return packed.tobytes()[:(total + 7) // 8]
+
+
+def _unpack_bits(data, lengths):
+    """Unpack uint64 values of `lengths' bits each written by `_pack_bits'."""
+    total = int(lengths.sum())
+    if len(data) < (total + 7) // 8:
+        raise InvalidData()
+    values = numpy.zeros(len(lengths), dtype=numpy.uint64)
+    if not total:
+        return values
+    padded = numpy.zeros((total + 63) // 64 * 8 + 8, dtype=numpy.uint8)
+    padded[:(total + 7) // 8] = numpy.frombuffer(
+        data, dtype=numpy.uint8, count=(total + 7) // 8)
+    packed = padded.view('>u8').astype(numpy.uint64)
+    non_empty = lengths > 0
+    offsets = (numpy.cumsum(lengths) - lengths)[non_empty]
+    words = offsets // 64
+    shifts = (offsets % 64).astype(numpy.uint64)
+    heads = packed[words] << shifts
+    spill = shifts > 0
+    heads[spill] |= packed[words[spill] + 1] >> (
+        numpy.uint64(64) - shifts[spill])
+    values[non_empty] = heads >> (
+        numpy.uint64(64) - lengths[non_empty].astype(numpy.uint64))
+    return values
+
+
+def encode_varints(values):
+    """Encode an array of int64 as zigzag LEB128 varints."""
+    values = numpy.asarray(values, dtype=numpy.int64)
+    zigzag = ((values << 1) ^ (values >> 63)).view(numpy.uint64)
+    lengths = numpy.maximum((_bit_length(zigzag) + 6) // 7, 1)
+    if not len(values) or lengths.max() == 1:
+        return zigzag.astype(numpy.uint8).tobytes()
+    records = numpy.repeat(numpy.arange(len(values)), lengths)
+    positions = numpy.arange(int(lengths.sum())) - numpy.repeat(
+        numpy.cumsum(lengths) - lengths, lengths)
+    encoded = (zigzag[records] >> (7 * positions).astype(numpy.uint64)) & (
+        numpy.uint64(0x7f))
+    encoded[positions < lengths[records] - 1] |= numpy.uint64(0x80)
+    return encoded.astype(numpy.uint8).tobytes()
+
+
+def decode_varints(data):
+    """Decode a buffer of zigzag LEB128 varints to an array of int64."""
+    encoded = numpy.frombuffer(data, dtype=numpy.uint8)
+    if not len(encoded) or encoded.max() < 0x80:
+        zigzag = encoded.astype(numpy.int64)
+        return (zigzag >> 1) ^ -(zigzag & 1)
+    ends = numpy.flatnonzero(encoded < 0x80)
+    if not len(ends) or ends[-1] != len(encoded) - 1:
+        raise InvalidData()
+    starts = numpy.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    if lengths.max() > 10:
+        raise InvalidData()
+    positions = numpy.arange(len(encoded)) - numpy.repeat(starts, lengths)
+    zigzag = numpy.bitwise_or.reduceat(
+        (encoded & 0x7f).astype(numpy.uint64) << (
+            7 * positions).astype(numpy.uint64),
+        starts)
+    return ((zigzag >> numpy.uint64(1)).view(numpy.int64)
+            ^ -(zigzag & numpy.uint64(1)).view(numpy.int64))
+
+
+def encode_xor_floats(values):
+    """Encode an array of floats Gorilla-style.
+
+    Each float is XORed with the previous one. A bitmap tells which XORed
+    values are not zero, then for each of them an 11 bits header stores the
+    number of leading zeros (up to 31) and of meaningful bits, and finally
+    the meaningful bits are packed together.
+    """
+    bits = numpy.asarray(values, dtype='<d').view(numpy.uint64)
+    xored = bits.copy()
+    xored[1:] ^= bits[:-1]
+    non_zero = xored != 0
+    xored = xored[non_zero]
+    trailing = _bit_length(xored & (~xored + numpy.uint64(1))) - 1
+    leading = numpy.minimum(64 - _bit_length(xored), 31)
+    meaningful = 64 - leading - trailing
+    headers = ((leading << 6) | (meaningful - 1)).astype(numpy.uint64)
+    return (numpy.packbits(non_zero).tobytes()
+            + _pack_bits(headers, numpy.full(len(headers), 11))
+            + _pack_bits(xored >> trailing.astype(numpy.uint64),
+                         meaningful))
+
+
+def decode_xor_floats(data, count):
+    """Decode `count' floats encoded with `encode_xor_floats'."""
+    offset = (count + 7) // 8
+    if len(data) < offset:
+        raise InvalidData()
+    non_zero = numpy.unpackbits(numpy.frombuffer(
+        data, dtype=numpy.uint8, count=offset))[:count].astype(bool)
+    nb_non_zero = int(non_zero.sum())
+    headers = _unpack_bits(memoryview(data)[offset:],
+                           numpy.full(nb_non_zero, 11))
+    offset += (nb_non_zero * 11 + 7) // 8
+    leading = (headers >> numpy.uint64(6)).astype(numpy.int64)
+    meaningful = (headers & numpy.uint64(63)).astype(numpy.int64) + 1
+    trailing = 64 - leading - meaningful
+    if numpy.any(trailing < 0):
+        raise InvalidData()
+    xored = numpy.zeros(count, dtype=numpy.uint64)
+    xored[non_zero] = _unpack_bits(
+        memoryview(data)[offset:], meaningful) << trailing.astype(
+            numpy.uint64)
+    return numpy.bitwise_xor.accumulate(xored).view('<d')
+
+
 class GroupedTimeSeries(object):
     def __init__(self, ts, granularity, start=None):
         # NOTE(sileht): The whole class assumes ts is ordered and don't have
@@ -131,52 +285,70 @@ class GroupedTimeSeries(object):
         self.tstamps, self.counts = numpy.unique(self.indexes,
                                                  return_counts=True)
 
-    @staticmethod
-    def _sum(values, counts):
-        return numpy.bincount(
-            numpy.repeat(numpy.arange(counts.size), counts), weights=values)
+    # The following properties are the building blocks shared by the
+    # aggregation methods. They are computed lazily and only once per grouped
+    # serie so that computing several aggregation methods on the same
+    # GroupedTimeSeries (see `aggregate') does not do the same work again.
+    @functools.cached_property
+    def _group_ids(self):
+        return numpy.repeat(numpy.arange(self.counts.size), self.counts)
+
+    @functools.cached_property
+    def _group_starts(self):
+        return numpy.cumsum(self.counts) - self.counts
+
+    @functools.cached_property
+    def _sums(self):
+        return numpy.bincount(self._group_ids, weights=self._ts['values'])
+
+    @functools.cached_property
+    def _means(self):
+        return self._sums / self.counts
+
+    @functools.cached_property
+    def _ordered_values(self):
+        # Values sorted by group and then by value, used by all the order
+        # statistics (median and quantiles).
+        return self._ts['values'][
+            numpy.lexsort((self._ts['values'], self._group_ids))]
 
     def mean(self):
-        return make_timeseries(
-            self.tstamps,
-            self._sum(self._ts['values'], self.counts) / self.counts)
+        return make_timeseries(self.tstamps, self._means)
 
     def sum(self):
-        return make_timeseries(self.tstamps,
-                               self._sum(self._ts['values'], self.counts))
+        return make_timeseries(self.tstamps, self._sums)
 
+    # min ignores NaN unless all the values of a group are NaN,
+    # while max returns NaN as soon as a group has one: this is what the
+    # argsort based implementation used to return.
     def min(self):
-        ordered = self._ts['values'].argsort()
-        uniq_inv = numpy.repeat(numpy.arange(self.counts.size), self.counts)
-        values = numpy.zeros(self.tstamps.size)
-        values[uniq_inv[ordered][::-1]] = self._ts['values'][ordered][::-1]
-        return make_timeseries(self.tstamps, values)
+        if not self.counts.size:
+            return make_timeseries([], [])
+        return make_timeseries(
+            self.tstamps,
+            numpy.fmin.reduceat(self._ts['values'], self._group_starts))
 
     def max(self):
-        ordered = self._ts['values'].argsort()
-        uniq_inv = numpy.repeat(numpy.arange(self.counts.size), self.counts)
-        values = numpy.zeros(self.tstamps.size)
-        values[uniq_inv[ordered]] = self._ts['values'][ordered]
-        return make_timeseries(self.tstamps, values)
+        if not self.counts.size:
+            return make_timeseries([], [])
+        return make_timeseries(
+            self.tstamps,
+            numpy.maximum.reduceat(self._ts['values'], self._group_starts))
 
     def median(self):
-        ordered = numpy.lexsort((self._ts['values'], self.indexes))
         # TODO(gordc): can use np.divmod when centos supports numpy 1.13
         mid_diff = numpy.floor_divide(self.counts, 2)
         odd = numpy.mod(self.counts, 2)
         mid_floor = (numpy.cumsum(self.counts) - 1) - mid_diff
         mid_ceil = mid_floor + (odd + 1) % 2
+        ordered = self._ordered_values
         return make_timeseries(
-            self.tstamps, (self._ts['values'][ordered][mid_floor] +
-                           self._ts['values'][ordered][mid_ceil]) / 2.0)
+            self.tstamps, (ordered[mid_floor] + ordered[mid_ceil]) / 2.0)
 
     def std(self):
-        values = self._sum(self._ts['values'], self.counts) / self.counts
         diff_sq = numpy.square(self._ts['values'] -
-                               numpy.repeat(values, self.counts))
-        bin_sum = numpy.bincount(
-            numpy.repeat(numpy.arange(self.counts.size), self.counts),
-            weights=diff_sq)
+                               numpy.repeat(self._means, self.counts))
+        bin_sum = numpy.bincount(self._group_ids, weights=diff_sq)
         return make_timeseries(self.tstamps[self.counts > 1],
                                numpy.sqrt(bin_sum[self.counts > 1] /
                                           (self.counts[self.counts > 1] - 1)))
@@ -190,25 +362,57 @@ class GroupedTimeSeries(object):
         return make_timeseries(self.tstamps, values)
 
     def first(self):
-        cumcounts = numpy.cumsum(self.counts) - self.counts
-        values = self._ts['values'][cumcounts]
+        values = self._ts['values'][self._group_starts]
         return make_timeseries(self.tstamps, values)
 
+    @property
+    def _group_offsets(self):
+        # The position of the first point of each group's timeserie
+        return 0
+
     def quantile(self, q):
-        ordered = numpy.lexsort((self._ts['values'], self.indexes))
-        min_pos = numpy.cumsum(self.counts) - self.counts
-        real_pos = min_pos + (self.counts - 1) * (q / 100)
+        ordered = self._ordered_values
+        offsets = self._group_offsets
+        real_pos = (self._group_starts - offsets) + (self.counts - 1) * (
+            q / 100)
         floor_pos = numpy.floor(real_pos).astype(numpy.int64, copy=False)
         ceil_pos = numpy.ceil(real_pos).astype(numpy.int64, copy=False)
         values = (
-            self._ts['values'][ordered][floor_pos] * (ceil_pos - real_pos) +
-            self._ts['values'][ordered][ceil_pos] * (real_pos - floor_pos))
+            ordered[floor_pos + offsets] * (ceil_pos - real_pos) +
+            ordered[ceil_pos + offsets] * (real_pos - floor_pos))
         # NOTE(gordc): above code doesn't compute proper value if pct lands on
         # exact index, it sets it to 0. we need to set it properly here
         exact_pos = numpy.equal(floor_pos, ceil_pos)
-        values[exact_pos] = self._ts['values'][ordered][floor_pos][exact_pos]
+        values[exact_pos] = ordered[floor_pos + offsets][exact_pos]
         return make_timeseries(self.tstamps, values)
 
+    def aggregate(self, methods):
+        """Compute several aggregation methods at once.
+
+        The grouping, the per-group sums and the sort needed by the order
+        statistics are only computed once for all the methods.
+
+        :param methods: An iterable of aggregation method names, e.g.
+                        `mean', `max' or `90pct'. `rate:' methods are computed
+                        on one shared derived serie.
+        :return: A dict of {method: timeseries array}.
+        """
+        results = {}
+        rate_methods = []
+        for method in methods:
+            if method.startswith("rate:"):
+                rate_methods.append(method)
+                continue
+            agg_name, q = AggregatedTimeSerie._get_agg_method(method)
+            results[method] = AggregatedTimeSerie._resample_grouped(
+                self, agg_name, q)
+        if rate_methods:
+            derived = self.derived().aggregate(
+                [method[5:] for method in rate_methods])
+            for method in rate_methods:
+                results[method] = derived[method[5:]]
+        return results
+
     def derived(self):
         if not self.can_derive:
             raise TypeError('Cannot derive aggregates on calendar '
@@ -221,6 +425,259 @@ class GroupedTimeSeries(object):
                                  self.granularity, self.start)
 
 
+class SegmentedGroupedTimeSeries(GroupedTimeSeries):
+    """Several timeseries grouped at once.
+
+    The timeseries are concatenated in one array where each point is tagged
+    with the index of the timeserie it comes from, its segment. Groups never
+    span several segments, so the aggregation methods of `GroupedTimeSeries`
+    compute the aggregates of all the timeseries with the same few numpy
+    operations. `aggregate_segments` then scatters the results back per
+    timeserie.
+    """
+
+    def __init__(self, ts, segments, nb_segments, granularity, starts):
+        """Group a segmented timeseries array.
+
+        :param ts: The concatenation of ordered timeseries without duplicate
+                   timestamps.
+        :param segments: The (non-decreasing) segment index of each point.
+        :param nb_segments: The number of segments.
+        :param granularity: The granularity to group at.
+        :param starts: An array with the start timestamp of each segment.
+        """
+        self.granularity = granularity
+        self.can_derive = True
+        self.nb_segments = nb_segments
+        self.starts = starts
+        segment_starts = starts[segments]
+        keep = ts['timestamps'] >= segment_starts
+        self._ts = ts[keep]
+        self._point_segments = segments[keep]
+        keep_for_derive = ts['timestamps'] >= segment_starts - granularity
+        self._ts_for_derive = ts[keep_for_derive]
+        self._point_segments_for_derive = segments[keep_for_derive]
+        self.indexes = round_timestamp(self._ts['timestamps'], granularity)
+        new_group = numpy.ones(len(self._ts), dtype=bool)
+        new_group[1:] = (
+            (self.indexes[1:] != self.indexes[:-1])
+            | (self._point_segments[1:] != self._point_segments[:-1]))
+        group_starts = numpy.flatnonzero(new_group)
+        self.tstamps = self.indexes[group_starts]
+        self.counts = numpy.diff(numpy.append(group_starts, len(self._ts)))
+        self.segments = self._point_segments[group_starts]
+
+    @classmethod
+    def from_timeseries(cls, timeseries, granularity, starts):
+        """Group a list of timeseries arrays.
+
+        :param timeseries: A list of ordered timeseries arrays.
+        :param granularity: The granularity to group at.
+        :param starts: The timestamp to start grouping from, one per
+                       timeserie.
+        """
+        if timeseries:
+            ts = numpy.concatenate(timeseries)
+        else:
+            ts = make_timeseries([], [])
+        # NOTE(jd) Our whole serialization system is based on Epoch, and we
+        # store unsigned integer, so we can't store anything before Epoch.
+        if len(ts) != 0:
+            first = ts['timestamps'].min()
+            if first < UNIX_UNIVERSAL_START64:
+                raise BeforeEpochError(first)
+        segments = numpy.repeat(numpy.arange(len(timeseries)),
+                                [len(t) for t in timeseries])
+        return cls(ts, segments, len(timeseries), granularity,
+                   numpy.asarray(starts, dtype='datetime64[ns]'))
+
+    @functools.cached_property
+    def _group_offsets(self):
+        # Interpolate percentiles with positions relative to the start of each
+        # segment so the floating point rounding is the same as when grouping
+        # each timeserie on its own.
+        return numpy.searchsorted(self._point_segments, self.segments)
+
+    def derived(self):
+        # Only diff points that belong to the same segment
+        same_segment = (self._point_segments_for_derive[1:]
+                        == self._point_segments_for_derive[:-1])
+        timestamps = self._ts_for_derive['timestamps'][1:][same_segment]
+        values = numpy.diff(self._ts_for_derive['values'])[same_segment]
+        return self.__class__(
+            make_timeseries(timestamps, values),
+            self._point_segments_for_derive[1:][same_segment],
+            self.nb_segments, self.granularity, self.starts)
+
+    def _scatter(self, results, tss, prefix=""):
+        boundaries = numpy.arange(self.nb_segments + 1)
+        for method, ts in tss.items():
+            # std is the only method that does not return a point per group: it
+            # skips groups with a single point.
+            if method == "std":
+                segments = self.segments[self.counts > 1]
+            else:
+                segments = self.segments
+            bounds = numpy.searchsorted(segments, boundaries)
+            for result, start, end in zip(results, bounds[:-1], bounds[1:]):
+                result[prefix + method] = ts[start:end]
+
+    def aggregate_segments(self, methods):
+        """Compute several aggregation methods for every segment.
+
+        :param methods: An iterable of aggregation method names.
+        :return: A list with, for each segment, a dict of
+                 {method: timeseries array}.
+        """
+        results = [{} for _ in range(self.nb_segments)]
+        methods = list(methods)
+        self._scatter(results, self.aggregate(
+            [m for m in methods if not m.startswith("rate:")]))
+        rate_methods = [m[5:] for m in methods if m.startswith("rate:")]
+        if rate_methods:
+            derived = self.derived()
+            derived._scatter(results, derived.aggregate(rate_methods),
+                             prefix="rate:")
+        return results
+
+
+class GroupedTimeSeriesMatrix(object):
+    """Several timeseries sharing the same timestamps, grouped at once.
+
+    The values are a (timestamps x timeseries) matrix. The groups only
+    depend on the timestamps, so they are computed once and every
+    aggregation method reduces all the columns of the matrix with the same
+    numpy operations, giving the same results as `GroupedTimeSeries` on each
+    column.
+    """
+
+    def __init__(self, timestamps, values, granularity):
+        """Group the rows of a matrix of values.
+
+        :param timestamps: The ordered timestamps, without duplicates.
+        :param values: A (timestamps x timeseries) matrix of values.
+        :param granularity: The granularity to group at.
+        """
+        self.granularity = granularity
+        self.timestamps = numpy.asarray(timestamps, dtype='datetime64[ns]')
+        self.values = numpy.asarray(values, dtype=numpy.float64)
+        self.tstamps, self.counts = numpy.unique(
+            round_timestamp(self.timestamps, granularity),
+            return_counts=True)
+
+    @functools.cached_property
+    def _group_ids(self):
+        return numpy.repeat(numpy.arange(self.counts.size), self.counts)
+
+    @functools.cached_property
+    def _group_starts(self):
+        return numpy.cumsum(self.counts) - self.counts
+
+    def _group_sums(self, values):
+        # bincount sums the values of each cell in order, as
+        # `GroupedTimeSeries' does, so the results are exactly the same.
+        nb_columns = values.shape[1]
+        cells = (self._group_ids[:, None] * nb_columns +
+                 numpy.arange(nb_columns))
+        return numpy.bincount(
+            cells.ravel(), weights=values.ravel(),
+            minlength=self.counts.size * nb_columns,
+        ).reshape(self.counts.size, nb_columns)
+
+    @functools.cached_property
+    def _sums(self):
+        return self._group_sums(self.values)
+
+    @functools.cached_property
+    def _means(self):
+        return self._sums / self.counts[:, None]
+
+    @functools.cached_property
+    def _ordered_values(self):
+        # Values of each column sorted by group and then by value
+        indexes = numpy.lexsort(
+            (self.values.T,
+             numpy.broadcast_to(self._group_ids, self.values.T.shape)))
+        return numpy.take_along_axis(self.values.T, indexes, axis=1).T
+
+    def mean(self):
+        return self.tstamps, self._means
+
+    def sum(self):
+        return self.tstamps, self._sums
+
+    def min(self):
+        if not self.counts.size:
+            return self.tstamps, self._sums
+        return self.tstamps, numpy.fmin.reduceat(
+            self.values, self._group_starts, axis=0)
+
+    def max(self):
+        if not self.counts.size:
+            return self.tstamps, self._sums
+        return self.tstamps, numpy.maximum.reduceat(
+            self.values, self._group_starts, axis=0)
+
+    def median(self):
+        mid_diff = numpy.floor_divide(self.counts, 2)
+        odd = numpy.mod(self.counts, 2)
+        mid_floor = (numpy.cumsum(self.counts) - 1) - mid_diff
+        mid_ceil = mid_floor + (odd + 1) % 2
+        ordered = self._ordered_values
+        return self.tstamps, (ordered[mid_floor] + ordered[mid_ceil]) / 2.0
+
+    def std(self):
+        several = self.counts > 1
+        diff_sq = numpy.square(
+            self.values - numpy.repeat(self._means, self.counts, axis=0))
+        bin_sum = self._group_sums(diff_sq)
+        return self.tstamps[several], numpy.sqrt(
+            bin_sum[several] / (self.counts[several, None] - 1))
+
+    def count(self):
+        return self.tstamps, numpy.repeat(
+            self.counts[:, None], self.values.shape[1], axis=1).astype(
+                numpy.float64)
+
+    def last(self):
+        return self.tstamps, self.values[numpy.cumsum(self.counts) - 1]
+
+    def first(self):
+        return self.tstamps, self.values[self._group_starts]
+
+    def quantile(self, q):
+        ordered = self._ordered_values
+        real_pos = self._group_starts + (self.counts - 1) * (q / 100)
+        floor_pos = numpy.floor(real_pos).astype(numpy.int64, copy=False)
+        ceil_pos = numpy.ceil(real_pos).astype(numpy.int64, copy=False)
+        values = (
+            ordered[floor_pos] * (ceil_pos - real_pos)[:, None] +
+            ordered[ceil_pos] * (real_pos - floor_pos)[:, None])
+        # Same as `GroupedTimeSeries.quantile': the interpolation gives 0 when
+        # the position is exact.
+        exact_pos = numpy.equal(floor_pos, ceil_pos)
+        values[exact_pos] = ordered[floor_pos][exact_pos]
+        return self.tstamps, values
+
+    def derived(self):
+        return self.__class__(self.timestamps[1:],
+                              numpy.diff(self.values, axis=0),
+                              self.granularity)
+
+    def aggregate(self, method):
+        """Compute an aggregation method on every column.
+
+        :param method: An aggregation method name, e.g. `mean', `90pct' or
+                       `rate:max'.
+        :return: A tuple with the timestamps and the matrix of values.
+        """
+        if method.startswith("rate:"):
+            return self.derived().aggregate(method[5:])
+        agg_name, q = AggregatedTimeSerie._get_agg_method(method)
+        agg_func = getattr(self, agg_name)
+        return agg_func(q) if agg_name == 'quantile' else agg_func()
+
+
 class TimeSerie(object):
     """A representation of series of a timestamp with a value.
 
@@ -467,6 +924,40 @@ class BoundTimeSerie(TimeSerie):
         rounded = round_timestamp(self.timestamps[-1], self.block_size)
         return rounded - (self.block_size * self.back_window)
 
+    def blocks(self, start=None):
+        """Split the timeserie into one timeserie per block.
+
+        :param start: If not None, only return the blocks starting at or
+                      after this timestamp.
+        :return: A list of (block timestamp, `BoundTimeSerie`) sorted by
+                 timestamps, the blocks with no points being omitted.
+        """
+        ts = self.ts if start is None else self[start:]
+        if len(ts) == 0:
+            return []
+        block_timestamps, indexes = numpy.unique(
+            round_timestamp(ts['timestamps'], self.block_size),
+            return_index=True)
+        return [
+            (block_timestamp,
+             self.__class__(ts[begin:end], self.block_size, self.back_window))
+            for block_timestamp, begin, end in zip(
+                block_timestamps, indexes,
+                itertools.chain(indexes[1:], (len(ts),)))
+        ]
+
+    @classmethod
+    def from_blocks(cls, blocks, block_size, back_window=0):
+        """Build a timeserie from consecutive blocks.
+
+        :param blocks: A list of `BoundTimeSerie` sorted by timestamps and
+                       not overlapping.
+        """
+        if not blocks:
+            return cls(block_size=block_size, back_window=back_window)
+        return cls(numpy.concatenate([block.ts for block in blocks]),
+                   block_size, back_window)
+
     def _truncate(self):
         """Truncate the timeserie."""
         if self.block_size is not None and len(self.ts) != 0:
@@ -580,6 +1071,9 @@ class AggregatedTimeSerie(TimeSerie):
     PADDED_SERIAL_LEN = struct.calcsize("<?d")
     COMPRESSED_SERIAL_LEN = struct.calcsize("<Hd")
     COMPRESSED_TIMESPAMP_LEN = struct.calcsize("<H")
+    V4_HEADER = struct.Struct("<IIB")
+    V4_RAW_VALUES = 0
+    V4_XOR_VALUES = 1
 
     def __init__(self, aggregation, ts=None):
         """A time serie that is downsampled.
@@ -675,6 +1169,22 @@ class AggregatedTimeSerie(TimeSerie):
         return cls(aggregation,
                    ts=cls._resample_grouped(grouped_serie, agg_name, q))
 
+    @classmethod
+    def from_grouped_serie_multi(cls, grouped_serie, aggregations):
+        """Build several aggregated timeseries from one grouped serie.
+
+        :param grouped_serie: A `GroupedTimeSeries`.
+        :param aggregations: A list of `Aggregation` sharing the granularity
+                             of `grouped_serie'.
+        :return: A dict of {aggregation: AggregatedTimeSerie}.
+        """
+        tss = grouped_serie.aggregate(
+            set(aggregation.method for aggregation in aggregations))
+        return {
+            aggregation: cls(aggregation, ts=tss[aggregation.method])
+            for aggregation in aggregations
+        }
+
     def __eq__(self, other):
         return (isinstance(other, AggregatedTimeSerie)
                 and super(AggregatedTimeSerie, self).__eq__(other)
@@ -694,12 +1204,13 @@ class AggregatedTimeSerie(TimeSerie):
         return serialized_data[0] == ord("c")
 
     @classmethod
-    def unserialize(cls, data, key, aggregation):
+    def unserialize(cls, data, key, aggregation, version=3):
         """Unserialize an aggregated timeserie.
 
         :param data: Raw data buffer.
         :param key: A :class:`SplitKey` key.
         :param aggregation: The Aggregation object of this timeseries.
+        :param version: The format version the data was serialized with.
         """
         x, y = [], []
 
@@ -715,6 +1226,10 @@ class AggregatedTimeSerie(TimeSerie):
                         "(key=%s, len=%d); skipping.",
                         key, len(data))
                     raise InvalidData()
+                if version >= 4:
+                    y, x = cls._unserialize_v4(uncompressed)
+                    return cls.from_data(
+                        aggregation, y * key.sampling + key.key, x)
                 nb_points = len(uncompressed) // cls.COMPRESSED_SERIAL_LEN
 
                 try:
@@ -739,6 +1254,51 @@ class AggregatedTimeSerie(TimeSerie):
 
         return cls.from_data(aggregation, y, x)
 
+    @classmethod
+    def _unserialize_v4(cls, uncompressed):
+        try:
+            nb_points, timestamps_len, values_encoding = (
+                cls.V4_HEADER.unpack_from(uncompressed))
+        except struct.error:
+            raise InvalidData()
+        offset = cls.V4_HEADER.size
+        deltas = decode_varints(
+            memoryview(uncompressed)[offset:offset + timestamps_len])
+        if len(deltas) != nb_points:
+            raise InvalidData()
+        offset += timestamps_len
+        if values_encoding == cls.V4_XOR_VALUES:
+            values = decode_xor_floats(
+                memoryview(uncompressed)[offset:], nb_points)
+        elif values_encoding == cls.V4_RAW_VALUES:
+            try:
+                values = numpy.frombuffer(uncompressed, dtype='<d',
+                                          count=nb_points, offset=offset)
+            except ValueError:
+                raise InvalidData()
+        else:
+            raise InvalidData()
+        return numpy.cumsum(numpy.cumsum(deltas)), values
+
+    def _serialize_v4(self, start):
+        # Timestamps are stored as delta-of-delta of their position in the
+        # split, which is 0 for regular timeseries. Values are XORed with the
+        # previous one, which leaves only a few meaningful bits for slowly
+        # changing values. Raw values are kept instead if they compress better,
+        # e.g. when a few values are repeated in any order.
+        positions = ((self.timestamps - start.key)
+                     // self.aggregation.granularity).astype(numpy.int64)
+        deltas = numpy.diff(positions, prepend=0)
+        timestamps = encode_varints(numpy.diff(deltas, prepend=0))
+        return min(
+            (self._compress(
+                self.V4_HEADER.pack(len(positions), len(timestamps),
+                                    encoding) + timestamps + values)
+             for encoding, values in (
+                 (self.V4_XOR_VALUES, encode_xor_floats(self.values)),
+                 (self.V4_RAW_VALUES, self.values.tobytes()))),
+            key=len)
+
     def get_split_key(self, timestamp=None):
         """Return the split key for a particular timestamp.
 
@@ -753,7 +1313,7 @@ class AggregatedTimeSerie(TimeSerie):
         return SplitKey.from_timestamp_and_sampling(
             timestamp, self.aggregation.granularity)
 
-    def serialize(self, start, compressed=True):
+    def serialize(self, start, compressed=True, version=3):
         """Serialize an aggregated timeserie.
 
         The serialization starts with a byte that indicate the serialization
@@ -763,14 +1323,21 @@ class AggregatedTimeSerie(TimeSerie):
         The offset returned indicates at which offset the data should be
         written from. In the case of compressed data, this is always 0.
 
+        The version 4 of the compressed format encodes timestamps as
+        delta-of-delta varints and values as XORed floats. The uncompressed
+        format is the same for both versions.
+
         :param start: SplitKey to start serialization at.
         :param compressed: Serialize in a compressed format.
+        :param version: The format version to serialize with.
         :return: a tuple of (offset, data)
 
         """
         offset_div = self.aggregation.granularity
         # calculate how many seconds from start the series runs until and
         # initialize list to store alternating delimiter, float entries
+        if compressed and version >= 4:
+            return None, b"c" + self._serialize_v4(start)
         if compressed:
             # NOTE(jd) Use a double delta encoding for timestamps
             timestamps = numpy.empty(self.timestamps.size, dtype='<H')
@@ -894,6 +1461,23 @@ class AggregatedTimeSerie(TimeSerie):
                   % (((points * 2 * 8)
                       / ((t1 - t0) / serialize_times)) / (1024.0 * 1024.0)))
 
+            t0 = time.time()
+            for i in range(serialize_times):
+                o, s = ts.serialize(key, compressed=True, version=4)
+            t1 = time.time()
+            print("  Compressed v4 serialization speed: %.2f MB/s"
+                  % (((points * 2 * 8)
+                      / ((t1 - t0) / serialize_times)) / (1024.0 * 1024.0)))
+            print("   Bytes per point: %.2f" % (len(s) / float(points)))
+
+            t0 = time.time()
+            for i in range(serialize_times):
+                cls.unserialize(s, key, 'mean', version=4)
+            t1 = time.time()
+            print("  Uncompression v4 speed: %.2f MB/s"
+                  % (((points * 2 * 8)
+                      / ((t1 - t0) / serialize_times)) / (1024.0 * 1024.0)))
+
             def per_sec(t1, t0):
                 return 1 / ((t1 - t0) / serialize_times)
 
@@ -16,11 +16,11 @@
 # limitations under the License.
 import datetime
 import hashlib
+import time
 
 import daiquiri
 import random
 
-from collections import defaultdict
 from gnocchi import carbonara
 from gnocchi import indexer
 from gnocchi import utils
@@ -46,13 +46,31 @@ class Chef(object):
 
     """
 
-    def __init__(self, coord, incoming, index, storage):
+    # Number of resources ended at once by `resource_ended_at_normalization'
+    RESOURCE_ENDED_AT_PAGE_SIZE = 1000
+    # Number of resources deleted at once by `auto_clean_expired_resources'
+    EXPIRED_RESOURCES_PAGE_SIZE = 1000
+    # Number of metrics cleaned up at once by
+    # `clean_raw_data_inactive_metrics'
+    RAW_DATA_CLEANUP_PAGE_SIZE = 1000
+
+    def __init__(self, coord, incoming, index, storage,
+                 vectorized_processing=False, sack_chunk_max_metrics=None,
+                 sack_chunk_max_size=None):
         self.coord = coord
         self.incoming = incoming
         # This variable is an instance of the indexer,
         # which means, database connector.
         self.index = index
         self.storage = storage
+        # Whether the measures of a sack are aggregated all at once rather
+        # than metric by metric, see `StorageDriver.add_measures_to_metrics'.
+        self.vectorized_processing = vectorized_processing
+        # Bounds of the chunks in which the measures of a sack are processed,
+        # see `IncomingDriver.iter_process_measures_for_sack'. If none is
+        # set, the whole sack is processed at once.
+        self.sack_chunk_max_metrics = sack_chunk_max_metrics
+        self.sack_chunk_max_size = sack_chunk_max_size
 
     def auto_clean_expired_resources(self, resource_ended_at_normalization):
         """Cleans expired resources.
@@ -60,45 +78,58 @@ class Chef(object):
         This method will clean resources that have expired according to their 'ended_at' field. The method itself will
         not execute the cleanup, we will mark the resource as deleted, and leave for the system to execute the actual
         removal of the data in the next Janitor processing cycle.
+
+        The expired resources are deleted by pages of
+        `EXPIRED_RESOURCES_PAGE_SIZE', and the lock is released between two
+        pages so that other workers are not held up by a large cleanup.
         """
         moment_now = utils.utcnow()
         moment = moment_now - datetime.timedelta(seconds=resource_ended_at_normalization)
         attribute_filter = {"<": {"ended_at": moment}}
 
-        auto_clean_lock = None
-        try:
-            auto_clean_lock = self.get_sack_lock("auto_clean_expired_resources_lock")
-            if not auto_clean_lock.acquire():
-                LOG.debug("Cannot obtain lock for the automatic cleanup process. This means that something else is "
-                          "processing the cleanup.")
-                return
-
-            all_resources_found = self.index.list_resources(attribute_filter=attribute_filter)
-            LOG.debug("Number of resources found for deletion: [%s] that have been expired since [%s].",
-                      len(all_resources_found), moment)
-            if not all_resources_found:
-                LOG.debug("No resources found that have been expired since [%s]. Therefore, there is nothing to do. ",
-                          moment)
-                return
+        total_deleted = 0
+        while True:
+            auto_clean_lock = None
+            try:
+                auto_clean_lock = self.get_sack_lock("auto_clean_expired_resources_lock")
+                if not auto_clean_lock.acquire():
+                    LOG.debug("Cannot obtain lock for the automatic cleanup process. This means that something else "
+                              "is processing the cleanup.")
+                    return total_deleted
+
+                resources = self.index.list_resources(
+                    attribute_filter=attribute_filter,
+                    limit=self.EXPIRED_RESOURCES_PAGE_SIZE,
+                    sorts=["id:asc"])
+                if not resources:
+                    break
+
+                resource_ids = [r.id for r in resources]
+                LOG.info("Deleting resources [%s] as part of the automatic cleanup process because their 'ended_at' "
+                         "timestamp is less than [%s].", resource_ids, moment)
+                # NOTE: the ended_at condition is repeated so that a resource
+                # updated in the meantime is not deleted.
+                deleted = self.index.delete_resources(
+                    attribute_filter={"and": [
+                        {"in": {"id": resource_ids}},
+                        attribute_filter,
+                    ]})
+                total_deleted += deleted
+                if (deleted == 0
+                        or len(resources) < self.EXPIRED_RESOURCES_PAGE_SIZE):
+                    break
+            finally:
+                if auto_clean_lock:
+                    LOG.debug("Releasing lock for the automatic cleanup process.")
+                    auto_clean_lock.release()
 
-            all_resource_ids_deleted = []
-            for resource in all_resources_found:
-                LOG.info("Deleting resource [%s] as part of the automatic cleanup process because its 'ended_at' "
-                         "timestamp is less than [%s].", resource, moment)
-                self.index.delete_resource(resource.id)
-                LOG.debug("Resource [%s] deleted.", resource.id)
-                all_resource_ids_deleted.append(resource.id)
-
-            if all_resource_ids_deleted:
-                LOG.info("Finished deleting resources that have been expired since [%s]. All resources deleted: [%s].",
-                         moment, all_resource_ids_deleted)
-            else:
-                LOG.debug("No resources found that have been expired since [%s]. Therefore, there is nothing to do at "
-                          "this moment.", moment)
-        finally:
-            if auto_clean_lock:
-                LOG.debug("Releasing lock for the automatic cleanup process.")
-                auto_clean_lock.release()
+        if total_deleted:
+            LOG.info("Finished deleting %d resources that have been expired since [%s].",
+                     total_deleted, moment)
+        else:
+            LOG.debug("No resources found that have been expired since [%s]. Therefore, there is nothing to do at "
+                      "this moment.", moment)
+        return total_deleted
 
     def resource_ended_at_normalization(self, metric_inactive_after):
         """Marks resources as ended at if needed.
@@ -114,6 +145,9 @@ class Chef(object):
         we do not need to lock these metrics while processing, as they are
         inactive, and chances are that they will not receive measures anymore.
         Moreover, we are only touching metadata, and not the actual data.
+
+        The resources are listed and ended by pages of
+        `RESOURCE_ENDED_AT_PAGE_SIZE' rather than one by one.
         """
 
         moment_now = utils.utcnow()
@@ -128,56 +162,23 @@ class Chef(object):
                           "something else is already executing this step. Therefore, we can skip the processing for "
                           "this cycle.")
                 return
-            inactive_metrics = self.index.list_metrics(
-                attribute_filter={"<": {
-                    "last_measure_timestamp": moment}},
-                resource_policy_filter={"==": {"ended_at": None}}
-            )
-
-            LOG.debug("Inactive metrics found for processing: [%s].",
-                      inactive_metrics)
-
-            inactive_metrics_by_resource_id = defaultdict(list)
-            for metric in inactive_metrics:
-                resource_id = metric.resource_id
-                inactive_metrics_by_resource_id[resource_id].append(metric)
-
-            for resource_id in inactive_metrics_by_resource_id.keys():
-                if resource_id is None:
-                    LOG.debug("We do not need to process inactive metrics that do "
-                              "not have resource. Therefore, these metrics [%s] "
-                              "will be considered inactive, but there is nothing "
-                              "else we can do in this process.",
-                              inactive_metrics_by_resource_id[resource_id])
-                    continue
-                resource = self.index.get_resource(
-                    "generic", resource_id, with_metrics=True)
-                resource_metrics = resource.metrics
-                resource_inactive_metrics = inactive_metrics_by_resource_id.get(resource_id)
-
-                all_metrics_are_inactive = True
-                for m in resource_metrics:
-                    if m not in resource_inactive_metrics:
-                        all_metrics_are_inactive = False
-                        LOG.debug("Not all metrics of resource [%s] are inactive. "
-                                  "Metric [%s] is not inactive. The inactive "
-                                  "metrics are [%s].",
-                                  resource, m, resource_inactive_metrics)
-                        break
-
-                if all_metrics_are_inactive:
-                    LOG.info("All metrics [%s] of resource [%s] are inactive."
-                             "Therefore, we will mark it as finished with an"
-                             "ended at timestmap.", resource_metrics, resource)
-                    if resource.ended_at is not None:
-                        LOG.debug(
-                            "Resource [%s] already has an ended at value.", resource)
-                    else:
-                        LOG.info("Marking ended at timestamp for resource "
-                                 "[%s] because all of its metrics are inactive.",
-                                 resource)
-                        self.index.update_resource(
-                            resource.type, resource_id, ended_at=moment_now)
+
+            marker = None
+            while True:
+                resources = self.index.list_resources_with_inactive_metrics(
+                    moment, limit=self.RESOURCE_ENDED_AT_PAGE_SIZE,
+                    marker=marker)
+                if not resources:
+                    break
+                LOG.debug("Resources with only inactive metrics found for "
+                          "processing: [%s].", resources)
+                ended = self.index.end_resources(resources, moment_now)
+                LOG.info("Marked %d resources as ended at [%s] because all "
+                         "of their metrics are inactive since [%s].",
+                         ended, moment_now, moment)
+                if len(resources) < self.RESOURCE_ENDED_AT_PAGE_SIZE:
+                    break
+                marker = resources[-1][0]
         finally:
             if processing_lock:
                 LOG.debug("Releasing lock for the automatic resource ended at field normalization.")
@@ -201,54 +202,107 @@ class Chef(object):
         If the metric is not receiving new datapoints, the processing workflow
         will not mark the column "needs_raw_data_truncation" to False;
         therefore, that is how we identify such metrics.
-        """
 
-        metrics_to_clean = self.index.list_metrics(
-            attribute_filter={"==": {
-                "needs_raw_data_truncation": True}}
-        )
-
-        LOG.debug("Metrics [%s] found to execute the raw data cleanup.",
-                  metrics_to_clean)
-
-        sack_by_metric = self.group_metrics_by_sack(metrics_to_clean)
+        The metrics are listed by pages of `RAW_DATA_CLEANUP_PAGE_SIZE'. The
+        timeseries of a page are truncated with batched storage reads and
+        writes and their flag is reset with a single query.
 
+        :return: The number of metrics cleaned up.
+        """
+        attribute_filter = {"==": {"needs_raw_data_truncation": True}}
+        cleaned = 0
+        marker = None
+        while True:
+            if marker is None:
+                page_filter = attribute_filter
+            else:
+                page_filter = {"and": [attribute_filter,
+                                       {">": {"id": marker}}]}
+            metrics = self.index.list_metrics(
+                attribute_filter=page_filter,
+                limit=self.RAW_DATA_CLEANUP_PAGE_SIZE,
+                sorts=["id:asc"])
+            if not metrics:
+                break
+            LOG.debug("Metrics [%s] found to execute the raw data cleanup.",
+                      metrics)
+            cleaned += self._clean_raw_data_metrics(metrics)
+            if len(metrics) < self.RAW_DATA_CLEANUP_PAGE_SIZE:
+                break
+            marker = metrics[-1].id
+
+        if cleaned:
+            LOG.debug("Cleaned up the raw data of %d metrics.", cleaned)
+        return cleaned
+
+    def _clean_raw_data_metrics(self, metrics):
+        """Truncate the raw data of a page of metrics.
+
+        The metrics are cleaned up sack by sack, each sack being locked only
+        while its metrics are truncated. The metrics whose sack is locked are
+        skipped, they are cleaned up in a later cycle.
+
+        :return: The number of metrics cleaned up.
+        """
+        metrics_by_id = {m.id: m for m in metrics}
+        sacks = list(self.incoming.group_metrics_by_sack(metrics_by_id.keys()))
         # We randomize the list to reduce the chances of lock collision.
-        all_sacks = list(sack_by_metric.keys())
-        random.shuffle(all_sacks)
-        for sack in all_sacks:
-            LOG.debug("Executing the raw data cleanup for sack [%s].",
-                      sack)
+        random.shuffle(sacks)
+
+        cleaned = 0
+        truncated_ids = []
+        for sack, metric_ids in sacks:
             try:
                 sack_lock = self.get_sack_lock(sack)
-
                 if not sack_lock.acquire():
                     LOG.debug(
                         "Sack [%s] is locked, cannot clean its metric "
                         "now. Probably some other agent is processing its "
                         "metrics.", sack)
                     continue
-
-                sack_metrics = sack_by_metric[sack]
-
-                for metric in sack_metrics:
-                    self.execute_raw_data_cleanup(metric)
             except Exception:
                 LOG.error("Unable to lock sack [%s] for cleanup.",
                           sack, exc_info=True)
                 continue
-            finally:
-                if sack_lock:
-                    sack_lock.release()
-                    LOG.debug("Releasing lock [%s] for sack [%s].",
-                              sack_lock, sack)
+            try:
+                sack_metrics = [metrics_by_id[metric_id]
+                                for metric_id in metric_ids]
+                try:
+                    truncated = self.storage.truncate_unaggregated_timeseries(
+                        sack_metrics)
+                    LOG.debug("Truncated the raw data of metrics [%s].",
+                              truncated)
+                except Exception:
+                    LOG.warning("Unable to clean up the raw data of %d "
+                                "metrics at once, cleaning them one by one",
+                                len(sack_metrics), exc_info=True)
+                    for metric in sack_metrics:
+                        try:
+                            self.execute_raw_data_cleanup(metric)
+                        except Exception:
+                            LOG.error("Unable to clean up the raw data of "
+                                      "metric [%s].", metric.id,
+                                      exc_info=True)
+                        else:
+                            cleaned += 1
                 else:
-                    LOG.debug(
-                        "There is no lock for sack [%s] to be released.",
-                        sack)
+                    truncated_ids.extend(metric_ids)
+            finally:
+                sack_lock.release()
+                LOG.debug("Releasing lock [%s].", sack_lock)
 
-        if metrics_to_clean:
-            LOG.debug("Cleaned up metrics [%s].", metrics_to_clean)
+        # The flags of all the metrics of the page truncated at once are
+        # reset with a single query.
+        if truncated_ids:
+            try:
+                self.index.update_needs_raw_data_truncation_for_metrics(
+                    truncated_ids)
+            except Exception:
+                LOG.error("Unable to reset the raw data truncation flag of "
+                          "%d metrics.", len(truncated_ids), exc_info=True)
+            else:
+                cleaned += len(truncated_ids)
+        return cleaned
 
     def execute_raw_data_cleanup(self, metric):
         LOG.debug("Executing the raw data cleanup for metric [%s].",
@@ -264,7 +318,10 @@ class Chef(object):
         raw_measure = self.storage. \
             _get_or_create_unaggregated_timeseries_unbatched(metric)
 
-        if raw_measure:
+        if self.storage._is_segmented_head(raw_measure):
+            # The segments of the timeserie have to be truncated too
+            self.storage.truncate_unaggregated_timeseries([metric])
+        elif raw_measure:
             LOG.debug("Truncating metric [%s] for backwindow [%s].",
                       metric.id, back_window)
 
@@ -283,29 +340,25 @@ class Chef(object):
 
         self.index.update_needs_raw_data_truncation(metric.id)
 
-    def group_metrics_by_sack(self, metrics_to_clean):
-        sack_by_metric = {}
-        for metric in metrics_to_clean:
-            sack_for_metric = self.incoming.sack_for_metric(metric.id)
-            if sack_for_metric not in sack_by_metric.keys():
-                sack_by_metric[sack_for_metric] = []
-
-            sack_by_metric[sack_for_metric].append(metric)
-        LOG.debug("Metrics grouped by sacks: [%s].", sack_by_metric)
-        return sack_by_metric
-
     def expunge_metrics(self, cleanup_batch_size, sync=False):
         """Remove deleted metrics.
 
+        The metrics are removed from the incoming, storage and indexer drivers
+        in bulk. If that fails, they are removed one by one so a single
+        failing metric does not prevent the others to be expunged.
+
         :param cleanup_batch_size: The amount of metrics to delete in one
                                    run.
         :param sync: If True, then delete everything synchronously and raise
                      on error
         :type sync: bool
+        :return: The number of metrics expunged.
         """
+        start = time.monotonic()
         metrics_to_expunge = self.index.list_metrics(status='delete',
                                                      limit=cleanup_batch_size)
         metrics_by_id = {m.id: m for m in metrics_to_expunge}
+        metrics = []
         for sack, metric_ids in self.incoming.group_metrics_by_sack(
                 metrics_by_id.keys()):
             try:
@@ -325,24 +378,50 @@ class Chef(object):
                 LOG.error("Unable to lock sack %s for expunging metrics",
                           sack, exc_info=True)
             else:
-                for metric_id in metric_ids:
-                    metric = metrics_by_id[metric_id]
-                    LOG.debug("Deleting metric %s", metric)
-                    try:
-                        self.incoming.delete_unprocessed_measures_for_metric(
-                            metric.id)
-                        self.storage._delete_metric(metric)
-                        try:
-                            self.index.expunge_metric(metric.id)
-                        except indexer.NoSuchMetric:
-                            # It's possible another process deleted or is
-                            # deleting the metric, not a big deal
-                            pass
-                    except Exception:
-                        if sync:
-                            raise
-                        LOG.error("Unable to expunge metric %s from storage",
-                                  metric, exc_info=True)
+                metrics.extend(metrics_by_id[metric_id]
+                               for metric_id in metric_ids)
+
+        if not metrics:
+            return 0
+
+        LOG.debug("Deleting metrics %s", metrics)
+        try:
+            self.incoming.delete_unprocessed_measures_for_metrics(
+                [metric.id for metric in metrics])
+            self.storage.delete_metrics(metrics)
+            expunged = self.index.expunge_metrics(
+                [metric.id for metric in metrics])
+        except Exception:
+            if sync:
+                raise
+            LOG.warning("Unable to expunge %d metrics at once, expunging "
+                        "them one by one", len(metrics), exc_info=True)
+            expunged = 0
+            for metric in metrics:
+                if self._expunge_metric(metric):
+                    expunged += 1
+
+        elapsed = time.monotonic() - start
+        LOG.info("Expunged %d metrics in %.2f seconds (%.2f metrics/s)",
+                 expunged, elapsed, expunged / elapsed if elapsed else 0)
+        return expunged
+
+    def _expunge_metric(self, metric):
+        LOG.debug("Deleting metric %s", metric)
+        try:
+            self.incoming.delete_unprocessed_measures_for_metric(metric.id)
+            self.storage.delete_metric(metric)
+            try:
+                self.index.expunge_metric(metric.id)
+            except indexer.NoSuchMetric:
+                # It's possible another process deleted or is
+                # deleting the metric, not a big deal
+                return False
+        except Exception:
+            LOG.error("Unable to expunge metric %s from storage",
+                      metric, exc_info=True)
+            return False
+        return True
 
     def refresh_metrics(self, metrics, timeout=None, sync=False):
         """Process added measures in background for some metrics only.
@@ -370,7 +449,7 @@ class Chef(object):
                             metrics_by_id[metric_id]: measures
                             for metric_id, measures
                             in metrics_and_measures.items()
-                        }, self.index)
+                        }, self.index, vectorized=self.vectorized_processing)
                         LOG.debug("Measures for %d metrics processed",
                                   len(metric_ids))
             except Exception:
@@ -398,23 +477,17 @@ class Chef(object):
             raise SackAlreadyLocked(sack)
         LOG.debug("Processing measures for sack %s", sack)
         try:
-            with self.incoming.process_measures_for_sack(sack) as measures:
-                # process only active metrics. deleted metrics with unprocessed
-                # measures will be skipped until cleaned by janitor.
-                if not measures:
-                    return 0
-
-                metrics = self.index.list_metrics(
-                    attribute_filter={
-                        "in": {"id": measures.keys()}
-                    })
-                self.storage.add_measures_to_metrics({
-                    metric: measures[metric.id]
-                    for metric in metrics
-                }, self.index)
-                LOG.debug("Measures for %d metrics processed",
-                          len(metrics))
-                return len(measures)
+            if self.sack_chunk_max_metrics or self.sack_chunk_max_size:
+                chunks = self.incoming.iter_process_measures_for_sack(
+                    sack, self.sack_chunk_max_metrics,
+                    self.sack_chunk_max_size)
+            else:
+                chunks = [self.incoming.process_measures_for_sack(sack)]
+            processed = 0
+            for chunk in chunks:
+                with chunk as measures:
+                    processed += self._process_new_measures(measures)
+            return processed
         except Exception:
             if sync:
                 raise
@@ -423,6 +496,30 @@ class Chef(object):
         finally:
             lock.release()
 
+    def _process_new_measures(self, measures):
+        """Aggregate new measures into the storage.
+
+        :param measures: A dict where keys are metric ids and values are
+                         measures arrays.
+        :return: The number of metrics processed.
+        """
+        # process only active metrics. deleted metrics with unprocessed
+        # measures will be skipped until cleaned by janitor.
+        if not measures:
+            return 0
+
+        metrics = self.index.list_metrics(
+            attribute_filter={
+                "in": {"id": measures.keys()}
+            })
+        self.storage.add_measures_to_metrics({
+            metric: measures[metric.id]
+            for metric in metrics
+        }, self.index, vectorized=self.vectorized_processing)
+        LOG.debug("Measures for %d metrics processed",
+                  len(metrics))
+        return len(measures)
+
     def get_sack_lock(self, sack):
         # FIXME(jd) Some tooz drivers have a limitation on lock name length
         # (e.g. MySQL). This should be handled by tooz, but it's not yet.
@@ -73,8 +73,12 @@ class MetricProcessBase(cotyledon.Service):
         self.store = storage.get_driver(self.conf)
         self.incoming = incoming.get_driver(self.conf)
         self.indexer = indexer.get_driver(self.conf)
-        self.chef = chef.Chef(self.coord, self.incoming,
-                              self.indexer, self.store)
+        self.chef = chef.Chef(
+            self.coord, self.incoming, self.indexer, self.store,
+            vectorized_processing=self.conf.metricd.vectorized_processing,
+            sack_chunk_max_metrics=self.conf.metricd.sack_chunk_max_metrics,
+            sack_chunk_max_size=(
+                self.conf.metricd.sack_chunk_max_size * 1024 * 1024))
 
     def run(self):
         self._configure()
@@ -159,6 +163,8 @@ class MetricProcessor(MetricProcessBase):
         retry=tenacity.retry_never)
     def _configure(self):
         super(MetricProcessor, self)._configure()
+        self.store.enable_bound_timeserie_cache(
+            self.conf.metricd.bound_timeserie_cache_size)
 
         # create fallback in case paritioning fails or assigned no tasks
         self.fallback_tasks = list(self.incoming.iter_sacks())
@@ -205,6 +211,9 @@ class MetricProcessor(MetricProcessBase):
             if (not self._tasks or
                     self.group_state != self.partitioner.ring.nodes):
                 self.group_state = self.partitioner.ring.nodes.copy()
+                # Other workers may now process our sacks, do not keep their
+                # timeseries around.
+                self.store.clear_bound_timeserie_cache()
                 self._tasks = [
                     sack for sack in self.incoming.iter_sacks()
                     if self.partitioner.belongs_to_self(
@@ -246,8 +255,9 @@ class MetricProcessor(MetricProcessBase):
         LOG.debug("%d metrics processed from %d sacks", m_count, s_count)
         try:
             # Update statistics
-            self.coord.update_capabilities(self.GROUP_ID,
-                                           self.store.statistics)
+            statistics = dict(self.store.statistics)
+            statistics.update(utils.get_executors_statistics())
+            self.coord.update_capabilities(self.GROUP_ID, statistics)
         except tooz.NotImplemented:
             pass
         if sacks == self._get_sacks_to_process():
@@ -331,7 +341,11 @@ def metricd_tester(conf):
     index = indexer.get_driver(conf)
     s = storage.get_driver(conf)
     inc = incoming.get_driver(conf)
-    c = chef.Chef(None, inc, index, s)
+    c = chef.Chef(None, inc, index, s,
+                  vectorized_processing=conf.metricd.vectorized_processing,
+                  sack_chunk_max_metrics=conf.metricd.sack_chunk_max_metrics,
+                  sack_chunk_max_size=(
+                      conf.metricd.sack_chunk_max_size * 1024 * 1024))
     metrics_count = 0
     for sack in inc.iter_sacks():
         try:
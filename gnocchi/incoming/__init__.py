@@ -32,6 +32,7 @@ LOG = daiquiri.getLogger(__name__)
 Measure = collections.namedtuple("Measure", ['timestamp', 'value'])
 
 
+ITEMGETTER_0 = operator.itemgetter(0)
 ITEMGETTER_1 = operator.itemgetter(1)
 
 
@@ -120,6 +121,11 @@ class IncomingDriver(object):
 
     def __init__(self, conf, greedy=True):
         self._sacks = None
+        if self.MAP_METHOD is utils.parallel_map:
+            # Each driver has its own pool of threads so their parallelism can
+            # be tuned independently.
+            self.MAP_METHOD = functools.partial(
+                utils.parallel_map, executor="incoming." + conf.driver)
 
     def upgrade(self, num_sacks):
         try:
@@ -159,6 +165,8 @@ class IncomingDriver(object):
             raise
 
     def _encode_measures(self, measures):
+        if isinstance(measures, numpy.ndarray):
+            return measures.astype(TIMESERIES_ARRAY_DTYPE, copy=False).tobytes()
         return numpy.fromiter(measures,
                               dtype=TIMESERIES_ARRAY_DTYPE).tobytes()
 
@@ -188,7 +196,9 @@ class IncomingDriver(object):
 
         :param metrics_and_measures: A dict where keys are metric objects
                                      and values are a list of
-                                     :py:class:`gnocchi.incoming.Measure`.
+                                     :py:class:`gnocchi.incoming.Measure`
+                                     or an array of
+                                     `TIMESERIES_ARRAY_DTYPE`.
         """
         self.MAP_METHOD(self._store_new_measures,
                         ((metric_id, self._encode_measures(measures))
@@ -221,6 +231,14 @@ class IncomingDriver(object):
     def delete_unprocessed_measures_for_metric(metric_id):
         raise exceptions.NotImplementedError
 
+    def delete_unprocessed_measures_for_metrics(self, metric_ids):
+        """Delete the unprocessed measures of several metrics.
+
+        :param metric_ids: A list of metric ids.
+        """
+        self.MAP_METHOD(self.delete_unprocessed_measures_for_metric,
+                        ((metric_id,) for metric_id in metric_ids))
+
     @staticmethod
     def process_measure_for_metrics(metric_id):
         raise exceptions.NotImplementedError
@@ -229,6 +247,69 @@ class IncomingDriver(object):
     def process_measures_for_sack(sack):
         raise exceptions.NotImplementedError
 
+    @staticmethod
+    def _iter_measures_for_sack(sack):
+        """Iterate on the measures to process of a sack, without reading them.
+
+        :param sack: The sack to list.
+        :return: An iterator of (metric_id, ref, size) where the references
+                 of the measures of a metric follow each other. `ref' is
+                 what the driver needs to read and delete the measures and
+                 `size' is their size in bytes.
+        """
+        raise exceptions.NotImplementedError
+
+    @staticmethod
+    def _process_measures_for_sack_chunk(sack, metrics_and_refs):
+        """Read the measures of a chunk of a sack and delete them afterward.
+
+        :param sack: The sack the chunk belongs to.
+        :param metrics_and_refs: A dict where keys are metric ids and values
+                                 are lists of references returned by
+                                 `_iter_measures_for_sack'.
+        :return: A context manager giving a dict where keys are metric ids
+                 and values are measures arrays.
+        """
+        raise exceptions.NotImplementedError
+
+    def iter_process_measures_for_sack(self, sack, max_metrics=None,
+                                       max_size=None):
+        """Process the measures of a sack chunk by chunk.
+
+        Like `process_measures_for_sack', but only a chunk of the metrics of
+        the sack is read at a time. The measures of a metric are never split
+        across chunks, so a chunk can exceed `max_size' if a single metric
+        does.
+
+        :param sack: The sack to process.
+        :param max_metrics: The maximum number of metrics per chunk, or None.
+        :param max_size: The maximum size of the measures of a chunk in
+                         bytes, or None.
+        :return: An iterator of context managers, each giving a dict where
+                 keys are metric ids and values are measures arrays. The
+                 measures of a chunk are deleted once its context exits
+                 without error. Each context must be exited before the next
+                 chunk is requested.
+        """
+        chunk = {}
+        chunk_size = 0
+        for metric_id, refs_and_sizes in itertools.groupby(
+                self._iter_measures_for_sack(sack), key=ITEMGETTER_0):
+            refs = []
+            size = 0
+            for _metric_id, ref, ref_size in refs_and_sizes:
+                refs.append(ref)
+                size += ref_size
+            if chunk and ((max_metrics and len(chunk) >= max_metrics)
+                          or (max_size and chunk_size + size > max_size)):
+                yield self._process_measures_for_sack_chunk(sack, chunk)
+                chunk = {}
+                chunk_size = 0
+            chunk.setdefault(metric_id, []).extend(refs)
+            chunk_size += size
+        if chunk:
+            yield self._process_measures_for_sack_chunk(sack, chunk)
+
     @staticmethod
     def has_unprocessed(metric_id):
         raise exceptions.NotImplementedError
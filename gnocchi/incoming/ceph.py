@@ -172,6 +172,23 @@ class CephStorage(incoming.IncomingDriver):
             self.ioctx.operate_write_op(op, str(sack),
                                         flags=self.OMAP_WRITE_FLAGS)
 
+    def delete_unprocessed_measures_for_metrics(self, metric_ids):
+        keys_by_sack = defaultdict(list)
+        for metric_id in metric_ids:
+            sack = self.sack_for_metric(metric_id)
+            key_prefix = self.MEASURE_PREFIX + "_" + str(metric_id)
+            keys_by_sack[sack].extend(
+                self._list_keys_to_process(sack, key_prefix).keys())
+
+        # One write operation per sack for all the metrics
+        for sack, keys in keys_by_sack.items():
+            if not keys:
+                continue
+            with rados.WriteOpCtx() as op:
+                self.ioctx.remove_omap_keys(op, tuple(keys))
+                self.ioctx.operate_write_op(op, str(sack),
+                                            flags=self.OMAP_WRITE_FLAGS)
+
     def has_unprocessed(self, metric_id):
         sack = self.sack_for_metric(metric_id)
         object_prefix = self.MEASURE_PREFIX + "_" + str(metric_id)
@@ -231,3 +248,43 @@ class CephStorage(incoming.IncomingDriver):
                 self.ioctx.remove_omap_keys(op, tuple(processed_keys))
                 self.ioctx.operate_write_op(op, str(sack),
                                             flags=self.OMAP_WRITE_FLAGS)
+
+    def _iter_measures_for_sack(self, sack):
+        marker = ""
+        while True:
+            omaps = self._list_keys_to_process(
+                sack, prefix=self.MEASURE_PREFIX + "_", marker=marker,
+                limit=self.Q_LIMIT)
+            for k, v in omaps.items():
+                try:
+                    metric_id = uuid.UUID(k.split("_")[1])
+                except (ValueError, IndexError):
+                    LOG.warning("Unable to parse measure object name %s",
+                                k)
+                    continue
+                # omap values are the measures themselves, keep them rather
+                # than reading them again.
+                yield metric_id, (k, v), len(v)
+            if len(omaps) < self.Q_LIMIT:
+                break
+            marker = k
+
+    @contextlib.contextmanager
+    def _process_measures_for_sack_chunk(self, sack, metrics_and_refs):
+        measures = {}
+        for metric_id, refs in metrics_and_refs.items():
+            measures[metric_id] = self._array_concatenate([
+                self._unserialize_measures(k, v) for k, v in refs
+            ])
+
+        yield measures
+
+        # Now clean omap
+        processed_keys = tuple(k for refs in metrics_and_refs.values()
+                               for k, v in refs)
+        with rados.WriteOpCtx() as op:
+            # NOTE(sileht): come on Ceph, no return code
+            # for this operation ?!!
+            self.ioctx.remove_omap_keys(op, processed_keys)
+            self.ioctx.operate_write_op(op, str(sack),
+                                        flags=self.OMAP_WRITE_FLAGS)
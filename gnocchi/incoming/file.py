@@ -214,3 +214,39 @@ class FileStorage(incoming.IncomingDriver):
 
         for metric_id, files in processed_files.items():
             self._delete_measures_files_for_metric(metric_id, files)
+
+    def _iter_measures_for_sack(self, sack):
+        for metric_id in self._list_target(self._sack_path(sack)):
+            try:
+                metric_id = uuid.UUID(metric_id)
+            except ValueError:
+                LOG.error("Unable to parse %s as an UUID, ignoring metric",
+                          metric_id)
+                continue
+            for f in self._list_measures_container_for_metric_str(
+                    sack, metric_id):
+                try:
+                    size = os.path.getsize(os.path.join(
+                        self._measure_path(sack, metric_id), f))
+                except OSError as e:
+                    # Some other process treated this one, then do nothing
+                    if e.errno == errno.ENOENT:
+                        continue
+                    raise
+                yield metric_id, f, size
+
+    @contextlib.contextmanager
+    def _process_measures_for_sack_chunk(self, sack, metrics_and_refs):
+        measures = {}
+        for metric_id, files in metrics_and_refs.items():
+            m = []
+            for f in files:
+                abspath = self._build_measure_path(metric_id, f)
+                with open(abspath, "rb") as e:
+                    m.append(self._unserialize_measures(f, e.read()))
+            measures[metric_id] = self._array_concatenate(m)
+
+        yield measures
+
+        for metric_id, files in metrics_and_refs.items():
+            self._delete_measures_files_for_metric(metric_id, files)
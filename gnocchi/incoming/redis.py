@@ -53,6 +53,19 @@ for i, sack_metric in ipairs(metric_with_measures) do
     }
 end
 return results
+""" % (redis.SEP_S, redis.SEP_S, redis.SEP_S, redis.SEP_S),
+        "list_measures_for_sack": """
+local results = {}
+local metric_id_extractor = "[^%s]*%s([^%s]*)"
+local metric_with_measures = redis.call("KEYS", KEYS[1] .. "%s*")
+for i, sack_metric in ipairs(metric_with_measures) do
+    -- estimate the size from the first batch of measures rather than
+    -- reading the whole list
+    local size = redis.call("LLEN", sack_metric) * string.len(
+        redis.call("LINDEX", sack_metric, 0) or "")
+    results[#results + 1] = {sack_metric:gmatch(metric_id_extractor)(), size}
+end
+return results
 """ % (redis.SEP_S, redis.SEP_S, redis.SEP_S, redis.SEP_S),
     }
 
@@ -133,6 +146,12 @@ return results
     def delete_unprocessed_measures_for_metric(self, metric_id):
         self._client.delete(self._build_measure_path(metric_id))
 
+    def delete_unprocessed_measures_for_metrics(self, metric_ids):
+        keys = [self._build_measure_path(metric_id)
+                for metric_id in metric_ids]
+        if keys:
+            self._client.delete(*keys)
+
     def has_unprocessed(self, metric_id):
         return bool(self._client.exists(self._build_measure_path(metric_id)))
 
@@ -183,6 +202,22 @@ return results
             pipe.ltrim(key, item_len + 1, -1)
         pipe.execute()
 
+    def _iter_measures_for_sack(self, sack):
+        for metric_id, size in self._scripts['list_measures_for_sack'](
+                keys=[str(sack)]):
+            try:
+                metric_id = uuid.UUID(metric_id.decode())
+            except ValueError:
+                LOG.error("Unable to parse metric id %s, ignoring",
+                          metric_id)
+                continue
+            # All the measures of a metric are read from its list at once so
+            # there is no reference to keep.
+            yield metric_id, None, size
+
+    def _process_measures_for_sack_chunk(self, sack, metrics_and_refs):
+        return self.process_measure_for_metrics(list(metrics_and_refs))
+
     # if ConnectionError exception occurs, try again, max 5 times.
     @tenacity.retry(
         wait=utils.wait_exponential,
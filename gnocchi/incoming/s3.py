@@ -17,6 +17,7 @@ from collections import defaultdict
 import contextlib
 import daiquiri
 import datetime
+import itertools
 import json
 import uuid
 
@@ -138,6 +139,13 @@ class S3Storage(incoming.IncomingDriver):
         files = self._list_measure_files_for_metric(sack, metric_id)
         s3.bulk_delete(self.s3, self._bucket_name_measures, files)
 
+    def delete_unprocessed_measures_for_metrics(self, metric_ids):
+        files = itertools.chain.from_iterable(self.MAP_METHOD(
+            self._list_measure_files_for_metric,
+            ((self.sack_for_metric(metric_id), metric_id)
+             for metric_id in metric_ids)))
+        s3.bulk_delete(self.s3, self._bucket_name_measures, list(files))
+
     def has_unprocessed(self, metric_id):
         sack = self.sack_for_metric(metric_id)
         return bool(self._list_measure_files_for_metric(sack, metric_id))
@@ -188,3 +196,36 @@ class S3Storage(incoming.IncomingDriver):
 
         # Now clean objects
         s3.bulk_delete(self.s3, self._bucket_name_measures, files)
+
+    def _iter_measures_for_sack(self, sack):
+        for response in self._list_files((str(sack),)):
+            for c in response.get('Contents', ()):
+                try:
+                    __, metric_id, measure_id = c['Key'].split("/")
+                    metric_id = uuid.UUID(metric_id)
+                except ValueError:
+                    LOG.warning("Unable to parse measure file name %s",
+                                c['Key'])
+                    continue
+                yield metric_id, c['Key'], c['Size']
+
+    @contextlib.contextmanager
+    def _process_measures_for_sack_chunk(self, sack, metrics_and_refs):
+        measures = {}
+        for metric_id, files in metrics_and_refs.items():
+            measures[metric_id] = self._array_concatenate([
+                self._unserialize_measures(
+                    f,
+                    self.s3.get_object(
+                        Bucket=self._bucket_name_measures,
+                        Key=f)['Body'].read(),
+                )
+                for f in files
+            ])
+
+        yield measures
+
+        # Now clean objects
+        s3.bulk_delete(self.s3, self._bucket_name_measures,
+                       [f for files in metrics_and_refs.values()
+                        for f in files])
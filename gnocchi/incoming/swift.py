@@ -168,3 +168,40 @@ class SwiftStorage(incoming.IncomingDriver):
         yield measures
 
         swift.bulk_delete(self.swift, sack_name, files)
+
+    def _iter_measures_for_sack(self, sack):
+        sack_name = self._container_name(str(sack))
+        marker = None
+        while True:
+            headers, files = self.swift.get_container(sack_name,
+                                                      marker=marker)
+            if not files:
+                break
+            for f in files:
+                try:
+                    metric_id, random_id = f['name'].split("/")
+                    metric_id = uuid.UUID(metric_id)
+                except ValueError:
+                    LOG.warning("Unable to parse measure file name %s", f)
+                    continue
+                yield metric_id, f, f['bytes']
+            marker = files[-1]['name']
+
+    @contextlib.contextmanager
+    def _process_measures_for_sack_chunk(self, sack, metrics_and_refs):
+        measures = {}
+        sack_name = self._container_name(str(sack))
+        for metric_id, files in metrics_and_refs.items():
+            measures[metric_id] = self._array_concatenate([
+                self._unserialize_measures(
+                    metric_id,
+                    self.swift.get_object(sack_name, f['name'])[1],
+                )
+                for f in files
+            ])
+
+        yield measures
+
+        swift.bulk_delete(self.swift, sack_name,
+                          [f for files in metrics_and_refs.values()
+                           for f in files])
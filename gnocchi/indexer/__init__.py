@@ -349,6 +349,46 @@ class IndexerDriver(object):
         """
         raise exceptions.NotImplementedError
 
+    @staticmethod
+    def get_resources(resource_type, resource_ids, with_metrics=False):
+        """Get several resources from the indexer in one query.
+
+        :param resource_type: The type of the resources to look for.
+        :param resource_ids: A list of resource UUIDs.
+        :param with_metrics: Whether to include metrics information.
+        :return: A list of resources; unknown ids are silently ignored.
+        """
+        raise exceptions.NotImplementedError
+
+    @staticmethod
+    def list_resources_with_inactive_metrics(inactive_before, limit=None,
+                                             marker=None):
+        """List the resources whose metrics are all inactive.
+
+        Only resources that are not ended and have at least one metric are
+        returned, ordered by id.
+
+        :param inactive_before: A metric which did not receive measures
+                                since this moment is inactive.
+        :param limit: The maximum number of resources to return.
+        :param marker: Only return the resources after this resource id.
+        :return: A list of (resource_id, resource_type).
+        """
+        raise exceptions.NotImplementedError
+
+    @staticmethod
+    def end_resources(resources, ended_at):
+        """Set the ended_at field of several resources at once.
+
+        A revision is created for each resource. The resources that are
+        already ended are left untouched.
+
+        :param resources: A list of (resource_id, resource_type).
+        :param ended_at: The value to set ended_at to.
+        :return: The number of resources updated.
+        """
+        raise exceptions.NotImplementedError
+
     @staticmethod
     def list_resources(resource_type='generic',
                        attribute_filter=None,
@@ -427,6 +467,31 @@ class IndexerDriver(object):
                         **kwargs):
         raise exceptions.NotImplementedError
 
+    @staticmethod
+    def create_resources(resource_type, creator, resources):
+        """Create several resources and their metrics in one transaction.
+
+        :param resource_type: The type of the resources to create.
+        :param creator: The creator of the resources.
+        :param resources: A list of dicts of the `create_resource` keyword
+                          arguments, each including the resource `id`.
+        :return: The list of the created resources.
+        """
+        raise exceptions.NotImplementedError
+
+    @staticmethod
+    def append_metrics_to_resources(resource_type, metrics_by_resource):
+        """Add metrics to several resources in one transaction.
+
+        This is the bulk version of `update_resource` with `append_metrics`
+        set and no revision created.
+
+        :param resource_type: The type of the resources to update.
+        :param metrics_by_resource: A dict of {resource UUID: metrics}.
+        :return: The list of the updated resources.
+        """
+        raise exceptions.NotImplementedError
+
     @staticmethod
     def delete_resource(uuid):
         raise exceptions.NotImplementedError
@@ -449,14 +514,42 @@ class IndexerDriver(object):
     def update_needs_raw_data_truncation(metric_id, value):
         raise exceptions.NotImplementedError
 
+    @staticmethod
+    def update_needs_raw_data_truncation_for_metrics(metric_ids, value=False):
+        """Set the raw data truncation flag of several metrics at once.
+
+        :param metric_ids: A list of metric UUIDs.
+        :param value: The value to set the flag to.
+        :return: The number of metrics updated.
+        """
+        raise exceptions.NotImplementedError
+
     @staticmethod
     def update_last_measure_timestamp(metric_id):
         raise exceptions.NotImplementedError
 
+    @staticmethod
+    def update_last_measure_timestamp_for_metrics(metric_ids):
+        """Mark several metrics as having received measures now.
+
+        :param metric_ids: A list of metric UUIDs.
+        :return: The number of metrics updated.
+        """
+        raise exceptions.NotImplementedError
+
     @staticmethod
     def expunge_metric(id):
         raise exceptions.NotImplementedError
 
+    @staticmethod
+    def expunge_metrics(ids):
+        """Remove several metrics marked as deleted at once.
+
+        :param ids: A list of metric UUIDs.
+        :return: The number of metrics removed.
+        """
+        raise exceptions.NotImplementedError
+
     def get_archive_policy_for_metric(self, metric_name):
         """Helper to get the archive policy according archive policy rules."""
         rules = self.list_archive_policy_rules()
@@ -14,6 +14,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
 import copy
 import datetime
 import itertools
@@ -43,6 +44,7 @@ from sqlalchemy.engine import url as sqlalchemy_url
 import sqlalchemy.exc
 from sqlalchemy import (
     delete,
+    insert,
     select,
     types as sa_types,
     update,
@@ -979,6 +981,76 @@ class SQLAlchemyIndexer(indexer.IndexerDriver):
 
             return r
 
+    @retry_on_deadlock
+    def create_resources(self, resource_type, creator, resources):
+        if not resources:
+            return []
+        with self.facade.writer() as session:
+            resource_cls = self._resource_type_to_mappers(
+                session, resource_type)['resource']
+            created = []
+            for kwargs in resources:
+                kwargs = kwargs.copy()
+                metrics = kwargs.pop('metrics', None)
+                if kwargs.get('original_resource_id') is None:
+                    kwargs['original_resource_id'] = str(kwargs['id'])
+                r = resource_cls(type=resource_type, creator=creator,
+                                 **kwargs)
+                session.add(r)
+
+                try:
+                    session.flush()
+                except exception.DBDuplicateEntry:
+                    raise indexer.ResourceAlreadyExists(r.id)
+                except exception.DBReferenceError as ex:
+                    raise indexer.ResourceValueError(r.type,
+                                                     ex.key,
+                                                     getattr(r, ex.key))
+
+                if metrics is not None:
+                    self._set_metrics_for_resource(session, r, metrics)
+                created.append(r)
+
+            session.commit()
+
+            # Force load of metrics
+            for r in created:
+                r.metrics
+
+            return created
+
+    @retry_on_deadlock
+    def append_metrics_to_resources(self, resource_type,
+                                    metrics_by_resource):
+        if not metrics_by_resource:
+            return []
+        with self.facade.writer() as session:
+            resource_cls = self._resource_type_to_mappers(
+                session, resource_type)['resource']
+            # Lock the resources in a stable order so that concurrent
+            # updates of overlapping resources cannot deadlock
+            q = select(resource_cls).filter(
+                resource_cls.id.in_(list(metrics_by_resource))
+            ).order_by(resource_cls.id).with_for_update()
+            resources = list(session.scalars(q).all())
+            if len(resources) != len(metrics_by_resource):
+                found = set(r.id for r in resources)
+                for resource_id in metrics_by_resource:
+                    if resource_id not in found:
+                        raise indexer.NoSuchResource(resource_id)
+
+            for r in resources:
+                self._set_metrics_for_resource(
+                    session, r, metrics_by_resource[r.id])
+
+            session.commit()
+
+            # Force load of metrics
+            for r in resources:
+                r.metrics
+
+            return resources
+
     @staticmethod
     def _set_metrics_for_resource(session, r, metrics):
         for name, value in metrics.items():
@@ -1073,6 +1145,103 @@ class SQLAlchemyIndexer(indexer.IndexerDriver):
                 q = q.options(sqlalchemy.orm.joinedload(Resource.metrics))
             return session.scalars(q).first()
 
+    @retry_on_deadlock
+    def get_resources(self, resource_type, resource_ids, with_metrics=False):
+        if not resource_ids:
+            return []
+        with self.facade.independent_reader() as session:
+            resource_cls = self._resource_type_to_mappers(
+                session, resource_type)['resource']
+            q = select(resource_cls).filter(resource_cls.id.in_(resource_ids))
+            if with_metrics:
+                q = q.options(sqlalchemy.orm.joinedload(Resource.metrics))
+            return list(session.scalars(q).unique().all())
+
+    def list_resources_with_inactive_metrics(self, inactive_before,
+                                             limit=None, marker=None):
+        with self.facade.independent_reader() as session:
+            q = select(Resource.id, Resource.type).join(
+                Metric, sqlalchemy.and_(Metric.resource_id == Resource.id,
+                                        Metric.status == 'active')
+            ).filter(
+                Resource.ended_at.is_(None)
+            ).group_by(
+                Resource.id, Resource.type
+            ).having(
+                sqlalchemy.func.sum(sqlalchemy.case(
+                    (Metric.last_measure_timestamp <
+                     utils.normalize_time(inactive_before), 0),
+                    else_=1)) == 0
+            ).order_by(Resource.id)
+            if marker is not None:
+                q = q.filter(Resource.id > marker)
+            if limit is not None:
+                q = q.limit(limit)
+            return [tuple(row) for row in session.execute(q)]
+
+    @retry_on_deadlock
+    def end_resources(self, resources, ended_at):
+        if not resources:
+            return 0
+        with self.facade.writer() as session:
+            # Lock the resources like update_resource() does so no revision is
+            # created concurrently.
+            q = select(Resource.id, Resource.type).filter(
+                Resource.id.in_([rid for rid, __ in resources]),
+                Resource.ended_at.is_(None),
+                Resource.started_at <= ended_at,
+            ).with_for_update()
+            resource_ids_by_type = collections.defaultdict(list)
+            for rid, rtype in session.execute(q):
+                resource_ids_by_type[rtype].append(rid)
+
+            mappers_by_type = {}
+            for rtype in list(resource_ids_by_type):
+                try:
+                    mappers_by_type[rtype] = self._resource_type_to_mappers(
+                        session, rtype)
+                except indexer.UnexpectedResourceTypeState as e:
+                    LOG.debug("Not ending resources %s: %s",
+                              resource_ids_by_type[rtype], e)
+                    del resource_ids_by_type[rtype]
+
+            if not resource_ids_by_type:
+                return 0
+            resource_ids = list(itertools.chain.from_iterable(
+                resource_ids_by_type.values()))
+
+            # Build history of all resources at once
+            now = utils.utcnow()
+            columns = [c.name for c in Resource.__table__.columns]
+            session.execute(insert(ResourceHistory).from_select(
+                columns + ["revision_end"],
+                select(*[Resource.__table__.c[c] for c in columns] + [
+                    sqlalchemy.literal(now, types.TimestampUTC)
+                ]).filter(Resource.id.in_(resource_ids))))
+
+            # And then of the attributes of each resource type
+            for rtype, rids in resource_ids_by_type.items():
+                if rtype == "generic":
+                    continue
+                mappers = mappers_by_type[rtype]
+                table = mappers["resource"].__table__
+                history_table = mappers["history"].__table__
+                attributes = [c.name for c in table.columns if c.name != "id"]
+                session.execute(insert(history_table).from_select(
+                    ["revision"] + attributes,
+                    select(ResourceHistory.revision,
+                           *[table.c[a] for a in attributes]).join(
+                        table, table.c.id == ResourceHistory.id
+                    ).filter(ResourceHistory.id.in_(rids),
+                             ResourceHistory.revision_end == now)))
+
+            stmt = update(Resource).filter(
+                Resource.id.in_(resource_ids)
+            ).values(
+                ended_at=ended_at, revision_start=now
+            ).execution_options(synchronize_session=False)
+            return session.execute(stmt).rowcount
+
     def extracts_filters_for_table(self, attribute_filter,
                                    allowed_keys_for_table=[
                                        'creator', 'started_at', 'ended_at',
@@ -1407,6 +1576,16 @@ class SQLAlchemyIndexer(indexer.IndexerDriver):
             if session.execute(stmt).rowcount == 0:
                 raise indexer.NoSuchMetric(id)
 
+    @retry_on_deadlock
+    def expunge_metrics(self, ids):
+        if not ids:
+            return 0
+        with self.facade.writer() as session:
+            stmt = delete(Metric).where(
+                Metric.id.in_(ids), Metric.status == "delete"
+            ).execution_options(synchronize_session=False)
+            return session.execute(stmt).rowcount
+
     def delete_metric(self, id):
         with self.facade.writer() as session:
             stmt = update(Metric).filter(
@@ -1422,6 +1601,17 @@ class SQLAlchemyIndexer(indexer.IndexerDriver):
             if session.execute(stmt).rowcount == 0:
                 raise indexer.NoSuchMetric(metrid_id)
 
+    @retry_on_deadlock
+    def update_needs_raw_data_truncation_for_metrics(self, metric_ids,
+                                                     value=False):
+        if not metric_ids:
+            return 0
+        with self.facade.writer() as session:
+            stmt = update(Metric).filter(Metric.id.in_(metric_ids)).values(
+                needs_raw_data_truncation=value).execution_options(
+                    synchronize_session=False)
+            return session.execute(stmt).rowcount
+
     def update_last_measure_timestamp(self, metrid_id):
         with self.facade.writer() as session:
             stmt = update(Metric).filter(Metric.id == metrid_id).values(
@@ -1429,6 +1619,16 @@ class SQLAlchemyIndexer(indexer.IndexerDriver):
             if session.execute(stmt).rowcount == 0:
                 raise indexer.NoSuchMetric(metrid_id)
 
+    @retry_on_deadlock
+    def update_last_measure_timestamp_for_metrics(self, metric_ids):
+        if not metric_ids:
+            return 0
+        with self.facade.writer() as session:
+            stmt = update(Metric).filter(Metric.id.in_(metric_ids)).values(
+                last_measure_timestamp=datetime.datetime.utcnow()
+            ).execution_options(synchronize_session=False)
+            return session.execute(stmt).rowcount
+
     def update_backwindow_changed_for_metrics_archive_policy(
             self, archive_policy_name):
         with self.facade.writer() as session:
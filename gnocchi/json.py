@@ -50,8 +50,8 @@ def to_primitive(obj):
     return obj
 
 
-def dumps(obj):
-    return ujson.dumps(to_primitive(obj))
+def dumps(obj, sort_keys=False):
+    return ujson.dumps(to_primitive(obj), sort_keys=sort_keys)
 
 
 # For convenience
@@ -18,10 +18,12 @@ import operator
 import uuid
 
 from oslo_config import cfg
+from oslo_config import types
 
 import gnocchi.archive_policy
 import gnocchi.common.redis
 import gnocchi.indexer
+import gnocchi.rest.aggregates.cache
 import gnocchi.rest.http_proxy_to_wsgi
 import gnocchi.storage
 import gnocchi.storage.ceph
@@ -101,6 +103,22 @@ def list_opts():
                 help='Number of threads to use to parallelize '
                 'some operations. '
                 'Default is set to the number of CPU available.'),
+            cfg.Opt(
+                'parallel_operations_by_executor',
+                type=types.Dict(value_type=types.Integer(min=1)),
+                default={},
+                help='Number of threads to use to parallelize the operations '
+                'of a driver, overriding parallel_operations. Each storage '
+                'and incoming driver has its own pool of threads, named '
+                'after its kind and driver name, for example '
+                '"storage.s3:32,incoming.redis:8".'),
+            cfg.IntOpt(
+                'parallel_operations_queue_size',
+                default=0,
+                min=0,
+                help='Maximum number of operations waiting for a thread in '
+                'each pool of threads. Submitting more operations blocks '
+                'until some are done. 0 means unlimited.'),
             cfg.BoolOpt(
                 'use-syslog',
                 default=False,
@@ -152,6 +170,40 @@ def list_opts():
                        "value may improve worker utilization but may also "
                        "increase load on coordination backend. Value is "
                        "capped by number of workers globally."),
+            cfg.BoolOpt('vectorized_processing',
+                        default=False,
+                        help="Aggregate the new measures of all the metrics "
+                        "of a sack sharing an archive policy at once, using "
+                        "a few vectorized operations, rather than metric by "
+                        "metric. This is faster when sacks contain a lot of "
+                        "metrics receiving few measures each. The computed "
+                        "aggregates are identical."),
+            cfg.IntOpt('bound_timeserie_cache_size',
+                       default=0,
+                       min=0,
+                       help="Maximum size in megabytes of the in-memory cache "
+                       "of unaggregated timeseries kept by each worker "
+                       "between two processings of the same metric. The "
+                       "cache is emptied each time the sacks are "
+                       "redistributed among the workers. 0 disables the "
+                       "cache."),
+            cfg.IntOpt('sack_chunk_max_metrics',
+                       default=0,
+                       min=0,
+                       help="Maximum number of metrics whose new measures "
+                       "are read and processed at once when processing a "
+                       "sack. The measures of a chunk are deleted from the "
+                       "incoming storage once processed. 0 means no limit."),
+            cfg.IntOpt('sack_chunk_max_size',
+                       default=0,
+                       min=0,
+                       help="Maximum size in megabytes of the new measures "
+                       "read and processed at once when processing a sack. "
+                       "The measures of a single metric are always "
+                       "processed at once. The size of the measures stored "
+                       "in Redis is estimated. 0 means no limit. If neither "
+                       "this option nor `sack_chunk_max_metrics` is set, "
+                       "all the measures of a sack are processed at once."),
             cfg.IntOpt('cleanup_batch_size',
                        default=10000,
                        min=1,
@@ -197,9 +249,25 @@ def list_opts():
                             'to do some operations.'),
             cfg.StrOpt('uwsgi_path',
                        default=None,
-                       help="Custom UWSGI path to avoid auto discovery of packages.")
+                       help="Custom UWSGI path to avoid auto discovery of packages."),
+            cfg.IntOpt('resources_cache_size',
+                       default=10000, min=1,
+                       help='Maximum number of resources kept by the cache '
+                            'of the Prometheus and InfluxDB write '
+                            'endpoints.'),
+            cfg.IntOpt('resources_cache_ttl',
+                       default=60, min=0,
+                       help='Number of seconds the Prometheus and InfluxDB '
+                            'write endpoints cache the resources and metrics '
+                            'they write to, so that they do not request them '
+                            'from the indexer on every write. A metric '
+                            'deleted meanwhile keeps being written to, and '
+                            'its measures dropped, until its resource '
+                            'expires from the cache. 0 disables the '
+                            'cache.'),
         ) + API_OPTS + gnocchi.rest.http_proxy_to_wsgi.OPTS,
         ),
+        ("aggregates_cache", gnocchi.rest.aggregates.cache.OPTS),
         ("storage", _STORAGE_OPTS),
         ("incoming", _INCOMING_OPTS),
         ("statsd", (
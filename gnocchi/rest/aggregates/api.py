@@ -17,14 +17,18 @@
 import daiquiri
 import fnmatch
 import itertools
+import warnings
 
 import numpy
 import pecan
 from pecan import rest
 import pyparsing
 import voluptuous
+import webob.exc
 
+from gnocchi import carbonara
 from gnocchi import indexer
+from gnocchi.rest.aggregates import cache as aggregates_cache
 from gnocchi.rest.aggregates import exceptions
 from gnocchi.rest.aggregates import operations as agg_operations
 from gnocchi.rest.aggregates import processor
@@ -166,15 +170,43 @@ def extract_references(nodes):
     return references
 
 
+def _is_relative_timestamp(value):
+    """Return whether a start or stop is relative to the current time."""
+    if value is None:
+        return False
+    try:
+        float(value)
+    except ValueError:
+        if value in ("now", "today"):
+            return True
+        try:
+            with warnings.catch_warnings():
+                # Timezones are dropped by numpy, only the format matters
+                warnings.simplefilter("ignore", UserWarning)
+                numpy.datetime64(value)
+        except ValueError:
+            return True
+    return False
+
+
 def get_measures_or_abort(references, operations, start,
                           stop, granularity, needed_overlap, fill):
+    return _call_processor_or_abort(
+        processor.get_measures, pecan.request.storage, references,
+        operations, start, stop, granularity, needed_overlap, fill)
+
+
+def get_measures_batch_or_abort(references_and_windows, operations,
+                                granularity, needed_overlap, fill):
+    return _call_processor_or_abort(
+        processor.get_measures_batch, pecan.request.storage,
+        references_and_windows, operations, granularity, needed_overlap,
+        fill)
+
+
+def _call_processor_or_abort(func, *args):
     try:
-        return processor.get_measures(
-            pecan.request.storage,
-            references,
-            operations,
-            start, stop,
-            granularity, needed_overlap, fill)
+        return func(*args)
     except exceptions.UnAggregableTimeseries as e:
         api.abort(400, e)
     # TODO(sileht): We currently got only one metric for these exceptions but
@@ -192,23 +224,32 @@ class MeasureGroup(object):
     def __init__(self, group_key, resources):
         self.resources = self.join_sequential_groups(resources)
         self.group_key = dict(group_key)
+        # Chunks of (timestamps, granularities, values) arrays
         self.measures = []
         self.references = None
 
-    def add_measures(self, aggregated_measures, date_map, start, stop,
-                     details):
-        measures = aggregated_measures['measures']['aggregated']
+    def add_measures(self, aggregated_measures, start, stop, details):
         if details:
             self.references = aggregated_measures['references']
-        for measure in measures:
-            self.add_measure(list(measure), date_map, start, stop)
+        measures = aggregated_measures['measures']['aggregated']
+        for granularity, timestamps, values in measures.series:
+            self.measures.append((
+                timestamps,
+                numpy.full(len(timestamps), granularity),
+                values * self.usage_coefficients(
+                    timestamps, granularity, start, stop)))
 
-    def add_measure(self, measure, date_map, start, stop):
-        measure = Measure(*(measure + [start, stop]))
-        if not date_map.get(measure.date, None):
-            date_map[measure.date] = []
-        date_map[measure.date].append(measure)
-        self.measures.append(measure)
+    @staticmethod
+    def usage_coefficients(timestamps, granularity, start, stop):
+        """Return the part of each measure window within [start, stop]."""
+        windows_end = timestamps + granularity
+        usage_start = (timestamps if start is None
+                       else numpy.maximum(numpy.datetime64(start), timestamps))
+        usage_end = (windows_end if stop is None
+                     else numpy.minimum(numpy.datetime64(stop), windows_end))
+        usage = (usage_end - usage_start).astype('timedelta64[ns]')
+        return (usage.astype(float) /
+                granularity.astype('timedelta64[ns]').astype(float))
 
     def join_sequential_groups(self, group):
         group.sort(key=lambda key: utils.to_timestamp(key['search_start']) if key['search_start'] else None)
@@ -229,34 +270,20 @@ class MeasureGroup(object):
         return "Group keys [%s]." % self.group_key
 
     def sum_groups_same_time_values(self):
-        to_remove = []
-        last_visited = None
-        for measure in self.measures:
-            if last_visited and last_visited.date == measure.date:
-                to_remove.append(last_visited)
-                measure.value += last_visited.value
-
-            last_visited = measure
-
-        self.measures = [m for m in self.measures if m not in to_remove]
-
-
-class Measure(object):
-    def __init__(self, date, granularity, value, start, stop):
-        self.date = date
-        self.granularity = granularity
-        self.value = value
-        self.start = (numpy.datetime64(start) if start
-                      else date)
-        measure_next_window_measurement = self.date + self.granularity
-        self.stop = (numpy.datetime64(stop) if stop
-                     else measure_next_window_measurement)
-        measure_expected_beg = max(self.start, self.date)
-        measure_expected_end = min(self.stop, measure_next_window_measurement)
-        measure_delta = measure_expected_end - measure_expected_beg
-        measure_delta_ns = measure_delta.astype('timedelta64[ns]')
-        self.usage_coefficient = (measure_delta_ns.astype(float) /
-                                  self.granularity.astype(float))
+        if not self.measures:
+            return
+        timestamps, granularities, values = (
+            numpy.concatenate(column) for column in zip(*self.measures))
+        if len(timestamps) == 0:
+            self.measures = []
+            return
+        # Sum the consecutive measures of the same timestamp, keeping the
+        # granularity of the last one
+        starts = numpy.flatnonzero(numpy.concatenate(
+            ([True], timestamps[1:] != timestamps[:-1])))
+        ends = numpy.append(starts[1:], len(timestamps)) - 1
+        self.measures = [(timestamps[starts], granularities[ends],
+                          numpy.add.reduceat(values, starts))]
 
 
 class Grouper(object):
@@ -273,7 +300,6 @@ class Grouper(object):
         self.needed_overlap = needed_overlap
         self.fill = fill
         self.details = details
-        self.measures_date_map = {}
         self.grouped_response = None
 
     def create_history_period_filter(self):
@@ -379,100 +405,44 @@ class Grouper(object):
         LOG.debug("Timewindow of object [%s] after truncating.", value)
 
     def get_measures(self, groups):
+        groups_and_windows = []
         for group in groups:
-            date_map = self.get_date_map(group)
             for resource in group.resources:
                 start = numpy.datetime64(resource['search_start']) \
                     if resource['search_start'] else None
                 stop = numpy.datetime64(resource['search_end']) \
                     if resource['search_end'] else None
+                groups_and_windows.append((group, resource, start, stop))
+
+        LOG.debug("Collecting measures of resources [%s], operations [%s], "
+                  "granularity [%s], need_overlap [%s], fill [%s], details "
+                  "[%s], and references [%s].", groups_and_windows,
+                  self.body["operations"], self.granularity,
+                  self.needed_overlap, self.fill, self.details,
+                  self.references)
+
+        responses = AggregatesController._get_resources_measures_by_name(
+            [(resource, start, stop)
+             for _, resource, start, stop in groups_and_windows],
+            self.references, self.body["operations"], self.granularity,
+            self.needed_overlap, self.fill, details=self.details)
+
+        for (group, resource, start, stop), response in zip(
+                groups_and_windows, responses):
+            if response is None:
+                LOG.debug("No measure found for resource [%s], start [%s], "
+                          "stop [%s].", resource, start, stop)
+                continue
+            group.add_measures(response, start, stop, self.details)
 
-                LOG.debug("[ Collecting measures from %s to %s ]",
-                          start, stop)
-
-                try:
-                    measure = AggregatesController._get_measures_by_name(
-                        [resource], self.references, self.body["operations"],
-                        start, stop, self.granularity, self.needed_overlap,
-                        self.fill, details=self.details)
-
-                    LOG.debug(
-                        "[%s] measure found for resource [%s], operations "
-                        "[%s], start [%s], stop [%s], granularity [%s], "
-                        "need_overlap [%s], fill [%s], details [%s], and "
-                        "references [%s].", measure, resource,
-                        self.body["operations"], start, stop, self.granularity,
-                        self.needed_overlap, self.fill, self.details,
-                        self.references)
-
-                    group.add_measures(measure, date_map, start, stop,
-                                       self.details)
-                except indexer.NoSuchMetric as e:
-                    LOG.debug("No measure found for resource [%s], operations "
-                              "[%s], start [%s], stop [%s], granularity [%s], "
-                              "need_overlap [%s], fill [%s], details [%s], "
-                              "and references [%s]. Error: [%s].", resource,
-                              self.body["operations"], start, stop,
-                              self.granularity, self.needed_overlap,
-                              self.fill, self.details, self.references, e)
-                    continue
-
-        self.truncate_measures()
-        self.sum_sequential_group_metrics(groups)
-        return groups
-
-    def get_date_map(self, group):
-        """This method returns the map used to control the groupby elements.
-
-        If the entry does not exist, an empty map is returned. The rest of the
-        code handles/works by adding entries to the map returned by this method
-        """
-        data_map_key = ""
-        all_keys = list(group.group_key.keys())
-        if not all_keys:
-            LOG.error("A group without keys [%s] should not be possible.",
-                      group)
-
-            return self.measures_date_map
-        all_keys.sort()
-        for key in all_keys:
-            data_map_key += "%s=%s," % (key, group.group_key[key])
-
-        data_map_key = data_map_key[0:len(data_map_key) - 1]
-
-        date_map_to_return = self.measures_date_map.setdefault(data_map_key, {})
-        LOG.debug("Date map [%s] found for key [%s].",
-                  date_map_to_return, data_map_key)
-
-        return date_map_to_return
-
-    def sum_sequential_group_metrics(self, groups):
         for group in groups:
             group.sum_groups_same_time_values()
-
-    def truncate_measures(self):
-        for measures in self.measures_date_map.values():
-            if isinstance(measures, list):
-                self.truncate_measure(measures)
-                continue
-
-            for measure in measures.values():
-                self.truncate_measure(measure)
-
-    def truncate_measure(self, measures_list):
-        if not measures_list:
-            return
-
-        for measure in measures_list:
-            measure_new_val = (measure.value * measure.usage_coefficient)
-            LOG.debug('Trucating measure [%s] value to [%s].',
-                      measure.__dict__, measure_new_val)
-            measure.value = measure_new_val
+        return groups
 
     def format_response(self):
         measures_list = []
         for group in self.grouped_response:
-            aggregated = []
+            aggregated = processor.Measures()
             measures = {
                 'measures': {'measures': {'aggregated': aggregated}},
                 'group': group.group_key
@@ -480,9 +450,16 @@ class Grouper(object):
             if group.references:
                 measures['measures']['references'] = group.references
 
-            for measure in group.measures:
-                aggregated.append((measure.date, measure.granularity,
-                                   measure.value))
+            for timestamps, granularities, values in group.measures:
+                # Split the measures on granularity changes
+                boundaries = numpy.flatnonzero(
+                    granularities[1:] != granularities[:-1]) + 1
+                for first, last in zip(
+                        numpy.concatenate(([0], boundaries)),
+                        numpy.append(boundaries, len(timestamps))):
+                    aggregated.add_series(granularities[first],
+                                          timestamps[first:last],
+                                          values[first:last])
 
             if aggregated:
                 measures_list.append(measures)
@@ -493,6 +470,24 @@ class Grouper(object):
         return measures_list
 
 
+def _abort_no_such_metric(references):
+    all_metrics_not_found = list(set((m for (m, a) in references)))
+    all_metrics_not_found.sort()
+    api.abort(404, str(indexer.NoSuchMetric(all_metrics_not_found)))
+
+
+def _metrics_freshness(metrics):
+    # The last measure timestamp changes every time new measures of a metric
+    # are processed, so it tells whether its aggregates changed.
+    return sorted((str(m.id), m.last_measure_timestamp, m.archive_policy_name)
+                  for m in metrics)
+
+
+def _resources_freshness(resources):
+    return sorted((str(r.id), r.revision_start, _metrics_freshness(r.metrics))
+                  for r in resources)
+
+
 def ResourceTypeSchema(resource_type):
     try:
         pecan.request.indexer.get_resource_type(resource_type)
@@ -513,6 +508,7 @@ class AggregatesController(rest.RestController):
     })
 
     @pecan.expose("json")
+    @pecan.expose(content_type=api.MEASURES_COLUMNAR_JSON)
     def post(self, start=None, stop=None, granularity=None,
              needed_overlap=None, fill=None, groupby=None, **kwargs):
 
@@ -521,6 +517,8 @@ class AggregatesController(rest.RestController):
 
         if fill is None and needed_overlap is None:
             fill = "dropna"
+        relative_start = _is_relative_timestamp(start)
+        relative_stop = _is_relative_timestamp(stop)
         start, stop, granularity, needed_overlap, fill = api.validate_qs(
             start, stop, granularity, needed_overlap, fill)
 
@@ -530,7 +528,22 @@ class AggregatesController(rest.RestController):
         if stop:
             stop = numpy.datetime64(stop)
 
+        key_start, key_stop = start, stop
+        cache = pecan.request.aggregates_cache
+        if cache is not None and cache.time_bucket:
+            # Requests with relative timestamps get different start and stop
+            # every time, round them in the cache key so they share their
+            # responses. The computation still uses the requested timestamps.
+            time_bucket = numpy.timedelta64(cache.time_bucket, 's')
+            if relative_start:
+                key_start = carbonara.round_timestamp(start, time_bucket)
+            if relative_stop:
+                key_stop = carbonara.round_timestamp(stop, time_bucket)
+
         body = api.deserialize_and_validate(self.FetchSchema)
+        cache_key = (pecan.request.pecan['content_type'], body["operations"],
+                     str(key_start), str(key_stop), granularity,
+                     needed_overlap, fill, details)
 
         references = extract_references(body["operations"])
         if not references:
@@ -564,9 +577,13 @@ class AggregatesController(rest.RestController):
                         body["resource_type"],
                         attribute_filter=attr_filter,
                         sorts=sorts)
-                    return self._get_measures_by_name(
-                        resources, references, body["operations"], start, stop,
-                        granularity, needed_overlap, fill, details=details)
+                    return self._render(
+                        cache_key + (body["resource_type"], attr_filter,
+                                     _resources_freshness(resources)),
+                        lambda: self._get_measures_by_name(
+                            resources, references, body["operations"],
+                            start, stop, granularity, needed_overlap, fill,
+                            details=details))
 
                 if use_history:
                     results = self.get_measures_grouping_with_history(
@@ -580,9 +597,6 @@ class AggregatesController(rest.RestController):
                         body["resource_type"],
                         attribute_filter=attr_filter,
                         sorts=sorts)
-                    results = self.get_measures_grouping(
-                        body, details, fill, granularity, needed_overlap,
-                        references, resources, start, stop, groupby)
 
                     LOG.debug(
                         "Resources found [%s] with query filter [%s].",
@@ -591,20 +605,33 @@ class AggregatesController(rest.RestController):
                           'ended_at': r.ended_at} for r in resources or []],
                         attr_filter)
 
+                    def _get_measures_grouping():
+                        results = self.get_measures_grouping(
+                            body, details, fill, granularity, needed_overlap,
+                            references, resources, start, stop, groupby)
+                        if not results:
+                            _abort_no_such_metric(references)
+                        return results
+
+                    return self._render(
+                        cache_key + (body["resource_type"], attr_filter,
+                                     groupby,
+                                     _resources_freshness(resources)),
+                        _get_measures_grouping)
+
             except indexer.NoSuchMetric as e:
                 api.abort(404, str(e))
             except indexer.IndexerException as e:
                 api.abort(400, str(e))
+            except webob.exc.HTTPException:
+                raise
             except Exception as e:
                 LOG.exception(e)
                 raise e
 
             if not results:
-                all_metrics_not_found = list(set((m for (m, a) in references)))
-                all_metrics_not_found.sort()
-                api.abort(404, str(
-                    indexer.NoSuchMetric(all_metrics_not_found)))
-            return results
+                _abort_no_such_metric(references)
+            return api.render_measures(results)
 
         else:
             try:
@@ -627,7 +654,7 @@ class AggregatesController(rest.RestController):
 
             number_of_metrics = len(metrics)
             if number_of_metrics == 0:
-                return []
+                return api.render_measures([])
 
             for metric in metrics:
                 api.enforce("get metric", metric)
@@ -636,15 +663,43 @@ class AggregatesController(rest.RestController):
             references = [processor.MetricReference(metrics_by_ids[m], a)
                           for (m, a) in references]
 
-            response = {
-                "measures": get_measures_or_abort(
-                    references, body["operations"],
-                    start, stop, granularity, needed_overlap, fill)
-            }
-            if details:
-                response["references"] = metrics
+            def _get_measures():
+                response = {
+                    "measures": get_measures_or_abort(
+                        references, body["operations"],
+                        start, stop, granularity, needed_overlap, fill)
+                }
+                if details:
+                    response["references"] = metrics
+                return response
 
-            return response
+            return self._render(
+                cache_key + (_metrics_freshness(metrics),), _get_measures)
+
+    @staticmethod
+    def _render(key, compute):
+        """Render the response returned by `compute`.
+
+        The response gets an ETag and is cached if the cache is enabled.
+
+        :param key: A tuple identifying everything the response depends on.
+        :param compute: A function returning the response.
+        """
+        key = api.measures_etag(*key)
+        api.measures_etag_precondition_check(key)
+
+        cache = pecan.request.aggregates_cache
+        if cache is None:
+            return api.render_measures(compute())
+
+        response = cache.get(key)
+        if response is None:
+            sw = utils.StopWatch().start()
+            content_type, body = api.encode_measures(compute())
+            response = aggregates_cache.CachedResponse(
+                content_type, body, sw.elapsed())
+            cache.set(key, response)
+        return api.send_body(response.content_type, response.body)
 
     def get_measures_grouping(self, body, details, fill, granularity,
                               needed_overlap, references, resources, start,
@@ -682,10 +737,7 @@ class AggregatesController(rest.RestController):
         return grouper.get_grouped_measures()
 
     @staticmethod
-    def _get_measures_by_name(resources, metric_wildcards, operations,
-                              start, stop, granularity, needed_overlap, fill,
-                              details):
-
+    def _get_references(resources, metric_wildcards):
         references = []
         for r in resources:
             references.extend([
@@ -699,6 +751,48 @@ class AggregatesController(rest.RestController):
                 set((m for (m, a) in metric_wildcards)))
             all_metrics_not_found.sort()
             raise indexer.NoSuchMetric(all_metrics_not_found)
+        return references
+
+    @classmethod
+    def _get_resources_measures_by_name(cls, resources_and_windows,
+                                        metric_wildcards, operations,
+                                        granularity, needed_overlap, fill,
+                                        details):
+        """Get the measures of each resource over its own time window.
+
+        The timeseries of all the resources are retrieved at once.
+
+        :return: The response of each resource, or None if it has no metric
+                 matching the wildcards.
+        """
+        responses = [None] * len(resources_and_windows)
+        indexes = []
+        references_and_windows = []
+        for i, (resource, start, stop) in enumerate(resources_and_windows):
+            try:
+                references = cls._get_references([resource], metric_wildcards)
+            except indexer.NoSuchMetric:
+                continue
+            indexes.append(i)
+            references_and_windows.append((references, start, stop))
+
+        all_measures = get_measures_batch_or_abort(
+            references_and_windows, operations, granularity, needed_overlap,
+            fill)
+
+        for i, (references, _, _), measures in zip(
+                indexes, references_and_windows, all_measures):
+            responses[i] = {"measures": measures}
+            if details:
+                responses[i]["references"] = set(
+                    (r.resource for r in references))
+        return responses
+
+    @classmethod
+    def _get_measures_by_name(cls, resources, metric_wildcards, operations,
+                              start, stop, granularity, needed_overlap, fill,
+                              details):
+        references = cls._get_references(resources, metric_wildcards)
 
         response = {
             "measures": get_measures_or_abort(
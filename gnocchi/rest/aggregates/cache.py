@@ -0,0 +1,160 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""Cache of the responses of the aggregates API."""
+import collections
+import threading
+
+import cachetools
+from oslo_config import cfg
+
+from gnocchi.common import redis
+
+
+OPTS = [
+    cfg.StrOpt('driver',
+               choices=['memory', 'redis'],
+               help='Cache to store the responses of the aggregates API in. '
+               'memory keeps them in each API process, redis shares them '
+               'between the API processes. The cache is disabled if unset.'),
+    cfg.IntOpt('size',
+               default=1000, min=1,
+               help='Maximum number of responses kept by the memory cache.'),
+    cfg.IntOpt('ttl',
+               default=300, min=1,
+               help='Number of seconds a response is kept in the cache.'),
+    cfg.IntOpt('time_bucket',
+               default=10, min=0,
+               help='Number of seconds the relative start and stop of the '
+               'requests are rounded down to in the cache key, so that '
+               'requests using relative timestamps share their responses. '
+               'Absolute timestamps are never rounded. 0 disables the '
+               'rounding.'),
+] + redis.OPTS
+
+
+CachedResponse = collections.namedtuple(
+    "CachedResponse", ["content_type", "body", "compute_time"])
+
+
+class AggregatesCache(object):
+    """Cache of the rendered responses of the aggregates API.
+
+    The keys must identify the request and the freshness of everything it
+    reads, so that a response never has to be invalidated: it is not found
+    anymore once one of its metrics receives new measures, and it eventually
+    expires.
+    """
+
+    def __init__(self, conf):
+        self.time_bucket = conf.time_bucket
+        self._statistics = collections.Counter()
+        self._statistics_lock = threading.Lock()
+
+    def get(self, key):
+        """Get a cached response.
+
+        :param key: The key of the response.
+        :return: A `CachedResponse` or None.
+        """
+        response = self._get(key)
+        with self._statistics_lock:
+            if response is None:
+                self._statistics["misses"] += 1
+            else:
+                self._statistics["hits"] += 1
+                self._statistics["saved_time"] += response.compute_time
+        return response
+
+    def set(self, key, response):
+        """Cache a response.
+
+        :param key: The key of the response.
+        :param response: A `CachedResponse`.
+        """
+        self._set(key, response)
+
+    def statistics(self):
+        """Return the statistics of the cache in this process."""
+        with self._statistics_lock:
+            hits = self._statistics["hits"]
+            misses = self._statistics["misses"]
+            saved_time = self._statistics["saved_time"]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": float(hits) / (hits + misses) if hits else 0.0,
+            "saved_time": saved_time,
+        }
+
+    @staticmethod
+    def _get(key):
+        raise NotImplementedError
+
+    @staticmethod
+    def _set(key, response):
+        raise NotImplementedError
+
+
+class MemoryAggregatesCache(AggregatesCache):
+    def __init__(self, conf):
+        super(MemoryAggregatesCache, self).__init__(conf)
+        self._cache = cachetools.TTLCache(conf.size, conf.ttl)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            return self._cache.get(key)
+
+    def _set(self, key, response):
+        with self._lock:
+            self._cache[key] = response
+
+
+class RedisAggregatesCache(AggregatesCache):
+    PREFIX = b"gnocchi-aggregates-cache"
+
+    def __init__(self, conf):
+        super(RedisAggregatesCache, self).__init__(conf)
+        self.ttl = conf.ttl
+        self._client = redis.get_client(conf)
+
+    def _build_key(self, key):
+        return redis.SEP.join([self.PREFIX, key.encode()])
+
+    def _get(self, key):
+        response = self._client.hgetall(self._build_key(key))
+        if not response:
+            return None
+        return CachedResponse(response[b"content_type"].decode(),
+                              response[b"body"],
+                              float(response[b"compute_time"]))
+
+    def _set(self, key, response):
+        key = self._build_key(key)
+        pipe = self._client.pipeline(transaction=True)
+        pipe.hset(key, mapping={
+            b"content_type": response.content_type.encode(),
+            b"body": response.body,
+            b"compute_time": repr(response.compute_time).encode(),
+        })
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+
+def get_driver(conf):
+    """Return the configured aggregates cache, or None if it is disabled."""
+    if conf.aggregates_cache.driver == "memory":
+        return MemoryAggregatesCache(conf.aggregates_cache)
+    if conf.aggregates_cache.driver == "redis":
+        return RedisAggregatesCache(conf.aggregates_cache)
@@ -263,21 +263,9 @@ def handle_rolling(agg, granularity, timestamps, values, is_aggregated,
 
 def handle_resample(agg, granularity, timestamps, values, is_aggregated,
                     references, sampling):
-    # TODO(sileht): make a more optimised version that
-    # compute the data across the whole matrix
-    new_values = None
-    result_timestamps = timestamps
-    for ts in values.T:
-        ts = carbonara.AggregatedTimeSerie.from_data(
-            carbonara.Aggregation(agg, None, None),
-            timestamps, ts)
-        ts = ts.resample(sampling)
-        result_timestamps = ts["timestamps"]
-        if new_values is None:
-            new_values = numpy.array([ts["values"]])
-        else:
-            new_values = numpy.concatenate((new_values, [ts["values"]]))
-    return sampling, result_timestamps, new_values.T, is_aggregated
+    timestamps, values = carbonara.GroupedTimeSeriesMatrix(
+        timestamps, values, sampling).aggregate(agg)
+    return sampling, timestamps, values, is_aggregated
 
 
 def handle_aggregation_operator(nodes, granularity, timestamps, initial_values,
@@ -300,6 +288,68 @@ aggregation_operators = {
 }
 
 
+# Aggregation methods of the `aggregate' operation that can be computed
+# incrementally, one timeserie at a time.
+STREAMABLE_AGG = ("sum", "mean", "min", "max", "count")
+
+
+class Reduction(object):
+    """The precomputed values of an `aggregate' node."""
+
+    def __init__(self, values):
+        self.values = values
+
+
+def metric_node_selects(nodes, lookup_key):
+    """Return whether a `metric' node selects a reference lookup key."""
+    if isinstance(nodes[1], list):
+        return lookup_key in nodes[1:]
+    return lookup_key == nodes[1:]
+
+
+def find_streamable_reductions(nodes):
+    """Find the reductions of a tree that can be computed incrementally.
+
+    A tree can be computed incrementally if all its timeseries come from
+    `aggregate' nodes of a `metric' node with one of the `STREAMABLE_AGG'
+    methods, optionally combined with numbers by the other operators.
+
+    :return: The list of the `aggregate' nodes, or None if the tree can't be
+             computed incrementally.
+    """
+    if isinstance(nodes, numbers.Number):
+        return []
+    if nodes[0] == "aggregate":
+        if (nodes[1] in STREAMABLE_AGG and isinstance(nodes[2], list)
+                and nodes[2][0] == "metric"):
+            return [nodes]
+        return None
+    if (nodes[0] in ternary_operators or nodes[0] in binary_operators or
+            nodes[0] in unary_operators or
+            nodes[0] in unary_operators_with_timestamps):
+        reductions = []
+        for subnodes in nodes[1:]:
+            sub_reductions = find_streamable_reductions(subnodes)
+            if sub_reductions is None:
+                return None
+            reductions.extend(sub_reductions)
+        return reductions
+    return None
+
+
+def replace_reductions(nodes, reductions):
+    """Replace the `aggregate' nodes of a tree by their values.
+
+    :param reductions: A dict of {id(node): `Reduction'}.
+    """
+    if id(nodes) in reductions:
+        return reductions[id(nodes)]
+    if isinstance(nodes, numbers.Number):
+        return nodes
+    return [nodes[0]] + [replace_reductions(subnodes, reductions)
+                         for subnodes in nodes[1:]]
+
+
 def sanity_check(method):
     # NOTE(sileht): This is important checks, because caller may use zip and
     # build an incomplete timeseries without we notice the result is
@@ -331,7 +381,9 @@ def sanity_check(method):
 @sanity_check
 def evaluate(nodes, granularity, timestamps, initial_values, is_aggregated,
              references):
-    if isinstance(nodes, numbers.Number):
+    if isinstance(nodes, Reduction):
+        return granularity, timestamps, nodes.values, True
+    elif isinstance(nodes, numbers.Number):
         return granularity, timestamps, nodes, is_aggregated
     elif nodes[0] in aggregation_operators:
         return handle_aggregation_operator(nodes, granularity, timestamps,
@@ -353,11 +405,8 @@ def evaluate(nodes, granularity, timestamps, initial_values, is_aggregated,
                                      initial_values, is_aggregated,
                                      references)
     elif nodes[0] == "metric":
-        if isinstance(nodes[1], list):
-            predicat = lambda r: r in nodes[1:]
-        else:
-            predicat = lambda r: r == nodes[1:]
-        indexes = [i for i, r in enumerate(references) if predicat(r)]
+        indexes = [i for i, r in enumerate(references)
+                   if metric_node_selects(nodes, r)]
         return (granularity, timestamps, initial_values.T[indexes].T,
                 is_aggregated)
 
@@ -16,6 +16,8 @@
 # under the License.
 """Timeseries cross-aggregation."""
 import collections
+import itertools
+import struct
 
 import daiquiri
 import numpy
@@ -50,6 +52,90 @@ class MetricReference(object):
                 self.aggregation == other.aggregation)
 
 
+class Measures(object):
+    """The measures of several granularities.
+
+    The timestamps and values of each granularity are kept as arrays, and
+    are converted to the format of the response when it is rendered.
+    """
+
+    # Header of the measures of a granularity in the binary format: the
+    # granularity in seconds and the number of measures.
+    BINARY_HEADER = struct.Struct("<dQ")
+
+    def __init__(self):
+        self.series = []
+
+    def __len__(self):
+        return sum(len(timestamps) for _, timestamps, _ in self.series)
+
+    def add_series(self, granularity, timestamps, values):
+        """Add the measures of a granularity.
+
+        :param granularity: The granularity of the measures.
+        :param timestamps: An array of datetime64 timestamps.
+        :param values: An array of values.
+        """
+        if len(timestamps):
+            self.series.append((granularity, timestamps, values))
+
+    def to_list(self):
+        """Return the measures as a list of (timestamp, granularity, value)."""
+        return [measure
+                for granularity, timestamps, values in self.series
+                for measure in zip(timestamps, itertools.repeat(granularity),
+                                   values)]
+
+    @staticmethod
+    def _timestamps_to_string(timestamps):
+        timestamps = timestamps.astype('datetime64[ns]')
+        # Keep the format of the default JSON format for whole seconds
+        if (timestamps.astype('<i8') % 10 ** 9).any():
+            unit = 'ns'
+        else:
+            unit = 's'
+        return numpy.char.add(
+            numpy.datetime_as_string(timestamps, unit=unit), "+00:00")
+
+    def to_columnar(self):
+        """Return the measures as a list of columns for each granularity."""
+        return [{
+            "granularity": utils.timespan_total_seconds(granularity),
+            "timestamps": self._timestamps_to_string(timestamps).tolist(),
+            "values": numpy.asarray(values, dtype=numpy.float64).tolist(),
+        } for granularity, timestamps, values in self.series]
+
+    def to_binary(self):
+        """Return the measures in the binary format.
+
+        For each granularity, the granularity in seconds and the number of
+        measures are followed by the timestamps in nanoseconds since Epoch
+        and the values, all little-endian.
+        """
+        return b"".join(
+            self.BINARY_HEADER.pack(
+                utils.timespan_total_seconds(granularity), len(timestamps))
+            + timestamps.astype('datetime64[ns]').astype('<i8').tobytes()
+            + numpy.asarray(values, dtype='<f8').tobytes()
+            for granularity, timestamps, values in self.series)
+
+
+def convert_measures(obj, convert):
+    """Convert all the `Measures` of a response.
+
+    :param obj: A response, where measures are `Measures` objects.
+    :param convert: The function converting a `Measures` object.
+    :return: A copy of the response with the measures converted.
+    """
+    if isinstance(obj, Measures):
+        return convert(obj)
+    if isinstance(obj, dict):
+        return {k: convert_measures(v, convert) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [convert_measures(v, convert) for v in obj]
+    return obj
+
+
 def _get_measures_timeserie(storage, ref, granularity, *args, **kwargs):
     agg = ref.metric.archive_policy.get_aggregation(
         ref.aggregation, granularity)
@@ -71,21 +157,14 @@ def _get_measures_timeserie(storage, ref, granularity, *args, **kwargs):
     return (ref, data)
 
 
-def get_measures(storage, references, operations,
-                 from_timestamp=None, to_timestamp=None,
-                 granularities=None, needed_overlap=100.0,
-                 fill=None):
-    """Get aggregated measures of multiple entities.
+def check_references(references, granularities=None):
+    """Check that references can be aggregated together.
 
-    :param storage: The storage driver.
-    :param metrics_and_aggregations: List of metric+agg_method tuple
-                                     measured to aggregate.
-    :param from timestamp: The timestamp to get the measure from.
-    :param to timestamp: The timestamp to get the measure to.
+    :param references: List of `MetricReference` to aggregate.
     :param granularities: The granularities to retrieve.
-    :param fill: The value to use to fill in missing data in series.
+    :return: The granularities to retrieve, the ones in common to all
+             references if none are given.
     """
-
     if granularities is None:
         all_granularities = (
             definition.granularity
@@ -131,17 +210,331 @@ def get_measures(storage, references, operations,
             references_with_missing_granularity,
             "Granularities are missing")
 
-    tss = utils.parallel_map(_get_measures_timeserie,
-                             [(storage, ref, g, from_timestamp, to_timestamp)
-                              for ref in references
-                              for g in granularities])
+    return granularities
+
+
+def get_measures(storage, references, operations,
+                 from_timestamp=None, to_timestamp=None,
+                 granularities=None, needed_overlap=100.0,
+                 fill=None):
+    """Get aggregated measures of multiple entities.
+
+    :param storage: The storage driver.
+    :param metrics_and_aggregations: List of metric+agg_method tuple
+                                     measured to aggregate.
+    :param from timestamp: The timestamp to get the measure from.
+    :param to timestamp: The timestamp to get the measure to.
+    :param granularities: The granularities to retrieve.
+    :param fill: The value to use to fill in missing data in series.
+    """
+    granularities = check_references(references, granularities)
+
+    args = [(storage, ref, g, from_timestamp, to_timestamp)
+            for ref in references
+            for g in granularities]
+    if _find_streamable_reductions(operations, fill):
+        # The timeseries are aggregated as they are retrieved, so only retrieve
+        # a batch of them at a time.
+        tss = _parallel_map_in_batches(_get_measures_timeserie, args)
+    else:
+        tss = utils.parallel_map(_get_measures_timeserie, args)
 
     return aggregated(tss, operations, from_timestamp, to_timestamp,
                       needed_overlap, fill)
 
 
+def get_measures_batch(storage, references_and_windows, operations,
+                       granularities=None, needed_overlap=100.0, fill=None):
+    """Get aggregated measures of multiple sets of entities.
+
+    Each set of entities is aggregated over its own time window, but the
+    timeseries of all of them are retrieved at once over the union of the
+    windows.
+
+    :param storage: The storage driver.
+    :param references_and_windows: List of (references, from_timestamp,
+                                   to_timestamp) to aggregate.
+    :param granularities: The granularities to retrieve.
+    :param fill: The value to use to fill in missing data in series.
+    :return: The list of the aggregated measures of each set of references.
+    """
+    references_and_windows = [
+        (references, check_references(references, granularities),
+         from_timestamp, to_timestamp)
+        for references, from_timestamp, to_timestamp
+        in references_and_windows]
+    if not references_and_windows:
+        return []
+
+    from_timestamps = [w[2] for w in references_and_windows]
+    to_timestamps = [w[3] for w in references_and_windows]
+    from_timestamp = (None if any(ts is None for ts in from_timestamps)
+                      else min(from_timestamps))
+    to_timestamp = (None if any(ts is None for ts in to_timestamps)
+                    else max(to_timestamps))
+
+    metrics = {}
+    metrics_and_aggregations = collections.defaultdict(set)
+    for references, granularities, _, _ in references_and_windows:
+        for ref in references:
+            metric = metrics.setdefault(ref.metric.id, ref.metric)
+            for g in granularities:
+                metrics_and_aggregations[metric].add(
+                    metric.archive_policy.get_aggregation(
+                        ref.aggregation, g))
+
+    timeseries = {}
+    while metrics_and_aggregations:
+        try:
+            results = storage.get_aggregated_measures(
+                {metric: list(aggregations)
+                 for metric, aggregations in metrics_and_aggregations.items()},
+                from_timestamp, to_timestamp)
+        except gnocchi_storage.MetricDoesNotExist as e:
+            # Metrics without any measure yet have empty timeseries, retrieve
+            # the other ones again without it.
+            LOG.debug("Measurement does not exist for metric [%s].", e.metric)
+            del metrics_and_aggregations[metrics[e.metric.id]]
+        else:
+            for metric, aggregations in results.items():
+                for aggregation, ts in aggregations.items():
+                    timeseries[metric.id, aggregation] = ts
+            break
+
+    def _get_timeserie(ref, granularity):
+        aggregation = ref.metric.archive_policy.get_aggregation(
+            ref.aggregation, granularity)
+        try:
+            return timeseries[ref.metric.id, aggregation]
+        except KeyError:
+            return carbonara.AggregatedTimeSerie(
+                carbonara.Aggregation(ref.aggregation, granularity, None))
+
+    return [
+        aggregated([(ref, _get_timeserie(ref, g))
+                    for ref in references
+                    for g in granularities],
+                   operations, from_timestamp, to_timestamp,
+                   needed_overlap, fill)
+        for references, granularities, from_timestamp, to_timestamp
+        in references_and_windows
+    ]
+
+
+# Number of timeseries retrieved at once when they are aggregated
+# incrementally.
+STREAMING_BATCH_SIZE = 128
+
+
+def _parallel_map_in_batches(fn, list_of_args,
+                             batch_size=STREAMING_BATCH_SIZE):
+    for i in range(0, len(list_of_args), batch_size):
+        for result in utils.parallel_map(fn, list_of_args[i:i + batch_size]):
+            yield result
+
+
+def _find_streamable_reductions(operations, fill):
+    if fill in ("ffill", "bfill", "full_ffill", "full_bfill"):
+        # Filling a timeserie depends on all the timestamps of the others
+        return None
+    return agg_operations.find_streamable_reductions(operations)
+
+
+class ReductionsAccumulator(object):
+    """Compute `aggregate' nodes one timeserie at a time.
+
+    The timestamps of all the timeseries added so far are merged into one
+    axis, and each `aggregate' node keeps running sums, counts, minimums and
+    maximums along it. This uses memory proportional to the number of
+    timestamps, whatever the number of timeseries.
+    """
+
+    def __init__(self, reductions):
+        self.reductions = reductions
+        self.lookup_keys = []
+        self.times = numpy.array([], dtype='datetime64[ns]')
+        # Number of timeseries with a value for each timestamp
+        self.counts = numpy.zeros(0, dtype=numpy.int64)
+        nb_reductions = len(reductions)
+        # Number of timeseries selected by each reduction
+        self.reduction_series = numpy.zeros(nb_reductions, dtype=numpy.int64)
+        # Number of points and values of the timeseries selected by each
+        # reduction, for each timestamp
+        self.reduction_points = numpy.zeros((nb_reductions, 0),
+                                            dtype=numpy.int64)
+        self.reduction_counts = numpy.zeros((nb_reductions, 0),
+                                            dtype=numpy.int64)
+        self.reduction_sums = numpy.zeros((nb_reductions, 0))
+        self.reduction_mins = numpy.zeros((nb_reductions, 0))
+        self.reduction_maxs = numpy.zeros((nb_reductions, 0))
+
+    def _extend_times(self, times):
+        new_times = numpy.union1d(self.times, times)
+        if len(new_times) == len(self.times):
+            return
+
+        positions = numpy.searchsorted(new_times, self.times)
+
+        def _extend(array, filler):
+            new_array = numpy.full(array.shape[:-1] + (len(new_times),),
+                                   filler, dtype=array.dtype)
+            new_array[..., positions] = array
+            return new_array
+
+        self.times = new_times
+        self.counts = _extend(self.counts, 0)
+        self.reduction_points = _extend(self.reduction_points, 0)
+        self.reduction_counts = _extend(self.reduction_counts, 0)
+        self.reduction_sums = _extend(self.reduction_sums, 0)
+        self.reduction_mins = _extend(self.reduction_mins, numpy.nan)
+        self.reduction_maxs = _extend(self.reduction_maxs, numpy.nan)
+
+    def add(self, lookup_key, timeserie):
+        """Add a timeserie.
+
+        :param lookup_key: The lookup key of the timeserie reference.
+        :param timeserie: A timeserie array.
+        """
+        self.lookup_keys.append(lookup_key)
+        self._extend_times(timeserie['timestamps'])
+        positions = numpy.searchsorted(self.times, timeserie['timestamps'])
+        has_value = ~numpy.isnan(timeserie['values'])
+        values = timeserie['values'][has_value]
+        value_positions = positions[has_value]
+        self.counts[value_positions] += 1
+        for i, node in enumerate(self.reductions):
+            if not agg_operations.metric_node_selects(node[2], lookup_key):
+                continue
+            self.reduction_series[i] += 1
+            self.reduction_points[i, positions] += 1
+            self.reduction_counts[i, value_positions] += 1
+            self.reduction_sums[i, value_positions] += values
+            self.reduction_mins[i, value_positions] = numpy.fmin(
+                self.reduction_mins[i, value_positions], values)
+            self.reduction_maxs[i, value_positions] = numpy.fmax(
+                self.reduction_maxs[i, value_positions], values)
+
+    def reduce(self, fill=None):
+        """Return the values of each reduction.
+
+        :param fill: The value the missing points of the timeseries are
+                     filled with.
+        :return: A dict of {id(node): `Reduction'}.
+        """
+        sums = self.reduction_sums
+        counts = self.reduction_counts
+        mins = self.reduction_mins
+        maxs = self.reduction_maxs
+        if (fill is not None and not isinstance(fill, str)
+                and not numpy.isnan(fill)):
+            missing = self.reduction_series[:, None] - self.reduction_points
+            sums = sums + missing * fill
+            counts = counts + missing
+            mins = numpy.where(missing > 0, numpy.fmin(mins, fill), mins)
+            maxs = numpy.where(missing > 0, numpy.fmax(maxs, fill), maxs)
+
+        reductions = {}
+        for i, node in enumerate(self.reductions):
+            agg = node[1]
+            if agg == "sum":
+                values = sums[i]
+            elif agg == "count":
+                values = counts[i]
+            elif agg == "mean":
+                with numpy.errstate(divide="ignore", invalid="ignore"):
+                    values = sums[i] / counts[i]
+            elif agg == "min":
+                values = mins[i]
+            else:
+                values = maxs[i]
+            reductions[id(node)] = agg_operations.Reduction(values[:, None])
+        return reductions
+
+
+def _aggregated_streaming(reductions, refs_and_timeseries, operations,
+                          from_timestamp, to_timestamp,
+                          needed_percent_of_overlap, fill):
+    accumulators = {}
+    for (ref, timeserie) in refs_and_timeseries:
+        sampling = timeserie.aggregation.granularity
+        from_ = (None if from_timestamp is None else
+                 carbonara.round_timestamp(from_timestamp, sampling))
+        if sampling not in accumulators:
+            accumulators[sampling] = ReductionsAccumulator(reductions)
+        accumulators[sampling].add(ref.lookup_key,
+                                   timeserie[from_:to_timestamp])
+
+    if not accumulators:
+        return aggregated([], operations, from_timestamp, to_timestamp,
+                          needed_percent_of_overlap, fill)
+
+    result = {}
+    for sampling in sorted(accumulators, reverse=True):
+        LOG.debug("Processing sampling [%s] incrementally.", sampling)
+        accumulator = accumulators[sampling]
+        times = accumulator.times
+        values = accumulator.reduce(fill)
+        if fill is None:
+            overlap = numpy.flatnonzero(
+                accumulator.counts == len(accumulator.lookup_keys))
+            times, values = _check_overlap(
+                times, values, overlap, accumulator.lookup_keys,
+                from_timestamp, to_timestamp, needed_percent_of_overlap)
+
+        granularity, times, values, is_aggregated = agg_operations.evaluate(
+            agg_operations.replace_reductions(operations, values),
+            sampling, times, None, False, accumulator.lookup_keys)
+        result[sampling] = (granularity, times, values.T, None)
+
+    return _aggregated_output(result, fill)
+
+
+def _check_overlap(times, values, overlap, lookup_keys, from_timestamp,
+                   to_timestamp, needed_percent_of_overlap):
+    """Check the overlap of timeseries and trim them to it.
+
+    :param times: The timestamps of the timeseries.
+    :param values: The values of the timeseries, either an array with a row
+                   per timestamp or a dict of `Reduction'.
+    :param overlap: The indexes of the timestamps where all the timeseries
+                    have a value.
+    :return: The timestamps and the values trimmed to the overlap when there
+             is no boundary.
+    """
+    if overlap.size == 0 and needed_percent_of_overlap > 0:
+        raise exceptions.UnAggregableTimeseries(lookup_keys, 'No overlap')
+
+    def _slice(values, s):
+        if isinstance(values, dict):
+            return {key: agg_operations.Reduction(reduction.values[s])
+                    for key, reduction in values.items()}
+        return values[s]
+
+    if times.size:
+        # if no boundary set, use first/last timestamp which overlap
+        if to_timestamp is None and overlap.size:
+            times = times[:overlap[-1] + 1]
+            values = _slice(values, slice(None, overlap[-1] + 1))
+        if from_timestamp is None and overlap.size:
+            times = times[overlap[0]:]
+            values = _slice(values, slice(overlap[0], None))
+        percent_of_overlap = overlap.size * 100.0 / times.size
+        if percent_of_overlap < needed_percent_of_overlap:
+            raise exceptions.UnAggregableTimeseries(
+                lookup_keys,
+                'Less than %f%% of datapoints overlap in this '
+                'timespan (%.2f%%)' % (needed_percent_of_overlap,
+                                       percent_of_overlap))
+    return times, values
+
+
 def aggregated(refs_and_timeseries, operations, from_timestamp=None,
                to_timestamp=None, needed_percent_of_overlap=100.0, fill=None):
+    reductions = _find_streamable_reductions(operations, fill)
+    if reductions:
+        return _aggregated_streaming(
+            reductions, refs_and_timeseries, operations, from_timestamp,
+            to_timestamp, needed_percent_of_overlap, fill)
 
     series = collections.defaultdict(list)
     references = collections.defaultdict(list)
@@ -200,24 +593,9 @@ def aggregated(refs_and_timeseries, operations, from_timestamp=None,
         if fill is None:
             overlap = numpy.flatnonzero(~numpy.any(numpy.isnan(values),
                                                    axis=1))
-            if overlap.size == 0 and needed_percent_of_overlap > 0:
-                raise exceptions.UnAggregableTimeseries(lookup_keys[sampling],
-                                                        'No overlap')
-            if times.size:
-                # if no boundary set, use first/last timestamp which overlap
-                if to_timestamp is None and overlap.size:
-                    times = times[:overlap[-1] + 1]
-                    values = values[:overlap[-1] + 1]
-                if from_timestamp is None and overlap.size:
-                    times = times[overlap[0]:]
-                    values = values[overlap[0]:]
-                percent_of_overlap = overlap.size * 100.0 / times.size
-                if percent_of_overlap < needed_percent_of_overlap:
-                    raise exceptions.UnAggregableTimeseries(
-                        lookup_keys[sampling],
-                        'Less than %f%% of datapoints overlap in this '
-                        'timespan (%.2f%%)' % (needed_percent_of_overlap,
-                                               percent_of_overlap))
+            times, values = _check_overlap(
+                times, values, overlap, lookup_keys[sampling],
+                from_timestamp, to_timestamp, needed_percent_of_overlap)
 
         granularity, times, values, is_aggregated = (
             agg_operations.evaluate(operations, sampling, times, values,
@@ -227,30 +605,13 @@ def aggregated(refs_and_timeseries, operations, from_timestamp=None,
         result[sampling] = (granularity, times, values, references[sampling])
 
     if is_aggregated:
-        output = {"aggregated": []}
-        for sampling in sorted(result, reverse=True):
-            LOG.debug("Aggregated data found for time [%s], granularity [%s], "
-                      "references [%s], and values [%s] for sampling [%s].",
-                      times, granularity, references, values, sampling)
-
-            granularity, times, values, references = result[sampling]
-            if fill in ("dropna", "ffill", "bfill", "full_ffill", "full_bfill"):
-                pos = ~numpy.logical_or(numpy.isnan(values[0]),
-                                        numpy.isinf(values[0]))
-                v = values[0][pos]
-                t = times[pos]
-            else:
-                v = values[0]
-                t = times
-            g = [granularity] * len(t)
-            output["aggregated"].extend(zip(t, g, v))
-        return output
+        return _aggregated_output(result, fill)
     else:
         r_output = collections.defaultdict(
             lambda: collections.defaultdict(
-                lambda: collections.defaultdict(list)))
+                lambda: collections.defaultdict(Measures)))
         m_output = collections.defaultdict(
-            lambda: collections.defaultdict(list))
+            lambda: collections.defaultdict(Measures))
         for sampling in sorted(result, reverse=True):
             granularity, times, values, references = result[sampling]
             for i, ref in enumerate(references):
@@ -262,11 +623,30 @@ def aggregated(refs_and_timeseries, operations, from_timestamp=None,
                 else:
                     v = values[i]
                     t = times
-                g = [granularity] * len(t)
-                measures = zip(t, g, v)
                 if ref.resource is None:
-                    m_output[ref.name][ref.aggregation].extend(measures)
+                    m_output[ref.name][ref.aggregation].add_series(
+                        granularity, t, v)
                 else:
                     r_output[str(ref.resource.id)][
-                        ref.metric.name][ref.aggregation].extend(measures)
+                        ref.metric.name][ref.aggregation].add_series(
+                            granularity, t, v)
         return r_output if r_output else m_output
+
+
+def _aggregated_output(result, fill):
+    output = {"aggregated": Measures()}
+    for sampling in sorted(result, reverse=True):
+        granularity, times, values, references = result[sampling]
+        LOG.debug("Aggregated data found for time [%s], granularity [%s], "
+                  "references [%s], and values [%s] for sampling [%s].",
+                  times, granularity, references, values, sampling)
+        if fill in ("dropna", "ffill", "bfill", "full_ffill", "full_bfill"):
+            pos = ~numpy.logical_or(numpy.isnan(values[0]),
+                                    numpy.isinf(values[0]))
+            v = values[0][pos]
+            t = times[pos]
+        else:
+            v = values[0]
+            t = times
+        output["aggregated"].add_series(granularity, t, v)
+    return output
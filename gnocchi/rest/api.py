@@ -16,15 +16,21 @@
 # under the License.
 import collections
 import functools
+import hashlib
 import itertools
 import logging
 import operator
+import struct
+import threading
 import uuid
 
 from collections import abc
+import cachetools
 import jsonpatch
+import numpy
 from oslo_utils import strutils
 import pecan
+from pecan import jsonify
 from pecan import rest
 import pyparsing
 import tenacity
@@ -36,6 +42,7 @@ import werkzeug.http
 import gnocchi
 from gnocchi import archive_policy
 from gnocchi import calendar
+from gnocchi import carbonara
 from gnocchi import chef
 from gnocchi.cli import metricd
 from gnocchi import incoming
@@ -78,7 +85,7 @@ def arg_to_list(value):
     return []
 
 
-def abort(status_code, detail=''):
+def abort(status_code, detail='', headers=None):
     """Like pecan.abort, but make sure detail is a string."""
     if status_code == 404 and not detail:
         raise RuntimeError("http code 404 must have 'detail' set")
@@ -92,7 +99,7 @@ def abort(status_code, detail=''):
     elif isinstance(detail, Exception):
         detail = detail.jsonify()
     LOG.debug("Aborting request. Code [%s]. Details [%s]", status_code, detail)
-    return pecan.abort(status_code, detail)
+    return pecan.abort(status_code, detail, headers=headers)
 
 
 def flatten_dict_to_keypairs(d, separator=':'):
@@ -173,6 +180,54 @@ def deserialize(expected_content_types=None):
     return params
 
 
+# Media types of the formats measures can be returned in, rather than the
+# default JSON list of [timestamp, granularity, value].
+MEASURES_COLUMNAR_JSON = "application/vnd.gnocchi.measures.columnar+json"
+MEASURES_BINARY = "application/vnd.gnocchi.measures.binary"
+
+
+def encode_measures(namespace):
+    """Encode a response containing measures in the negotiated format.
+
+    :param namespace: The response, where measures are `processor.Measures`
+                      objects. It must be one to be encoded in the binary
+                      format.
+    :return: A tuple (content_type, body).
+    """
+    content_type = pecan.request.pecan['content_type']
+    if content_type == MEASURES_COLUMNAR_JSON:
+        body = json.dumps(processor.convert_measures(
+            namespace, processor.Measures.to_columnar)).encode('utf-8')
+    elif content_type == MEASURES_BINARY:
+        body = namespace.to_binary()
+    else:
+        content_type = "application/json"
+        body = jsonify.encode(processor.convert_measures(
+            namespace, processor.Measures.to_list)).encode('utf-8')
+    return content_type, body
+
+
+def send_body(content_type, body):
+    """Send an already encoded response body."""
+    pecan.response.body = body
+    pecan.response.content_type = content_type
+    return pecan.response
+
+
+def render_measures(namespace):
+    """Render a response containing measures in the negotiated format.
+
+    :param namespace: The response, where measures are `processor.Measures`
+                      objects. It must be one to be rendered in the binary
+                      format.
+    """
+    if pecan.request.pecan['content_type'] not in (MEASURES_COLUMNAR_JSON,
+                                                   MEASURES_BINARY):
+        return processor.convert_measures(namespace,
+                                          processor.Measures.to_list)
+    return send_body(*encode_measures(namespace))
+
+
 def validate(schema, data, required=True):
     try:
         return voluptuous.Schema(schema, required=required)(data)
@@ -187,6 +242,81 @@ def deserialize_and_validate(schema, required=True,
                     required)
 
 
+# Media type of the binary format the batch endpoints accept measures in,
+# rather than JSON.
+MEASURES_BATCH_BINARY = "application/vnd.gnocchi.measures.batch.binary"
+BINARY_BATCH_COUNT = struct.Struct("<Q")
+BINARY_BATCH_NAME_LENGTH = struct.Struct("<H")
+BINARY_BATCH_MEASURE_SIZE = numpy.dtype(
+    carbonara.TIMESERIES_ARRAY_DTYPE).itemsize
+
+
+def is_binary_measures_batch():
+    mime_type, options = werkzeug.http.parse_options_header(
+        pecan.request.headers.get('Content-Type'))
+    return mime_type == MEASURES_BATCH_BINARY
+
+
+def read_binary_batch_metric_id(data, offset):
+    return uuid.UUID(bytes=data[offset:offset + 16]), offset + 16
+
+
+def _read_binary_batch_name(data, offset):
+    length, = BINARY_BATCH_NAME_LENGTH.unpack_from(data, offset)
+    offset += BINARY_BATCH_NAME_LENGTH.size
+    name = data[offset:offset + length]
+    if len(name) != length:
+        raise ValueError("truncated name")
+    return name.decode("utf-8"), offset + length
+
+
+def read_binary_batch_resource_metric(data, offset):
+    resource_id, offset = _read_binary_batch_name(data, offset)
+    name, offset = _read_binary_batch_name(data, offset)
+    return (resource_id, name), offset
+
+
+def deserialize_binary_measures_batch(key_reader):
+    """Decode a batch of measures sent as `MEASURES_BATCH_BINARY`.
+
+    The body is a sequence of frames, each made of a key read by `key_reader`,
+    the number of measures (a little-endian uint64) and the measures as an
+    array of `carbonara.TIMESERIES_ARRAY_DTYPE`. The arrays are views on the
+    body.
+
+    :param key_reader: A function that reads a key from the body at an offset
+                       and returns it with the offset of the data after it.
+    :return: A dict of the arrays of measures by key.
+    """
+    data = pecan.request.body
+    batch = collections.defaultdict(list)
+    offset = 0
+    try:
+        while offset < len(data):
+            key, offset = key_reader(data, offset)
+            count, = BINARY_BATCH_COUNT.unpack_from(data, offset)
+            offset += BINARY_BATCH_COUNT.size
+            if count > (len(data) - offset) // BINARY_BATCH_MEASURE_SIZE:
+                raise ValueError("truncated measures")
+            measures = numpy.frombuffer(
+                data, dtype=carbonara.TIMESERIES_ARRAY_DTYPE,
+                count=count, offset=offset)
+            offset += measures.nbytes
+            batch[key].append(measures)
+    except (struct.error, ValueError) as e:
+        abort(400, "Unable to decode binary measures: %s" % e)
+
+    body = {}
+    for key, arrays in batch.items():
+        measures = arrays[0] if len(arrays) == 1 else numpy.concatenate(arrays)
+        if numpy.isnat(measures['timestamps']).any():
+            abort(400, "Invalid timestamp: NaT")
+        if (measures['timestamps'] < utils.unix_universal_start64).any():
+            abort(400, "Timestamp must be after Epoch")
+        body[key] = measures
+    return body
+
+
 def Timespan(value):
     try:
         return utils.to_timespan(value)
@@ -461,11 +591,20 @@ def MeasuresListSchema(measures):
         raise voluptuous.Invalid("unexpected timestamp '%s'" % e)
 
     try:
-        values = [float(i['value']) for i in measures]
+        raw_values = [i['value'] for i in measures]
+        # Homogeneous numeric payloads are converted at once; anything else
+        # (strings, None, nested lists, huge integers...) goes through float()
+        # item per item so the validation stays the same.
+        values = numpy.array(raw_values)
+        if values.ndim != 1 or values.dtype.kind not in "biuf":
+            values = [float(v) for v in raw_values]
     except Exception:
         raise voluptuous.Invalid("unexpected measures value")
 
-    return (incoming.Measure(t, v) for t, v in zip(times, values))
+    measures = numpy.empty(len(times), dtype=carbonara.TIMESERIES_ARRAY_DTYPE)
+    measures['timestamps'] = times
+    measures['values'] = values
+    return measures
 
 
 class MetricController(rest.RestController):
@@ -488,11 +627,13 @@ class MetricController(rest.RestController):
     def post_measures(self):
         self.enforce_metric("post measures")
         measures = deserialize_and_validate(MeasuresListSchema)
-        if measures:
+        if len(measures):
             pecan.request.incoming.add_measures(self.metric.id, measures)
         pecan.response.status = 202
 
     @pecan.expose('json')
+    @pecan.expose(content_type=MEASURES_COLUMNAR_JSON)
+    @pecan.expose(content_type=MEASURES_BINARY)
     def get_measures(self, start=None, stop=None, aggregation='mean',
                      granularity=None, resample=None, refresh=False,
                      **param):
@@ -545,18 +686,33 @@ class MetricController(rest.RestController):
             except chef.SackAlreadyLocked:
                 abort(503, 'Unable to refresh metric: %s. Metric is locked. '
                       'Please try again.' % self.metric.id)
+        else:
+            # The last measure timestamp of the metric changes every time its
+            # new measures are processed. It is outdated once the metric got
+            # refreshed, so no ETag is sent in that case.
+            measures_etag_precondition_check(measures_etag(
+                pecan.request.pecan['content_type'],
+                self.metric.id, self.metric.last_measure_timestamp,
+                self.metric.archive_policy.name,
+                [(d.granularity, d.points)
+                 for d in self.metric.archive_policy.definition],
+                aggregation, [a.granularity for a in aggregations],
+                str(start), str(stop), resample))
+        measures = processor.Measures()
         try:
             results = pecan.request.storage.get_aggregated_measures(
                 {self.metric: aggregations},
                 start, stop, resample)[self.metric]
-            return [(timestamp, results[key].aggregation.granularity, value)
-                    for key in sorted(results.keys(),
-                                      reverse=True)
-                    for timestamp, value in results[key]]
         except storage.AggregationDoesNotExist as e:
             abort(404, str(e))
         except storage.MetricDoesNotExist:
-            return []
+            pass
+        else:
+            for key in sorted(results.keys(), reverse=True):
+                measures.add_series(results[key].aggregation.granularity,
+                                    results[key].timestamps,
+                                    results[key].values)
+        return render_measures(measures)
 
     @pecan.expose('json')
     def delete(self):
@@ -879,6 +1035,27 @@ def etag_set_headers(obj):
     pecan.response.last_modified = obj.lastmodified
 
 
+def measures_etag(*parts):
+    """Build the ETag of a response containing measures.
+
+    :param parts: Everything the response depends on, including the freshness
+                  of its metrics.
+    """
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def measures_etag_precondition_check(etag):
+    """Set the ETag of a response, answering 304 if the client has it.
+
+    Unlike `etag_precondition_check`, the check is done before reading
+    anything, so it also answers 304 to the POST requests reading measures.
+    """
+    pecan.response.etag = etag
+    if etag in pecan.request.if_none_match:
+        abort(304, headers={"ETag": pecan.response.headers["ETag"]})
+
+
 def AttributesPath(value):
     if value.startswith("/attributes"):
         return value
@@ -1557,69 +1734,85 @@ class SearchMetricController(rest.RestController):
     )
 
     class MeasureQuery(object):
+        """A query compiled into numpy expressions.
+
+        The query is evaluated on whole arrays of values at once.
+        """
+
         binary_operators = {
-            u"=": operator.eq,
-            u"==": operator.eq,
-            u"eq": operator.eq,
+            u"=": numpy.equal,
+            u"==": numpy.equal,
+            u"eq": numpy.equal,
 
-            u"<": operator.lt,
-            u"lt": operator.lt,
+            u"<": numpy.less,
+            u"lt": numpy.less,
 
-            u">": operator.gt,
-            u"gt": operator.gt,
+            u">": numpy.greater,
+            u"gt": numpy.greater,
 
-            u"<=": operator.le,
-            u"≤": operator.le,
-            u"le": operator.le,
+            u"<=": numpy.less_equal,
+            u"≤": numpy.less_equal,
+            u"le": numpy.less_equal,
 
-            u">=": operator.ge,
-            u"≥": operator.ge,
-            u"ge": operator.ge,
+            u">=": numpy.greater_equal,
+            u"≥": numpy.greater_equal,
+            u"ge": numpy.greater_equal,
 
-            u"!=": operator.ne,
-            u"≠": operator.ne,
-            u"ne": operator.ne,
+            u"!=": numpy.not_equal,
+            u"≠": numpy.not_equal,
+            u"ne": numpy.not_equal,
 
-            u"%": operator.mod,
-            u"mod": operator.mod,
+            u"%": numpy.mod,
+            u"mod": numpy.mod,
 
-            u"+": operator.add,
-            u"add": operator.add,
+            u"+": numpy.add,
+            u"add": numpy.add,
 
-            u"-": operator.sub,
-            u"sub": operator.sub,
+            u"-": numpy.subtract,
+            u"sub": numpy.subtract,
 
-            u"*": operator.mul,
-            u"×": operator.mul,
-            u"mul": operator.mul,
+            u"*": numpy.multiply,
+            u"×": numpy.multiply,
+            u"mul": numpy.multiply,
 
-            u"/": operator.truediv,
-            u"÷": operator.truediv,
-            u"div": operator.truediv,
+            u"/": numpy.true_divide,
+            u"÷": numpy.true_divide,
+            u"div": numpy.true_divide,
 
-            u"**": operator.pow,
-            u"^": operator.pow,
-            u"pow": operator.pow,
+            u"**": numpy.power,
+            u"^": numpy.power,
+            u"pow": numpy.power,
         }
 
+        # Operator and result of the operation on no operand
         multiple_operators = {
-            u"or": any,
-            u"∨": any,
-            u"and": all,
-            u"∧": all,
+            u"or": (numpy.logical_or, False),
+            u"∨": (numpy.logical_or, False),
+            u"and": (numpy.logical_and, True),
+            u"∧": (numpy.logical_and, True),
         }
 
         def __init__(self, tree):
             self._eval = self.build_evaluator(tree)
 
-        def __call__(self, value):
-            return self._eval(value)
+        def __call__(self, values):
+            return self._eval(values)
+
+        def mask(self, values):
+            """Return the mask of the values matching the query.
+
+            :param values: An array of values.
+            """
+            with numpy.errstate(all="ignore"):
+                result = self._eval(values)
+            return numpy.broadcast_to(
+                numpy.asarray(result).astype(bool), numpy.shape(values))
 
         def build_evaluator(self, tree):
             try:
                 operator, nodes = list(tree.items())[0]
             except Exception:
-                return lambda value: tree
+                return lambda values: tree
             try:
                 op = self.multiple_operators[operator]
             except KeyError:
@@ -1632,13 +1825,15 @@ class SearchMetricController(rest.RestController):
 
         def _handle_multiple_op(self, op, nodes):
             elements = [self.build_evaluator(node) for node in nodes]
-            return lambda value: op((e(value) for e in elements))
+            op, initial = op
+            return lambda values: functools.reduce(
+                op, (e(values) for e in elements), initial)
 
         def _handle_binary_op(self, op, node):
             try:
                 iterator = iter(node)
             except Exception:
-                return lambda value: op(value, node)
+                return lambda values: op(values, node)
             nodes = list(iterator)
             if len(nodes) != 2:
                 raise self.InvalidQuery(
@@ -1646,7 +1841,7 @@ class SearchMetricController(rest.RestController):
                     (op, len(nodes)))
             node0 = self.build_evaluator(node[0])
             node1 = self.build_evaluator(node[1])
-            return lambda value: op(node0(value), node1(value))
+            return lambda values: op(node0(values), node1(values))
 
         class InvalidQuery(Exception):
             pass
@@ -1712,15 +1907,15 @@ class SearchMetricController(rest.RestController):
             # doesn't have any measures yet.
             abort(400, e)
 
-        return {
-            str(metric.id): [
-                (timestamp, aggregation.granularity, value)
-                for aggregation, ts in aggregations_and_ts.items()
-                for timestamp, value in ts
-                if predicate(value)
-            ]
-            for metric, aggregations_and_ts in timeseries.items()
-        }
+        results = {}
+        for metric, aggregations_and_ts in timeseries.items():
+            measures = results[str(metric.id)] = processor.Measures()
+            for aggregation, ts in aggregations_and_ts.items():
+                mask = predicate.mask(ts["values"])
+                measures.add_series(aggregation.granularity,
+                                    ts["timestamps"][mask],
+                                    ts["values"][mask])
+        return render_measures(results)
 
 
 class ResourcesMetricsMeasuresBatchController(rest.RestController):
@@ -1745,10 +1940,18 @@ class ResourcesMetricsMeasuresBatchController(rest.RestController):
     def post(self, create_metrics=False):
         creator = pecan.request.auth_helper.get_current_user(
             pecan.request)
-        MeasuresBatchSchema = voluptuous.Schema(
-            {functools.partial(ResourceID, creator=creator):
-             {str: self.BackwardCompatibleMeasuresList}})
-        body = deserialize_and_validate(MeasuresBatchSchema)
+        if is_binary_measures_batch():
+            body = collections.defaultdict(dict)
+            for (rid, name), measures in deserialize_binary_measures_batch(
+                    read_binary_batch_resource_metric).items():
+                body[rid][name] = {"measures": measures}
+            body = validate({functools.partial(ResourceID, creator=creator):
+                             {str: {"measures": numpy.ndarray}}}, body)
+        else:
+            MeasuresBatchSchema = voluptuous.Schema(
+                {functools.partial(ResourceID, creator=creator):
+                 {str: self.BackwardCompatibleMeasuresList}})
+            body = deserialize_and_validate(MeasuresBatchSchema)
 
         known_metrics = []
         unknown_metrics = []
@@ -1860,7 +2063,11 @@ class MetricsMeasuresBatchController(rest.RestController):
 
     @pecan.expose("json")
     def post(self):
-        body = deserialize_and_validate(self.MeasuresBatchSchema)
+        if is_binary_measures_batch():
+            body = deserialize_binary_measures_batch(
+                read_binary_batch_metric_id)
+        else:
+            body = deserialize_and_validate(self.MeasuresBatchSchema)
         metrics = pecan.request.indexer.list_metrics(
             attribute_filter={"in": {"id": list(body.keys())}})
 
@@ -2124,7 +2331,7 @@ class AggregationController(rest.RestController):
                 pecan.request.storage,
                 [processor.MetricReference(m, aggregation) for m in metrics],
                 operations, start, stop,
-                granularity, needed_overlap, fill)["aggregated"]
+                granularity, needed_overlap, fill)["aggregated"].to_list()
         except exceptions.UnAggregableTimeseries as e:
             abort(400, e)
         except storage.AggregationDoesNotExist as e:
@@ -2217,6 +2424,9 @@ class StatusController(rest.RestController):
         else:
             report_dict['metricd']['processors'] = None
             report_dict['metricd']['statistics'] = {}
+        if pecan.request.aggregates_cache is not None:
+            report_dict['aggregates_cache'] = (
+                pecan.request.aggregates_cache.statistics())
         return report_dict
 
 
@@ -2316,6 +2526,148 @@ def get_or_create_resource_and_metrics(
             raise
 
 
+class ResourcesCache(object):
+    """In-process cache of resources with their metrics.
+
+    Resources are cached for a short time only, as they are not invalidated
+    when they are updated by other processes.
+    """
+
+    def __init__(self, size, ttl):
+        self._cache = cachetools.TTLCache(size, ttl)
+        self._lock = threading.Lock()
+
+    def get(self, resource_type, rid):
+        with self._lock:
+            return self._cache.get((resource_type, rid))
+
+    def set(self, resource_type, resource):
+        with self._lock:
+            self._cache[(resource_type, resource.id)] = resource
+
+    def delete(self, resource_type, rid):
+        with self._lock:
+            self._cache.pop((resource_type, rid), None)
+
+
+def get_or_create_resources_and_metrics(creator, resources, resource_type,
+                                        resource_type_attributes=None):
+    """Get or create several resources and their metrics.
+
+    The resources are looked up in the resources cache and then retrieved
+    from the indexer at once. The metrics and resources which do not exist
+    yet are created in bulk, falling back to creating them one resource at a
+    time on conflicts.
+
+    A cached resource is not refreshed when one of its metrics is deleted by
+    another request: measures keep being accepted for the deleted metric,
+    and then dropped, until the entry expires after
+    `[api] resources_cache_ttl` seconds.
+
+    :param resources: A dict of {original_resource_id: (resource_attributes,
+                      metric_names)}.
+    :return: A dict of {original_resource_id: metrics}.
+    """
+    cache = pecan.request.resources_cache
+    rids = dict((original_rid, ResourceUUID(original_rid, creator=creator))
+                for original_rid in resources)
+
+    existing = {}
+    for original_rid, rid in rids.items():
+        r = cache.get(resource_type, rid) if cache else None
+        if r is not None:
+            existing[original_rid] = r
+
+    rids_to_fetch = [rid for original_rid, rid in rids.items()
+                     if original_rid not in existing]
+    if rids_to_fetch:
+        try:
+            fetched = pecan.request.indexer.get_resources(
+                resource_type, rids_to_fetch, with_metrics=True)
+        except (indexer.NoSuchResourceType,
+                indexer.UnexpectedResourceTypeState):
+            # get_or_create_resource_and_metrics() handles them
+            fetched = []
+        fetched = dict((r.id, r) for r in fetched)
+        for original_rid, rid in rids.items():
+            r = fetched.get(rid)
+            if r is not None:
+                existing[original_rid] = r
+                if cache:
+                    cache.set(resource_type, r)
+
+    results = {}
+    metrics_to_append = {}
+    resources_to_create = []
+    for original_rid, (attributes, metric_names) in resources.items():
+        rid = rids[original_rid]
+        r = existing.get(original_rid)
+        if r is not None:
+            enforce("update resource", r)
+            exists_metric_names = set(m.name for m in r.metrics)
+            if exists_metric_names.issuperset(metric_names):
+                results[original_rid] = r.metrics
+                continue
+            metrics_to_append[rid] = MetricsSchema(dict(
+                (m, {}) for m in metric_names
+                if m not in exists_metric_names))
+        else:
+            metrics = MetricsSchema(dict((m, {}) for m in metric_names))
+            target = {
+                "id": rid,
+                "resource_type": resource_type,
+                "creator": creator,
+                "original_resource_id": original_rid,
+                "metrics": metrics,
+            }
+            target.update(attributes)
+            enforce("create resource", target)
+            kwargs = dict(attributes)
+            kwargs.update(id=rid, original_resource_id=original_rid,
+                          metrics=metrics)
+            resources_to_create.append(kwargs)
+        if cache:
+            cache.delete(resource_type, rid)
+
+    original_rids = dict((rid, original_rid)
+                         for original_rid, rid in rids.items())
+    # Missing metrics and resources are created in one transaction per kind.
+    # If another request raced us, or the resource type does not exist yet,
+    # the whole transaction is rolled back and each resource goes through
+    # the slower, retrying path instead.
+    fallback = []
+    if metrics_to_append:
+        try:
+            updated = pecan.request.indexer.append_metrics_to_resources(
+                resource_type, metrics_to_append)
+        except (indexer.NoSuchResource, indexer.NamedMetricAlreadyExists):
+            fallback.extend(original_rids[rid] for rid in metrics_to_append)
+        else:
+            for r in updated:
+                results[original_rids[r.id]] = r.metrics
+    if resources_to_create:
+        try:
+            created = pecan.request.indexer.create_resources(
+                resource_type, creator, resources_to_create)
+        except (indexer.NoSuchResourceType,
+                indexer.UnexpectedResourceTypeState,
+                indexer.ResourceAlreadyExists):
+            fallback.extend(kwargs["original_resource_id"]
+                            for kwargs in resources_to_create)
+        else:
+            for r in created:
+                results[original_rids[r.id]] = r.metrics
+
+    timeout = pecan.request.conf.api.operation_timeout
+    for original_rid in fallback:
+        attributes, metric_names = resources[original_rid]
+        results[original_rid] = get_or_create_resource_and_metrics.retry_with(
+            stop=tenacity.stop_after_delay(timeout))(
+                creator, rids[original_rid], original_rid, metric_names,
+                dict(attributes), resource_type, resource_type_attributes)
+    return results
+
+
 class PrometheusWriteController(rest.RestController):
 
     PROMETHEUS_RESOURCE_TYPE = {
@@ -2348,17 +2700,20 @@ class PrometheusWriteController(rest.RestController):
 
         creator = pecan.request.auth_helper.get_current_user(pecan.request)
 
-        measures_to_batch = {}
+        resources = {}
+        measures_by_original_rid = {}
         for (job, instance), measures in measures_by_rid.items():
             original_rid = '%s@%s' % (job, instance)
-            rid = ResourceUUID(original_rid, creator=creator)
-            metric_names = list(measures.keys())
-            timeout = pecan.request.conf.api.operation_timeout
-            metrics = get_or_create_resource_and_metrics.retry_with(
-                stop=tenacity.stop_after_delay(timeout))(
-                    creator, rid, original_rid, metric_names,
-                    dict(job=job, instance=instance),
-                    "prometheus", self.PROMETHEUS_RESOURCE_TYPE)
+            resources[original_rid] = (dict(job=job, instance=instance),
+                                       list(measures.keys()))
+            measures_by_original_rid[original_rid] = measures
+
+        metrics_by_original_rid = get_or_create_resources_and_metrics(
+            creator, resources, "prometheus", self.PROMETHEUS_RESOURCE_TYPE)
+
+        measures_to_batch = {}
+        for original_rid, metrics in metrics_by_original_rid.items():
+            measures = measures_by_original_rid[original_rid]
 
             for metric in metrics:
                 enforce("post measures", metric)
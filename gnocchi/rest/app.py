@@ -33,6 +33,8 @@ from gnocchi import exceptions
 from gnocchi import incoming as gnocchi_incoming
 from gnocchi import indexer as gnocchi_indexer
 from gnocchi import json
+from gnocchi.rest.aggregates import cache as aggregates_cache
+from gnocchi.rest import api
 from gnocchi.rest import http_proxy_to_wsgi
 from gnocchi.rest import policies
 from gnocchi import storage as gnocchi_storage
@@ -54,6 +56,12 @@ class GnocchiHook(pecan.hooks.PecanHook):
         self.auth_helper = driver.DriverManager("gnocchi.rest.auth_helper",
                                                 conf.api.auth_mode,
                                                 invoke_on_load=True).driver
+        self.aggregates_cache = aggregates_cache.get_driver(conf)
+        if conf.api.resources_cache_ttl:
+            self.resources_cache = api.ResourcesCache(
+                conf.api.resources_cache_size, conf.api.resources_cache_ttl)
+        else:
+            self.resources_cache = None
 
     def on_route(self, state):
         state.request.coordinator = self._lazy_load('coordinator')
@@ -69,6 +77,8 @@ class GnocchiHook(pecan.hooks.PecanHook):
         state.request.conf = self.conf
         state.request.policy_enforcer = self.policy_enforcer
         state.request.auth_helper = self.auth_helper
+        state.request.aggregates_cache = self.aggregates_cache
+        state.request.resources_cache = self.resources_cache
 
     @staticmethod
     def after(state):
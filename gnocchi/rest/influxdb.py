@@ -14,20 +14,19 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import collections
+import re
 import time
 
 import gnocchi
-from gnocchi import incoming
+from gnocchi import carbonara
 from gnocchi import indexer
 from gnocchi.rest import api
-from gnocchi import utils
 
 import daiquiri
 import numpy
 import pecan
 from pecan import rest
 import pyparsing
-import tenacity
 try:
     import uwsgi
 except ImportError:
@@ -37,57 +36,149 @@ except ImportError:
 LOG = daiquiri.getLogger(__name__)
 
 
-boolean = "False|True|false|true|FALSE|TRUE|F|T|f|t"
-boolean = pyparsing.Regex(boolean).setParseAction(
-    lambda t: t[0].lower()[0] == "t")
-
-quoted_string = pyparsing.QuotedString('"', escChar="\\")
-unquoted_string = pyparsing.OneOrMore(
-    pyparsing.CharsNotIn(" ,=\\") +
-    pyparsing.Optional(
-        pyparsing.OneOrMore(
-            (pyparsing.Literal("\\ ") |
-             pyparsing.Literal("\\,") |
-             pyparsing.Literal("\\=") |
-             pyparsing.Literal("\\")).setParseAction(
-                 lambda s, loc, tok: tok[0][-1])))).setParseAction(
-                     lambda s, loc, tok: "".join(list(tok)))
-measurement = tag_key = tag_value = field_key = quoted_string | unquoted_string
-number = r"[+-]?\d+(:?\.\d*)?(:?[eE][+-]?\d+)?"
-number = pyparsing.Regex(number).setParseAction(
-    lambda s, loc, tok: float(tok[0]))
-integer = (
-    pyparsing.Word(pyparsing.nums).setParseAction(
-        lambda s, loc, tok: int(tok[0])) +
-    pyparsing.Suppress("i")
-)
-field_value = integer | number | quoted_string
-timestamp = pyparsing.Word(pyparsing.nums).setParseAction(
-    lambda s, loc, tok: numpy.datetime64(int(tok[0]), 'ns'))
-
-line_protocol = (
-    measurement +
-    # Tags
-    pyparsing.Optional(pyparsing.Suppress(",") +
-                       pyparsing.delimitedList(
-                           pyparsing.OneOrMore(
-                               pyparsing.Group(
-                                   tag_key +
-                                   pyparsing.Suppress("=") +
-                                   tag_value), ",")).setParseAction(
-                                       lambda s, loc, tok: dict(list(tok))),
-                       default={}) +
-    pyparsing.Suppress(" ") +
-    # Fields
-    pyparsing.delimitedList(
-        pyparsing.OneOrMore(
-            pyparsing.Group(field_key +
-                            pyparsing.Suppress("=") +
-                            field_value), ",")).setParseAction(
-                                lambda s, loc, tok: dict(list(tok))) +
-    # Timestamp
-    pyparsing.Optional(pyparsing.Suppress(" ") + timestamp, default=None)
-).leaveWhitespace()
+class LineProtocolError(ValueError):
+    pass
+
+
+# An identifier (measurement, tag key or value, field key) is either a quoted
+# string or a run of characters where space, comma and equal sign must be
+# escaped with a backslash.
+_IDENTIFIER = r'"(?:[^"\\]|\\.)*"|(?:[^ ,=\\]|\\.|\\$)+'
+_MEASUREMENT_RE = re.compile(_IDENTIFIER)
+_TAG_RE = re.compile(r"(%s)=(%s)" % (_IDENTIFIER, _IDENTIFIER))
+_FIELD_RE = re.compile(
+    r"(%s)=(?:"
+    # Integers
+    r"([+-]?\d+)[iu]|"
+    # Floats
+    r"([+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)|"
+    # Strings
+    r'"((?:[^"\\]|\\.)*)"|'
+    # Booleans
+    r"(true|True|TRUE|t|T|false|False|FALSE|f|F)"
+    r")(?=[ ,]|$)" % _IDENTIFIER)
+_TIMESTAMP_RE = re.compile(r"(?: (\d+))?\s*$")
+_ESCAPE_RE = re.compile(r"\\(.)")
+_UNESCAPE_RE = re.compile(r"\\([ ,=])")
+
+
+def _unescape_identifier(identifier):
+    if identifier[0] == '"' and len(identifier) > 1 and identifier[-1] == '"':
+        return _ESCAPE_RE.sub(r"\1", identifier[1:-1])
+    if "\\" in identifier:
+        return _UNESCAPE_RE.sub(r"\1", identifier)
+    return identifier
+
+
+_SIMPLE_NUMBER_RE = re.compile(
+    r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?$")
+_SIMPLE_INTEGER_RE = re.compile(r"[+-]?\d+[iu]$")
+_SIMPLE_TIMESTAMP_RE = re.compile(r"\d+$")
+
+
+def _parse_simple_line(line):
+    """Parse a line without quotes nor escaped characters.
+
+    :return: The same as :py:func:`parse_line` or None if the line must go
+             through the complete parser.
+    """
+    parts = line.rstrip().split(" ")
+    if len(parts) == 2:
+        identifiers, fields_str = parts
+        timestamp = None
+    elif len(parts) == 3:
+        identifiers, fields_str, timestamp = parts
+        if not _SIMPLE_TIMESTAMP_RE.match(timestamp):
+            return
+        timestamp = int(timestamp)
+    else:
+        return
+
+    identifiers = identifiers.split(",")
+    measurement = identifiers[0]
+    if not measurement:
+        return
+    tags = {}
+    for tag in identifiers[1:]:
+        key, sep, value = tag.partition("=")
+        if not key or not value or "=" in value:
+            return
+        tags[key] = value
+
+    fields = {}
+    for field in fields_str.split(","):
+        key, sep, value = field.partition("=")
+        if not key or not value:
+            return
+        if _SIMPLE_NUMBER_RE.match(value):
+            fields[key] = float(value)
+        elif _SIMPLE_INTEGER_RE.match(value):
+            fields[key] = int(value[:-1])
+        else:
+            return
+
+    return measurement, tags, fields, timestamp
+
+
+def parse_line(line):
+    """Parse a line of the InfluxDB line protocol.
+
+    :param line: The line to parse, as a string.
+    :return: A tuple (measurement, tags, fields, timestamp) where tags and
+             fields are dicts and timestamp is the number of nanoseconds
+             since the epoch or None.
+    :raise LineProtocolError: If the line is not valid.
+    """
+    if "\\" not in line and '"' not in line:
+        result = _parse_simple_line(line)
+        if result is not None:
+            return result
+
+    match = _MEASUREMENT_RE.match(line)
+    if match is None:
+        raise LineProtocolError("Unable to parse measurement")
+    measurement = _unescape_identifier(match.group())
+    pos = match.end()
+
+    tags = {}
+    while line.startswith(",", pos):
+        match = _TAG_RE.match(line, pos + 1)
+        if match is None:
+            raise LineProtocolError("Unable to parse tag")
+        key, value = match.groups()
+        tags[_unescape_identifier(key)] = _unescape_identifier(value)
+        pos = match.end()
+
+    if not line.startswith(" ", pos):
+        raise LineProtocolError("Unable to parse fields")
+
+    fields = {}
+    while True:
+        match = _FIELD_RE.match(line, pos + 1)
+        if match is None:
+            raise LineProtocolError("Unable to parse field")
+        key, integer, number, string, boolean = match.groups()
+        if number is not None:
+            value = float(number)
+        elif integer is not None:
+            value = int(integer)
+        elif string is not None:
+            value = _ESCAPE_RE.sub(r"\1", string)
+        else:
+            value = boolean[0] in "tT"
+        fields[_unescape_identifier(key)] = value
+        pos = match.end()
+        if not line.startswith(",", pos):
+            break
+
+    match = _TIMESTAMP_RE.match(line, pos)
+    if match is None:
+        raise LineProtocolError("Unable to parse timestamp")
+    timestamp = match.group(1)
+    if timestamp is not None:
+        timestamp = int(timestamp)
+
+    return measurement, tags, fields, timestamp
 
 
 query_parser = (
@@ -112,6 +203,9 @@ class InfluxDBController(rest.RestController):
 
     DEFAULT_TAG_RESOURCE_ID = "host"
 
+    # Size of the reads of a chunked body when not running with uwsgi
+    CHUNK_READ_SIZE = 1024 * 1024
+
     @pecan.expose()
     def ping(self):
         pecan.response.headers['X-Influxdb-Version'] = (
@@ -138,18 +232,115 @@ class InfluxDBController(rest.RestController):
             pecan.response.status = 204
 
     @staticmethod
-    def _write_get_lines():
+    def _write_get_chunks():
+        """Yield the request body as chunks of complete lines."""
         encoding = pecan.request.headers.get('Transfer-Encoding', "").lower()
-        if encoding == "chunked":
-            # TODO(sileht): Support reading chunk without uwsgi when
-            # pecan.request.environ['wsgi.input_terminated'] is set.
-            # https://github.com/unbit/uwsgi/issues/1428
-            if uwsgi is None:
-                api.abort(
-                    501, {"cause": "Not implemented error",
-                          "reason": "This server is not running with uwsgi"})
-            return encoding, uwsgi.chunked_read()
-        return None, pecan.request.body
+        if encoding != "chunked":
+            yield pecan.request.body
+            return
+
+        if uwsgi is not None:
+            while True:
+                chunk = uwsgi.chunked_read()
+                if not chunk:
+                    return
+                yield chunk
+
+        # Without uwsgi, the chunked body can only be read when the WSGI server
+        # dechunks it and sets wsgi.input_terminated.
+        # https://github.com/unbit/uwsgi/issues/1428
+        if not pecan.request.is_body_readable:
+            api.abort(
+                501, {"cause": "Not implemented error",
+                      "reason": "This server is not running with uwsgi"})
+
+        stream = pecan.request.body_file
+        remaining = b""
+        while True:
+            data = stream.read(InfluxDBController.CHUNK_READ_SIZE)
+            if not data:
+                break
+            data = remaining + data
+            end = data.rfind(b"\n") + 1
+            remaining = data[end:]
+            if end:
+                yield data[:end]
+        if remaining:
+            yield remaining
+
+    @staticmethod
+    def _parse_chunk(chunk, tag_to_rid, now):
+        """Parse a chunk of lines and group the measures.
+
+        :return: A dict of {resource_id: {metric_name: measures}} where
+                 measures is an array of `TIMESERIES_ARRAY_DTYPE`.
+        """
+        # resources = { resource_id: {
+        #     metric_name: ([timestamp, …], [value, …]), …
+        #   }, …
+        # }
+        resources = collections.defaultdict(
+            lambda: collections.defaultdict(lambda: ([], [])))
+        for line_number, line in enumerate(chunk.split(b"\n")):
+            # Ignore empty lines
+            if not line:
+                continue
+
+            try:
+                measurement, tags, fields, timestamp = parse_line(
+                    line.decode())
+            except (UnicodeDecodeError, LineProtocolError):
+                api.abort(400, {
+                    "cause": "Value error",
+                    "detail": "line",
+                    "reason": "Unable to parse line %d" % (
+                        line_number + 1),
+                })
+
+            if timestamp is None:
+                timestamp = now
+
+            try:
+                resource_id = tags.pop(tag_to_rid)
+            except KeyError:
+                api.abort(400, {
+                    "cause": "Value error",
+                    "detail": "key",
+                    "reason": "Unable to find key `%s' in tags" % (
+                        tag_to_rid),
+                })
+
+            tags_str = (("@" if tags else "") +
+                        ",".join(("%s=%s" % (k, tags[k]))
+                                 for k in sorted(tags)))
+
+            metrics = resources[resource_id]
+            for field_name, field_value in fields.items():
+                if isinstance(field_value, (str, bool)):
+                    # We do not support field value that are not numerical
+                    continue
+
+                # Metric name is the:
+                # <measurement>.<field_key>@<tag_key>=<tag_value>,…
+                # with tag ordered
+                # Replace "/" with "_" because Gnocchi does not support /
+                # in metric names
+                metric_name = (
+                    measurement + "." + field_name + tags_str
+                ).replace("/", "_")
+
+                timestamps, values = metrics[metric_name]
+                timestamps.append(timestamp)
+                values.append(field_value)
+
+        return dict(
+            (resource_id, dict(
+                (metric_name, carbonara.make_timeseries(
+                    numpy.array(timestamps, dtype=numpy.int64).view(
+                        "datetime64[ns]"),
+                    numpy.array(values, dtype=numpy.float64)))
+                for metric_name, (timestamps, values) in metrics.items()))
+            for resource_id, metrics in resources.items())
 
     @pecan.expose('json')
     def post_write(self, db="influxdb"):
@@ -159,89 +350,27 @@ class InfluxDBController(rest.RestController):
             "X-Gnocchi-InfluxDB-Tag-Resource-ID",
             self.DEFAULT_TAG_RESOURCE_ID)
 
-        while True:
-            encoding, chunk = self._write_get_lines()
-
+        for chunk in self._write_get_chunks():
             # If chunk is empty then this is over.
             if not chunk:
                 break
 
             # Compute now on a per-chunk basis
-            now = numpy.datetime64(int(time.time() * 10e8), 'ns')
-
-            # resources = { resource_id: {
-            #     metric_name: [ incoming.Measure(t, v), …], …
-            #   }, …
-            # }
-            resources = collections.defaultdict(
-                lambda: collections.defaultdict(list))
-            for line_number, line in enumerate(chunk.split(b"\n")):
-                # Ignore empty lines
-                if not line:
-                    continue
+            now = int(time.time() * 10e8)
 
-                try:
-                    measurement, tags, fields, timestamp = (
-                        line_protocol.parseString(line.decode())
-                    )
-                except (UnicodeDecodeError, SyntaxError,
-                        pyparsing.ParseException):
-                    api.abort(400, {
-                        "cause": "Value error",
-                        "detail": "line",
-                        "reason": "Unable to parse line %d" % (
-                            line_number + 1),
-                    })
-
-                if timestamp is None:
-                    timestamp = now
-
-                try:
-                    resource_id = tags.pop(tag_to_rid)
-                except KeyError:
-                    api.abort(400, {
-                        "cause": "Value error",
-                        "detail": "key",
-                        "reason": "Unable to find key `%s' in tags" % (
-                            tag_to_rid),
-                    })
-
-                tags_str = (("@" if tags else "") +
-                            ",".join(("%s=%s" % (k, tags[k]))
-                                     for k in sorted(tags)))
-
-                for field_name, field_value in fields.items():
-                    if isinstance(field_value, str):
-                        # We do not support field value that are not numerical
-                        continue
-
-                    # Metric name is the:
-                    # <measurement>.<field_key>@<tag_key>=<tag_value>,…
-                    # with tag ordered
-                    # Replace "/" with "_" because Gnocchi does not support /
-                    # in metric names
-                    metric_name = (
-                        measurement + "." + field_name + tags_str
-                    ).replace("/", "_")
-
-                    resources[resource_id][metric_name].append(
-                        incoming.Measure(timestamp, field_value))
+            resources = self._parse_chunk(chunk, tag_to_rid, now)
 
-            measures_to_batch = {}
-            for resource_name, metrics_and_measures in resources.items():
-                resource_name = resource_name
-                resource_id = utils.ResourceUUID(
-                    resource_name, creator=creator)
-                LOG.debug("Getting metrics from resource `%s'", resource_name)
-                timeout = pecan.request.conf.api.operation_timeout
-                metrics = (
-                    api.get_or_create_resource_and_metrics.retry_with(
-                        stop=tenacity.stop_after_delay(timeout))(
-                            creator, resource_id, resource_name,
-                            metrics_and_measures.keys(),
-                            {}, db)
-                )
+            LOG.debug("Getting metrics from %d resources", len(resources))
+            resources_metrics = api.get_or_create_resources_and_metrics(
+                creator,
+                dict((resource_name, ({}, metrics_and_measures.keys()))
+                     for resource_name, metrics_and_measures
+                     in resources.items()),
+                db)
 
+            measures_to_batch = {}
+            for resource_name, metrics in resources_metrics.items():
+                metrics_and_measures = resources[resource_name]
                 for metric in metrics:
                     api.enforce("post measures", metric)
 
@@ -255,5 +384,45 @@ class InfluxDBController(rest.RestController):
             pecan.request.incoming.add_measures_batch(measures_to_batch)
             pecan.response.status = 204
 
-            if encoding != "chunked":
-                return
+    @staticmethod
+    def benchmark():
+        """Run a speed benchmark!"""
+        lines = [
+            "cpu,cpu=cpu%d,host=abydos usage_system=11.1,usage_idle=73.2,"
+            "usage_nice=0,usage_irq=0,usage_user=15.7,usage_softirq=0,"
+            "usage_steal=0,usage_guest=0,usage_guest_nice=0,usage_iowait=0 "
+            "1510150170000000000" % (i % 8)
+            for i in range(5000)
+        ] + [
+            "disk,path=/private/var/vm,device=disk1s4,fstype=apfs,"
+            "host=host%d inodes_total=9223372036854775807i,"
+            "inodes_free=9223372036854775803i,inodes_used=4i,"
+            "total=250140434432i,free=28950695936i,used=4296265728i,"
+            "used_percent=12.922280752806417 1510150170000000000" % (i % 100)
+            for i in range(5000)
+        ] + [
+            'system,host=abydos uptime=337369i,'
+            'uptime_format="3 days, 21:42",'
+            'load1=2.18 %d' % (1510150170000000000 + i)
+            for i in range(5000)
+        ]
+        chunk = "\n".join(lines).encode()
+        times = 10
+
+        print("InfluxDB line protocol")
+        print("======================")
+
+        t0 = time.time()
+        for i in range(times):
+            for line in lines:
+                parse_line(line)
+        t1 = time.time()
+        print("  Parsing speed: %.2f lines/s"
+              % (len(lines) * times / (t1 - t0)))
+
+        t0 = time.time()
+        for i in range(times):
+            InfluxDBController._parse_chunk(chunk, "host", 0)
+        t1 = time.time()
+        print("  Parsing and grouping speed: %.2f lines/s"
+              % (len(lines) * times / (t1 - t0)))
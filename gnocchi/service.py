@@ -54,6 +54,9 @@ def prepare_service(args=None, conf=None,
          version=gnocchi.__version__)
 
     utils.parallel_map.MAX_WORKERS = conf.parallel_operations
+    utils.parallel_map.MAX_WORKERS_BY_EXECUTOR = (
+        conf.parallel_operations_by_executor)
+    utils.parallel_map.MAX_QUEUE_SIZE = conf.parallel_operations_queue_size
 
     if not log_to_std and (conf.log_dir or conf.log_file):
         outputs = [daiquiri.output.File(filename=conf.log_file,
@@ -15,9 +15,13 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import collections
+import functools
 import itertools
 import operator
+import struct
+import threading
 
+import cachetools
 import daiquiri
 import datetime
 import numpy
@@ -31,6 +35,38 @@ OPTS = [
     cfg.StrOpt('driver',
                default='file',
                help='Storage driver to use'),
+    cfg.IntOpt('split_format_version',
+               default=3,
+               choices=[3, 4],
+               help='Format version used to write aggregated splits. '
+               'Version 4 encodes timestamps as delta-of-delta varints and '
+               'values as XORed floats. Splits stored with version 3 stay '
+               'readable and are rewritten lazily by metricd. All the API '
+               'and metricd nodes must be upgraded before enabling it.'),
+    cfg.IntOpt('split_rewrite_batch_size',
+               default=16,
+               min=0,
+               help='Maximum number of read-only splits stored with version '
+               '3 that metricd rewrites with the configured split format '
+               'version each time it processes new measures for a metric. '
+               'The remaining ones are rewritten by the next passes. 0 '
+               'disables the lazy rewrite.'),
+    cfg.IntOpt('split_cache_size',
+               default=0,
+               min=0,
+               help='Maximum size in megabytes of the in-memory cache of '
+               'unserialized read-only splits used to query measures. '
+               '0 disables the cache.'),
+    cfg.BoolOpt('unaggregated_segments',
+                default=False,
+                help='Store the unaggregated timeserie of each metric as one '
+                'object per block of its back window rather than as one '
+                'object, so new measures only rewrite the last blocks. This '
+                'reduces the amount of data written for archive policies '
+                'with a back window. Timeseries are read whatever their '
+                'layout and converted to the configured one when next '
+                'written, so the option can be disabled again later. All '
+                'the metricd nodes must be upgraded before enabling it.'),
 ]
 
 
@@ -86,6 +122,17 @@ class AggregationDoesNotExist(StorageError):
         }
 
 
+class UnaggregatedSegmentMissing(StorageError):
+    """Error raised when a segment of an unaggregated timeserie is missing."""
+
+    def __init__(self, metric, segment):
+        self.metric = metric
+        self.segment = segment
+        super(UnaggregatedSegmentMissing, self).__init__(
+            "Segment %s of the unaggregated timeserie of metric %s is "
+            "missing or corrupted" % (segment, metric))
+
+
 class MetricAlreadyExists(StorageError):
     """Error raised when this metric already exists."""
 
@@ -95,6 +142,10 @@ class MetricAlreadyExists(StorageError):
             "Metric %s already exists" % metric)
 
 
+SegmentedTimeSerie = collections.namedtuple(
+    "SegmentedTimeSerie", ["ts", "segments"])
+
+
 @utils.retry_on_exception_and_log("Unable to initialize storage driver")
 def get_driver(conf):
     """Return the configured driver."""
@@ -129,8 +180,63 @@ class StorageDriver(object):
     # threads by setting this to utils.sequencial_map
     MAP_METHOD = staticmethod(utils.parallel_map)
 
+    # Splits stored with this format version are always readable, whatever the
+    # split format version that is configured.
+    LEGACY_SPLIT_VERSION = 3
+
+    # Rough memory used by an AggregatedTimeSerie on top of its Numpy array
+    SPLIT_CACHE_OVERHEAD = 512
+
+    # Rough memory used by a BoundTimeSerie on top of its Numpy array
+    BOUND_TIMESERIE_CACHE_OVERHEAD = 512
+
     def __init__(self, conf):
         self.statistics = Statistics()
+        if self.MAP_METHOD is utils.parallel_map:
+            # Each driver has its own pool of threads so their parallelism can
+            # be tuned independently.
+            self.MAP_METHOD = functools.partial(
+                utils.parallel_map, executor="storage." + conf.driver)
+        self.split_version = conf.split_format_version
+        self.split_rewrite_batch_size = conf.split_rewrite_batch_size
+        self.unaggregated_segments = conf.unaggregated_segments
+        if conf.split_cache_size:
+            self._split_cache = cachetools.LRUCache(
+                conf.split_cache_size * 1024 * 1024,
+                getsizeof=lambda ts: ts.ts.nbytes + self.SPLIT_CACHE_OVERHEAD)
+        else:
+            self._split_cache = None
+        self._split_cache_lock = threading.Lock()
+        self._bound_timeserie_cache = None
+        self._bound_timeserie_cache_lock = threading.Lock()
+
+    def enable_bound_timeserie_cache(self, size):
+        """Keep the unaggregated timeseries processed in memory.
+
+        The unaggregated timeseries stored by `add_measures_to_metrics' are
+        kept unserialized, along with a generation token of their stored
+        version. The next time the measures of the same metric are processed,
+        the cached timeserie is used if the token did not change, saving the
+        read and the unserialization of the timeserie.
+
+        :param size: The maximum size of the cache in megabytes. 0 disables
+                     the cache.
+        """
+        with self._bound_timeserie_cache_lock:
+            if size:
+                self._bound_timeserie_cache = cachetools.LRUCache(
+                    size * 1024 * 1024,
+                    getsizeof=lambda generation_and_ts: (
+                        generation_and_ts[1].ts.nbytes
+                        + self.BOUND_TIMESERIE_CACHE_OVERHEAD))
+            else:
+                self._bound_timeserie_cache = None
+
+    def clear_bound_timeserie_cache(self):
+        """Empty the unaggregated timeseries cache."""
+        with self._bound_timeserie_cache_lock:
+            if self._bound_timeserie_cache is not None:
+                self._bound_timeserie_cache.clear()
 
     @staticmethod
     def upgrade():
@@ -165,6 +271,35 @@ class StorageDriver(object):
         """
         raise NotImplementedError
 
+    @staticmethod
+    def _get_unaggregated_timeseries_generation_unbatched(metric, version=3):
+        """Get the generation token of the unaggregated timeserie of a metric.
+
+        The token changes every time the unaggregated timeserie is stored and
+        must be much cheaper to retrieve than the timeserie itself.
+
+        :param metric: A metric.
+        :param version: The storage format version number.
+        :return: A token, or None if the timeserie does not exist or if the
+                 driver does not support generation tokens.
+        """
+        return None
+
+    def _get_unaggregated_timeseries_generations(self, metrics, version=3):
+        """Get the generation tokens of the unaggregated timeserie of metrics.
+
+        :param metrics: A list of metrics.
+        :param version: The storage format version number.
+        :return: A dict where keys are metrics and values are their token.
+        """
+        return dict(
+            zip(
+                metrics,
+                self.MAP_METHOD(
+                    utils.return_none_on_failure(
+                        self._get_unaggregated_timeseries_generation_unbatched),
+                    ((metric, version) for metric in metrics))))
+
     def _get_or_create_unaggregated_timeseries(self, metrics, version=3):
         """Get the unaggregated timeserie of metrics.
 
@@ -202,6 +337,107 @@ class StorageDriver(object):
                 self._store_unaggregated_timeseries_unbatched),
             ((metric, data, version) for metric, data in metrics_and_data))
 
+    @staticmethod
+    def _unaggregated_segment_name(segment, version=3):
+        """Return the name of a segment of an unaggregated timeserie.
+
+        :param segment: The timestamp of the block stored in the segment.
+        :param version: Storage engine data format version
+        """
+        name = 'none_%s' % float(carbonara.datetime64_to_epoch(segment))
+        return name + '_v%s' % version if version else name
+
+    @staticmethod
+    def _get_unaggregated_timeserie_segment_unbatched(
+            metric, segment, version=3):
+        """Get a segment of the unaggregated timeserie of a metric.
+
+        :param metric: A metric.
+        :param segment: The timestamp of the block stored in the segment.
+        :param version: Storage engine data format version
+        :return: The serialized segment, or None if it does not exist.
+        """
+        raise NotImplementedError
+
+    def _get_unaggregated_timeseries_segments(self, metrics_and_segments,
+                                              version=3):
+        """Get segments of the unaggregated timeserie of metrics.
+
+        :param metrics_and_segments: A dict where keys are metrics and values
+                                     are lists of segment timestamps.
+        :param version: Storage engine data format version
+        :return: A dict where keys are metrics and values are dict
+                 {segment: serialized segment or None}.
+        """
+        results = collections.defaultdict(dict)
+        for metric, segment, data in self.MAP_METHOD(
+                lambda m, s, v: (
+                    m, s,
+                    self._get_unaggregated_timeserie_segment_unbatched(
+                        m, s, v)),
+                ((metric, segment, version)
+                 for metric, segments in metrics_and_segments.items()
+                 for segment in segments)):
+            results[metric][segment] = data
+        return results
+
+    @staticmethod
+    def _store_unaggregated_timeserie_segment_unbatched(
+            metric, segment, data, version=3):
+        """Store a segment of the unaggregated timeserie of a metric.
+
+        :param metric: A metric.
+        :param segment: The timestamp of the block stored in the segment.
+        :param data: The serialized segment.
+        :param version: Storage engine data format version
+        """
+        raise NotImplementedError
+
+    def _store_unaggregated_timeseries_segments(self, metrics_segments_data,
+                                                version=3):
+        """Store segments of the unaggregated timeserie of metrics.
+
+        :param metrics_segments_data: A dict where keys are metrics and
+                                      values are lists of (segment,
+                                      serialized segment) tuples.
+        :param version: Storage engine data format version
+        :raise: The first error met storing a segment, so that the head
+                listing the segments is not stored.
+        """
+        self.MAP_METHOD(
+            self._store_unaggregated_timeserie_segment_unbatched,
+            ((metric, segment, data, version)
+             for metric, segments_data in metrics_segments_data.items()
+             for segment, data in segments_data))
+
+    @staticmethod
+    def _delete_unaggregated_timeserie_segment_unbatched(
+            metric, segment, version=3):
+        """Delete a segment of the unaggregated timeserie of a metric.
+
+        Deleting a segment that does not exist is not an error.
+
+        :param metric: A metric.
+        :param segment: The timestamp of the block stored in the segment.
+        :param version: Storage engine data format version
+        """
+        raise NotImplementedError
+
+    def _delete_unaggregated_timeseries_segments(self, metrics_and_segments,
+                                                 version=3):
+        """Delete segments of the unaggregated timeserie of metrics.
+
+        :param metrics_and_segments: A dict where keys are metrics and values
+                                     are lists of segment timestamps.
+        :param version: Storage engine data format version
+        """
+        self.MAP_METHOD(
+            utils.return_none_on_failure(
+                self._delete_unaggregated_timeserie_segment_unbatched),
+            ((metric, segment, version)
+             for metric, segments in metrics_and_segments.items()
+             for segment in segments))
+
     @staticmethod
     def _store_metric_splits_unbatched(metric, key, aggregation, data, offset,
                                        version=3):
@@ -238,18 +474,27 @@ class StorageDriver(object):
              in keys_aggregations_data_offset))
 
     @staticmethod
-    def _list_split_keys_unbatched(self, metric, aggregations, version=3):
+    def _list_split_keys_unbatched(self, metric, aggregations, version=3,
+                                   from_timestamp=None, to_timestamp=None):
         """List split keys for a metric.
 
+        Drivers able to list only a range of keys should use `from_timestamp'
+        and `to_timestamp', but they can return keys out of that range.
+
         :param metric: The metric to look key for.
         :param aggregations: List of Aggregations to look for.
         :param version: Storage engine format version.
+        :param from_timestamp: If not None, the keys of the splits ending
+                               before this timestamp are not needed.
+        :param to_timestamp: If not None, the keys of the splits starting
+                             after this timestamp are not needed.
         :return: A dict where keys are Aggregation objects and values are
                  a set of SplitKey objects.
         """
         raise NotImplementedError
 
-    def _list_split_keys(self, metrics_and_aggregations, version=3):
+    def _list_split_keys(self, metrics_and_aggregations, version=3,
+                         from_timestamp=None, to_timestamp=None):
         """List split keys for metrics.
 
         :param metrics_and_aggregations: Dict of
@@ -257,6 +502,10 @@ class StorageDriver(object):
                                           [`carbonara.Aggregation`]}
                                          to look for.
         :param version: Storage engine format version.
+        :param from_timestamp: If not None, only list the keys of the splits
+                               ending after this timestamp.
+        :param to_timestamp: If not None, only list the keys of the splits
+                             starting before this timestamp.
         :return: A dict where keys are `storage.Metric` and values are dicts
                  where keys are `carbonara.Aggregation` objects and values are
                  a set of `carbonara.SplitKey` objects.
@@ -264,12 +513,117 @@ class StorageDriver(object):
         metrics = list(metrics_and_aggregations.keys())
         r = self.MAP_METHOD(
             self._list_split_keys_unbatched,
-            ((metric, metrics_and_aggregations[metric], version)
+            ((metric, metrics_and_aggregations[metric], version,
+              from_timestamp, to_timestamp)
              for metric in metrics))
-        return {
-            metric: results
-            for metric, results in zip(metrics, r)
+        results = dict(zip(metrics, r))
+        if from_timestamp is not None or to_timestamp is not None:
+            for aggregations_and_keys in results.values():
+                for aggregation, keys in aggregations_and_keys.items():
+                    aggregations_and_keys[aggregation] = (
+                        self._filter_split_keys(
+                            keys, aggregation,
+                            from_timestamp, to_timestamp))
+        return results
+
+    @staticmethod
+    def _split_keys_range(aggregation, from_timestamp=None,
+                          to_timestamp=None):
+        """Return the first and last split keys of a time range.
+
+        :return: A tuple (start, stop) of `carbonara.SplitKey`, each being
+                 None if the range is not bounded on this side.
+        """
+        start = (
+            carbonara.SplitKey.from_timestamp_and_sampling(
+                from_timestamp, aggregation.granularity)
+        ) if from_timestamp is not None else None
+        stop = (
+            carbonara.SplitKey.from_timestamp_and_sampling(
+                to_timestamp, aggregation.granularity)
+        ) if to_timestamp is not None else None
+        return start, stop
+
+    @classmethod
+    def _filter_split_keys(cls, keys, aggregation, from_timestamp=None,
+                           to_timestamp=None):
+        """Only keep the split keys covering a time range."""
+        start, stop = cls._split_keys_range(
+            aggregation, from_timestamp, to_timestamp)
+        return {key for key in keys
+                if ((start is None or key >= start)
+                    and (stop is None or key <= stop))}
+
+    @classmethod
+    def _sortable_split_keys_range(cls, aggregations, from_timestamp=None,
+                                   to_timestamp=None):
+        """Return names bounding split keys covering a time range.
+
+        Split keys are named after their timestamp in seconds since Epoch.
+        Those names sort lexicographically like the keys as long as they
+        have the same number of digits, which is the case from 2001-09-09 to
+        2286-11-20. Drivers listing names in lexicographical order can use
+        those bounds to only list the keys of that range.
+
+        :param aggregations: The aggregations whose keys are listed.
+        :return: A tuple (start, stop) where start is a name sorting before
+                 the names of the first keys of the range, and stop a name
+                 sorting before the names of the keys after the range.
+                 They are None if the range is not bounded on this side or
+                 if the names of that side cannot be sorted.
+        """
+        if from_timestamp is None or not aggregations:
+            # Keys named with less digits sort after the others so no
+            # lexicographical stop can be used without a start.
+            return None, None
+        starts, stops = zip(*(
+            cls._split_keys_range(aggregation, from_timestamp, to_timestamp)
+            for aggregation in aggregations))
+        start = min((str(key) for key in starts), key=float)
+        if not 10 ** 9 <= float(start) < 10 ** 10:
+            return None, None
+        if to_timestamp is None:
+            return start, None
+        stop = max((str(key) for key in stops), key=float)
+        if float(stop) >= 10 ** 10:
+            return start, None
+        # Names are the key followed by "_" then other fields, and "`" is the
+        # character following "_".
+        return start, stop + "`"
+
+    def _list_split_keys_and_versions(self, metrics_and_aggregations,
+                                      from_timestamp=None, to_timestamp=None):
+        """List split keys for metrics with their format version.
+
+        :param metrics_and_aggregations: Dict of
+                                         {`storage.Metric`:
+                                          [`carbonara.Aggregation`]}
+                                         to look for.
+        :param from_timestamp: If not None, only list the keys of the splits
+                               ending after this timestamp.
+        :param to_timestamp: If not None, only list the keys of the splits
+                             starting before this timestamp.
+        :return: A dict where keys are `storage.Metric` and values are dicts
+                 where keys are `carbonara.Aggregation` objects and values are
+                 dicts of {`carbonara.SplitKey`: version}.
+        """
+        results = {
+            metric: {aggregation: {} for aggregation in aggregations}
+            for metric, aggregations in metrics_and_aggregations.items()
         }
+        versions = [self.LEGACY_SPLIT_VERSION]
+        if self.split_version != self.LEGACY_SPLIT_VERSION:
+            versions.append(self.split_version)
+        # If a split is stored with both versions, the configured one wins: the
+        # legacy one is going to be deleted.
+        for version in versions:
+            for metric, aggregations_and_keys in self._list_split_keys(
+                    metrics_and_aggregations, version,
+                    from_timestamp, to_timestamp).items():
+                for aggregation, keys in aggregations_and_keys.items():
+                    results[metric][aggregation].update(
+                        dict.fromkeys(keys, version))
+        return results
 
     @staticmethod
     def _version_check(name, v):
@@ -291,29 +645,25 @@ class StorageDriver(object):
         :param from timestamp: The timestamp to get the measure from.
         :param to timestamp: The timestamp to get the measure to.
         """
-        metrics_aggs_keys = self._list_split_keys(metrics_and_aggregations)
+        metrics_aggs_keys = self._list_split_keys_and_versions(
+            metrics_and_aggregations, from_timestamp, to_timestamp)
+        immutable_before = collections.defaultdict(dict)
 
         for metric, aggregations_keys in metrics_aggs_keys.items():
             for aggregation, keys in aggregations_keys.items():
-                start = (
-                    carbonara.SplitKey.from_timestamp_and_sampling(
-                        from_timestamp, aggregation.granularity)
-                ) if from_timestamp else None
-
-                stop = (
-                    carbonara.SplitKey.from_timestamp_and_sampling(
-                        to_timestamp, aggregation.granularity)
-                ) if to_timestamp else None
-
-                # Replace keys with filtered version
-                metrics_aggs_keys[metric][aggregation] = [
-                    key for key in sorted(keys)
-                    if ((not start or key >= start)
-                        and (not stop or key <= stop))
-                ]
-
-        metrics_aggregations_splits = self._get_splits_and_unserialize(
-            metrics_aggs_keys)
+                if keys:
+                    # The last key listed might not be the last key of the
+                    # metric, which only makes this bound lower.
+                    immutable_before[metric][aggregation] = (
+                        self._oldest_mutable_timestamp_lower_bound(
+                            metric, max(keys)))
+                metrics_aggs_keys[metric][aggregation] = {
+                    key: keys[key] for key in sorted(keys)
+                }
+
+        metrics_aggregations_splits = (
+            self._get_splits_and_unserialize_cached(
+                metrics_aggs_keys, immutable_before))
 
         results = collections.defaultdict(dict)
         for metric, aggregations in metrics_and_aggregations.items():
@@ -337,26 +687,188 @@ class StorageDriver(object):
                     aggregation].fetch(from_timestamp, to_timestamp)
         return results
 
-    def _get_splits_and_unserialize(self, metrics_aggregations_keys):
+    @staticmethod
+    def _oldest_mutable_timestamp_lower_bound(metric, last_key):
+        """Return a timestamp before which the splits cannot change anymore.
+
+        The last split contains the last measure processed for the metric,
+        and the unaggregated timeserie does not accept measures older than
+        its back window, which starts after the returned timestamp.
+
+        :param metric: The metric.
+        :param last_key: The last `carbonara.SplitKey` of an aggregation.
+        """
+        block_size = metric.archive_policy.max_block_size
+        return (carbonara.round_timestamp(last_key.key, block_size)
+                - block_size * metric.archive_policy.back_window)
+
+    def _get_splits_and_unserialize_cached(self, metrics_aggregations_keys,
+                                           immutable_before):
+        """Get splits and unserialize them using the split cache.
+
+        :param metrics_aggregations_keys: A dict where keys are
+                                         `storage.Metric` and values are dict
+                                          of {Aggregation: {SplitKey:
+                                          version}} to retrieve.
+        :param immutable_before: A dict of {`storage.Metric`: {Aggregation:
+                                 timestamp}} where the splits ending before
+                                 timestamp are read-only and can be cached.
+        :return: A dict where keys are `storage.Metric` and values are dict
+                 {aggregation: [`carbonara.AggregatedTimeSerie`]}.
+        """
+        if self._split_cache is None:
+            return self._get_splits_and_unserialize({
+                metric: {aggregation: list(keys)
+                         for aggregation, keys in aggregations_keys.items()}
+                for metric, aggregations_keys
+                in metrics_aggregations_keys.items()
+            })
+
+        cached = {}
+        keys_to_get = collections.defaultdict(
+            lambda: collections.defaultdict(list))
+        with self._split_cache_lock:
+            for metric, aggregations_keys in (
+                    metrics_aggregations_keys.items()):
+                for aggregation, keys in aggregations_keys.items():
+                    for key, version in keys.items():
+                        ts = self._split_cache.get(
+                            (metric.id, aggregation, key, version))
+                        if ts is None:
+                            keys_to_get[metric][aggregation].append(key)
+                        else:
+                            cached[(metric, aggregation, key)] = ts
+        self.statistics["split cache hits"] += len(cached)
+        self.statistics["split cache misses"] += sum(
+            len(keys) for aggregations_keys in keys_to_get.values()
+            for keys in aggregations_keys.values())
+
+        splits = self._get_splits_and_unserialize(keys_to_get)
+        with self._split_cache_lock:
+            for metric, aggregations_and_splits in splits.items():
+                for aggregation, tss in aggregations_and_splits.items():
+                    for key, ts in zip(keys_to_get[metric][aggregation], tss):
+                        cached[(metric, aggregation, key)] = ts
+                        # Do not cache empty, e.g. corrupted, splits
+                        if (ts and next(key)
+                                <= immutable_before[metric][aggregation]):
+                            self._split_cache[(
+                                metric.id, aggregation, key,
+                                metrics_aggregations_keys[metric][
+                                    aggregation][key])] = ts
+
+        results = collections.defaultdict(
+            lambda: collections.defaultdict(list))
+        for metric, aggregations_keys in metrics_aggregations_keys.items():
+            for aggregation, keys in aggregations_keys.items():
+                results[metric][aggregation] = [
+                    cached[(metric, aggregation, key)] for key in keys]
+        return results
+
+    def _invalidate_split_cache(self, metrics_keys_aggregations=None,
+                                metric=None):
+        """Remove splits from the split cache.
+
+        :param metrics_keys_aggregations: A dict where keys are
+                                         `storage.Metric` and values are lists
+                                         of tuples starting with (key,
+                                         aggregation) to remove, whatever
+                                         their version.
+        :param metric: A `storage.Metric` to remove all the splits of.
+        """
+        if self._split_cache is None:
+            return
+        with self._split_cache_lock:
+            if metric is not None:
+                for cache_key in [cache_key for cache_key in self._split_cache
+                                  if cache_key[0] == metric.id]:
+                    del self._split_cache[cache_key]
+            for m, keys_aggregations in (
+                    metrics_keys_aggregations or {}).items():
+                for key, aggregation, *_ in keys_aggregations:
+                    for version in (self.LEGACY_SPLIT_VERSION,
+                                    self.split_version):
+                        self._split_cache.pop(
+                            (m.id, aggregation, key, version), None)
+
+    def delete_metric(self, metric):
+        """Delete a metric and all its data.
+
+        :param metric: The metric to delete.
+        """
+        self.delete_metrics([metric])
+
+    def delete_metrics(self, metrics):
+        """Delete several metrics and all their data.
+
+        :param metrics: The metrics to delete.
+        """
+        self._delete_metrics(metrics)
+        for metric in metrics:
+            self._invalidate_split_cache(metric=metric)
+        with self._bound_timeserie_cache_lock:
+            if self._bound_timeserie_cache is not None:
+                for metric in metrics:
+                    self._bound_timeserie_cache.pop(metric.id, None)
+
+    def _get_splits_and_unserialize(self, metrics_aggregations_keys,
+                                    legacy_keys=None):
         """Get splits and unserialize them
 
+        Splits that are not stored with the configured format version are
+        read from the legacy format version.
+
         :param metrics_aggregations_keys: A dict where keys are
                                          `storage.Metric` and values are dict
                                           of {Aggregation: [SplitKey]} to
                                           retrieve.
+        :param legacy_keys: If not None, a dict filled with the
+                            {`storage.Metric`: [(key, aggregation)]} splits
+                            that have been read from the legacy format.
         :return: A dict where keys are `storage.Metric` and values are dict
                  {aggregation: [`carbonara.AggregatedTimeSerie`]}.
         """
-        raw_measures = self._get_splits(metrics_aggregations_keys)
+        raw_measures = self._get_splits(metrics_aggregations_keys,
+                                        self.split_version)
+        versions = {}
+        if self.split_version != self.LEGACY_SPLIT_VERSION:
+            missing_keys = collections.defaultdict(
+                lambda: collections.defaultdict(list))
+            for metric, aggregations_and_raws in raw_measures.items():
+                for aggregation, raws in aggregations_and_raws.items():
+                    for key, raw in zip(
+                            metrics_aggregations_keys[metric][aggregation],
+                            raws):
+                        if raw is None:
+                            missing_keys[metric][aggregation].append(key)
+            if missing_keys:
+                legacy_raw_measures = self._get_splits(
+                    missing_keys, self.LEGACY_SPLIT_VERSION)
+            else:
+                legacy_raw_measures = {}
+            for metric, aggregations_and_raws in legacy_raw_measures.items():
+                for aggregation, raws in aggregations_and_raws.items():
+                    for key, raw in zip(missing_keys[metric][aggregation],
+                                        raws):
+                        if raw is None:
+                            continue
+                        versions[(metric, key, aggregation)] = (
+                            self.LEGACY_SPLIT_VERSION, raw)
+                        if legacy_keys is not None:
+                            legacy_keys.setdefault(metric, []).append(
+                                (key, aggregation))
+
         results = collections.defaultdict(
             lambda: collections.defaultdict(list))
         for metric, aggregations_and_raws in raw_measures.items():
             for aggregation, raws in aggregations_and_raws.items():
                 for key, raw in zip(
                         metrics_aggregations_keys[metric][aggregation], raws):
+                    version, raw = versions.get(
+                        (metric, key, aggregation), (self.split_version, raw))
                     try:
                         ts = carbonara.AggregatedTimeSerie.unserialize(
-                            raw, key, aggregation)
+                            raw, key, aggregation, version)
                     except carbonara.InvalidData:
                         LOG.error("Data corruption detected for %s "
                                   "aggregated `%s' timeserie, granularity "
@@ -380,6 +892,7 @@ class StorageDriver(object):
                                                   oldest_mutable_timestamp)
         """
         metrics_splits_to_store = {}
+        legacy_splits_to_store = {}
         keys_to_get = collections.defaultdict(
             lambda: collections.defaultdict(list))
         splits_to_rewrite = collections.defaultdict(
@@ -400,7 +913,9 @@ class StorageDriver(object):
                     keys_to_get[metric][aggregation].append(key)
                     splits_to_rewrite[metric][aggregation].append(split)
 
-        existing_data = self._get_splits_and_unserialize(keys_to_get)
+        legacy_keys = {}
+        existing_data = self._get_splits_and_unserialize(keys_to_get,
+                                                         legacy_keys)
 
         for metric, (keys_and_aggregations_and_splits,
                      oldest_mutable_timestamp) in (
@@ -416,18 +931,44 @@ class StorageDriver(object):
                         (key, split.aggregation)] = existing
 
             keys_aggregations_data_offset = []
+            legacy_keys_aggregations_data_offset = []
             for (key, aggregation), split in (
                     keys_and_aggregations_and_splits.items()):
                 # Do not store the split if it's empty.
                 if split:
+                    compressed = key in keys_to_get[metric][aggregation]
                     offset, data = split.serialize(
-                        key,
-                        compressed=key in keys_to_get[metric][aggregation])
-                    keys_aggregations_data_offset.append(
-                        (key, split.aggregation, data, offset))
+                        key, compressed=compressed,
+                        version=self.split_version)
+                    # The uncompressed format is the same for every version:
+                    # keep writing it at the offset of the legacy split, which
+                    # is rewritten with the configured version once compressed.
+                    if compressed:
+                        keys_aggregations_data_offset.append(
+                            (key, split.aggregation, data, offset))
+                    else:
+                        legacy_keys_aggregations_data_offset.append(
+                            (key, split.aggregation, data, offset))
+            if self.split_version == self.LEGACY_SPLIT_VERSION:
+                keys_aggregations_data_offset.extend(
+                    legacy_keys_aggregations_data_offset)
+            elif legacy_keys_aggregations_data_offset:
+                legacy_splits_to_store[metric] = (
+                    legacy_keys_aggregations_data_offset)
             metrics_splits_to_store[metric] = keys_aggregations_data_offset
 
-        return self._store_metric_splits(metrics_splits_to_store)
+        self._invalidate_split_cache(metrics_splits_to_store)
+        self._invalidate_split_cache(legacy_splits_to_store)
+        self._store_metric_splits(metrics_splits_to_store,
+                                  self.split_version)
+        if legacy_splits_to_store:
+            self._store_metric_splits(legacy_splits_to_store,
+                                      self.LEGACY_SPLIT_VERSION)
+        if legacy_keys:
+            # The legacy splits have been rewritten with the configured
+            # version, they are not needed anymore.
+            self._delete_metric_splits(legacy_keys,
+                                       self.LEGACY_SPLIT_VERSION)
 
     def _compute_split_operations(self, metric, aggregations_and_timeseries,
                                   previous_oldest_mutable_timestamp,
@@ -446,7 +987,8 @@ class StorageDriver(object):
         :param oldest_mutable_timestamp: The current oldest storable timestamp
                                          from the current backwindow.
         :return: A tuple (keys_to_delete, keys_to_store) where keys_to_delete
-                 is a set of `carbonara.SplitKey` to delete and where
+                 is a set of (`carbonara.SplitKey`, aggregation, version)
+                 to delete and where
                  keys_to_store is a dictionary of the form {key: aggts}
                  where key is a `carbonara.SplitKey` and aggts a
                  `carbonara.AggregatedTimeSerie` to be serialized.
@@ -488,14 +1030,27 @@ class StorageDriver(object):
 
             oldest_values[aggregation.granularity] = agg_oldest_values
 
-        all_existing_keys = self._list_split_keys(
-            {metric: aggregations_needing_list_of_keys})[metric]
+        if (self.split_version == self.LEGACY_SPLIT_VERSION
+                and not any(aggregation.timespan for aggregation
+                            in aggregations_needing_list_of_keys)):
+            # Nothing is deleted, only the splits between the previous and the
+            # current oldest mutable keys are rewritten.
+            from_timestamp = previous_oldest_mutable_timestamp
+            to_timestamp = oldest_mutable_timestamp
+        else:
+            from_timestamp = to_timestamp = None
+        all_existing_keys = self._list_split_keys_and_versions(
+            {metric: aggregations_needing_list_of_keys},
+            from_timestamp, to_timestamp)[metric]
 
         # NOTE(jd) This dict uses (key, aggregation) tuples as keys because
         # using just (key) would not carry the aggregation method and therefore
         # would not be unique per aggregation!
         keys_and_split_to_store = {}
         deleted_keys = set()
+        # Legacy splits are rewritten by batches so the first pass after the
+        # upgrade does not rewrite the whole history of the metric.
+        legacy_rewrites_left = self.split_rewrite_batch_size
 
         for aggregation, ts in aggregations_and_timeseries.items():
             # Don't do anything if the timeseries is empty
@@ -512,7 +1067,8 @@ class StorageDriver(object):
             if aggregation in all_existing_keys:
                 # FIXME(jd) This should be sorted by the driver and asserted it
                 # is in tests. It's likely backends already sort anyway.
-                existing_keys = sorted(all_existing_keys[aggregation])
+                existing_keys_and_versions = all_existing_keys[aggregation]
+                existing_keys = sorted(existing_keys_and_versions)
                 # First, check for old splits to delete
                 if aggregation.timespan:
                     for key in list(existing_keys):
@@ -523,9 +1079,33 @@ class StorageDriver(object):
                         # much
                         if key >= oldest_key_to_keep:
                             break
-                        deleted_keys.add((key, aggregation))
+                        deleted_keys.add(
+                            (key, aggregation,
+                             existing_keys_and_versions[key]))
                         existing_keys.remove(key)
 
+                # Lazily rewrite the read-only splits stored with the legacy
+                # format version. Passing an empty split makes
+                # _update_metric_splits merge it with the existing one.
+                if self.split_version != self.LEGACY_SPLIT_VERSION:
+                    oldest_mutable_key = ts.get_split_key(
+                        oldest_mutable_timestamp)
+                    for key in existing_keys:
+                        if not legacy_rewrites_left:
+                            break
+                        if (existing_keys_and_versions[key]
+                                != self.LEGACY_SPLIT_VERSION):
+                            continue
+                        if not self.WRITE_FULL and key >= oldest_mutable_key:
+                            break
+                        legacy_rewrites_left -= 1
+                        LOG.debug(
+                            "Rewriting legacy split %s (%s) for metric %s",
+                            key, aggregation.method, metric)
+                        keys_and_split_to_store[(key, aggregation)] = (
+                            carbonara.AggregatedTimeSerie(aggregation)
+                        )
+
                 # Rewrite all read-only splits just for fun (and
                 # compression). This only happens if
                 # `previous_oldest_mutable_timestamp' exists, which means
@@ -562,6 +1142,10 @@ class StorageDriver(object):
     def _delete_metric(metric):
         raise NotImplementedError
 
+    def _delete_metrics(self, metrics):
+        self.MAP_METHOD(self._delete_metric,
+                        ((metric,) for metric in metrics))
+
     @staticmethod
     def _delete_metric_splits_unbatched(metric, keys, aggregation, version=3):
         raise NotImplementedError
@@ -572,47 +1156,164 @@ class StorageDriver(object):
         :param metrics_keys_aggregations: A dict where keys are
                                          `storage.Metric` and values are lists
                                          of (key, aggregation) tuples.
+        :param version: Storage engine format version.
         """
         self.MAP_METHOD(
             utils.return_none_on_failure(self._delete_metric_splits_unbatched),
-            ((metric, key, aggregation)
+            ((metric, key, aggregation, version)
              for metric, keys_and_aggregations
              in metrics_keys_aggregations.items()
              for key, aggregation in keys_and_aggregations))
 
-    def add_measures_to_metrics(self, metrics_and_measures, indexer_driver):
+    def _delete_metric_splits_of_any_version(self,
+                                             metrics_keys_aggregations):
+        """Delete splits of metrics stored with any format version.
+
+        :param metrics_keys_aggregations: A dict where keys are
+                                         `storage.Metric` and values are lists
+                                         of (key, aggregation, version)
+                                         tuples.
+        """
+        versions_metrics_keys_aggregations = collections.defaultdict(
+            lambda: collections.defaultdict(list))
+        for metric, keys_aggregations_versions in (
+                metrics_keys_aggregations.items()):
+            for key, aggregation, version in keys_aggregations_versions:
+                versions_metrics_keys_aggregations[version][metric].append(
+                    (key, aggregation))
+        self._invalidate_split_cache(metrics_keys_aggregations)
+        for version, metrics_keys_aggregations in (
+                versions_metrics_keys_aggregations.items()):
+            self._delete_metric_splits(metrics_keys_aggregations, version)
+
+    def add_measures_to_metrics(self, metrics_and_measures, indexer_driver,
+                                vectorized=False):
         """Update a metric with a new measures, computing new aggregations.
 
         :param metrics_and_measures: A dict there keys are `storage.Metric`
                                      objects and values are timeseries array of
                                      the new measures.
+        :param indexer_driver: The indexer driver to update metadata with.
+        :param vectorized: Compute the aggregations of all the metrics
+                           sharing an archive policy at once rather than
+                           metric by metric. The results are identical.
         """
         raw_measures = self.get_raw_measures(metrics_and_measures)
 
         new_boundts = []
         splits_to_delete = {}
         splits_to_update = {}
+        sorted_metrics_and_measures = {}
 
         for metric, measures in metrics_and_measures.items():
             measures = numpy.sort(measures, order='timestamps')
 
-            self.execute_data_processing(
-                measures, metric, new_boundts, raw_measures, splits_to_delete, splits_to_update)
+            if not vectorized:
+                self.execute_data_processing(
+                    measures, metric, new_boundts, raw_measures, splits_to_delete, splits_to_update)
 
-            self.execute_metadata_updates_if_needed(indexer_driver, measures, metric)
+            sorted_metrics_and_measures[metric] = measures
+
+        if vectorized:
+            self.execute_data_processing_vectorized(
+                sorted_metrics_and_measures, new_boundts, raw_measures, splits_to_delete, splits_to_update)
 
         self.store_data_backend(new_boundts, splits_to_delete, splits_to_update)
 
+        # The last measure timestamps are the freshness token of the ETags
+        # and of the aggregates cache: only bump them once the new splits
+        # are readable, otherwise a response computed from the old splits
+        # could be served under the new token.
+        self.execute_metadata_updates_if_needed(indexer_driver, sorted_metrics_and_measures)
+
+        self._cache_bound_timeseries(raw_measures)
+
     def get_raw_measures(self, metrics_and_measures):
+        """Get the unaggregated timeseries of metrics.
+
+        :return: A dict where keys are `storage.Metric` objects and values
+                 are either their serialized unaggregated timeserie, None if
+                 they have none yet, their `carbonara.BoundTimeSerie`
+                 coming from the bound timeserie cache, or a
+                 `SegmentedTimeSerie` rebuilt from its segments.
+        """
+        raw_measures = self._pop_cached_bound_timeseries(
+            metrics_and_measures.keys())
+        metrics_to_fetch = [metric for metric in metrics_and_measures
+                            if metric not in raw_measures]
         with self.statistics.time("raw measures fetch"):
-            raw_measures = self._get_or_create_unaggregated_timeseries(
-                metrics_and_measures.keys())
-        self.statistics["raw measures fetch"] += len(metrics_and_measures)
+            fetched = self._get_or_create_unaggregated_timeseries(
+                metrics_to_fetch)
+            raw_measures.update(
+                self._get_segmented_bound_timeseries(fetched))
+        self.statistics["raw measures fetch"] += len(metrics_to_fetch)
         self.statistics["processed measures"] += sum(
             map(len, metrics_and_measures.values()))
         return raw_measures
 
-    def execute_data_processing(self, measures, metric, new_boundts, raw_measures, splits_to_delete, splits_to_update):
+    def _pop_cached_bound_timeseries(self, metrics):
+        """Take the still valid unaggregated timeseries out of the cache.
+
+        The timeseries are removed from the cache, so a processing failure
+        cannot leave a half-updated timeserie in it.
+
+        :param metrics: A list of metrics.
+        :return: A dict where keys are metrics and values are their
+                 `carbonara.BoundTimeSerie`, for the metrics that were
+                 cached with the generation token currently stored.
+        """
+        if self._bound_timeserie_cache is None:
+            return {}
+        with self._bound_timeserie_cache_lock:
+            cached = {
+                metric: self._bound_timeserie_cache.pop(metric.id)
+                for metric in metrics
+                if metric.id in self._bound_timeserie_cache
+            }
+        self.statistics["bound timeserie cache misses"] += (
+            len(metrics) - len(cached))
+        if not cached:
+            return {}
+        generations = self._get_unaggregated_timeseries_generations(
+            list(cached.keys()))
+        hits = {}
+        for metric, (generation, ts) in cached.items():
+            if (generation is not None
+               and generations[metric] == generation
+               and (ts.block_size, ts.back_window)
+               == self._get_bound_timeserie_parameters(metric)):
+                hits[metric] = ts
+        self.statistics["bound timeserie cache hits"] += len(hits)
+        self.statistics["bound timeserie cache misses"] += (
+            len(cached) - len(hits))
+        return hits
+
+    def _cache_bound_timeseries(self, raw_measures):
+        """Cache the unaggregated timeseries that have just been stored.
+
+        :param raw_measures: The dict returned by `get_raw_measures', where
+                             `_get_bound_timeserie' replaced the values by
+                             the processed `carbonara.BoundTimeSerie'.
+        """
+        if self._bound_timeserie_cache is None:
+            return
+        bound_timeseries = {
+            metric: ts for metric, ts in raw_measures.items()
+            if isinstance(ts, carbonara.BoundTimeSerie) and len(ts)
+        }
+        generations = self._get_unaggregated_timeseries_generations(
+            list(bound_timeseries.keys()))
+        with self._bound_timeserie_cache_lock:
+            if self._bound_timeserie_cache is None:
+                return
+            for metric, generation in generations.items():
+                if generation is not None:
+                    self._bound_timeserie_cache[metric.id] = (
+                        generation, bound_timeseries[metric])
+
+    @staticmethod
+    def _get_bound_timeserie_parameters(metric):
+        """Return the block size and back window of a metric timeserie."""
         agg_methods = list(metric.archive_policy.aggregation_methods)
         block_size = metric.archive_policy.max_block_size
         back_window = metric.archive_policy.back_window
@@ -620,17 +1321,202 @@ class StorageDriver(object):
         # correctly
         if any(filter(lambda x: x.startswith("rate:"), agg_methods)):
             back_window += 1
-        if raw_measures[metric] is None:
-            ts = None
-        else:
-            try:
-                ts = carbonara.BoundTimeSerie.unserialize(
-                    raw_measures[metric], block_size, back_window)
-            except carbonara.InvalidData:
-                LOG.error("Data corruption detected for %s "
-                          "unaggregated timeserie, creating a new one",
-                          metric.id)
+        return block_size, back_window
+
+    # The head of a segmented unaggregated timeserie starts with this byte.
+    # A serialized `carbonara.BoundTimeSerie' cannot: it starts with its
+    # little-endian uncompressed size, which is a multiple of 16.
+    _SEGMENTED_HEAD_MARKER = b"S"
+    _SEGMENTED_HEAD_HEADER = struct.Struct("<cI")
+
+    @classmethod
+    def _pack_segmented_head(cls, data, segments):
+        """Serialize the head of a segmented unaggregated timeserie.
+
+        :param data: The serialized last block of the timeserie.
+        :param segments: The timestamps of the blocks stored as segments.
+        """
+        return (cls._SEGMENTED_HEAD_HEADER.pack(cls._SEGMENTED_HEAD_MARKER,
+                                                len(segments))
+                + numpy.array(segments, dtype='datetime64[ns]').astype(
+                    '<Q').tobytes()
+                + data)
+
+    @classmethod
+    def _is_segmented_head(cls, data):
+        """Return whether a stored unaggregated timeserie is segmented."""
+        return (isinstance(data, bytes)
+                and data.startswith(cls._SEGMENTED_HEAD_MARKER))
+
+    @classmethod
+    def _unpack_unaggregated_timeserie(cls, data):
+        """Split a stored unaggregated timeserie object.
+
+        :return: A tuple (serialized timeserie, segments) where segments is
+                 the list of the timestamps of the blocks stored as segments,
+                 or None if the timeserie is not segmented.
+        """
+        if not cls._is_segmented_head(data):
+            return data, None
+        try:
+            _, count = cls._SEGMENTED_HEAD_HEADER.unpack_from(data)
+            segments = numpy.frombuffer(
+                data, dtype='<Q', count=count,
+                offset=cls._SEGMENTED_HEAD_HEADER.size)
+        except (struct.error, ValueError):
+            raise carbonara.InvalidData
+        return (data[cls._SEGMENTED_HEAD_HEADER.size + segments.nbytes:],
+                list(segments.astype('datetime64[ns]')))
+
+    def _get_segmented_bound_timeseries(self, raw_measures):
+        """Rebuild the segmented unaggregated timeseries.
+
+        The head of a segmented unaggregated timeserie only stores its last
+        block and lists the segments storing its previous blocks. They are
+        rebuilt whatever `unaggregated_segments' is set to, so the option can
+        be changed at any time.
+
+        :param raw_measures: A dict where keys are metrics and values are
+                             their stored unaggregated timeserie object.
+        :return: A dict where keys are metrics and values are either their
+                 unaggregated timeserie object if it is not segmented, or a
+                 `SegmentedTimeSerie'.
+        :raise UnaggregatedSegmentMissing: If a listed segment cannot be
+                                           read.
+        """
+        results = {}
+        heads = {}
+        for metric, data in raw_measures.items():
+            if data is not None:
+                try:
+                    head, segments = self._unpack_unaggregated_timeserie(
+                        data)
+                except carbonara.InvalidData:
+                    LOG.error("Data corruption detected for %s "
+                              "unaggregated timeserie, creating a new one",
+                              metric.id)
+                    data = None
+                else:
+                    if segments is not None:
+                        heads[metric] = (head, segments)
+                        continue
+            results[metric] = data
+
+        segments_data = self._get_unaggregated_timeseries_segments({
+            metric: segments for metric, (_, segments) in heads.items()
+        })
+
+        for metric, (head, segments) in heads.items():
+            blocks = []
+            for segment in segments:
+                block = self._unserialize_bound_timeserie(
+                    metric, segments_data[metric][segment])
+                if block is None:
+                    raise UnaggregatedSegmentMissing(metric.id, segment)
+                blocks.append(block)
+            head = self._unserialize_bound_timeserie(metric, head)
+            if head is None:
                 ts = None
+            else:
+                ts = carbonara.BoundTimeSerie.from_blocks(
+                    blocks + [head], head.block_size, head.back_window)
+            results[metric] = SegmentedTimeSerie(ts, segments)
+        return results
+
+    @staticmethod
+    def _block_timestamps(ts):
+        """Return the timestamps of the blocks of a timeserie with points."""
+        return list(numpy.unique(
+            carbonara.round_timestamp(ts.timestamps, ts.block_size)))
+
+    def _serialize_bound_timeserie(self, ts, first_modified_timestamp,
+                                   stored_segments):
+        """Serialize the unaggregated timeserie of a metric to store.
+
+        :param ts: The `carbonara.BoundTimeSerie` to serialize.
+        :param first_modified_timestamp: The oldest timestamp that might
+                                         have changed in the timeserie since
+                                         it has been stored.
+        :param stored_segments: The timestamps of the blocks of the stored
+                                timeserie stored as segments, or None if it
+                                is not segmented.
+        :return: A tuple (serialized head, [(segment, serialized segment)] to
+                 store, [segment] to delete).
+        """
+        stored_segments = set(stored_segments or ())
+        if not self.unaggregated_segments:
+            return ts.serialize(), [], sorted(stored_segments)
+        segments = self._block_timestamps(ts)[:-1]
+        start = carbonara.round_timestamp(first_modified_timestamp,
+                                          ts.block_size)
+        # Blocks that are not stored as segments yet, e.g. when the
+        # timeserie was stored as one object, are all written.
+        if not stored_segments.issuperset(
+                segment for segment in segments if segment < start):
+            start = None
+        blocks = ts.blocks(start)
+        return (self._pack_segmented_head(blocks[-1][1].serialize(),
+                                          segments),
+                [(segment, block.serialize())
+                 for segment, block in blocks[:-1]],
+                sorted(stored_segments.difference(segments)))
+
+    @staticmethod
+    def _first_modified_timestamp(ts, measures):
+        """Return the oldest timestamp new measures can change in a block.
+
+        The block of the last timestamp of the timeserie is included, as it
+        might not be the last block anymore once the measures are added.
+
+        :param ts: The `carbonara.BoundTimeSerie` before adding the measures.
+        :param measures: The sorted new measures.
+        """
+        if len(ts) == 0:
+            return measures['timestamps'][0]
+        return min(measures['timestamps'][0], ts.last)
+
+    def _unserialize_bound_timeserie(self, metric, data):
+        """Unserialize an unaggregated timeserie or one of its segments.
+
+        :return: A `carbonara.BoundTimeSerie` or None if there is no data or
+                 if it is corrupted.
+        """
+        if data is None:
+            return
+        block_size, back_window = self._get_bound_timeserie_parameters(metric)
+        try:
+            return carbonara.BoundTimeSerie.unserialize(
+                data, block_size, back_window)
+        except carbonara.InvalidData:
+            LOG.error("Data corruption detected for %s "
+                      "unaggregated timeserie, creating a new one",
+                      metric.id)
+
+    def _get_bound_timeserie(self, metric, raw_measures):
+        """Unserialize the unaggregated timeserie of a metric.
+
+        The timeserie replaces the serialized one in `raw_measures', so it
+        can be cached once stored.
+
+        :return: A tuple (`carbonara.BoundTimeSerie`,
+                 current_first_block_timestamp, stored_segments) where
+                 stored_segments are the timestamps of the blocks stored as
+                 segments, or None if the timeserie is not segmented.
+        """
+        block_size, back_window = self._get_bound_timeserie_parameters(metric)
+        raw = raw_measures[metric]
+        if isinstance(raw, SegmentedTimeSerie):
+            ts, stored_segments = raw
+        elif isinstance(raw, carbonara.BoundTimeSerie):
+            # The cached timeseries have been stored by this driver
+            ts = raw
+            if self.unaggregated_segments:
+                stored_segments = self._block_timestamps(ts)[:-1]
+            else:
+                stored_segments = None
+        else:
+            ts = self._unserialize_bound_timeserie(metric, raw)
+            stored_segments = None
         if ts is None:
             # This is the first time we treat measures for this
             # metric, or data are corrupted, create a new one
@@ -639,6 +1525,14 @@ class StorageDriver(object):
             current_first_block_timestamp = None
         else:
             current_first_block_timestamp = ts.first_block_timestamp()
+        raw_measures[metric] = ts
+        return ts, current_first_block_timestamp, stored_segments
+
+    def execute_data_processing(self, measures, metric, new_boundts, raw_measures, splits_to_delete, splits_to_update):
+        ts, current_first_block_timestamp, stored_segments = (
+            self._get_bound_timeserie(metric, raw_measures))
+        first_modified_timestamp = self._first_modified_timestamp(
+            ts, measures)
 
         def _map_compute_splits_operations(bound_timeserie):
             # NOTE (gordc): bound_timeserie is entire set of
@@ -651,22 +1545,19 @@ class StorageDriver(object):
             )
             aggregations = metric.archive_policy.aggregations
 
-            grouped_timeseries = {
-                granularity: bound_timeserie.group_serie(
-                    granularity,
-                    carbonara.round_timestamp(tstamp, granularity))
-                for granularity, aggregations
-                # No need to sort the aggregation, they are already
-                in itertools.groupby(aggregations, ATTRGETTER_GRANULARITY)
-            }
-
-            aggregations_and_timeseries = {
-                aggregation:
-                    carbonara.AggregatedTimeSerie.from_grouped_serie(
-                        grouped_timeseries[aggregation.granularity],
-                        aggregation)
-                for aggregation in aggregations
-            }
+            # All the aggregation methods of a granularity are computed at once
+            # on the same grouped serie so the grouping, sums and sorts are
+            # shared between them.
+            aggregations_and_timeseries = {}
+            # No need to sort the aggregation, they are already
+            for granularity, aggs in itertools.groupby(
+                    aggregations, ATTRGETTER_GRANULARITY):
+                aggregations_and_timeseries.update(
+                    carbonara.AggregatedTimeSerie.from_grouped_serie_multi(
+                        bound_timeserie.group_serie(
+                            granularity,
+                            carbonara.round_timestamp(tstamp, granularity)),
+                        list(aggs)))
 
             deleted_keys, keys_and_split_to_store = (
                 self._compute_split_operations(
@@ -689,26 +1580,138 @@ class StorageDriver(object):
         splits_to_delete[metric] = deleted_keys
         splits_to_update[metric] = (keys_and_splits_to_store,
                                     new_first_block_timestamp)
-        new_boundts.append((metric, ts.serialize()))
-
-    def execute_metadata_updates_if_needed(self, indexer_driver, measures, metric):
-        # If the archive policy backwindow is changed, the data is going to
-        # be truncated in the processing of new datapoints. Therefore, we
-        # can mark the metric as not needing raw data truncation anymore
-        if metric.needs_raw_data_truncation:
-            indexer_driver.update_needs_raw_data_truncation(metric.id)
-
-        # Mark when the metric receives its latest measures
-        indexer_driver.update_last_measure_timestamp(metric.id)
-        resource_id = metric.resource_id
-        if resource_id:
-            # We can receive multiple measures for the same metric in different timestamps to process.
-            latest_timestamp_in_measurements = self.get_latest_timestmap_of_measures(measures)
-
-            resource = indexer_driver.get_resource('generic', resource_id)
+        new_boundts.append((metric, self._serialize_bound_timeserie(
+            ts, first_modified_timestamp, stored_segments)))
+
+    def execute_data_processing_vectorized(self, metrics_and_measures, new_boundts, raw_measures,
+                                           splits_to_delete, splits_to_update):
+        """Process new measures of several metrics at once.
+
+        This does the same as calling `execute_data_processing' for each
+        metric, but the unaggregated timeseries of all the metrics sharing an
+        archive policy are grouped and aggregated together as one segmented
+        array, replacing a lot of small numpy operations by a few large ones.
+
+        :param metrics_and_measures: A dict where keys are `storage.Metric`
+                                     objects and values are the sorted
+                                     timeseries array of their new measures.
+        """
+        metrics_by_archive_policy = collections.defaultdict(list)
+
+        with self.statistics.time("aggregated measures compute"):
+            for metric, measures in metrics_and_measures.items():
+                ts, current_first_block_timestamp, stored_segments = (
+                    self._get_bound_timeserie(metric, raw_measures))
+                first_modified_timestamp = self._first_modified_timestamp(
+                    ts, measures)
+
+                def _get_timeserie_to_aggregate(bound_timeserie):
+                    # Keep the untruncated array and where to start aggregating
+                    # from, see `execute_data_processing'.
+                    return (bound_timeserie.ts,
+                            max(bound_timeserie.first,
+                                measures['timestamps'][0]),
+                            bound_timeserie.first_block_timestamp())
+
+                unaggregated, tstamp, new_first_block_timestamp = ts.set_values(
+                    measures,
+                    before_truncate_callback=_get_timeserie_to_aggregate)
+                metrics_by_archive_policy[metric.archive_policy.name].append(
+                    (metric, unaggregated, tstamp,
+                     current_first_block_timestamp, new_first_block_timestamp))
+                new_boundts.append((metric, self._serialize_bound_timeserie(
+                    ts, first_modified_timestamp, stored_segments)))
+
+            for metrics in metrics_by_archive_policy.values():
+                aggregations_and_timeseries = [{} for _ in metrics]
+                unaggregated = [m[1] for m in metrics]
+                tstamps = numpy.array([m[2] for m in metrics],
+                                      dtype='datetime64[ns]')
+                # No need to sort the aggregation, they are already
+                for granularity, aggs in itertools.groupby(
+                        metrics[0][0].archive_policy.aggregations,
+                        ATTRGETTER_GRANULARITY):
+                    aggs = list(aggs)
+                    grouped = carbonara.SegmentedGroupedTimeSeries.from_timeseries(
+                        unaggregated, granularity,
+                        carbonara.round_timestamp(tstamps, granularity))
+                    for aggs_and_ts, tss in zip(
+                            aggregations_and_timeseries,
+                            grouped.aggregate_segments(
+                                set(agg.method for agg in aggs))):
+                        for aggregation in aggs:
+                            aggs_and_ts[aggregation] = (
+                                carbonara.AggregatedTimeSerie(
+                                    aggregation, ts=tss[aggregation.method]))
+
+                for (metric, _, _, current_first_block_timestamp,
+                     new_first_block_timestamp), aggs_and_ts in zip(
+                         metrics, aggregations_and_timeseries):
+                    deleted_keys, keys_and_split_to_store = (
+                        self._compute_split_operations(
+                            metric, aggs_and_ts,
+                            current_first_block_timestamp,
+                            new_first_block_timestamp))
+                    splits_to_delete[metric] = deleted_keys
+                    splits_to_update[metric] = (keys_and_split_to_store,
+                                                new_first_block_timestamp)
+
+    def execute_metadata_updates_if_needed(self, indexer_driver, metrics_and_measures):
+        """Update the indexer metadata of the metrics that received measures.
+
+        All the updates are batched: one query to reset the raw data
+        truncation flags, one to mark the last measure timestamps and one to
+        fetch the resources that might need to be restored.
+
+        :param indexer_driver: The indexer driver to use.
+        :param metrics_and_measures: A dict where keys are `storage.Metric`
+                                     objects and values are the sorted
+                                     timeseries array of their new measures.
+        """
+        if not metrics_and_measures:
+            return
+
+        with self.statistics.time("metadata update"):
+            # If the archive policy backwindow is changed, the data is going
+            # to be truncated in the processing of new datapoints. Therefore,
+            # we can mark the metrics as not needing raw data truncation
+            # anymore
+            metric_ids_truncated = [
+                metric.id for metric in metrics_and_measures
+                if metric.needs_raw_data_truncation]
+            if metric_ids_truncated:
+                indexer_driver.update_needs_raw_data_truncation_for_metrics(
+                    metric_ids_truncated)
+
+            # Mark when the metrics receive their latest measures
+            indexer_driver.update_last_measure_timestamp_for_metrics(
+                [metric.id for metric in metrics_and_measures])
+
+            metrics_by_resource_id = collections.defaultdict(list)
+            for metric in metrics_and_measures:
+                if metric.resource_id:
+                    metrics_by_resource_id[metric.resource_id].append(metric)
+                else:
+                    LOG.debug("Metric [%s] does not have a resource assigned to it.", metric)
+
+            if metrics_by_resource_id:
+                self._restore_ended_resources_if_needed(
+                    indexer_driver, metrics_by_resource_id, metrics_and_measures)
+        self.statistics["metadata update"] += len(metrics_and_measures)
+
+    def _restore_ended_resources_if_needed(self, indexer_driver, metrics_by_resource_id, metrics_and_measures):
+        resources = indexer_driver.get_resources(
+            'generic', list(metrics_by_resource_id.keys()))
+        for resource in resources:
+            # We can receive multiple measures for the same metric in different timestamps to process, and
+            # several metrics of the resource in the same batch: only the most recent measure matters.
+            metric, latest_timestamp_in_measurements = max(
+                ((m, self.get_latest_timestmap_of_measures(metrics_and_measures[m]))
+                 for m in metrics_by_resource_id[resource.id]),
+                key=operator.itemgetter(1))
             LOG.debug("Checking if resource [%s] of metric [%s] with "
                       "resource ID [%s] needs to be restored. The measurement timestamps are [%s].",
-                      resource, metric.id, resource_id, measures['timestamps'])
+                      resource, metric.id, resource.id, metrics_and_measures[metric]['timestamps'])
 
             if resource.ended_at is not None:
                 if resource.ended_at > latest_timestamp_in_measurements:
@@ -720,20 +1723,80 @@ class StorageDriver(object):
                              "measurement for metric [%s] with a max timestamp as [%s]. Therefore, restoring it.",
                              resource, metric.id, latest_timestamp_in_measurements)
                     indexer_driver.update_resource(
-                        resource.type, resource_id, ended_at=None)
-        else:
-            LOG.debug("Metric [%s] does not have a resource assigned to it.", metric)
+                        resource.type, resource.id, ended_at=None)
 
     def store_data_backend(self, new_boundts, splits_to_delete, splits_to_update):
         with self.statistics.time("splits delete"):
-            self._delete_metric_splits(splits_to_delete)
+            self._delete_metric_splits_of_any_version(splits_to_delete)
         self.statistics["splits delete"] += len(splits_to_delete)
         with self.statistics.time("splits update"):
             self._update_metric_splits(splits_to_update)
         self.statistics["splits update"] += len(splits_to_update)
         with self.statistics.time("raw measures store"):
-            self._store_unaggregated_timeseries(new_boundts)
+            self._store_serialized_bound_timeseries(new_boundts)
+        self.statistics["raw measures store"] += len(new_boundts)
+
+    def _store_serialized_bound_timeseries(self, new_boundts):
+        """Store unaggregated timeseries and their segments.
+
+        The segments are stored before the heads listing them: a head is not
+        stored if one of its segments cannot be. The segments the heads do
+        not list anymore are deleted once the heads are stored.
+
+        :param new_boundts: A list of (metric, data) tuples where data is
+                            returned by `_serialize_bound_timeserie'.
+        """
+        self._store_unaggregated_timeseries_segments({
+            metric: segments_data
+            for metric, (_, segments_data, _) in new_boundts
+            if segments_data
+        })
+        self._store_unaggregated_timeseries([
+            (metric, head) for metric, (head, _, _) in new_boundts
+        ])
+        self._delete_unaggregated_timeseries_segments({
+            metric: segments_to_delete
+            for metric, (_, _, segments_to_delete) in new_boundts
+            if segments_to_delete
+        })
+        self.statistics["raw segments store"] += sum(
+            len(segments_data) for _, (_, segments_data, _) in new_boundts)
+
+    def truncate_unaggregated_timeseries(self, metrics):
+        """Truncate the unaggregated timeseries of metrics.
+
+        The unaggregated timeseries are only truncated to the back window of
+        their archive policy when new measures are processed. This truncates
+        those of metrics that do not receive measures anymore. The
+        timeseries are read and stored in batches.
+
+        A failure to read one of the timeseries is raised rather than taken
+        for an empty timeserie, so that the metric is not marked as cleaned.
+
+        :param metrics: A list of metrics.
+        :return: The list of metrics whose timeserie has been truncated.
+        """
+        raw_measures = self._get_segmented_bound_timeseries(dict(zip(
+            metrics, self.MAP_METHOD(
+                self._get_or_create_unaggregated_timeseries_unbatched,
+                ((metric,) for metric in metrics)))))
+
+        new_boundts = []
+        for metric in metrics:
+            if raw_measures[metric] is None:
+                continue
+            ts, _, stored_segments = self._get_bound_timeserie(
+                metric, raw_measures)
+            if len(ts) == 0:
+                continue
+            ts._truncate()
+            new_boundts.append((metric, self._serialize_bound_timeserie(
+                ts, ts.last, stored_segments)))
+
+        with self.statistics.time("raw measures store"):
+            self._store_serialized_bound_timeseries(new_boundts)
         self.statistics["raw measures store"] += len(new_boundts)
+        return [metric for metric, _ in new_boundts]
 
     def get_latest_timestmap_of_measures(self, measures):
         latest_timestamp_in_measurements = max(measures['timestamps'])
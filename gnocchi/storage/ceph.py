@@ -15,6 +15,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import collections
+import uuid
+
 import daiquiri
 
 from oslo_config import cfg
@@ -46,12 +48,15 @@ rados = ceph.rados
 LOG = daiquiri.getLogger(__name__)
 
 DEFAULT_RADOS_BUFFER_SIZE = 8192
+OMAP_LISTING_PAGE_SIZE = 1000
 MAP_UNAGGREGATED_METRIC_NAME_BY_SIZE = {}
 
 
 class CephStorage(storage.StorageDriver):
     WRITE_FULL = False
 
+    GENERATION_XATTR = "gnocchi_generation"
+
     def __init__(self, conf):
         super(CephStorage, self).__init__(conf)
         self.rados, self.ioctx = ceph.create_rados_connection(conf)
@@ -130,7 +135,11 @@ class CephStorage(storage.StorageDriver):
                 self.ioctx.operate_write_op(
                     op, self._build_unaggregated_timeserie_path(metric, 3))
 
-    def _delete_metric(self, metric):
+    def _list_metric_objects(self, metric):
+        """Return the names of the split objects of a metric.
+
+        :return: A list of object names or None if the metric does not exist.
+        """
         with rados.ReadOpCtx() as op:
             omaps, ret = self.ioctx.get_omap_vals(op, "", "", -1)
             try:
@@ -150,17 +159,34 @@ class CephStorage(storage.StorageDriver):
             except rados.ObjectNotFound:
                 return
 
-        ops = [self.ioctx.aio_remove(name) for name, _ in omaps]
+            return [name for name, _ in omaps]
 
+    def _delete_metric(self, metric):
+        self._delete_metrics([metric])
+
+    def _delete_metrics(self, metrics):
+        metrics = list(metrics)
+        metrics_objects = [
+            (metric, names)
+            for metric, names in zip(metrics, self.MAP_METHOD(
+                self._list_metric_objects, ((metric,) for metric in metrics)))
+            if names is not None
+        ]
+
+        ops = [self.ioctx.aio_remove(name)
+               for metric, names in metrics_objects
+               for name in names]
         for op in ops:
             op.wait_for_complete_and_cb()
 
-        try:
-            self.ioctx.remove_object(
-                self._build_unaggregated_timeserie_path(metric, 3))
-        except rados.ObjectNotFound:
+        # The unaggregated objects list the splits, only remove them once all
+        # the splits are gone.
+        ops = [self.ioctx.aio_remove(
+            self._build_unaggregated_timeserie_path(metric, 3))
+            for metric, names in metrics_objects]
+        for op in ops:
             # It's possible that the object does not exists
-            pass
+            op.wait_for_complete_and_cb()
 
     def _get_splits_unbatched(self, metric, key, aggregation, version=3):
         try:
@@ -177,47 +203,67 @@ class CephStorage(storage.StorageDriver):
         except rados.ObjectNotFound:
             return
 
-    def _list_split_keys_unbatched(self, metric, aggregations, version=3):
-        with rados.ReadOpCtx() as op:
-            omaps, ret = self.ioctx.get_omap_vals(op, "", "", -1)
-            try:
-                self.ioctx.operate_read_op(
-                    op, self._build_unaggregated_timeserie_path(metric, 3))
-            except rados.ObjectNotFound:
-                raise storage.MetricDoesNotExist(metric)
-
-            # NOTE(sileht): after reading the libradospy, I'm
-            # not sure that ret will have the correct value
-            # get_omap_vals transforms the C int to python int
-            # before operate_read_op is called, I dunno if the int
-            # content is copied during this transformation or if
-            # this is a pointer to the C int, I think it's copied...
-            try:
-                ceph.errno_to_exception(ret)
-            except rados.ObjectNotFound:
-                raise storage.MetricDoesNotExist(metric)
-
-            raw_keys = [name.split("_")
-                        for name, value in omaps
-                        if self._version_check(name, version)]
-            keys = collections.defaultdict(set)
-            if not raw_keys:
-                return keys
-            zipped = list(zip(*raw_keys))
-            k_timestamps = utils.to_timestamps(zipped[2])
-            k_methods = zipped[3]
-            k_granularities = list(map(utils.to_timespan, zipped[4]))
-
-            for timestamp, method, granularity in zip(
-                    k_timestamps, k_methods, k_granularities):
-                for aggregation in aggregations:
-                    if (aggregation.method == method
-                       and aggregation.granularity == granularity):
-                        keys[aggregation].add(carbonara.SplitKey(
-                            timestamp,
-                            sampling=granularity))
-                        break
+    def _list_split_keys_unbatched(self, metric, aggregations, version=3,
+                                   from_timestamp=None, to_timestamp=None):
+        prefix = "gnocchi_%s_" % metric.id
+        start, stop = self._sortable_split_keys_range(
+            aggregations, from_timestamp, to_timestamp)
+        start_after = "" if start is None else prefix + start
+        # Without a stop, everything after the start is listed at once;
+        # otherwise omap is listed by pages until past the stop.
+        max_return = -1 if stop is None else OMAP_LISTING_PAGE_SIZE
+        names = []
+        while True:
+            with rados.ReadOpCtx() as op:
+                omaps, ret = self.ioctx.get_omap_vals(
+                    op, start_after, "", max_return)
+                try:
+                    self.ioctx.operate_read_op(
+                        op, self._build_unaggregated_timeserie_path(metric, 3))
+                except rados.ObjectNotFound:
+                    raise storage.MetricDoesNotExist(metric)
+
+                # NOTE(sileht): after reading the libradospy, I'm
+                # not sure that ret will have the correct value
+                # get_omap_vals transforms the C int to python int
+                # before operate_read_op is called, I dunno if the int
+                # content is copied during this transformation or if
+                # this is a pointer to the C int, I think it's copied...
+                try:
+                    ceph.errno_to_exception(ret)
+                except rados.ObjectNotFound:
+                    raise storage.MetricDoesNotExist(metric)
+
+                page = [name for name, value in omaps]
+            names.extend(page)
+            if (max_return == -1 or len(page) < max_return
+                    or page[-1] >= prefix + stop):
+                break
+            start_after = page[-1]
+
+        raw_keys = [name.split("_")
+                    for name in names
+                    if self._version_check(name, version)
+                    # Skip the unaggregated timeserie segments
+                    and name.split("_")[2] != "none"]
+        keys = collections.defaultdict(set)
+        if not raw_keys:
             return keys
+        zipped = list(zip(*raw_keys))
+        k_timestamps = utils.to_timestamps(zipped[2])
+        k_methods = zipped[3]
+        k_granularities = list(map(utils.to_timespan, zipped[4]))
+
+        for timestamp, method, granularity in zip(
+                k_timestamps, k_methods, k_granularities):
+            for aggregation in aggregations:
+                if (aggregation.method == method
+                   and aggregation.granularity == granularity):
+                    keys[aggregation].add(carbonara.SplitKey(
+                        timestamp,
+                        sampling=granularity))
+                    break
+        return keys
 
     @staticmethod
     def _build_unaggregated_timeserie_path(metric, version):
@@ -243,6 +289,61 @@ class CephStorage(storage.StorageDriver):
             # emptiness instead.
             return contents or None
 
+    @classmethod
+    def _build_unaggregated_segment_path(cls, metric, segment, version=3):
+        return 'gnocchi_%s_%s' % (
+            metric.id, cls._unaggregated_segment_name(segment, version))
+
+    def _get_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, version=3):
+        try:
+            return self._get_object_content(
+                self._build_unaggregated_segment_path(
+                    metric, segment, version))
+        except rados.ObjectNotFound:
+            return
+
+    def _store_unaggregated_timeseries_segments(self, metrics_segments_data,
+                                                version=3):
+        with rados.WriteOpCtx() as op:
+            for metric, segments_data in metrics_segments_data.items():
+                for segment, data in segments_data:
+                    name = self._build_unaggregated_segment_path(
+                        metric, segment, version)
+                    self.ioctx.write_full(name, data)
+                    # Reference the segments like the splits so they are
+                    # removed with the metric.
+                    self.ioctx.set_omap(op, (name,), (b"",))
+                self.ioctx.operate_write_op(
+                    op, self._build_unaggregated_timeserie_path(metric, 3))
+
+    def _delete_unaggregated_timeseries_segments(self, metrics_and_segments,
+                                                 version=3):
+        with rados.WriteOpCtx() as op:
+            for metric, segments in metrics_and_segments.items():
+                names = tuple(
+                    self._build_unaggregated_segment_path(
+                        metric, segment, version)
+                    for segment in segments
+                )
+                for name in names:
+                    try:
+                        self.ioctx.remove_object(name)
+                    except rados.ObjectNotFound:
+                        pass
+                self.ioctx.remove_omap_keys(op, names)
+                self.ioctx.operate_write_op(
+                    op, self._build_unaggregated_timeserie_path(metric, 3))
+
+    def _get_unaggregated_timeseries_generation_unbatched(
+            self, metric, version=3):
+        try:
+            return self.ioctx.get_xattr(
+                self._build_unaggregated_timeserie_path(metric, version),
+                self.GENERATION_XATTR)
+        except (rados.ObjectNotFound, rados.NoData):
+            return
+
     def _store_unaggregated_timeseries_unbatched(
             self, metric, data, version=3):
 
@@ -254,6 +355,10 @@ class CephStorage(storage.StorageDriver):
             LOG.debug(
                 "Storing unaggregated time series size [%s] for metric [%s]",
                 metric_size, metric_name)
+        # Change the generation first: if we crash before writing the data, the
+        # cached timeseries are only invalidated for nothing.
+        self.ioctx.set_xattr(
+            metric_name, self.GENERATION_XATTR, uuid.uuid4().bytes)
         self.ioctx.write_full(metric_name, data)
 
     def _get_object_content(self, name, buffer_size=DEFAULT_RADOS_BUFFER_SIZE):
@@ -131,6 +131,11 @@ class FileStorage(storage.StorageDriver):
             self._build_metric_dir(metric),
             'none' + ("_v%s" % version if version else ""))
 
+    def _build_unaggregated_segment_path(self, metric, segment, version=3):
+        return os.path.join(
+            self._build_metric_dir(metric),
+            self._unaggregated_segment_name(segment, version))
+
     def _build_metric_path(self, metric, aggregation):
         return os.path.join(self._build_metric_dir(metric),
                             "agg_" + aggregation)
@@ -161,9 +166,19 @@ class FileStorage(storage.StorageDriver):
 
     def _store_unaggregated_timeseries_unbatched(
             self, metric, data, version=3):
-        dest = self._build_unaggregated_timeserie_path(metric, version)
-        with open(dest, "wb") as f:
-            f.write(data)
+        # Replacing the file gives it a new inode, which makes the generation
+        # token change even if the modification time does not.
+        self._atomic_file_store(
+            self._build_unaggregated_timeserie_path(metric, version), data)
+
+    def _get_unaggregated_timeseries_generation_unbatched(
+            self, metric, version=3):
+        try:
+            stat = os.stat(
+                self._build_unaggregated_timeserie_path(metric, version))
+        except FileNotFoundError:
+            return
+        return stat.st_ino, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size
 
     def _get_or_create_unaggregated_timeseries_unbatched(
             self, metric, version=3):
@@ -181,7 +196,31 @@ class FileStorage(storage.StorageDriver):
         except storage.MetricAlreadyExists:
             pass
 
-    def _list_split_keys_unbatched(self, metric, aggregations, version=3):
+    def _get_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, version=3):
+        path = self._build_unaggregated_segment_path(metric, segment, version)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return
+
+    def _store_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, data, version=3):
+        self._atomic_file_store(
+            self._build_unaggregated_segment_path(metric, segment, version),
+            data)
+
+    def _delete_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, version=3):
+        try:
+            os.unlink(self._build_unaggregated_segment_path(
+                metric, segment, version))
+        except FileNotFoundError:
+            pass
+
+    def _list_split_keys_unbatched(self, metric, aggregations, version=3,
+                                   from_timestamp=None, to_timestamp=None):
         keys = collections.defaultdict(set)
         for method, grouped_aggregations in itertools.groupby(
                 sorted(aggregations, key=ATTRGETTER_METHOD),
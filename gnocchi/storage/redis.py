@@ -34,6 +34,9 @@ local metric_key = KEYS[1]
 local ids = {}
 local cursor = 0
 local substring = "([^%s]*)%s([^%s]*)%s([^%s]*)"
+-- Optional range of split keys to return, as seconds since Epoch
+local start = tonumber(ARGV[2])
+local stop = tonumber(ARGV[3])
 repeat
     local result = redis.call("HSCAN", metric_key, cursor, "MATCH", ARGV[1])
     cursor = tonumber(result[1])
@@ -41,7 +44,10 @@ repeat
         -- Only return keys, not values
         if i %% 2 ~= 0 then
             local timestamp, method, granularity = v:gmatch(substring)()
-            ids[#ids + 1] = {timestamp, method, granularity}
+            local t = tonumber(timestamp)
+            if (start == nil or t >= start) and (stop == nil or t <= stop) then
+                ids[#ids + 1] = {timestamp, method, granularity}
+            end
         end
     end
 until cursor == 0
@@ -63,6 +69,10 @@ return ids
     def _unaggregated_field(version=3):
         return 'none' + ("_v%s" % version if version else "")
 
+    @classmethod
+    def _unaggregated_generation_field(cls, version=3):
+        return cls._unaggregated_field(version) + '_generation'
+
     @classmethod
     def _aggregated_field_for_split(cls, aggregation, key, version=3,
                                     granularity=None):
@@ -74,10 +84,22 @@ return ids
     def _store_unaggregated_timeseries(self, metrics_and_data, version=3):
         pipe = self._client.pipeline(transaction=False)
         unagg_key = self._unaggregated_field(version)
+        generation_key = self._unaggregated_generation_field(version)
         for metric, data in metrics_and_data:
-            pipe.hset(self._metric_key(metric), unagg_key, data)
+            metric_key = self._metric_key(metric)
+            # Change the generation first so no cached timeserie can be
+            # considered valid with newer data.
+            pipe.hincrby(metric_key, generation_key)
+            pipe.hset(metric_key, unagg_key, data)
         pipe.execute()
 
+    def _get_unaggregated_timeseries_generations(self, metrics, version=3):
+        pipe = self._client.pipeline(transaction=False)
+        generation_key = self._unaggregated_generation_field(version)
+        for metric in metrics:
+            pipe.hget(self._metric_key(metric), generation_key)
+        return dict(zip(metrics, pipe.execute()))
+
     def _get_or_create_unaggregated_timeseries(self, metrics, version=3):
         pipe = self._client.pipeline(transaction=False)
         for metric in metrics:
@@ -95,7 +117,49 @@ return ids
         }
         return ts
 
-    def _list_split_keys(self, metrics_and_aggregations, version=3):
+    def _get_unaggregated_timeseries_segments(self, metrics_and_segments,
+                                              version=3):
+        pipe = self._client.pipeline(transaction=False)
+        metrics_and_segments = [
+            (metric, segments)
+            for metric, segments in metrics_and_segments.items()
+            # Do not send any fetch request if segments is empty
+            if segments
+        ]
+        for metric, segments in metrics_and_segments:
+            pipe.hmget(self._metric_key(metric), [
+                self._unaggregated_segment_name(segment, version)
+                for segment in segments
+            ])
+        results = collections.defaultdict(dict)
+        for (metric, segments), data in zip(
+                metrics_and_segments, pipe.execute()):
+            results[metric] = dict(zip(segments, data))
+        return results
+
+    def _store_unaggregated_timeseries_segments(self, metrics_segments_data,
+                                                version=3):
+        pipe = self._client.pipeline(transaction=False)
+        for metric, segments_data in metrics_segments_data.items():
+            metric_key = self._metric_key(metric)
+            for segment, data in segments_data:
+                pipe.hset(metric_key,
+                          self._unaggregated_segment_name(segment, version),
+                          data)
+        pipe.execute()
+
+    def _delete_unaggregated_timeseries_segments(self, metrics_and_segments,
+                                                 version=3):
+        pipe = self._client.pipeline(transaction=False)
+        for metric, segments in metrics_and_segments.items():
+            metric_key = self._metric_key(metric)
+            for segment in segments:
+                pipe.hdel(metric_key,
+                          self._unaggregated_segment_name(segment, version))
+        pipe.execute()
+
+    def _list_split_keys(self, metrics_and_aggregations, version=3,
+                         from_timestamp=None, to_timestamp=None):
         pipe = self._client.pipeline(transaction=False)
         # Keep an ordered list of metrics
         metrics = list(metrics_and_aggregations.keys())
@@ -104,10 +168,14 @@ return ids
             pipe.exists(key)
             aggregations = metrics_and_aggregations[metric]
             for aggregation in aggregations:
+                start, stop = self._split_keys_range(
+                    aggregation, from_timestamp, to_timestamp)
                 self._scripts["list_split_keys"](
                     keys=[key], args=[self._aggregated_field_for_split(
                         aggregation.method, "*",
-                        version, aggregation.granularity)],
+                        version, aggregation.granularity),
+                        "" if start is None else str(start),
+                        "" if stop is None else str(stop)],
                     client=pipe,
                 )
         results = pipe.execute()
@@ -164,6 +232,11 @@ return ids
     def _delete_metric(self, metric):
         self._client.delete(self._metric_key(metric))
 
+    def _delete_metrics(self, metrics):
+        keys = [self._metric_key(metric) for metric in metrics]
+        if keys:
+            self._client.delete(*keys)
+
     def _get_splits(self, metrics_aggregations_keys, version=3):
         # Use a list of metric and aggregations with a constant sorting
         metrics_aggregations = [
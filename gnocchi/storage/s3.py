@@ -13,7 +13,9 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import itertools
 import os
+import uuid
 
 from oslo_config import cfg
 import tenacity
@@ -69,6 +71,9 @@ class S3Storage(storage.StorageDriver):
 
     WRITE_FULL = True
 
+    # Metadata of the unaggregated timeserie objects changed on every store
+    GENERATION_METADATA = "gnocchi-generation"
+
     _consistency_wait = tenacity.wait_exponential(multiplier=0.1)
 
     def __init__(self, conf):
@@ -107,8 +112,8 @@ class S3Storage(storage.StorageDriver):
     def _prefix(metric):
         return str(metric.id) + '/'
 
-    def _put_object_safe(self, Bucket, Key, Body):
-        put = self.s3.put_object(Bucket=Bucket, Key=Key, Body=Body)
+    def _put_object_safe(self, Bucket, Key, Body, **kwargs):
+        put = self.s3.put_object(Bucket=Bucket, Key=Key, Body=Body, **kwargs)
 
         if self._consistency_stop:
 
@@ -137,8 +142,9 @@ class S3Storage(storage.StorageDriver):
             Key=self._prefix(metric) + self._object_name(
                 key, aggregation.method, version))
 
-    def _delete_metric(self, metric):
+    def _list_metric_objects(self, metric):
         bucket = self._bucket_name
+        keys = []
         response = {}
         while response.get('IsTruncated', True):
             if 'NextContinuationToken' in response:
@@ -153,10 +159,23 @@ class S3Storage(storage.StorageDriver):
             except botocore.exceptions.ClientError as e:
                 if e.response['Error'].get('Code') == "NoSuchKey":
                     # Maybe it never has been created (no measure)
-                    return
+                    return keys
                 raise
-            s3.bulk_delete(self.s3, bucket,
-                           [c['Key'] for c in response.get('Contents', ())])
+            keys.extend(c['Key'] for c in response.get('Contents', ()))
+        return keys
+
+    def _delete_metric(self, metric):
+        s3.bulk_delete(self.s3, self._bucket_name,
+                       self._list_metric_objects(metric))
+
+    def _delete_metrics(self, metrics):
+        keys = list(itertools.chain.from_iterable(self.MAP_METHOD(
+            self._list_metric_objects, ((metric,) for metric in metrics))))
+        # delete_objects() accepts up to 1000 keys at once, send the requests
+        # in parallel
+        self.MAP_METHOD(s3.bulk_delete,
+                        ((self.s3, self._bucket_name, keys_slice)
+                         for keys_slice in utils.grouper(keys, 1000)))
 
     def _get_splits_unbatched(self, metric, key, aggregation, version=3):
         try:
@@ -171,7 +190,10 @@ class S3Storage(storage.StorageDriver):
         return response['Body'].read()
 
     def _metric_exists_p(self, metric, version):
-        unaggkey = self._build_unaggregated_timeserie_path(metric, version)
+        # The unaggregated timeserie is stored with the legacy
+        # version, whatever the version of the splits.
+        unaggkey = self._build_unaggregated_timeserie_path(
+            metric, min(version, self.LEGACY_SPLIT_VERSION))
         try:
             self.s3.head_object(Bucket=self._bucket_name, Key=unaggkey)
         except botocore.exceptions.ClientError as e:
@@ -180,26 +202,31 @@ class S3Storage(storage.StorageDriver):
             raise
         return True
 
-    def _list_split_keys_unbatched(self, metric, aggregations, version=3):
+    def _list_split_keys_unbatched(self, metric, aggregations, version=3,
+                                   from_timestamp=None, to_timestamp=None):
         bucket = self._bucket_name
         keys = {}
         for aggregation in aggregations:
             keys[aggregation] = set()
+            prefix = self._prefix(metric) + '%s_%s' % (
+                aggregation.method,
+                utils.timespan_total_seconds(aggregation.granularity),
+            )
+            start, stop = self._sortable_split_keys_range(
+                [aggregation], from_timestamp, to_timestamp)
             response = {}
             while response.get('IsTruncated', True):
                 if 'NextContinuationToken' in response:
                     kwargs = {
                         'ContinuationToken': response['NextContinuationToken']
                     }
+                elif start is not None:
+                    kwargs = {'StartAfter': prefix + '_' + start}
                 else:
                     kwargs = {}
                 response = self.s3.list_objects_v2(
                     Bucket=bucket,
-                    Prefix=self._prefix(metric) + '%s_%s' % (
-                        aggregation.method,
-                        utils.timespan_total_seconds(
-                            aggregation.granularity),
-                    ),
+                    Prefix=prefix,
                     **kwargs)
                 # If response is empty then check that the metric exists
                 contents = response.get('Contents', ())
@@ -215,6 +242,11 @@ class S3Storage(storage.StorageDriver):
                     except (ValueError, IndexError):
                         # Might be "none", or any other file. Be resilient.
                         continue
+                # Objects are listed in lexicographical order, stop once past
+                # the range.
+                if (stop is not None and contents
+                        and contents[-1]['Key'] >= prefix + '_' + stop):
+                    break
         return keys
 
     @staticmethod
@@ -222,6 +254,53 @@ class S3Storage(storage.StorageDriver):
         return S3Storage._prefix(metric) + 'none' + ("_v%s" % version
                                                      if version else "")
 
+    def _build_unaggregated_segment_path(self, metric, segment, version=3):
+        return self._prefix(metric) + self._unaggregated_segment_name(
+            segment, version)
+
+    def _get_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, version=3):
+        try:
+            response = self.s3.get_object(
+                Bucket=self._bucket_name,
+                Key=self._build_unaggregated_segment_path(
+                    metric, segment, version))
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error'].get('Code') == 'NoSuchKey':
+                return
+            raise
+        return response['Body'].read()
+
+    def _store_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, data, version=3):
+        self._put_object_safe(
+            Bucket=self._bucket_name,
+            Key=self._build_unaggregated_segment_path(
+                metric, segment, version),
+            Body=data)
+
+    def _delete_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, version=3):
+        self.s3.delete_object(
+            Bucket=self._bucket_name,
+            Key=self._build_unaggregated_segment_path(
+                metric, segment, version))
+
+    def _get_unaggregated_timeseries_generation_unbatched(
+            self, metric, version=3):
+        try:
+            response = self.s3.head_object(
+                Bucket=self._bucket_name,
+                Key=self._build_unaggregated_timeserie_path(metric, version))
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error'].get('Code') == "404":
+                return
+            raise
+        # The ETag cannot be used: it does not change if the same
+        # content is stored again, e.g. when only the segments of a
+        # segmented timeserie have been rewritten.
+        return response.get('Metadata', {}).get(self.GENERATION_METADATA)
+
     def _get_or_create_unaggregated_timeseries_unbatched(
             self, metric, version=3):
         key = self._build_unaggregated_timeserie_path(metric, version)
@@ -243,4 +322,5 @@ class S3Storage(storage.StorageDriver):
         self._put_object_safe(
             Bucket=self._bucket_name,
             Key=self._build_unaggregated_timeserie_path(metric, version),
-            Body=data)
+            Body=data,
+            Metadata={self.GENERATION_METADATA: uuid.uuid4().hex})
@@ -15,6 +15,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import collections
+import uuid
 
 from oslo_config import cfg
 
@@ -107,6 +108,8 @@ class SwiftStorage(storage.StorageDriver):
     # NOTE(sileht): Using threads with swiftclient doesn't work
     # as expected, so disable it
     MAP_METHOD = staticmethod(utils.sequencial_map)
+    # Metadata of the unaggregated timeserie objects changed on every store
+    GENERATION_HEADER = "x-object-meta-gnocchi-generation"
 
     def __init__(self, conf):
         super(SwiftStorage, self).__init__(conf)
@@ -185,11 +188,15 @@ class SwiftStorage(storage.StorageDriver):
             raise
         return contents
 
-    def _list_split_keys_unbatched(self, metric, aggregations, version=3):
+    def _list_split_keys_unbatched(self, metric, aggregations, version=3,
+                                   from_timestamp=None, to_timestamp=None):
         container = self._container_name(metric)
+        start, stop = self._sortable_split_keys_range(
+            aggregations, from_timestamp, to_timestamp)
         try:
             headers, files = self.swift.get_container(
-                container, full_listing=True)
+                container, full_listing=True,
+                marker=start, end_marker=stop)
         except swclient.ClientException as e:
             if e.http_status == 404:
                 raise storage.MetricDoesNotExist(metric)
@@ -223,6 +230,50 @@ class SwiftStorage(storage.StorageDriver):
     def _build_unaggregated_timeserie_path(version):
         return 'none' + ("_v%s" % version if version else "")
 
+    def _get_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, version=3):
+        try:
+            headers, contents = self.swift.get_object(
+                self._container_name(metric),
+                self._unaggregated_segment_name(segment, version))
+        except swclient.ClientException as e:
+            if e.http_status == 404:
+                return
+            raise
+        return contents
+
+    def _store_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, data, version=3):
+        self.swift.put_object(
+            self._container_name(metric),
+            self._unaggregated_segment_name(segment, version),
+            data)
+
+    def _delete_unaggregated_timeserie_segment_unbatched(
+            self, metric, segment, version=3):
+        try:
+            self.swift.delete_object(
+                self._container_name(metric),
+                self._unaggregated_segment_name(segment, version))
+        except swclient.ClientException as e:
+            if e.http_status != 404:
+                raise
+
+    def _get_unaggregated_timeseries_generation_unbatched(
+            self, metric, version=3):
+        try:
+            headers = self.swift.head_object(
+                self._container_name(metric),
+                self._build_unaggregated_timeserie_path(version))
+        except swclient.ClientException as e:
+            if e.http_status != 404:
+                raise
+            return
+        # The ETag cannot be used: it does not change if the same
+        # content is stored again, e.g. when only the segments of a
+        # segmented timeserie have been rewritten.
+        return headers.get(self.GENERATION_HEADER)
+
     def _get_or_create_unaggregated_timeseries_unbatched(
             self, metric, version=3):
         try:
@@ -244,4 +295,5 @@ class SwiftStorage(storage.StorageDriver):
         self.swift.put_object(
             self._container_name(metric),
             self._build_unaggregated_timeserie_path(version),
-            data)
+            data,
+            headers={self.GENERATION_HEADER: uuid.uuid4().hex})
@@ -25,6 +25,7 @@ from gnocchi import incoming
 from gnocchi import indexer
 from gnocchi.rest.aggregates import api
 from gnocchi.rest.aggregates import exceptions
+from gnocchi.rest.aggregates import operations as agg_operations
 from gnocchi.rest.aggregates import processor
 from gnocchi import storage
 from gnocchi.tests import base
@@ -42,6 +43,10 @@ def datetime64(*args):
     return numpy.datetime64(datetime.datetime(*args))
 
 
+def measures_to_list(response):
+    return processor.convert_measures(response, processor.Measures.to_list)
+
+
 class TestGrouper(base.BaseTestCase):
     def setUp(self):
         super(TestGrouper, self).setUp()
@@ -138,6 +143,59 @@ class TestGrouper(base.BaseTestCase):
                          response_of_method[2].resources[0].get('uuid'))
 
 
+class TestMeasures(base.BaseTestCase):
+    def test_formats(self):
+        measures = processor.Measures()
+        measures.add_series(
+            numpy.timedelta64(1, 'm'),
+            numpy.array(['2014-01-01T12:00', '2014-01-01T12:01'],
+                        dtype='datetime64[ns]'),
+            numpy.array([1.0, 2.0]))
+        measures.add_series(
+            numpy.timedelta64(1, 's'),
+            numpy.array([], dtype='datetime64[ns]'),
+            numpy.array([]))
+        self.assertEqual(2, len(measures))
+        self.assertEqual([{
+            "granularity": 60.0,
+            "timestamps": ['2014-01-01T12:00:00+00:00',
+                           '2014-01-01T12:01:00+00:00'],
+            "values": [1.0, 2.0],
+        }], measures.to_columnar())
+        self.assertEqual([
+            (numpy.datetime64('2014-01-01T12:00'),
+             numpy.timedelta64(1, 'm'), 1.0),
+            (numpy.datetime64('2014-01-01T12:01'),
+             numpy.timedelta64(1, 'm'), 2.0),
+        ], measures.to_list())
+
+    def test_convert_measures(self):
+        measures = processor.Measures()
+        measures.add_series(
+            numpy.timedelta64(1, 'm'),
+            numpy.array(['2014-01-01T12:00'], dtype='datetime64[ns]'),
+            numpy.array([1.0]))
+        self.assertEqual(
+            [{"measures": {"aggregated": [
+                (numpy.datetime64('2014-01-01T12:00'),
+                 numpy.timedelta64(1, 'm'), 1.0)]},
+              "group": {"id": "foo"}}],
+            measures_to_list([{"measures": {"aggregated": measures},
+                               "group": {"id": "foo"}}]))
+
+    def test_columnar_sub_second(self):
+        measures = processor.Measures()
+        measures.add_series(
+            numpy.timedelta64(500, 'ms'),
+            numpy.array(['2014-01-01T12:00:00', '2014-01-01T12:00:00.5'],
+                        dtype='datetime64[ns]'),
+            numpy.array([1.0, 2.0]))
+        self.assertEqual(
+            ['2014-01-01T12:00:00.000000000+00:00',
+             '2014-01-01T12:00:00.500000000+00:00'],
+            measures.to_columnar()[0]["timestamps"])
+
+
 class TestAggregatedTimeseries(base.BaseTestCase):
     @staticmethod
     def _resample_and_merge(ts, agg_dict):
@@ -183,6 +241,64 @@ class TestAggregatedTimeseries(base.BaseTestCase):
                           operations=["aggregate", "mean", [
                               "metric", ["all", "mean"]]])
 
+    def test_find_streamable_reductions(self):
+        reduction = ["aggregate", "sum", ["metric", ["foo", "mean"]]]
+        self.assertEqual(
+            [reduction],
+            agg_operations.find_streamable_reductions(reduction))
+        self.assertEqual(
+            [reduction, reduction],
+            agg_operations.find_streamable_reductions(
+                ["abs", ["-", ["*", reduction, 2], reduction]]))
+        for operations in (
+                ["metric", ["foo", "mean"]],
+                ["aggregate", "median", ["metric", ["foo", "mean"]]],
+                ["aggregate", "sum", ["abs", ["metric", ["foo", "mean"]]]],
+                ["+", reduction, ["metric", ["foo", "mean"]]],
+                ["resample", "mean", numpy.timedelta64(1, 'h'), reduction],
+                ["rolling", "sum", 2, reduction]):
+            self.assertIsNone(
+                agg_operations.find_streamable_reductions(operations))
+
+    def test_aggregated_streaming(self):
+        metrics = [mock.Mock(id=str(uuid.uuid4())) for _ in range(3)]
+        refs = [processor.MetricReference(metric, "mean")
+                for metric in metrics]
+        sampling = numpy.timedelta64(60, 's')
+        timeseries = [
+            carbonara.AggregatedTimeSerie.from_data(
+                carbonara.Aggregation("mean", sampling, None),
+                [datetime64(2014, 1, 1, 12, minute, 0)
+                 for minute in minutes], values)
+            for minutes, values in (
+                ((0, 1, 2, 3, 5), (4, 8, numpy.nan, 2, 9)),
+                ((1, 2, 3, 4), (1, 3, 7, 5)),
+                ((2, 3, 6), (6, 2.5, 1)),
+            )
+        ]
+        lookup_keys = [ref.lookup_key for ref in refs]
+        for agg in agg_operations.STREAMABLE_AGG:
+            for operations in (
+                    ["aggregate", agg, ["metric"] + lookup_keys],
+                    ["-", ["*", ["aggregate", agg,
+                                 ["metric"] + lookup_keys[:2]], 2],
+                     ["aggregate", agg, ["metric"] + lookup_keys[1:]]]):
+                for fill in (None, "null", "dropna", 0.0, 1.5):
+                    output = measures_to_list(processor.aggregated(
+                        list(zip(refs, timeseries)), operations,
+                        needed_percent_of_overlap=0, fill=fill))
+                    with mock.patch.object(
+                            processor, "_find_streamable_reductions",
+                            return_value=None):
+                        expected = measures_to_list(processor.aggregated(
+                            list(zip(refs, timeseries)), operations,
+                            needed_percent_of_overlap=0, fill=fill))
+                    self.assertEqual(
+                        [(t, g, eq_nan if numpy.isnan(v) else v)
+                         for t, g, v in expected["aggregated"]],
+                        list(output["aggregated"]),
+                        "%s with fill %s" % (operations, fill))
+
     def test_aggregated_different_archive_no_overlap2(self):
         tsc1 = {'sampling': numpy.timedelta64(60, 's'),
                 'size': 50, 'agg': 'mean'}
@@ -259,7 +375,7 @@ class TestAggregatedTimeseries(base.BaseTestCase):
                           ]])
 
         # Retry with 80% and it works
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             from_timestamp=dtfrom, to_timestamp=dtto,
             operations=["aggregate", "mean", [
@@ -267,7 +383,7 @@ class TestAggregatedTimeseries(base.BaseTestCase):
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key,
             ]],
-            needed_percent_of_overlap=80.0)["aggregated"]
+            needed_percent_of_overlap=80.0))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 1, 0),
@@ -322,13 +438,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
         # By default we require 100% of point that overlap
         # but we allow that the last datapoint is missing
         # of the precisest granularity
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["aggregate", "sum", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]])["aggregated"]
+            ]]))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 3, 0),
@@ -360,13 +476,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
                         before_truncate_callback=functools.partial(
                             self._resample_and_merge, agg_dict=tsc2))
 
-        output = processor.aggregated(
+        output = measures_to_list(processor.aggregated(
             [tsc1['return'], tsc2['return']],
             operations=["aggregate", "mean", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]])["aggregated"]
+            ]]))["aggregated"]
         self.assertEqual([
             (datetime64(
                 2014, 1, 1, 12, 3, 0
@@ -400,13 +516,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
             before_truncate_callback=functools.partial(
                 self._resample_and_merge, agg_dict=tsc2))
 
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["aggregate", "mean", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]], needed_percent_of_overlap=50.0)["aggregated"]
+            ]], needed_percent_of_overlap=50.0))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 1, 0),
@@ -446,7 +562,7 @@ class TestAggregatedTimeseries(base.BaseTestCase):
             before_truncate_callback=functools.partial(
                 self._resample_and_merge, agg_dict=tsc2))
 
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["aggregate", "mean", [
                 "metric",
@@ -454,7 +570,7 @@ class TestAggregatedTimeseries(base.BaseTestCase):
                 tsc2['return'][0].lookup_key
             ]],
             from_timestamp=datetime64(2014, 1, 1, 12, 0, 0),
-            needed_percent_of_overlap=50.0)["aggregated"]
+            needed_percent_of_overlap=50.0))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
@@ -469,7 +585,7 @@ class TestAggregatedTimeseries(base.BaseTestCase):
              numpy.timedelta64(60000000000, 'ns'), 4.5),
         ], list(output))
 
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["aggregate", "mean", [
                 "metric",
@@ -477,7 +593,7 @@ class TestAggregatedTimeseries(base.BaseTestCase):
                 tsc2['return'][0].lookup_key,
             ]],
             to_timestamp=datetime64(2014, 1, 1, 12, 7, 0),
-            needed_percent_of_overlap=50.0)["aggregated"]
+            needed_percent_of_overlap=50.0))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 1, 0),
@@ -523,13 +639,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
             before_truncate_callback=functools.partial(
                 self._resample_and_merge, agg_dict=tsc2))
 
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["aggregate", "mean", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]], fill=0)["aggregated"]
+            ]], fill=0))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
@@ -552,11 +668,11 @@ class TestAggregatedTimeseries(base.BaseTestCase):
              numpy.timedelta64(60000000000, 'ns'), 1.5),
         ], list(output))
 
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["-", ["metric"] + tsc1['return'][0].lookup_key,
                         ["metric"] + tsc2['return'][0].lookup_key
-                        ], fill=0)["aggregated"]
+                        ], fill=0))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
@@ -610,13 +726,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
             before_truncate_callback=functools.partial(
                 self._resample_and_merge, agg_dict=tsc2))
 
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["aggregate", "mean", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]], fill='null')["aggregated"]
+            ]], fill='null'))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
@@ -639,11 +755,11 @@ class TestAggregatedTimeseries(base.BaseTestCase):
              numpy.timedelta64(60000000000, 'ns'), 3.0),
         ], list(output))
 
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["-", ["metric"] + tsc1['return'][0].lookup_key,
                         ["metric"] + tsc2['return'][0].lookup_key
-                        ], fill='null')["aggregated"]
+                        ], fill='null'))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
@@ -693,13 +809,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
             before_truncate_callback=functools.partial(
                 self._resample_and_merge, agg_dict=tsc2))
 
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["aggregate", "mean", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]], fill=0)["aggregated"]
+            ]], fill=0))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
@@ -718,11 +834,11 @@ class TestAggregatedTimeseries(base.BaseTestCase):
              numpy.timedelta64(60000000000, 'ns'), 1.5),
         ], list(output))
 
-        output = processor.aggregated([
+        output = measures_to_list(processor.aggregated([
             tsc1['return'], tsc2['return']],
             operations=["-", ["metric"] + tsc1['return'][0].lookup_key,
                         ["metric"] + tsc2['return'][0].lookup_key
-                        ], fill=0)["aggregated"]
+                        ], fill=0))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
@@ -800,13 +916,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
             (datetime64(2014, 1, 1, 12, 6, 0), 1)],
             dtype=carbonara.TIMESERIES_ARRAY_DTYPE),
             before_truncate_callback=ts2_update)
-        output = processor.aggregated(
+        output = measures_to_list(processor.aggregated(
             [tsc1['return'], tsc12['return'], tsc2['return'], tsc22['return']],
             operations=["aggregate", "mean", [
                 "metric",
                 tsc1['return'][0].lookup_key, tsc12['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key, tsc22['return'][0].lookup_key
-            ]])["aggregated"]
+            ]]))["aggregated"]
         self.assertEqual([
             (datetime64(2014, 1, 1, 11, 45),
              numpy.timedelta64(300, 's'), 5.75),
@@ -875,13 +991,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
             before_truncate_callback=functools.partial(
                 self._resample_and_merge, agg_dict=tsc2))
 
-        output = processor.aggregated(
+        output = measures_to_list(processor.aggregated(
             [tsc1['return'], tsc2['return']],
             operations=["aggregate", "sum", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]])["aggregated"]
+            ]]))["aggregated"]
 
         self.assertEqual([
             (datetime64(
@@ -895,14 +1011,14 @@ class TestAggregatedTimeseries(base.BaseTestCase):
         dtfrom = datetime64(2015, 12, 3, 13, 17, 0)
         dtto = datetime64(2015, 12, 3, 13, 25, 0)
 
-        output = processor.aggregated(
+        output = measures_to_list(processor.aggregated(
             [tsc1['return'], tsc2['return']],
             from_timestamp=dtfrom, to_timestamp=dtto,
             operations=["aggregate", "sum", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]], needed_percent_of_overlap=0)["aggregated"]
+            ]], needed_percent_of_overlap=0))["aggregated"]
         self.assertEqual([
             (datetime64(
                 2015, 12, 3, 13, 19, 15
@@ -925,13 +1041,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
         ], list(output))
 
         # Check boundaries are set when overlap=0
-        output = processor.aggregated(
+        output = measures_to_list(processor.aggregated(
             [tsc1['return'], tsc2['return']],
             operations=["aggregate", "sum", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]], needed_percent_of_overlap=0)["aggregated"]
+            ]], needed_percent_of_overlap=0))["aggregated"]
         self.assertEqual([
             (datetime64(
                 2015, 12, 3, 13, 21, 15
@@ -962,13 +1078,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
                               tsc2['return'][0].lookup_key
                           ]])
         # Retry with 50% and it works
-        output = processor.aggregated(
+        output = measures_to_list(processor.aggregated(
             [tsc1['return'], tsc2['return']], from_timestamp=dtfrom,
             operations=["aggregate", "sum", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]], needed_percent_of_overlap=50.0)["aggregated"]
+            ]], needed_percent_of_overlap=50.0))["aggregated"]
         self.assertEqual([
             (datetime64(
                 2015, 12, 3, 13, 19, 15
@@ -984,13 +1100,13 @@ class TestAggregatedTimeseries(base.BaseTestCase):
             ), numpy.timedelta64(1, 's'), 11.0),
         ], list(output))
 
-        output = processor.aggregated(
+        output = measures_to_list(processor.aggregated(
             [tsc1['return'], tsc2['return']], to_timestamp=dtto,
             operations=["aggregate", "sum", [
                 "metric",
                 tsc1['return'][0].lookup_key,
                 tsc2['return'][0].lookup_key
-            ]], needed_percent_of_overlap=50.0)["aggregated"]
+            ]], needed_percent_of_overlap=50.0))["aggregated"]
         self.assertEqual([
             (datetime64(
                 2015, 12, 3, 13, 21, 15
@@ -1029,11 +1145,64 @@ class CrossMetricAggregated(base.TestCase):
 
     def test_get_measures_empty_metric_needed_overlap_zero(self):
         m_id = str(self.metric.id)
-        result = processor.get_measures(
+        result = measures_to_list(processor.get_measures(
             self.storage, [processor.MetricReference(self.metric, "mean")],
-            operations=["metric", m_id, "mean"], needed_overlap=0)
+            operations=["metric", m_id, "mean"], needed_overlap=0))
         self.assertEqual({m_id: {"mean": []}}, result)
 
+    def test_get_measures_batch(self):
+        metric2 = indexer.Metric(uuid.uuid4(),
+                                 self.archive_policies['low'])
+        metric3 = indexer.Metric(uuid.uuid4(),
+                                 self.archive_policies['low'])
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 0, 1), 69),
+            incoming.Measure(datetime64(2014, 1, 1, 12, 7, 31), 42),
+            incoming.Measure(datetime64(2014, 1, 1, 12, 9, 31), 4),
+            incoming.Measure(datetime64(2014, 1, 1, 12, 12, 45), 44),
+        ])
+        self.incoming.add_measures(metric2.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 0, 5), 9),
+            incoming.Measure(datetime64(2014, 1, 1, 12, 7, 41), 2),
+            incoming.Measure(datetime64(2014, 1, 1, 12, 10, 31), 4),
+            incoming.Measure(datetime64(2014, 1, 1, 12, 13, 10), 4),
+        ])
+        self.trigger_processing([self.metric, metric2])
+
+        references_and_windows = [
+            ([processor.MetricReference(self.metric, "mean", None, "*")],
+             None, datetime64(2014, 1, 1, 12, 7)),
+            ([processor.MetricReference(self.metric, "mean", None, "*"),
+              processor.MetricReference(metric2, "mean", None, "*")],
+             datetime64(2014, 1, 1, 12, 5), datetime64(2014, 1, 1, 12, 11)),
+            # Metric without measures
+            ([processor.MetricReference(metric3, "mean", None, "*")],
+             datetime64(2014, 1, 1, 12, 10), None),
+        ]
+        operations = ["aggregate", "sum", ["metric", "*", "mean"]]
+        values = measures_to_list(processor.get_measures_batch(
+            self.storage, references_and_windows, operations,
+            granularities=[numpy.timedelta64(5, 'm')], needed_overlap=0))
+        self.assertEqual([
+            measures_to_list(processor.get_measures(
+                self.storage, references, operations, start, stop,
+                granularities=[numpy.timedelta64(5, 'm')], needed_overlap=0))
+            for references, start, stop in references_and_windows
+        ], values)
+        self.assertEqual([
+            (datetime64(2014, 1, 1, 12, 0, 0),
+             numpy.timedelta64(5, 'm'), 69.0),
+            (datetime64(2014, 1, 1, 12, 5, 0),
+             numpy.timedelta64(5, 'm'), 23.0),
+        ], values[0]["aggregated"])
+        self.assertEqual([
+            (datetime64(2014, 1, 1, 12, 5, 0),
+             numpy.timedelta64(5, 'm'), 25.0),
+            (datetime64(2014, 1, 1, 12, 10, 0),
+             numpy.timedelta64(5, 'm'), 48.0),
+        ], values[1]["aggregated"])
+        self.assertEqual([], values[2]["aggregated"])
+
     def test_get_measures_unknown_aggregation(self):
         metric2 = indexer.Metric(uuid.uuid4(),
                                  self.archive_policies['low'])
@@ -1130,7 +1299,7 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1138,7 +1307,7 @@ class CrossMetricAggregated(base.TestCase):
                 "metric",
                 [str(self.metric.id), "mean"],
                 [str(metric2.id), "mean"],
-            ]])["aggregated"]
+            ]]))["aggregated"]
         self.assertEqual([
             (datetime64(2014, 1, 1, 0, 0, 0),
              numpy.timedelta64(1, 'D'), 22.25),
@@ -1152,7 +1321,7 @@ class CrossMetricAggregated(base.TestCase):
              numpy.timedelta64(5, 'm'), 24.0)
         ], values)
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1160,7 +1329,7 @@ class CrossMetricAggregated(base.TestCase):
                 "metric",
                 [str(self.metric.id), "mean"],
                 [str(metric2.id), "mean"],
-            ]])["aggregated"]
+            ]]))["aggregated"]
         self.assertEqual([
             (datetime64(2014, 1, 1, 0, 0, 0),
              numpy.timedelta64(1, 'D'), 39.75),
@@ -1174,7 +1343,7 @@ class CrossMetricAggregated(base.TestCase):
              numpy.timedelta64(5, 'm'), 44)
         ], values)
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1183,7 +1352,7 @@ class CrossMetricAggregated(base.TestCase):
                 [str(self.metric.id), "mean"],
                 [str(metric2.id), "mean"],
             ]],
-            from_timestamp=datetime64(2014, 1, 1, 12, 10, 0))["aggregated"]
+            from_timestamp=datetime64(2014, 1, 1, 12, 10, 0)))["aggregated"]
         self.assertEqual([
             (datetime64(2014, 1, 1),
              numpy.timedelta64(1, 'D'), 22.25),
@@ -1193,7 +1362,7 @@ class CrossMetricAggregated(base.TestCase):
              numpy.timedelta64(5, 'm'), 24.0),
         ], values)
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1202,7 +1371,7 @@ class CrossMetricAggregated(base.TestCase):
                 [str(self.metric.id), "mean"],
                 [str(metric2.id), "mean"],
             ]],
-            to_timestamp=datetime64(2014, 1, 1, 12, 5, 0))["aggregated"]
+            to_timestamp=datetime64(2014, 1, 1, 12, 5, 0)))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 0, 0, 0),
@@ -1213,7 +1382,7 @@ class CrossMetricAggregated(base.TestCase):
              numpy.timedelta64(5, 'm'), 39.0),
         ], values)
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1223,7 +1392,7 @@ class CrossMetricAggregated(base.TestCase):
                 [str(metric2.id), "mean"],
             ]],
             from_timestamp=datetime64(2014, 1, 1, 12, 10, 10),
-            to_timestamp=datetime64(2014, 1, 1, 12, 10, 10))["aggregated"]
+            to_timestamp=datetime64(2014, 1, 1, 12, 10, 10)))["aggregated"]
         self.assertEqual([
             (datetime64(2014, 1, 1),
              numpy.timedelta64(1, 'D'), 22.25),
@@ -1233,7 +1402,7 @@ class CrossMetricAggregated(base.TestCase):
              numpy.timedelta64(5, 'm'), 24.0),
         ], values)
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1243,7 +1412,7 @@ class CrossMetricAggregated(base.TestCase):
                 [str(metric2.id), "mean"],
             ]],
             from_timestamp=datetime64(2014, 1, 1, 12, 0, 0),
-            to_timestamp=datetime64(2014, 1, 1, 12, 0, 1))["aggregated"]
+            to_timestamp=datetime64(2014, 1, 1, 12, 0, 1)))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1),
@@ -1254,7 +1423,7 @@ class CrossMetricAggregated(base.TestCase):
              numpy.timedelta64(5, 'm'), 39.0),
         ], values)
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1265,7 +1434,7 @@ class CrossMetricAggregated(base.TestCase):
             ]],
             from_timestamp=datetime64(2014, 1, 1, 12, 0, 0),
             to_timestamp=datetime64(2014, 1, 1, 12, 0, 1),
-            granularities=[numpy.timedelta64(5, 'm')])["aggregated"]
+            granularities=[numpy.timedelta64(5, 'm')]))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
@@ -1289,7 +1458,7 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, 'mean'),
              processor.MetricReference(metric2, 'mean')],
@@ -1297,7 +1466,7 @@ class CrossMetricAggregated(base.TestCase):
                 "metric",
                 [str(self.metric.id), "mean"],
                 [str(metric2.id), "mean"],
-            ]])["aggregated"]
+            ]]))["aggregated"]
         self.assertEqual([
             (datetime64(2014, 1, 1, 0, 0, 0),
              numpy.timedelta64(1, 'D'), 18.875),
@@ -1327,7 +1496,7 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1335,7 +1504,7 @@ class CrossMetricAggregated(base.TestCase):
              ["metric",
               [str(self.metric.id), "mean"],
               [str(metric2.id), "mean"]]],
-            granularities=[numpy.timedelta64(1, 'h')])
+            granularities=[numpy.timedelta64(1, 'h')]))
 
         self.assertEqual({
             str(self.metric.id): {
@@ -1364,7 +1533,7 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1372,7 +1541,7 @@ class CrossMetricAggregated(base.TestCase):
                    ["metric",
                     [str(self.metric.id), "mean"],
                     [str(metric2.id), "mean"]]], 2],
-            granularities=[numpy.timedelta64(1, 'h')])
+            granularities=[numpy.timedelta64(1, 'h')]))
 
         self.assertEqual({
             str(self.metric.id): {
@@ -1401,7 +1570,7 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1411,7 +1580,7 @@ class CrossMetricAggregated(base.TestCase):
               ["metric",
                [str(self.metric.id), "mean"],
                [str(metric2.id), "mean"]]]],
-            granularities=[numpy.timedelta64(1, 'h')])
+            granularities=[numpy.timedelta64(1, 'h')]))
 
         self.assertEqual({
             str(self.metric.id): {
@@ -1440,14 +1609,14 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
             ["/", ["rolling", "sum", 2,
                    ["metric", [str(self.metric.id), "mean"],
                     [str(metric2.id), "mean"]]], 2],
-            granularities=[numpy.timedelta64(5, 'm')])
+            granularities=[numpy.timedelta64(5, 'm')]))
 
         self.assertEqual({
             str(self.metric.id): {
@@ -1484,13 +1653,13 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
             ["*", ["metric", str(self.metric.id), "mean"],
                   ["metric", str(metric2.id), "mean"]],
-            granularities=[numpy.timedelta64(1, 'h')])["aggregated"]
+            granularities=[numpy.timedelta64(1, 'h')]))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
@@ -1513,10 +1682,10 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing()
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage, [processor.MetricReference(self.metric, "mean")],
             ["*", ["metric", str(self.metric.id), "mean"], 2],
-            granularities=[numpy.timedelta64(1, 'h')])
+            granularities=[numpy.timedelta64(1, 'h')]))
 
         self.assertEqual({str(self.metric.id): {
             "mean": [
@@ -1540,10 +1709,10 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing()
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage, [processor.MetricReference(self.metric, "mean")],
             ["clip", ["metric", str(self.metric.id), "mean"], 5, 60],
-            granularities=[numpy.timedelta64(1, 'h')])
+            granularities=[numpy.timedelta64(1, 'h')]))
 
         self.assertEqual({str(self.metric.id): {
             "mean": [
@@ -1567,10 +1736,10 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing()
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage, [processor.MetricReference(self.metric, "mean")],
             ["clip", ["metric", str(self.metric.id), "mean"], 50],
-            granularities=[numpy.timedelta64(1, 'h')])
+            granularities=[numpy.timedelta64(1, 'h')]))
 
         self.assertEqual({str(self.metric.id): {
             "mean": [
@@ -1594,10 +1763,10 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing()
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage, [processor.MetricReference(self.metric, "mean")],
             ["*", 2, ["metric", str(self.metric.id), "mean"]],
-            granularities=[numpy.timedelta64(1, 'h')])
+            granularities=[numpy.timedelta64(1, 'h')]))
 
         self.assertEqual({str(self.metric.id): {
             "mean": [(datetime64(2014, 1, 1, 12, 0, 0),
@@ -1626,7 +1795,7 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1637,7 +1806,7 @@ class CrossMetricAggregated(base.TestCase):
                 ["*", ["metric", str(self.metric.id), "mean"],
                       ["metric", str(metric2.id), "mean"]],
             ],
-            granularities=[numpy.timedelta64(1, 'h')])["aggregated"]
+            granularities=[numpy.timedelta64(1, 'h')]))["aggregated"]
 
         self.assertEqual([
             (datetime64(2014, 1, 1, 13, 0, 0),
@@ -1664,7 +1833,7 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1682,7 +1851,7 @@ class CrossMetricAggregated(base.TestCase):
                 ],
                 10
             ],
-            granularities=[numpy.timedelta64(1, 'h')])["aggregated"]
+            granularities=[numpy.timedelta64(1, 'h')]))["aggregated"]
         self.assertEqual([
             (datetime64(2014, 1, 1, 12, 0, 0),
              numpy.timedelta64(1, 'h'), 1),
@@ -1710,13 +1879,13 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
             ["abs", ["metric", [str(self.metric.id), "mean"],
                      [str(metric2.id), "mean"]]],
-            granularities=[numpy.timedelta64(1, 'h')])
+            granularities=[numpy.timedelta64(1, 'h')]))
 
         self.assertEqual({
             str(self.metric.id): {
@@ -1756,7 +1925,7 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric, metric2])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean"),
              processor.MetricReference(metric2, "mean")],
@@ -1770,7 +1939,7 @@ class CrossMetricAggregated(base.TestCase):
                 ]
             ],
             granularities=[numpy.timedelta64(1, 'h')]
-        )["aggregated"]
+        ))["aggregated"]
 
         self.assertEqual(
             [
@@ -1793,12 +1962,12 @@ class CrossMetricAggregated(base.TestCase):
         ])
         self.trigger_processing([self.metric])
 
-        values = processor.get_measures(
+        values = measures_to_list(processor.get_measures(
             self.storage,
             [processor.MetricReference(self.metric, "mean")],
             ["rateofchangesec", ["metric", str(self.metric.id), "mean"]],
             granularities=[numpy.timedelta64(5, 'm')],
-        )
+        ))
 
         self.assertEqual({
             str(self.metric.id): {
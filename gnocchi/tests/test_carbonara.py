@@ -69,6 +69,29 @@ class TestBoundTimeSerie(base.BaseTestCase):
                                   dtype=carbonara.TIMESERIES_ARRAY_DTYPE))
         self.assertEqual(3, len(ts))
 
+    def test_blocks(self):
+        ts = carbonara.BoundTimeSerie.from_data(
+            [datetime64(2014, 1, 1, 12, 0, 0),
+             datetime64(2014, 1, 1, 12, 0, 4),
+             datetime64(2014, 1, 1, 12, 0, 9),
+             datetime64(2014, 1, 1, 12, 0, 21)],
+            [3, 5, 6, 7],
+            block_size=numpy.timedelta64(5, 's'),
+            back_window=3)
+        blocks = ts.blocks()
+        self.assertEqual([datetime64(2014, 1, 1, 12, 0, 0),
+                          datetime64(2014, 1, 1, 12, 0, 5),
+                          datetime64(2014, 1, 1, 12, 0, 20)],
+                         [block_timestamp for block_timestamp, _ in blocks])
+        self.assertEqual([2, 1, 1], [len(block) for _, block in blocks])
+        self.assertEqual(ts, carbonara.BoundTimeSerie.from_blocks(
+            [block for _, block in blocks], ts.block_size, ts.back_window))
+        self.assertEqual(
+            [datetime64(2014, 1, 1, 12, 0, 20)],
+            [block_timestamp for block_timestamp, _
+             in ts.blocks(datetime64(2014, 1, 1, 12, 0, 10))])
+        self.assertEqual([], ts.blocks(datetime64(2014, 1, 1, 12, 0, 25)))
+
     def test_block_size_unordered(self):
         ts = carbonara.BoundTimeSerie.from_data(
             [datetime64(2014, 1, 1, 12, 0, 5),
@@ -308,6 +331,22 @@ class TestAggregatedTimeSerie(base.BaseTestCase):
     def test_aggregation_max(self):
         self._do_test_aggregation('max', 5, 42, 4)
 
+    def test_aggregation_min_max_nan(self):
+        ts = carbonara.TimeSerie.from_data(
+            [datetime64(2014, 1, 1, 12, 0, 0),
+             datetime64(2014, 1, 1, 12, 0, 10),
+             datetime64(2014, 1, 1, 12, 0, 20),
+             datetime64(2014, 1, 1, 12, 1, 0),
+             datetime64(2014, 1, 1, 12, 1, 10),
+             datetime64(2014, 1, 1, 12, 2, 0)],
+            [3, numpy.nan, 1, numpy.nan, numpy.nan, 4])
+        grouped = ts.group_serie(numpy.timedelta64(60, 's'))
+        # min skips NaN unless the group only has NaN, max propagates it
+        numpy.testing.assert_equal(
+            [1, numpy.nan, 4], grouped.min()['values'])
+        numpy.testing.assert_equal(
+            [numpy.nan, numpy.nan, 4], grouped.max()['values'])
+
     def test_aggregation_std(self):
         self._do_test_aggregation('std', 1.3416407864998738,
                                   13.266499161421599, 1.4142135623730951)
@@ -330,6 +369,109 @@ class TestAggregatedTimeSerie(base.BaseTestCase):
         self.assertEqual(1.5275252316519465,
                          ts[datetime64(2014, 1, 1, 12, 0, 0)][1])
 
+    def test_aggregate_multiple_methods(self):
+        ts = carbonara.TimeSerie.from_data(
+            [datetime64(2014, 1, 1, 12, 0, 0),
+             datetime64(2014, 1, 1, 12, 0, 10),
+             datetime64(2014, 1, 1, 12, 0, 20),
+             datetime64(2014, 1, 1, 12, 0, 30),
+             datetime64(2014, 1, 1, 12, 0, 40),
+             datetime64(2014, 1, 1, 12, 1, 0),
+             datetime64(2014, 1, 1, 12, 1, 10),
+             datetime64(2014, 1, 1, 12, 1, 20),
+             datetime64(2014, 1, 1, 12, 1, 30),
+             datetime64(2014, 1, 1, 12, 1, 40),
+             datetime64(2014, 1, 1, 12, 1, 50),
+             datetime64(2014, 1, 1, 12, 2, 0),
+             datetime64(2014, 1, 1, 12, 2, 10)],
+            [3, 5, 2, 3, 5, 8, 11, 22, 10, 42, 9, 4, 2])
+        sampling = numpy.timedelta64(60, 's')
+        aggregations = [
+            carbonara.Aggregation(method, sampling, None)
+            for method in ('mean', 'sum', 'min', 'max', 'std', 'count',
+                           'first', 'last', 'median', '56pct', '90pct',
+                           'rate:mean', 'rate:max', 'rate:last')
+        ]
+        fused = carbonara.AggregatedTimeSerie.from_grouped_serie_multi(
+            ts.group_serie(sampling), aggregations)
+        self.assertEqual(set(aggregations), set(fused.keys()))
+        for aggregation in aggregations:
+            self.assertEqual(
+                carbonara.AggregatedTimeSerie.from_grouped_serie(
+                    ts.group_serie(sampling), aggregation),
+                fused[aggregation])
+
+    def test_aggregate_empty(self):
+        ts = carbonara.TimeSerie()
+        grouped = ts.group_serie(numpy.timedelta64(60, 's'))
+        for method, result in grouped.aggregate(
+                ['mean', 'min', 'max', 'median', '90pct']).items():
+            self.assertEqual(0, len(result), method)
+
+    def test_aggregate_segments(self):
+        ts1 = carbonara.TimeSerie.from_data(
+            [datetime64(2014, 1, 1, 12, 0, 0),
+             datetime64(2014, 1, 1, 12, 0, 10),
+             datetime64(2014, 1, 1, 12, 0, 20),
+             datetime64(2014, 1, 1, 12, 1, 0),
+             datetime64(2014, 1, 1, 12, 1, 10),
+             datetime64(2014, 1, 1, 12, 2, 40)],
+            [3, 5, 2, 8, 11, 22])
+        ts2 = carbonara.TimeSerie()
+        ts3 = carbonara.TimeSerie.from_data(
+            [datetime64(2014, 1, 1, 12, 0, 30),
+             datetime64(2014, 1, 1, 12, 1, 20),
+             datetime64(2014, 1, 1, 12, 1, 30),
+             datetime64(2014, 1, 1, 12, 1, 40),
+             datetime64(2014, 1, 1, 12, 3, 0)],
+            [10, 42, 9, 4, 2])
+        sampling = numpy.timedelta64(60, 's')
+        starts = [datetime64(2014, 1, 1, 12, 1, 0),
+                  datetime64(2014, 1, 1, 12, 0, 0),
+                  datetime64(2014, 1, 1, 12, 0, 0)]
+        methods = ['mean', 'sum', 'min', 'max', 'std', 'count', 'first',
+                   'last', 'median', '56pct', 'rate:mean', 'rate:90pct']
+        grouped = carbonara.SegmentedGroupedTimeSeries.from_timeseries(
+            [ts1.ts, ts2.ts, ts3.ts], sampling, starts)
+        results = grouped.aggregate_segments(methods)
+        self.assertEqual(3, len(results))
+        for ts, start, result in zip((ts1, ts2, ts3), starts, results):
+            expected = ts.group_serie(sampling, start).aggregate(methods)
+            self.assertEqual(set(methods), set(result.keys()))
+            for method in methods:
+                numpy.testing.assert_array_equal(
+                    expected[method], result[method], method)
+
+    def test_aggregate_matrix(self):
+        timestamps = [datetime64(2014, 1, 1, 12, 0, 0),
+                      datetime64(2014, 1, 1, 12, 0, 10),
+                      datetime64(2014, 1, 1, 12, 0, 20),
+                      datetime64(2014, 1, 1, 12, 1, 0),
+                      datetime64(2014, 1, 1, 12, 1, 10),
+                      datetime64(2014, 1, 1, 12, 2, 40)]
+        values = numpy.array([[3, 10, numpy.nan],
+                              [5, 42, 1],
+                              [2, 9, 7],
+                              [8, numpy.nan, 4],
+                              [11, 4, 5],
+                              [22, 2, 6]])
+        sampling = numpy.timedelta64(60, 's')
+        methods = ['mean', 'sum', 'min', 'max', 'std', 'count', 'first',
+                   'last', 'median', '56pct', 'rate:mean', 'rate:90pct']
+        grouped = carbonara.GroupedTimeSeriesMatrix(
+            timestamps, values, sampling)
+        for method in methods:
+            result_timestamps, result_values = grouped.aggregate(method)
+            self.assertEqual(values.shape[1], result_values.shape[1])
+            for column, result_column in zip(values.T, result_values.T):
+                expected = carbonara.AggregatedTimeSerie.from_data(
+                    carbonara.Aggregation(method, None, None),
+                    timestamps, column).resample(sampling)
+                numpy.testing.assert_array_equal(
+                    expected['timestamps'], result_timestamps, method)
+                numpy.testing.assert_array_equal(
+                    expected['values'], result_column, method)
+
     def test_different_length_in_timestamps_and_data(self):
         self.assertRaises(
             ValueError,
@@ -627,6 +769,90 @@ class TestAggregatedTimeSerie(base.BaseTestCase):
                          carbonara.AggregatedTimeSerie.unserialize(
                              s, key, ts['return'].aggregation))
 
+    def test_serialize_v4(self):
+        sampling = numpy.timedelta64(60, 's')
+        aggregation = carbonara.Aggregation('mean', sampling, None)
+        timestamps = [datetime64(2014, 1, 1, 12, 0, 0),
+                      datetime64(2014, 1, 1, 12, 1, 0),
+                      datetime64(2014, 1, 1, 12, 2, 0),
+                      datetime64(2014, 1, 1, 12, 5, 0),
+                      datetime64(2014, 1, 1, 14, 0, 0),
+                      datetime64(2014, 1, 3, 0, 0, 0)]
+        for values in ([3, 3, 3, 4, 4, 3],
+                       [1.5, -0.1, float('nan'), float('inf'), -0.0, 1e308],
+                       [0.1, 0.2, 0.3, 0.4, 0.5, 0.6]):
+            ts = carbonara.AggregatedTimeSerie.from_data(
+                aggregation, timestamps, values)
+            for key, split in ts.split():
+                o, s = split.serialize(key, version=4)
+                self.assertIsNone(o)
+                self.assertTrue(
+                    carbonara.AggregatedTimeSerie.is_compressed(s))
+                unserialized = carbonara.AggregatedTimeSerie.unserialize(
+                    s, key, aggregation, version=4)
+                numpy.testing.assert_array_equal(
+                    split.timestamps, unserialized.timestamps)
+                numpy.testing.assert_array_equal(
+                    split.values.view('<u8'),
+                    unserialized.values.view('<u8'))
+                # The uncompressed format is the same for both versions
+                self.assertEqual(split.serialize(key, compressed=False),
+                                 split.serialize(key, compressed=False,
+                                                 version=4))
+
+    def test_serialize_v4_smaller(self):
+        sampling = numpy.timedelta64(60, 's')
+        aggregation = carbonara.Aggregation('sum', sampling, None)
+        ts = carbonara.AggregatedTimeSerie.from_data(
+            aggregation,
+            datetime64(2014, 1, 1) + numpy.arange(3600) * sampling,
+            numpy.arange(3600) * 3.0)
+        key = ts.get_split_key()
+        self.assertLess(len(ts.serialize(key, version=4)[1]),
+                        len(ts.serialize(key)[1]))
+
+    def test_unserialize_v4_corrupted(self):
+        sampling = numpy.timedelta64(60, 's')
+        aggregation = carbonara.Aggregation('mean', sampling, None)
+        ts = carbonara.AggregatedTimeSerie.from_data(
+            aggregation,
+            [datetime64(2014, 1, 1, 12, 0, 0),
+             datetime64(2014, 1, 1, 12, 1, 0)],
+            [3, 5])
+        key = ts.get_split_key()
+        for payload in (b"", b"\x02\x00\x00\x00\x08\x00\x00\x00\x01",
+                        b"\x02\x00\x00\x00\x01\x00\x00\x00\x00\x80"):
+            self.assertRaises(
+                carbonara.InvalidData,
+                carbonara.AggregatedTimeSerie.unserialize,
+                b"c" + ts._compress(payload), key, aggregation, 4)
+
+    def test_varints(self):
+        values = numpy.array([0, 1, -1, 63, -64, 64, -65, 2 ** 40,
+                              2 ** 63 - 1, -2 ** 63])
+        encoded = carbonara.encode_varints(values)
+        self.assertEqual(1 + 1 + 1 + 1 + 1 + 2 + 2 + 6 + 10 + 10,
+                         len(encoded))
+        numpy.testing.assert_array_equal(
+            values, carbonara.decode_varints(encoded))
+        self.assertEqual(b"\x00\x02\x01",
+                         carbonara.encode_varints([0, 1, -1]))
+        self.assertRaises(carbonara.InvalidData,
+                          carbonara.decode_varints, b"\x80")
+
+    def test_xor_floats(self):
+        values = numpy.array([12.0, 12.0, 24.0, 15.5, 15.5, 0.1,
+                              float('nan'), -0.0, 5e-324])
+        encoded = carbonara.encode_xor_floats(values)
+        numpy.testing.assert_array_equal(
+            values.view('<u8'),
+            carbonara.decode_xor_floats(encoded, len(values)).view('<u8'))
+        # Repeated values only take one bit
+        self.assertEqual(2, len(carbonara.encode_xor_floats([0.0] * 10)))
+        self.assertRaises(carbonara.InvalidData,
+                          carbonara.decode_xor_floats, encoded[:3],
+                          len(values))
+
     def test_no_truncation(self):
         ts = {'sampling': numpy.timedelta64(60, 's'), 'agg': 'mean'}
         tsb = carbonara.BoundTimeSerie()
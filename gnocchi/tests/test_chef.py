@@ -14,9 +14,11 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import datetime
+import uuid
 
 import numpy
 
+from gnocchi import archive_policy
 from gnocchi import carbonara
 from gnocchi import chef
 from gnocchi import incoming
@@ -48,6 +50,40 @@ class TestChef(base.TestCase):
         self.assertNotIn(str(self.metric.id), details)
         self.chef.expunge_metrics(10000, sync=True)
 
+    def test_expunge_metrics_bulk(self):
+        metric2, __ = self._create_metric()
+        for m in (self.metric, metric2):
+            self.incoming.add_measures(m.id, [
+                incoming.Measure(datetime64(2014, 1, 1, 12, 0, 1), 69),
+            ])
+        self.trigger_processing([self.metric, metric2])
+        self.index.delete_metric(self.metric.id)
+        self.index.delete_metric(metric2.id)
+        with mock.patch.object(self.index, 'expunge_metric') as expunge_metric:
+            self.assertGreaterEqual(self.chef.expunge_metrics(10000, sync=True), 2)
+            self.assertEqual(0, expunge_metric.call_count)
+        for m in (self.metric, metric2):
+            self.assertRaises(indexer.NoSuchMetric, self.index.delete_metric, m.id)
+
+    def test_expunge_metrics_bulk_failure(self):
+        metric2, __ = self._create_metric()
+        self.index.delete_metric(self.metric.id)
+        self.index.delete_metric(metric2.id)
+
+        def delete_metric(metric):
+            if metric.id == metric2.id:
+                raise Exception("boom")
+
+        with mock.patch.object(self.storage, 'delete_metrics', side_effect=Exception("boom")):
+            with mock.patch.object(self.storage, 'delete_metric', side_effect=delete_metric):
+                self.assertRaises(Exception, self.chef.expunge_metrics, 10000, sync=True)
+                self.chef.expunge_metrics(10000)
+
+        # The metrics are expunged one by one, the failing one is kept
+        self.assertRaises(indexer.NoSuchMetric, self.index.delete_metric, self.metric.id)
+        self.assertEqual([metric2.id], [m.id for m in self.index.list_metrics(
+            status="delete", attribute_filter={"in": {"id": [self.metric.id, metric2.id]}})])
+
     def test_delete_expunge_metric(self):
         self.incoming.add_measures(self.metric.id, [
             incoming.Measure(datetime64(2014, 1, 1, 12, 0, 1), 69),
@@ -58,6 +94,35 @@ class TestChef(base.TestCase):
         self.assertRaises(indexer.NoSuchMetric, self.index.delete_metric,
                           self.metric.id)
 
+    def test_process_new_measures_for_sack_by_chunks(self):
+        sack = self.incoming.sack_for_metric(self.metric.id)
+        metrics = [self.metric]
+        while len(metrics) < 3:
+            metric, __ = self._create_metric()
+            if self.incoming.sack_for_metric(metric.id) == sack:
+                metrics.append(metric)
+        for metric in metrics:
+            self.incoming.add_measures(metric.id, [
+                incoming.Measure(datetime64(2014, 1, 1, 12, 0, 1), 69),
+            ])
+        self.chef = chef.Chef(self.coord, self.incoming,
+                              self.index, self.storage,
+                              sack_chunk_max_metrics=2)
+        with mock.patch.object(
+                self.incoming, 'iter_process_measures_for_sack',
+                wraps=self.incoming.iter_process_measures_for_sack
+        ) as iter_process:
+            self.assertEqual(3, self.chef.process_new_measures_for_sack(
+                sack, blocking=True, sync=True))
+        iter_process.assert_called_once_with(sack, 2, None)
+        for metric in metrics:
+            self.assertFalse(self.incoming.has_unprocessed(metric.id))
+            aggregation = metric.archive_policy.get_aggregation(
+                "mean", numpy.timedelta64(5, 'm'))
+            ts = self.storage.get_aggregated_measures(
+                {metric: [aggregation]})[metric][aggregation]
+            self.assertEqual([69], list(ts.values))
+
     def test_auto_clean_expired_resources_lock_not_acquired(self):
         auto_clean_lock_mock = mock.Mock()
         auto_clean_lock_mock.acquire.return_value = False
@@ -113,220 +178,116 @@ class TestChef(base.TestCase):
                                return_value=auto_clean_lock_mock) as get_sack_lock_mock:
             with mock.patch.object(self.index, 'list_resources',
                                    return_value=[resource_mock_1, resource_mock_2]) as list_resources_mock:
-                with mock.patch.object(self.index, 'delete_resource') as delete_resource_mock:
-                    self.chef.auto_clean_expired_resources(
-                        resource_ended_at_normalization=resource_ended_at_normalization_used)
+                with mock.patch.object(self.index, 'delete_resources',
+                                       return_value=2) as delete_resources_mock:
+                    self.assertEqual(2, self.chef.auto_clean_expired_resources(
+                        resource_ended_at_normalization=resource_ended_at_normalization_used))
 
                     get_sack_lock_mock.assert_called()
                     auto_clean_lock_mock.acquire.assert_called()
                     auto_clean_lock_mock.release.assert_called()
 
-                    self.assertEqual(1, list_resources_mock.call_count)
-                    self.assertEqual(2, delete_resource_mock.call_count)
-
-                    list_resources_mock.assert_has_calls([mock.call(attribute_filter=attribute_filter_expected)])
-                    delete_resource_mock.assert_has_calls([mock.call("resource-1"), mock.call("resource-2")])
-
-    @mock.patch.object(utils, 'utcnow')
-    def test_resource_ended_at_normalization_not_all_metrics_expired(self, utcnow_mock):
-        metric_inactive_after_used = 3600
-
-        utc_return = utils.datetime_utc(2025, 7, 17, 12, 00, 00)
-        utcnow_mock.return_value = utc_return
-
-        moment_expected = utc_return - datetime.timedelta(seconds=metric_inactive_after_used)
-        attribute_filter_expected = {"<": {"last_measure_timestamp": moment_expected}}
-
-        inactive_metric_mock_1_resource_1 = mock.Mock(id="metric-1", resource_id="resource-1")
-        inactive_metric_mock_2_resource_1 = mock.Mock(id="metric-2", resource_id="resource-1")
-        inactive_metric_mock_3_resource_1 = mock.Mock(id="metric-3", resource_id="resource-1")
-        inactive_metric_mock_4_resource_2 = mock.Mock(id="metric-4", resource_id="resource-2")
-        inactive_metric_mock_5_resource_2 = mock.Mock(id="metric-5", resource_id="resource-2")
-
-        all_resource_1_inactive_metrics = [inactive_metric_mock_1_resource_1,
-                                           inactive_metric_mock_2_resource_1,
-                                           inactive_metric_mock_3_resource_1]
-        resource_1_mock = mock.Mock(id="resource-1", metrics=all_resource_1_inactive_metrics + [
-            mock.Mock(id="metric-10", resource_id="resource-1")])
-
-        all_resource_2_inactive_metrics = [inactive_metric_mock_4_resource_2,
-                                           inactive_metric_mock_5_resource_2]
-        resource_2_mock = mock.Mock(id="resource-2", metrics=all_resource_2_inactive_metrics + [
-            mock.Mock(id="metric-12", resource_id="resource-2")])
-
-        all_metrics_mock = all_resource_1_inactive_metrics + all_resource_2_inactive_metrics
-
-        def get_resource_side_effect(resource_type, resource_id, with_metrics):
-            if resource_id == "resource-1":
-                return resource_1_mock
-            if resource_id == "resource-2":
-                return resource_2_mock
-            return None
-
-        with mock.patch.object(self.index, 'list_metrics',
-                               return_value=all_metrics_mock) as list_metrics_mock:
-
-            with mock.patch.object(self.index, 'get_resource',
-                                   side_effect=get_resource_side_effect) as get_resource_mock:
-                with mock.patch.object(self.index, 'update_resource') as update_resource_mock:
-                    self.chef.resource_ended_at_normalization(metric_inactive_after=metric_inactive_after_used)
-
-                    get_resource_mock.assert_has_calls([mock.call("generic", "resource-1", with_metrics=True),
-                                                        mock.call("generic", "resource-2", with_metrics=True)])
-
-                    list_metrics_mock.assert_has_calls([mock.call(attribute_filter=attribute_filter_expected,
-                                                                  resource_policy_filter={"==": {"ended_at": None}})])
-
-                    self.assertEqual(0, update_resource_mock.call_count)
-
-    @mock.patch.object(utils, 'utcnow')
-    def test_resource_ended_at_normalization_all_metrics_expired(self, utcnow_mock):
-        metric_inactive_after_used = 3600
-
-        utc_return = utils.datetime_utc(2025, 7, 17, 12, 00, 00)
-        utcnow_mock.return_value = utc_return
-
-        moment_expected = utc_return - datetime.timedelta(seconds=metric_inactive_after_used)
-        attribute_filter_expected = {"<": {"last_measure_timestamp": moment_expected}}
-
-        inactive_metric_mock_1_resource_1 = mock.Mock(id="metric-1", resource_id="resource-1")
-        inactive_metric_mock_2_resource_1 = mock.Mock(id="metric-2", resource_id="resource-1")
-        inactive_metric_mock_3_resource_1 = mock.Mock(id="metric-3", resource_id="resource-1")
-        inactive_metric_mock_4_resource_2 = mock.Mock(id="metric-4", resource_id="resource-2")
-        inactive_metric_mock_5_resource_2 = mock.Mock(id="metric-5", resource_id="resource-2")
-
-        all_resource_1_inactive_metrics = [inactive_metric_mock_1_resource_1,
-                                           inactive_metric_mock_2_resource_1,
-                                           inactive_metric_mock_3_resource_1]
-        resource_1_mock = mock.Mock(id="resource-1", metrics=all_resource_1_inactive_metrics, ended_at=None)
-
-        all_resource_2_inactive_metrics = [inactive_metric_mock_4_resource_2,
-                                           inactive_metric_mock_5_resource_2]
-        resource_2_mock = mock.Mock(id="resource-2", metrics=all_resource_2_inactive_metrics, ended_at=None)
-
-        all_metrics_mock = all_resource_1_inactive_metrics + all_resource_2_inactive_metrics
-
-        def get_resource_side_effect(resource_type, resource_id, with_metrics):
-            if resource_id == "resource-1":
-                return resource_1_mock
-            if resource_id == "resource-2":
-                return resource_2_mock
-            return None
-
-        with mock.patch.object(self.index, 'list_metrics',
-                               return_value=all_metrics_mock) as list_metrics_mock:
-
-            with mock.patch.object(self.index, 'get_resource',
-                                   side_effect=get_resource_side_effect) as get_resource_mock:
-                with mock.patch.object(self.index, 'update_resource') as update_resource_mock:
-                    self.chef.resource_ended_at_normalization(metric_inactive_after=metric_inactive_after_used)
-                    get_resource_mock.assert_has_calls([mock.call("generic", "resource-1", with_metrics=True),
-                                                        mock.call("generic", "resource-2", with_metrics=True)])
+                    list_resources_mock.assert_called_once_with(
+                        attribute_filter=attribute_filter_expected,
+                        limit=self.chef.EXPIRED_RESOURCES_PAGE_SIZE,
+                        sorts=["id:asc"])
+                    delete_resources_mock.assert_called_once_with(
+                        attribute_filter={"and": [
+                            {"in": {"id": ["resource-1", "resource-2"]}},
+                            attribute_filter_expected,
+                        ]})
+
+    def test_auto_clean_expired_resources_pages(self):
+        now = utils.utcnow()
+        expired = [str(uuid.uuid4()) for _ in range(5)]
+        for rid in expired:
+            self.index.create_resource(
+                'generic', rid, str(uuid.uuid4()), str(uuid.uuid4()),
+                started_at=now - datetime.timedelta(hours=3),
+                ended_at=now - datetime.timedelta(hours=2))
+        alive = str(uuid.uuid4())
+        self.index.create_resource(
+            'generic', alive, str(uuid.uuid4()), str(uuid.uuid4()))
 
-                    list_metrics_mock.assert_has_calls([mock.call(attribute_filter=attribute_filter_expected,
-                                                                  resource_policy_filter={"==": {"ended_at": None}})])
+        auto_clean_lock_mock = mock.Mock()
+        auto_clean_lock_mock.acquire.return_value = True
 
-                    self.assertEqual(2, update_resource_mock.call_count)
+        with mock.patch.object(chef.Chef, 'EXPIRED_RESOURCES_PAGE_SIZE', 2):
+            with mock.patch.object(self.chef, 'get_sack_lock',
+                                   return_value=auto_clean_lock_mock):
+                with mock.patch.object(self.index, 'delete_resources',
+                                       wraps=self.index.delete_resources) as delete:
+                    # Other tests may have left expired resources behind
+                    deleted = self.chef.auto_clean_expired_resources(
+                        resource_ended_at_normalization=3600)
+
+        self.assertGreaterEqual(deleted, 5)
+        self.assertGreaterEqual(delete.call_count, 3)
+        for call in delete.call_args_list:
+            ids = call.kwargs["attribute_filter"]["and"][0]["in"]["id"]
+            self.assertLessEqual(len(ids), 2)
+        # The lock is taken and released once per page
+        self.assertGreaterEqual(auto_clean_lock_mock.acquire.call_count,
+                                delete.call_count)
+        self.assertEqual(auto_clean_lock_mock.acquire.call_count,
+                         auto_clean_lock_mock.release.call_count)
+        self.assertEqual([], self.index.get_resources('generic', expired))
+        self.assertIsNotNone(self.index.get_resource('generic', alive))
 
     @mock.patch.object(utils, 'utcnow')
-    def test_resource_ended_at_normalization_all_metrics_expired_one_resource_finished(self, utcnow_mock):
+    def test_resource_ended_at_normalization(self, utcnow_mock):
         metric_inactive_after_used = 3600
 
         utc_return = utils.datetime_utc(2025, 7, 17, 12, 00, 00)
         utcnow_mock.return_value = utc_return
 
         moment_expected = utc_return - datetime.timedelta(seconds=metric_inactive_after_used)
-        attribute_filter_expected = {"<": {"last_measure_timestamp": moment_expected}}
-
-        inactive_metric_mock_1_resource_1 = mock.Mock(id="metric-1", resource_id="resource-1")
-        inactive_metric_mock_2_resource_1 = mock.Mock(id="metric-2", resource_id="resource-1")
-        inactive_metric_mock_3_resource_1 = mock.Mock(id="metric-3", resource_id="resource-1")
-        inactive_metric_mock_4_resource_2 = mock.Mock(id="metric-4", resource_id="resource-2")
-        inactive_metric_mock_5_resource_2 = mock.Mock(id="metric-5", resource_id="resource-2")
-
-        all_resource_1_inactive_metrics = [inactive_metric_mock_1_resource_1,
-                                           inactive_metric_mock_2_resource_1,
-                                           inactive_metric_mock_3_resource_1]
-        resource_1_mock = mock.Mock(id="resource-1", metrics=all_resource_1_inactive_metrics, ended_at=None)
-
-        all_resource_2_inactive_metrics = [inactive_metric_mock_4_resource_2,
-                                           inactive_metric_mock_5_resource_2]
-        resource_2_mock = mock.Mock(id="resource-2", metrics=all_resource_2_inactive_metrics,
-                                    ended_at=utils.datetime_utc(2025, 5, 17, 12, 00, 00))
-
-        all_metrics_mock = all_resource_1_inactive_metrics + all_resource_2_inactive_metrics
-
-        def get_resource_side_effect(resource_type, resource_id, with_metrics):
-            if resource_id == "resource-1":
-                return resource_1_mock
-            if resource_id == "resource-2":
-                return resource_2_mock
-            return None
 
-        with mock.patch.object(self.index, 'list_metrics',
-                               return_value=all_metrics_mock) as list_metrics_mock:
-
-            with mock.patch.object(self.index, 'get_resource',
-                                   side_effect=get_resource_side_effect) as get_resource_mock:
-                with mock.patch.object(self.index, 'update_resource') as update_resource_mock:
-                    self.chef.resource_ended_at_normalization(metric_inactive_after=metric_inactive_after_used)
-                    get_resource_mock.assert_has_calls([mock.call("generic", "resource-1", with_metrics=True),
-                                                        mock.call("generic", "resource-2", with_metrics=True)])
+        resources = [("resource-1", "generic"), ("resource-2", "instance")]
 
-                    list_metrics_mock.assert_has_calls([mock.call(attribute_filter=attribute_filter_expected,
-                                                                  resource_policy_filter={"==": {"ended_at": None}})])
+        with mock.patch.object(self.index, 'list_resources_with_inactive_metrics',
+                               return_value=resources) as list_resources_mock:
+            with mock.patch.object(self.index, 'end_resources', return_value=2) as end_resources_mock:
+                self.chef.resource_ended_at_normalization(metric_inactive_after=metric_inactive_after_used)
 
-                    self.assertEqual(1, update_resource_mock.call_count)
+                list_resources_mock.assert_called_once_with(
+                    moment_expected, limit=chef.Chef.RESOURCE_ENDED_AT_PAGE_SIZE, marker=None)
+                end_resources_mock.assert_called_once_with(resources, utc_return)
 
     @mock.patch.object(utils, 'utcnow')
-    def test_resource_ended_at_normalization_only_one_resource_expired(self, utcnow_mock):
+    def test_resource_ended_at_normalization_pages(self, utcnow_mock):
         metric_inactive_after_used = 3600
 
         utc_return = utils.datetime_utc(2025, 7, 17, 12, 00, 00)
         utcnow_mock.return_value = utc_return
 
         moment_expected = utc_return - datetime.timedelta(seconds=metric_inactive_after_used)
-        attribute_filter_expected = {"<": {"last_measure_timestamp": moment_expected}}
-
-        inactive_metric_mock_1_resource_1 = mock.Mock(id="metric-1", resource_id="resource-1")
-        inactive_metric_mock_2_resource_1 = mock.Mock(id="metric-2", resource_id="resource-1")
-        inactive_metric_mock_3_resource_1 = mock.Mock(id="metric-3", resource_id="resource-1")
-        inactive_metric_mock_4_resource_2 = mock.Mock(id="metric-4", resource_id="resource-2")
-        inactive_metric_mock_5_resource_2 = mock.Mock(id="metric-5", resource_id="resource-2")
-
-        all_resource_1_inactive_metrics = [inactive_metric_mock_1_resource_1,
-                                           inactive_metric_mock_2_resource_1,
-                                           inactive_metric_mock_3_resource_1]
-        resource_1_mock = mock.Mock(id="resource-1", metrics=all_resource_1_inactive_metrics + [
-            mock.Mock(id="metric-10", resource_id="resource-1")])
-
-        all_resource_2_inactive_metrics = [inactive_metric_mock_4_resource_2,
-                                           inactive_metric_mock_5_resource_2]
-        resource_2_mock = mock.Mock(id="resource-2", metrics=all_resource_2_inactive_metrics, ended_at=None)
-
-        all_metrics_mock = all_resource_1_inactive_metrics + all_resource_2_inactive_metrics
-
-        def get_resource_side_effect(resource_type, resource_id, with_metrics):
-            if resource_id == "resource-1":
-                return resource_1_mock
-            if resource_id == "resource-2":
-                return resource_2_mock
-            return None
 
-        with mock.patch.object(self.index, 'list_metrics',
-                               return_value=all_metrics_mock) as list_metrics_mock:
+        pages = [[("resource-1", "generic"), ("resource-2", "generic")],
+                 [("resource-3", "generic"), ("resource-4", "generic")],
+                 []]
 
-            with mock.patch.object(self.index, 'get_resource',
-                                   side_effect=get_resource_side_effect) as get_resource_mock:
-                with mock.patch.object(self.index, 'update_resource') as update_resource_mock:
+        with mock.patch.object(chef.Chef, 'RESOURCE_ENDED_AT_PAGE_SIZE', 2):
+            with mock.patch.object(self.index, 'list_resources_with_inactive_metrics',
+                                   side_effect=pages) as list_resources_mock:
+                with mock.patch.object(self.index, 'end_resources', return_value=2) as end_resources_mock:
                     self.chef.resource_ended_at_normalization(metric_inactive_after=metric_inactive_after_used)
-                    get_resource_mock.assert_has_calls([mock.call("generic", "resource-1", with_metrics=True),
-                                                        mock.call("generic", "resource-2", with_metrics=True)])
-
-                    list_metrics_mock.assert_has_calls([mock.call(attribute_filter=attribute_filter_expected,
-                                                                  resource_policy_filter={"==": {"ended_at": None}})])
 
-                    self.assertEqual(1, update_resource_mock.call_count)
+                    list_resources_mock.assert_has_calls([
+                        mock.call(moment_expected, limit=2, marker=None),
+                        mock.call(moment_expected, limit=2, marker="resource-2"),
+                        mock.call(moment_expected, limit=2, marker="resource-4")])
+                    end_resources_mock.assert_has_calls([
+                        mock.call(pages[0], utc_return),
+                        mock.call(pages[1], utc_return)])
+                    self.assertEqual(2, end_resources_mock.call_count)
+
+    def test_resource_ended_at_normalization_no_resource(self):
+        with mock.patch.object(self.index, 'list_resources_with_inactive_metrics',
+                               return_value=[]):
+            with mock.patch.object(self.index, 'end_resources') as end_resources_mock:
+                self.chef.resource_ended_at_normalization(metric_inactive_after=3600)
+                self.assertEqual(0, end_resources_mock.call_count)
 
     def test_clean_raw_data_inactive_metrics(self):
         metric_mock_1_resource_1 = mock.Mock()
@@ -341,25 +302,151 @@ class TestChef(base.TestCase):
         sack_mock = mock.Mock()
         with mock.patch.object(self.index, 'list_metrics',
                                return_value=mock_metrics_to_clean) as list_metrics_mock:
-            with mock.patch.object(self.chef, 'execute_raw_data_cleanup') as execute_raw_data_cleanup_mock:
-                with mock.patch.object(self.chef, 'get_sack_lock', return_value=sack_mock) as get_sack_lock_mock:
-                    self.chef.clean_raw_data_inactive_metrics()
+            with mock.patch.object(self.storage, 'truncate_unaggregated_timeseries') as truncate_mock:
+                with mock.patch.object(self.index,
+                                       'update_needs_raw_data_truncation_for_metrics') as update_flag_mock:
+                    with mock.patch.object(self.chef, 'get_sack_lock', return_value=sack_mock) as get_sack_lock_mock:
+                        self.assertEqual(3, self.chef.clean_raw_data_inactive_metrics())
+
+                        list_metrics_mock.assert_called_once_with(
+                            attribute_filter={"==": {"needs_raw_data_truncation": True}},
+                            limit=self.chef.RAW_DATA_CLEANUP_PAGE_SIZE,
+                            sorts=["id:asc"])
+                        # One truncation per sack, one flag reset per page
+                        self.assertEqual(3, truncate_mock.call_count)
+                        self.assertCountEqual(mock_metrics_to_clean,
+                                              [metric for call in truncate_mock.call_args_list
+                                               for metric in call[0][0]])
+                        self.assertEqual(1, update_flag_mock.call_count)
+                        self.assertCountEqual([m.id for m in mock_metrics_to_clean],
+                                              update_flag_mock.call_args[0][0])
+                        self.assertEqual(3, get_sack_lock_mock.call_count)
+                        self.assertEqual(3, sack_mock.release.call_count)
+
+    def test_clean_raw_data_inactive_metrics_sack_by_sack(self):
+        metrics = []
+        for i in range(3):
+            metric_mock = mock.Mock()
+            metric_mock.id = mock.Mock(int=i)
+            metrics.append(metric_mock)
+
+        locked = []
+
+        def get_sack_lock(sack):
+            sack_lock = mock.Mock()
+            sack_lock.acquire.side_effect = lambda: locked.append(sack) or True
+            sack_lock.release.side_effect = lambda: locked.remove(sack)
+            return sack_lock
+
+        def truncate(sack_metrics):
+            # Only the sack of the metrics being truncated is locked
+            self.assertEqual(
+                [self.incoming.sack_for_metric(m.id) for m in sack_metrics[:1]],
+                locked)
+            return sack_metrics
+
+        with mock.patch.object(self.index, 'list_metrics', return_value=metrics):
+            with mock.patch.object(self.storage, 'truncate_unaggregated_timeseries',
+                                   side_effect=truncate) as truncate_mock:
+                with mock.patch.object(self.index, 'update_needs_raw_data_truncation_for_metrics'):
+                    with mock.patch.object(self.chef, 'get_sack_lock', side_effect=get_sack_lock):
+                        self.assertEqual(3, self.chef.clean_raw_data_inactive_metrics())
+                        self.assertEqual(3, truncate_mock.call_count)
+                        self.assertEqual([], locked)
+
+    def test_clean_raw_data_inactive_metrics_read_failure(self):
+        metric_mock = mock.Mock()
+        metric_mock.id = mock.Mock(int=1)
+
+        sack_mock = mock.Mock()
+        with mock.patch.object(self.index, 'list_metrics', return_value=[metric_mock]):
+            with mock.patch.object(self.storage, '_get_or_create_unaggregated_timeseries_unbatched',
+                                   side_effect=Exception("boom")):
+                with mock.patch.object(self.index,
+                                       'update_needs_raw_data_truncation_for_metrics') as update_flags_mock:
+                    with mock.patch.object(self.index,
+                                           'update_needs_raw_data_truncation') as update_flag_mock:
+                        with mock.patch.object(self.chef, 'get_sack_lock', return_value=sack_mock):
+                            self.assertEqual(0, self.chef.clean_raw_data_inactive_metrics())
+
+                            self.assertEqual(0, update_flags_mock.call_count)
+                            self.assertEqual(0, update_flag_mock.call_count)
+                            self.assertEqual(1, sack_mock.release.call_count)
+
+    def test_clean_raw_data_inactive_metrics_sack_locked(self):
+        metric_mock = mock.Mock()
+        metric_mock.id = mock.Mock(int=1)
 
-                    list_metrics_mock.assert_has_calls([mock.call(attribute_filter={"==": {
-                        "needs_raw_data_truncation": True}})])
-                    self.assertEqual(3, execute_raw_data_cleanup_mock.call_count)
-                    self.assertEqual(3, get_sack_lock_mock.call_count)
-                    self.assertEqual(3, sack_mock.release.call_count)
+        sack_mock = mock.Mock()
+        sack_mock.acquire.return_value = False
+        with mock.patch.object(self.index, 'list_metrics', return_value=[metric_mock]):
+            with mock.patch.object(self.storage, 'truncate_unaggregated_timeseries') as truncate_mock:
+                with mock.patch.object(self.index,
+                                       'update_needs_raw_data_truncation_for_metrics') as update_flag_mock:
+                    with mock.patch.object(self.chef, 'get_sack_lock', return_value=sack_mock):
+                        self.assertEqual(0, self.chef.clean_raw_data_inactive_metrics())
+
+                        self.assertEqual(0, truncate_mock.call_count)
+                        self.assertEqual(0, update_flag_mock.call_count)
+                        self.assertEqual(0, sack_mock.release.call_count)
 
     def test_clean_raw_data_inactive_metrics_no_metrics_to_clean(self):
         with mock.patch.object(self.index, 'list_metrics',
                                return_value=[]) as list_metrics_mock:
-            with mock.patch.object(self.chef, 'execute_raw_data_cleanup') as execute_raw_data_cleanup_mock:
-                self.chef.clean_raw_data_inactive_metrics()
-
-                list_metrics_mock.assert_has_calls([mock.call(attribute_filter={"==": {
-                    "needs_raw_data_truncation": True}})])
-                self.assertEqual(0, execute_raw_data_cleanup_mock.call_count)
+            with mock.patch.object(self.storage, 'truncate_unaggregated_timeseries') as truncate_mock:
+                self.assertEqual(0, self.chef.clean_raw_data_inactive_metrics())
+
+                list_metrics_mock.assert_called_once_with(
+                    attribute_filter={"==": {"needs_raw_data_truncation": True}},
+                    limit=self.chef.RAW_DATA_CLEANUP_PAGE_SIZE,
+                    sorts=["id:asc"])
+                self.assertEqual(0, truncate_mock.call_count)
+
+    def test_clean_raw_data_inactive_metrics_pages(self):
+        apname = str(uuid.uuid4())
+        ap = archive_policy.ArchivePolicy(apname, 2, [(60, 60)])
+        self.index.create_archive_policy(ap)
+        metrics = []
+        for _ in range(5):
+            metric = self.index.create_metric(
+                uuid.uuid4(), str(uuid.uuid4()), apname)
+            self.incoming.add_measures(metric.id, [
+                incoming.Measure(datetime64(2014, 1, 1, 12, minute, 1), 1)
+                for minute in range(5)
+            ])
+            metrics.append(metric)
+        metrics = self.index.list_metrics(
+            attribute_filter={"in": {"id": [m.id for m in metrics]}})
+        self.trigger_processing(metrics)
+
+        self.index.update_archive_policy(
+            apname, ap.definition, back_window=0)
+        self.index.update_backwindow_changed_for_metrics_archive_policy(
+            apname)
+        metrics = self.index.list_metrics(
+            attribute_filter={"in": {"id": [m.id for m in metrics]}})
+
+        with mock.patch.object(chef.Chef, 'RAW_DATA_CLEANUP_PAGE_SIZE', 2):
+            with mock.patch.object(self.index, 'list_metrics', wraps=self.index.list_metrics) as list_metrics:
+                with mock.patch.object(self.storage, 'truncate_unaggregated_timeseries',
+                                       wraps=self.storage.truncate_unaggregated_timeseries) as truncate:
+                    # Other tests may have left metrics to clean behind
+                    self.assertGreaterEqual(self.chef.clean_raw_data_inactive_metrics(), 5)
+
+        self.assertGreaterEqual(list_metrics.call_count, 3)
+        for call in truncate.call_args_list:
+            self.assertLessEqual(len(call[0][0]), 2)
+        self.assertEqual([], self.index.list_metrics(
+            attribute_filter={"and": [
+                {"in": {"id": [m.id for m in metrics]}},
+                {"==": {"needs_raw_data_truncation": True}},
+            ]}))
+        for metric in metrics:
+            self.assertEqual(
+                [(datetime64(2014, 1, 1, 12, 4, 1), 1)],
+                list(carbonara.BoundTimeSerie.unserialize(
+                    self.storage._get_or_create_unaggregated_timeseries(
+                        [metric])[metric], ap.max_block_size, 0)))
 
     def test_execute_raw_data_cleanup(self):
         metric_mock = mock.Mock()
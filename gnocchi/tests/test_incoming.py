@@ -64,3 +64,79 @@ class TestIncomingDriver(tests_base.TestCase):
             ])
         else:
             self.fail("Notification for metric not received")
+
+    def test_add_measures_array(self):
+        measures = numpy.array(
+            [(numpy.datetime64("2014-01-01 12:00:01"), 69),
+             (numpy.datetime64("2014-01-01 12:00:02"), 42)],
+            dtype=incoming.TIMESERIES_ARRAY_DTYPE)
+        self.incoming.add_measures(self.metric.id, measures)
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(numpy.datetime64("2014-01-01 12:00:03"), 4),
+        ])
+        with self.incoming.process_measure_for_metrics(
+                [self.metric.id]) as new_measures:
+            result = numpy.sort(new_measures[self.metric.id],
+                                order="timestamps")
+        self.assertEqual(
+            [numpy.datetime64("2014-01-01 12:00:01"),
+             numpy.datetime64("2014-01-01 12:00:02"),
+             numpy.datetime64("2014-01-01 12:00:03")],
+            list(result['timestamps']))
+        self.assertEqual([69, 42, 4], list(result['values']))
+
+    def test_delete_unprocessed_measures_for_metrics(self):
+        metric2, __ = self._create_metric()
+        metric3, __ = self._create_metric()
+        for m in (self.metric, metric2, metric3):
+            self.incoming.add_measures(m.id, [
+                incoming.Measure(numpy.datetime64("2014-01-01 12:00:01"), 69),
+            ])
+        self.incoming.delete_unprocessed_measures_for_metrics(
+            [self.metric.id, metric2.id])
+        self.incoming.delete_unprocessed_measures_for_metrics([])
+        self.assertFalse(self.incoming.has_unprocessed(self.metric.id))
+        self.assertFalse(self.incoming.has_unprocessed(metric2.id))
+        self.assertTrue(self.incoming.has_unprocessed(metric3.id))
+
+    def test_iter_process_measures_for_sack(self):
+        sack = self.incoming.sack_for_metric(self.metric.id)
+        metric_ids = [self.metric.id]
+        while len(metric_ids) < 3:
+            metric_id = uuid.uuid4()
+            if self.incoming.sack_for_metric(metric_id) == sack:
+                metric_ids.append(metric_id)
+        for i, metric_id in enumerate(metric_ids):
+            self.incoming.add_measures(metric_id, [
+                incoming.Measure(numpy.datetime64("2014-01-01 12:00:01"), i),
+            ])
+            self.incoming.add_measures(metric_id, [
+                incoming.Measure(numpy.datetime64("2014-01-01 12:00:02"), i),
+            ])
+
+        # The measures of a chunk failing to be processed are kept
+        chunks = self.incoming.iter_process_measures_for_sack(
+            sack, max_metrics=2)
+
+        def _fail_processing():
+            with next(chunks) as measures:
+                self.assertEqual(2, len(measures))
+                raise ValueError
+
+        self.assertRaises(ValueError, _fail_processing)
+        for metric_id in metric_ids:
+            self.assertTrue(self.incoming.has_unprocessed(metric_id))
+
+        # Each metric is too big to share a chunk
+        processed = {}
+        for chunk in self.incoming.iter_process_measures_for_sack(
+                sack, max_size=1):
+            with chunk as measures:
+                self.assertEqual(1, len(measures))
+                processed.update(measures)
+        self.assertEqual(set(metric_ids), set(processed))
+        for i, metric_id in enumerate(metric_ids):
+            self.assertEqual([i, i], list(processed[metric_id]['values']))
+            self.assertFalse(self.incoming.has_unprocessed(metric_id))
+        self.assertEqual(
+            [], list(self.incoming.iter_process_measures_for_sack(sack)))
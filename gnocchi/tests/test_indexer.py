@@ -569,6 +569,84 @@ class TestIndexerDriver(tests_base.TestCase):
         r = self.index.get_resource('generic', r1, with_metrics=True)
         self.assertEqual(e1, r.metrics[0].id)
 
+    def test_create_resources(self):
+        r1 = uuid.uuid4()
+        r2 = uuid.uuid4()
+        creator = str(uuid.uuid4())
+        created = self.index.create_resources('generic', creator, [
+            {"id": r1, "metrics": {"foo": {"archive_policy_name": "low"}}},
+            {"id": r2, "original_resource_id": "bar"},
+        ])
+        self.assertEqual([r1, r2], [r.id for r in created])
+        self.assertEqual(["foo"], [m.name for m in created[0].metrics])
+        self.assertEqual([], created[1].metrics)
+        r = self.index.get_resource('generic', r1, with_metrics=True)
+        self.assertEqual(created[0], r)
+        self.assertEqual(str(r1), r.original_resource_id)
+        r = self.index.get_resource('generic', r2)
+        self.assertEqual("bar", r.original_resource_id)
+        self.assertEqual(creator, r.creator)
+        self.assertEqual([], self.index.create_resources(
+            'generic', creator, []))
+
+    def test_create_resources_already_exists(self):
+        r1 = uuid.uuid4()
+        r2 = uuid.uuid4()
+        creator = str(uuid.uuid4())
+        self.index.create_resource('generic', r2, creator)
+        self.assertRaises(indexer.ResourceAlreadyExists,
+                          self.index.create_resources,
+                          'generic', creator, [{"id": r1}, {"id": r2}])
+        self.assertIsNone(self.index.get_resource('generic', r1))
+
+    def test_append_metrics_to_resources(self):
+        r1 = uuid.uuid4()
+        r2 = uuid.uuid4()
+        e1 = uuid.uuid4()
+        creator = str(uuid.uuid4())
+        self.index.create_metric(e1, creator, archive_policy_name="low")
+        self.index.create_resource('generic', r1, creator,
+                                   metrics={'foo': e1})
+        self.index.create_resource('generic', r2, creator)
+        updated = self.index.append_metrics_to_resources('generic', {
+            r1: {'bar': {'archive_policy_name': 'low'}},
+            r2: {'foo': {'archive_policy_name': 'low'}},
+        })
+        self.assertEqual({r1, r2}, set(r.id for r in updated))
+        for rc in updated:
+            r = self.index.get_resource('generic', rc.id, with_metrics=True)
+            self.assertEqual(rc, r)
+        updated = {r.id: r for r in updated}
+        self.assertEqual({'foo', 'bar'},
+                         set(m.name for m in updated[r1].metrics))
+        self.assertEqual(['foo'], [m.name for m in updated[r2].metrics])
+        self.assertEqual([], self.index.append_metrics_to_resources(
+            'generic', {}))
+
+    def test_append_metrics_to_resources_fail(self):
+        r1 = uuid.uuid4()
+        r2 = uuid.uuid4()
+        e1 = uuid.uuid4()
+        creator = str(uuid.uuid4())
+        self.index.create_metric(e1, creator, archive_policy_name="low")
+        self.index.create_resource('generic', r1, creator)
+        self.index.create_resource('generic', r2, creator,
+                                   metrics={'foo': e1})
+        self.assertRaises(indexer.NamedMetricAlreadyExists,
+                          self.index.append_metrics_to_resources,
+                          'generic', {
+                              r1: {'foo': {'archive_policy_name': 'low'}},
+                              r2: {'foo': {'archive_policy_name': 'low'}},
+                          })
+        r = self.index.get_resource('generic', r1, with_metrics=True)
+        self.assertEqual([], r.metrics)
+        self.assertRaises(indexer.NoSuchResource,
+                          self.index.append_metrics_to_resources,
+                          'generic', {
+                              uuid.uuid4(): {
+                                  'foo': {'archive_policy_name': 'low'}},
+                          })
+
     def test_update_resource_attribute(self):
         mgr = self.index.get_resource_type_schema()
         resource_type = str(uuid.uuid4())
@@ -1223,6 +1301,178 @@ class TestIndexerDriver(tests_base.TestCase):
         metrics = self.index.list_metrics()
         self.assertNotIn(e1, [m.id for m in metrics])
 
+    def test_update_last_measure_timestamp_for_metrics(self):
+        creator = str(uuid.uuid4())
+        e1 = uuid.uuid4()
+        e2 = uuid.uuid4()
+        e3 = uuid.uuid4()
+        for e in (e1, e2, e3):
+            self.index.create_metric(e, creator, archive_policy_name="low")
+        before = {m.id: m.last_measure_timestamp
+                  for m in self.index.list_metrics(
+                      attribute_filter={"in": {"id": [e1, e2, e3]}})}
+        self.assertEqual(
+            2, self.index.update_last_measure_timestamp_for_metrics(
+                [e1, e2, uuid.uuid4()]))
+        after = {m.id: m.last_measure_timestamp
+                 for m in self.index.list_metrics(
+                     attribute_filter={"in": {"id": [e1, e2, e3]}})}
+        self.assertGreater(after[e1], before[e1])
+        self.assertGreater(after[e2], before[e2])
+        self.assertEqual(after[e3], before[e3])
+        self.assertEqual(
+            0, self.index.update_last_measure_timestamp_for_metrics([]))
+
+    def test_expunge_metrics(self):
+        creator = str(uuid.uuid4())
+        e1 = uuid.uuid4()
+        e2 = uuid.uuid4()
+        e3 = uuid.uuid4()
+        for e in (e1, e2, e3):
+            self.index.create_metric(e, creator, archive_policy_name="low")
+        self.index.delete_metric(e1)
+        self.index.delete_metric(e2)
+        # Active metrics are not expunged
+        self.assertEqual(
+            2, self.index.expunge_metrics([e1, e2, e3, uuid.uuid4()]))
+        self.assertEqual(0, self.index.expunge_metrics([e1]))
+        self.assertEqual(0, self.index.expunge_metrics([]))
+        self.assertEqual([], self.index.list_metrics(
+            status="delete", attribute_filter={"in": {"id": [e1, e2]}}))
+        self.assertEqual([e3], [m.id for m in self.index.list_metrics(
+            attribute_filter={"in": {"id": [e1, e2, e3]}})])
+
+    def test_update_needs_raw_data_truncation_for_metrics(self):
+        creator = str(uuid.uuid4())
+        e1 = uuid.uuid4()
+        e2 = uuid.uuid4()
+        self.index.create_metric(e1, creator, archive_policy_name="low")
+        self.index.create_metric(e2, creator, archive_policy_name="low")
+        self.assertEqual(
+            2, self.index.update_needs_raw_data_truncation_for_metrics(
+                [e1, e2], True))
+        metrics = self.index.list_metrics(
+            attribute_filter={"==": {"needs_raw_data_truncation": True}})
+        self.assertIn(e1, [m.id for m in metrics])
+        self.assertIn(e2, [m.id for m in metrics])
+        self.assertEqual(
+            1, self.index.update_needs_raw_data_truncation_for_metrics([e1]))
+        metrics = self.index.list_metrics(
+            attribute_filter={"==": {"needs_raw_data_truncation": True}})
+        self.assertNotIn(e1, [m.id for m in metrics])
+        self.assertIn(e2, [m.id for m in metrics])
+
+    def test_get_resources(self):
+        creator = str(uuid.uuid4())
+        r1 = uuid.uuid4()
+        r2 = uuid.uuid4()
+        e1 = uuid.uuid4()
+        self.index.create_metric(e1, creator, archive_policy_name="low")
+        self.index.create_resource('generic', r1, creator,
+                                   metrics={'foo': e1})
+        self.index.create_resource('generic', r2, creator)
+        resources = self.index.get_resources(
+            'generic', [r1, r2, uuid.uuid4()], with_metrics=True)
+        self.assertEqual({r1, r2}, set(r.id for r in resources))
+        resources = {r.id: r for r in resources}
+        self.assertEqual([e1], [m.id for m in resources[r1].metrics])
+        self.assertEqual([], resources[r2].metrics)
+        self.assertEqual([], self.index.get_resources('generic', []))
+
+    def test_list_resources_with_inactive_metrics(self):
+        creator = str(uuid.uuid4())
+        rids = [uuid.uuid4() for i in range(5)]
+        r_active, r_inactive, r_mixed, r_ended, r_no_metric = rids
+        metrics = {}
+        for rid in rids[:4]:
+            metrics[rid] = [uuid.uuid4(), uuid.uuid4()]
+            for e in metrics[rid]:
+                self.index.create_metric(e, creator,
+                                         archive_policy_name="low")
+        self.index.create_resource('generic', r_active, creator, metrics={
+            'foo': metrics[r_active][0], 'bar': metrics[r_active][1]})
+        self.index.create_resource('generic', r_inactive, creator, metrics={
+            'foo': metrics[r_inactive][0], 'bar': metrics[r_inactive][1]})
+        self.index.create_resource('generic', r_mixed, creator, metrics={
+            'foo': metrics[r_mixed][0], 'bar': metrics[r_mixed][1]})
+        self.index.create_resource(
+            'generic', r_ended, creator,
+            ended_at=utils.datetime_utc(2020, 1, 1),
+            started_at=utils.datetime_utc(2019, 1, 1),
+            metrics={'foo': metrics[r_ended][0],
+                     'bar': metrics[r_ended][1]})
+        self.index.create_resource('generic', r_no_metric, creator)
+        # A deleted metric is not taken into account
+        self.index.delete_metric(metrics[r_inactive][1])
+
+        inactive_before = utils.utcnow()
+        self.index.update_last_measure_timestamp_for_metrics(
+            metrics[r_active] + [metrics[r_mixed][0]])
+
+        resources = [r for r in self.index.list_resources_with_inactive_metrics(
+            inactive_before) if r[0] in rids]
+        self.assertEqual([(r_inactive, "generic")], resources)
+
+        resources = [r for r in self.index.list_resources_with_inactive_metrics(
+            utils.utcnow() + datetime.timedelta(hours=1)) if r[0] in rids]
+        self.assertEqual(sorted([(r_active, "generic"),
+                                 (r_inactive, "generic"),
+                                 (r_mixed, "generic")]), resources)
+
+        # Pagination
+        resources = self.index.list_resources_with_inactive_metrics(
+            utils.utcnow() + datetime.timedelta(hours=1), limit=2)
+        self.assertEqual(2, len(resources))
+        next_resources = self.index.list_resources_with_inactive_metrics(
+            utils.utcnow() + datetime.timedelta(hours=1), limit=2,
+            marker=resources[1][0])
+        self.assertTrue(all(r[0] > resources[1][0] for r in next_resources))
+
+    def test_end_resources(self):
+        mgr = self.index.get_resource_type_schema()
+        resource_type = str(uuid.uuid4())
+        self.index.create_resource_type(mgr.resource_type_from_dict(
+            resource_type, {"col1": {"type": "string", "required": True,
+                                     "min_length": 2, "max_length": 15}},
+            'creating'))
+        creator = str(uuid.uuid4())
+        r1 = uuid.uuid4()
+        r2 = uuid.uuid4()
+        r3 = uuid.uuid4()
+        self.index.create_resource(resource_type, r1, creator, col1="foo")
+        self.index.create_resource('generic', r2, creator)
+        already_ended = utils.datetime_utc(2020, 1, 1)
+        self.index.create_resource(
+            'generic', r3, creator, started_at=utils.datetime_utc(2019, 1, 1),
+            ended_at=already_ended)
+
+        ended_at = utils.utcnow()
+        self.assertEqual(2, self.index.end_resources(
+            [(r1, resource_type), (r2, "generic"), (r3, "generic"),
+             (uuid.uuid4(), "generic")], ended_at))
+        self.assertEqual(0, self.index.end_resources([], ended_at))
+
+        r = self.index.get_resource(resource_type, r1)
+        self.assertEqual(ended_at, r.ended_at)
+        self.assertEqual("foo", r.col1)
+        self.assertEqual(ended_at, self.index.get_resource(
+            'generic', r2).ended_at)
+        self.assertEqual(already_ended, self.index.get_resource(
+            'generic', r3).ended_at)
+
+        history = self.index.list_resources(
+            resource_type, {"=": {"id": r1}}, history=True,
+            sorts=['revision_start:asc'])
+        self.assertEqual(2, len(history))
+        self.assertIsNone(history[0].ended_at)
+        self.assertEqual("foo", history[0].col1)
+        self.assertEqual(history[1].revision_start, history[0].revision_end)
+        self.assertEqual(ended_at, history[1].ended_at)
+        self.assertEqual(2, len(self.index.list_resources(
+            'generic', {"=": {"id": r2}}, history=True)))
+        self.assertEqual(1, len(self.index.list_resources(
+            'generic', {"=": {"id": r3}}, history=True)))
+
     def test_resource_type_crud(self):
         mgr = self.index.get_resource_type_schema()
         rtype = mgr.resource_type_from_dict("indexer_test", {
@@ -13,6 +13,7 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import fixtures
 import numpy
 import pyparsing
 
@@ -37,7 +38,7 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
                'usage_guest_nice': 0.0,
                'usage_irq': 0.0,
                'usage_system': 11.1},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('cpu,cpu=cpu-total,host=abydos usage_idle=79.2198049512378,usage_nice=0,usage_iowait=0,usage_steal=0,usage_guest=0,usage_guest_nice=0,usage_system=9.202300575143786,usage_irq=0,usage_softirq=0,usage_user=11.577894473618404 1510150170000000000',  # noqa
              ['cpu',
               {'cpu': 'cpu-total',
@@ -52,7 +53,7 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
                'usage_steal': 0.0,
                'usage_system': 9.202300575143786,
                'usage_user': 11.577894473618404},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('diskio,name=disk0,host=abydos io_time=11020501i,iops_in_progress=0i,read_bytes=413847966208i,read_time=9816308i,write_time=1204193i,weighted_io_time=0i,reads=33523907i,writes=7321123i,write_bytes=141510539264i 1510150170000000000',  # noqa
              ['diskio',
               {'host': 'abydos',
@@ -66,7 +67,7 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
                'write_bytes': 141510539264,
                'write_time': 1204193,
                'writes': 7321123},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('disk,path=/,device=disk1s1,fstype=apfs,host=abydos total=250140434432i,free=28950695936i,used=216213557248i,used_percent=88.19130621205531,inodes_total=9223372036854775807i,inodes_free=9223372036850748963i,inodes_used=4026844i 1510150170000000000',  # noqa
              ['disk',
               {'device': 'disk1s1', 'fstype': 'apfs',
@@ -78,7 +79,7 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
                'total': 250140434432,
                'used': 216213557248,
                'used_percent': 88.19130621205531},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('mem,host=abydos free=16195584i,available_percent=24.886322021484375,used=6452215808i,cached=0i,buffered=0i,active=2122153984i,inactive=2121523200i,used_percent=75.11367797851562,total=8589934592i,available=2137718784i 1510150170000000000',  # noqa
              ['mem',
               {'host': 'abydos'},
@@ -92,7 +93,7 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
                'total': 8589934592,
                'used': 6452215808,
                'used_percent': 75.11367797851562},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('disk,path=/private/var/vm,device=disk1s4,fstype=apfs,host=abydos inodes_total=9223372036854775807i,inodes_free=9223372036854775803i,inodes_used=4i,total=250140434432i,free=28950695936i,used=4296265728i,used_percent=12.922280752806417 1510150170000000000',  # noqa
              ['disk',
               {'device': 'disk1s4',
@@ -106,7 +107,7 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
                'total': 250140434432,
                'used': 4296265728,
                'used_percent': 12.922280752806417},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('swap,host=abydos used=2689073152i,free=532152320i,used_percent=83.47981770833334,total=3221225472i 1510150170000000000',  # noqa
              ['swap',
               {'host': 'abydos'},
@@ -114,12 +115,12 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
                'total': 3221225472,
                'used': 2689073152,
                'used_percent': 83.47981770833334},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('swap,host=abydos in=0i,out=0i 1510150170000000000',
              ['swap',
               {'host': 'abydos'},
               {'in': 0, 'out': 0},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('processes,host=abydos stopped=0i,running=2i,sleeping=379i,total=382i,unknown=0i,idle=0i,blocked=1i,zombies=0i 1510150170000000000',  # noqa
              ['processes',
               {'host': 'abydos'},
@@ -131,7 +132,7 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
                'total': 382,
                'unknown': 0,
                'zombies': 0},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('system,host=abydos load5=3.02,load15=3.31,n_users=1i,n_cpus=4i,load1=2.18 1510150170000000000',  # noqa
              ['system',
               {'host': 'abydos'},
@@ -140,21 +141,21 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
                'load5': 3.02,
                'n_cpus': 4,
                'n_users': 1},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('system,host=abydos uptime=337369i,uptime_format="3 days, 21:42" 1510150170000000000',  # noqa
              ['system',
               {'host': 'abydos'},
               {'uptime': 337369, 'uptime_format': '3 days, 21:42'},
-              numpy.datetime64('2017-11-08T14:09:30.000000000')]),
+              1510150170000000000]),
             ('notag up=1 123234',
              ['notag',
               {},
               {'up': 1.0},
-              numpy.datetime64('1970-01-01T00:00:00.000123234')]),
+              123234]),
             ('notag up=3 ', ['notag', {}, {'up': 3.0}, None]),
         )
         for line, result in lines:
-            parsed = list(influxdb.line_protocol.parseString(line))
+            parsed = list(influxdb.parse_line(line))
             self.assertEqual(result, parsed)
 
     def test_line_protocol_parser_fail(self):
@@ -166,12 +167,67 @@ class TestInfluxDBLineProtocol(base.BaseTestCase):
             "measurement,tag=value 123",
             ",tag=value 123",
             "foobar,tag=value field=string 123",
+            "foobar,tag=value field=12i3 123",
+            "foobar,tag=value field=1 123 456",
+            "foobar,tag=value field=1 12a",
+            "foobar,tag=value field=1 1_000",
+            "foobar,tag=value field=1 -123",
+            "foobar,tag=value field=\"string\" -123",
+            "foobar,tag=value field=\"unterminated 123",
+            "foobar,tag field=1 123",
+            "foobar field=1,",
+            "foobar  field=1",
+            "",
         )
         for line in lines:
-            self.assertRaises(pyparsing.ParseException,
-                              influxdb.line_protocol.parseString,
+            self.assertRaises(influxdb.LineProtocolError,
+                              influxdb.parse_line,
                               line)
 
+    def test_line_protocol_parser_escapes_and_types(self):
+        lines = (
+            ('my\\ measure\\,ment,t\\=ag=v\\ al\\,ue f\\ ield=1',
+             ['my measure,ment', {'t=ag': 'v al,ue'}, {'f ield': 1.0},
+              None]),
+            ('"quoted meas",tag="a \\"value\\"" field=-1.5e3 1',
+             ['quoted meas', {'tag': 'a "value"'}, {'field': -1500.0}, 1]),
+            ('m s="a \\"str\\", x=1",i=-12i,u=12u,b=true,c=F,d=.5 2',
+             ['m', {},
+              {'s': 'a "str", x=1', 'i': -12, 'u': 12,
+               'b': True, 'c': False, 'd': 0.5},
+              2]),
+            ('back\\slash,tag=a\\b field=1  ',
+             ['back\\slash', {'tag': 'a\\b'}, {'field': 1.0}, None]),
+        )
+        for line, result in lines:
+            parsed = list(influxdb.parse_line(line))
+            self.assertEqual(result, parsed)
+
+    def test_parse_chunk(self):
+        measures = influxdb.InfluxDBController._parse_chunk(
+            b"cpu,host=foo,cpu=0 idle=1,user=2i 1000\n"
+            b"\n"
+            b"cpu,cpu=0,host=foo idle=3,state=\"ok\",up=t 2000\n"
+            b"disk,path=/var,host=bar used=4\n",
+            "host", 42)
+        self.assertEqual({"foo", "bar"}, set(measures))
+        self.assertEqual({"cpu.idle@cpu=0", "cpu.user@cpu=0"},
+                         set(measures["foo"]))
+        self.assertEqual(["disk.used@path=_var"], list(measures["bar"]))
+        idle = measures["foo"]["cpu.idle@cpu=0"]
+        self.assertEqual(
+            [numpy.datetime64(1000, 'ns'), numpy.datetime64(2000, 'ns')],
+            list(idle['timestamps']))
+        self.assertEqual([1.0, 3.0], list(idle['values']))
+        used = measures["bar"]["disk.used@path=_var"]
+        self.assertEqual([numpy.datetime64(42, 'ns')],
+                         list(used['timestamps']))
+        self.assertEqual([4.0], list(used['values']))
+
+    def test_benchmark(self):
+        self.useFixture(fixtures.Timeout(300, gentle=True))
+        influxdb.InfluxDBController.benchmark()
+
     def test_query_parser_ok(self):
         lines = (
             "CREATE DATABASE foobar;",
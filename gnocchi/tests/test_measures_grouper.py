@@ -14,6 +14,7 @@ import datetime
 import numpy
 
 from gnocchi.rest.aggregates.api import Grouper
+from gnocchi.rest.aggregates import processor
 from gnocchi.tests import base
 from unittest import mock
 
@@ -21,7 +22,8 @@ from unittest import mock
 RETRIEVE_RESOURCES_HISTORY = \
     "gnocchi.rest.aggregates.api.Grouper.retrieve_resources_history"
 API_AGGREGATE = \
-    "gnocchi.rest.aggregates.api.AggregatesController._get_measures_by_name"
+    "gnocchi.rest.aggregates.api.AggregatesController." \
+    "_get_resources_measures_by_name"
 
 
 class Resource(object):
@@ -78,7 +80,7 @@ class TestScenario(object):
                                None, None)
         history = self.create_test_scenario()
         mock_history.side_effect = history.get_history_as_dict
-        mock_measure.side_effect = get_metric
+        mock_measure.side_effect = get_metrics
         self.execute()
 
     def execute(self):
@@ -92,7 +94,8 @@ class TestScenario(object):
             for out in self.expected_output:
                 if out['group'] == r['group']:
                     for date, val in out['measures'].items():
-                        aggregated = r['measures']['measures']['aggregated']
+                        aggregated = r['measures']['measures'][
+                            'aggregated'].to_list()
                         self.execute_assert(
                             len(aggregated), len(out['measures']))
                         for dat, gran, value in aggregated:
@@ -120,25 +123,28 @@ class TestScenario(object):
         return resource_history
 
 
-def get_metric(*args, **kwargs):
-    start = args[3]
-    end = args[4]
+def get_metrics(resources_and_windows, *args, **kwargs):
+    return [get_metric(start, end)
+            for _, start, end in resources_and_windows]
+
+
+def get_metric(start, end):
     if not end:
         end = numpy.datetime64('2020-03-10T12:00:00Z')
     ts = (start - numpy.datetime64(
         '1970-01-01T00:00:00Z')) / numpy.timedelta64(1, 's')
     current = numpy.datetime64(
         datetime.datetime.utcfromtimestamp(ts - (ts % 3600)))
-    to_return = []
+    timestamps = []
     while current < end:
-        to_return.append((
-            current,
-            numpy.timedelta64(3600000000000, 'ns'),
-            100
-        ))
+        timestamps.append(current)
         current += numpy.timedelta64(3600, 's')
 
-    return {'measures': {'aggregated': to_return}}
+    measures = processor.Measures()
+    measures.add_series(numpy.timedelta64(3600000000000, 'ns'),
+                        numpy.array(timestamps, dtype='datetime64[ns]'),
+                        numpy.full(len(timestamps), 100.0))
+    return {'measures': {'aggregated': measures}}
 
 
 class TestGroupMeasuresWithHistory(base.BaseTestCase):
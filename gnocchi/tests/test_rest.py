@@ -21,6 +21,7 @@ import datetime
 from email import utils as email_utils
 import hashlib
 import json
+import struct
 import unittest
 from unittest import mock
 import uuid
@@ -28,14 +29,18 @@ import uuid
 import fixtures
 import iso8601
 from keystonemiddleware import fixture as ksm_fixture
+import numpy
 import testscenarios
 import webob
 import webtest
 
 import gnocchi
 from gnocchi import archive_policy
+from gnocchi import carbonara
+from gnocchi import indexer
 from gnocchi.rest import api
 from gnocchi.rest import app
+from gnocchi.rest import influxdb
 from gnocchi.tests import base as tests_base
 from gnocchi import utils
 
@@ -504,6 +509,255 @@ class MetricTest(RestTest):
              [u'2013-01-01T23:30:00+00:00', 60.0, 1234.2]],
             result)
 
+    def test_add_measures_mixed_formats(self):
+        ap_name = str(uuid.uuid4())
+        with self.app.use_admin_user():
+            self.app.post_json(
+                "/v1/archive_policy",
+                params={"name": ap_name,
+                        "definition":
+                        [{
+                            "granularity": "1 minute",
+                            "points": 20,
+                        }]},
+                status=201)
+        result = self.app.post_json("/v1/metric",
+                                    params={"archive_policy_name": ap_name})
+        metric = json.loads(result.text)
+        # Epoch timestamps and integer values
+        self.app.post_json(
+            "/v1/metric/%s/measures" % metric['id'],
+            params=[{"timestamp": 1357082903, "value": 1},
+                    {"timestamp": 1357082963.5, "value": 3}],
+            status=202)
+        # ISO timestamps and values of mixed types
+        self.app.post_json(
+            "/v1/metric/%s/measures" % metric['id'],
+            params=[{"timestamp": '2013-01-01 23:30:23', "value": "4.5"},
+                    {"timestamp": '2013-01-01 23:31:23', "value": True},
+                    {"timestamp": '2013-01-01 23:32:23', "value": 2 ** 70}],
+            status=202)
+        for value in (None, [1], [[1]], "foo", {"a": 1}):
+            self.app.post_json(
+                "/v1/metric/%s/measures" % metric['id'],
+                params=[{"timestamp": '2013-01-01 23:33:23', "value": 1},
+                        {"timestamp": '2013-01-01 23:34:23', "value": value}],
+                status=400)
+        self.app.post_json(
+            "/v1/metric/%s/measures" % metric['id'],
+            params=[], status=202)
+
+        ret = self.app.get("/v1/metric/%s/measures" % metric['id'])
+        self.assertEqual(
+            [[u'2013-01-01T23:28:00+00:00', 60.0, 1.0],
+             [u'2013-01-01T23:29:00+00:00', 60.0, 3.0],
+             [u'2013-01-01T23:30:00+00:00', 60.0, 4.5],
+             [u'2013-01-01T23:31:00+00:00', 60.0, 1.0],
+             [u'2013-01-01T23:32:00+00:00', 60.0, float(2 ** 70)]],
+            json.loads(ret.text))
+
+    @staticmethod
+    def _binary_batch_frame(key, measures):
+        return (key + struct.pack("<Q", len(measures)) +
+                numpy.array([(numpy.datetime64(t), v) for t, v in measures],
+                            dtype=carbonara.TIMESERIES_ARRAY_DTYPE).tobytes())
+
+    @staticmethod
+    def _binary_batch_name(name):
+        name = name.encode("utf-8")
+        return struct.pack("<H", len(name)) + name
+
+    def test_add_measures_batch_binary(self):
+        ap_name = str(uuid.uuid4())
+        with self.app.use_admin_user():
+            self.app.post_json(
+                "/v1/archive_policy",
+                params={"name": ap_name,
+                        "definition":
+                        [{
+                            "granularity": "1 minute",
+                            "points": 20,
+                        }]},
+                status=201)
+        metric1 = self.app.post_json(
+            "/v1/metric", params={"archive_policy_name": ap_name}).json
+        metric2 = self.app.post_json(
+            "/v1/metric", params={"archive_policy_name": ap_name}).json
+        body = (
+            self._binary_batch_frame(
+                uuid.UUID(metric1['id']).bytes,
+                [("2013-01-01T23:28:23", 1), ("2013-01-01T23:29:23", 2)]) +
+            self._binary_batch_frame(
+                uuid.UUID(metric2['id']).bytes,
+                [("2013-01-01T23:28:23", 3)]) +
+            self._binary_batch_frame(
+                uuid.UUID(metric1['id']).bytes,
+                [("2013-01-01T23:30:23", 4)]))
+        self.app.post("/v1/batch/metrics/measures", params=body,
+                      content_type=api.MEASURES_BATCH_BINARY, status=202)
+
+        ret = self.app.get("/v1/metric/%s/measures" % metric1['id'])
+        self.assertEqual(
+            [[u'2013-01-01T23:28:00+00:00', 60.0, 1.0],
+             [u'2013-01-01T23:29:00+00:00', 60.0, 2.0],
+             [u'2013-01-01T23:30:00+00:00', 60.0, 4.0]],
+            ret.json)
+        ret = self.app.get("/v1/metric/%s/measures" % metric2['id'])
+        self.assertEqual(
+            [[u'2013-01-01T23:28:00+00:00', 60.0, 3.0]],
+            ret.json)
+
+        # Truncated frame
+        self.app.post("/v1/batch/metrics/measures", params=body[:-1],
+                      content_type=api.MEASURES_BATCH_BINARY, status=400)
+        # Count larger than the frame
+        self.app.post(
+            "/v1/batch/metrics/measures",
+            params=(uuid.UUID(metric1['id']).bytes +
+                    struct.pack("<Q", 2 ** 64 - 1)),
+            content_type=api.MEASURES_BATCH_BINARY, status=400)
+        # Not a Time
+        self.app.post(
+            "/v1/batch/metrics/measures",
+            params=self._binary_batch_frame(
+                uuid.UUID(metric1['id']).bytes, [("NaT", 1)]),
+            content_type=api.MEASURES_BATCH_BINARY, status=400)
+        # Before Epoch
+        self.app.post(
+            "/v1/batch/metrics/measures",
+            params=self._binary_batch_frame(
+                uuid.UUID(metric1['id']).bytes,
+                [("1960-01-01T23:28:23", 1)]),
+            content_type=api.MEASURES_BATCH_BINARY, status=400)
+        # Unknown metric
+        self.app.post(
+            "/v1/batch/metrics/measures",
+            params=self._binary_batch_frame(
+                uuid.uuid4().bytes, [("2013-01-01T23:28:23", 1)]),
+            content_type=api.MEASURES_BATCH_BINARY, status=400)
+
+    def test_add_measures_resources_batch_binary(self):
+        ap_name = str(uuid.uuid4())
+        with self.app.use_admin_user():
+            self.app.post_json(
+                "/v1/archive_policy",
+                params={"name": ap_name,
+                        "definition":
+                        [{
+                            "granularity": "1 minute",
+                            "points": 20,
+                        }]},
+                status=201)
+        resource_id = str(uuid.uuid4())
+        self.app.post_json(
+            "/v1/resource/generic",
+            params={"id": resource_id,
+                    "metrics": {"cpu": {"archive_policy_name": ap_name}}},
+            status=201)
+        body = self._binary_batch_frame(
+            self._binary_batch_name(resource_id) +
+            self._binary_batch_name("cpu"),
+            [("2013-01-01T23:28:23", 1), ("2013-01-01T23:29:23", 2)])
+        self.app.post("/v1/batch/resources/metrics/measures", params=body,
+                      content_type=api.MEASURES_BATCH_BINARY, status=202)
+
+        ret = self.app.get(
+            "/v1/resource/generic/%s/metric/cpu/measures" % resource_id)
+        self.assertEqual(
+            [[u'2013-01-01T23:28:00+00:00', 60.0, 1.0],
+             [u'2013-01-01T23:29:00+00:00', 60.0, 2.0]],
+            ret.json)
+
+        ret = self.app.post(
+            "/v1/batch/resources/metrics/measures",
+            params=self._binary_batch_frame(
+                self._binary_batch_name(resource_id) +
+                self._binary_batch_name("mem"),
+                [("2013-01-01T23:28:23", 1)]),
+            content_type=api.MEASURES_BATCH_BINARY, status=400)
+        self.assertIn("Unknown metrics: %s/mem" % resource_id, ret.text)
+
+    def test_get_measures_etag(self):
+        result = self.app.post_json("/v1/metric",
+                                    params={"archive_policy_name": "low"})
+        metric = json.loads(result.text)
+        self.app.post_json(
+            "/v1/metric/%s/measures" % metric['id'],
+            params=[{"timestamp": '2013-01-01 23:23:23', "value": 1234.2}],
+            status=202)
+
+        url = "/v1/metric/%s/measures" % metric['id']
+        ret = self.app.get(url)
+        etag = ret.headers["ETag"]
+        ret = self.app.get(url, headers={"If-None-Match": etag}, status=304)
+        self.assertEqual(etag, ret.headers["ETag"])
+        self.assertEqual(b"", ret.body)
+        ret = self.app.get(url + "?granularity=300",
+                           headers={"If-None-Match": etag})
+        self.assertNotEqual(etag, ret.headers["ETag"])
+
+        self.app.post_json(
+            "/v1/metric/%s/measures" % metric['id'],
+            params=[{"timestamp": '2013-01-01 23:33:23', "value": 1}],
+            status=202)
+        ret = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertNotEqual(etag, ret.headers["ETag"])
+        self.assertEqual(2, len([m for m in ret.json if m[1] == 300]))
+
+    def test_get_measures_columnar_and_binary(self):
+        ap_name = str(uuid.uuid4())
+        with self.app.use_admin_user():
+            self.app.post_json(
+                "/v1/archive_policy",
+                params={"name": ap_name,
+                        "definition": [
+                            {"granularity": "1 minute", "points": 20},
+                            {"granularity": "1 hour", "points": 20},
+                        ]},
+                status=201)
+        result = self.app.post_json("/v1/metric",
+                                    params={"archive_policy_name": ap_name})
+        metric = json.loads(result.text)
+        self.app.post_json(
+            "/v1/metric/%s/measures" % metric['id'],
+            params=[{"timestamp": '2013-01-01 23:28:23', "value": 1.5},
+                    {"timestamp": '2013-01-01 23:30:23', "value": 2.5}],
+            status=202)
+
+        ret = self.app.get(
+            "/v1/metric/%s/measures?refresh=true" % metric['id'],
+            headers={"Accept": api.MEASURES_COLUMNAR_JSON})
+        self.assertEqual(api.MEASURES_COLUMNAR_JSON, ret.content_type)
+        self.assertEqual([
+            {"granularity": 3600.0,
+             "timestamps": ['2013-01-01T23:00:00+00:00'],
+             "values": [2.0]},
+            {"granularity": 60.0,
+             "timestamps": ['2013-01-01T23:28:00+00:00',
+                            '2013-01-01T23:30:00+00:00'],
+             "values": [1.5, 2.5]},
+        ], json.loads(ret.text))
+
+        ret = self.app.get(
+            "/v1/metric/%s/measures?granularity=60" % metric['id'],
+            headers={"Accept": api.MEASURES_BINARY})
+        self.assertEqual(api.MEASURES_BINARY, ret.content_type)
+        self.assertEqual(
+            struct.pack("<dQ", 60.0, 2)
+            + struct.pack("<2q",
+                          1357082880 * 10 ** 9, 1357083000 * 10 ** 9)
+            + struct.pack("<2d", 1.5, 2.5),
+            ret.body)
+
+        # The default format is still the list of measures
+        ret = self.app.get(
+            "/v1/metric/%s/measures?granularity=60" % metric['id'])
+        self.assertEqual("application/json", ret.content_type)
+        self.assertEqual(
+            [[u'2013-01-01T23:28:00+00:00', 60.0, 1.5],
+             [u'2013-01-01T23:30:00+00:00', 60.0, 2.5]],
+            json.loads(ret.text))
+
     def test_get_measure_with_another_user(self):
         result = self.app.post_json("/v1/metric",
                                     params={"archive_policy_name": "low"})
@@ -1993,6 +2247,326 @@ class AggregatesTest(RestTest):
                               ["2013-01-01T12:00:00+00:00", 300, 12]],
                              measures["mean"])
 
+    def test_get_metric_aggregates_columnar(self):
+        r = self.app.post_json(
+            "/v1/metric",
+            params={"archive_policy_name": "low"},
+            status=201)
+        metric_id = r.json['id']
+        self.app.post_json(
+            f"/v1/metric/{metric_id}/measures",
+            params=[{"timestamp": "2013-01-01 12:00:01",
+                     "value": 8},
+                    {"timestamp": "2013-01-01 12:05:02",
+                     "value": 16}])
+        r = self.app.post_json(
+            "/v1/aggregates?granularity=300",
+            params={"operations": ["metric", metric_id, "mean"]},
+            headers={"Accept": api.MEASURES_COLUMNAR_JSON},
+            status=200)
+        self.assertEqual(api.MEASURES_COLUMNAR_JSON, r.content_type)
+        self.assertEqual({"measures": {metric_id: {"mean": [{
+            "granularity": 300.0,
+            "timestamps": ["2013-01-01T12:00:00+00:00",
+                           "2013-01-01T12:05:00+00:00"],
+            "values": [8.0, 16.0],
+        }]}}}, json.loads(r.text))
+
+    def test_get_aggregates_etag(self):
+        r = self.app.post_json(
+            "/v1/metric",
+            params={"archive_policy_name": "low"},
+            status=201)
+        metric_id = r.json['id']
+        self.app.post_json(
+            f"/v1/metric/{metric_id}/measures",
+            params=[{"timestamp": "2013-01-01 12:00:01", "value": 8}])
+        params = {"operations": ["metric", metric_id, "mean"]}
+        r = self.app.post_json("/v1/aggregates", params=params)
+        etag = r.headers["ETag"]
+        r = self.app.post_json("/v1/aggregates", params=params,
+                               headers={"If-None-Match": etag}, status=304)
+        self.assertEqual(etag, r.headers["ETag"])
+        r = self.app.post_json("/v1/aggregates", params=params,
+                               headers={"If-None-Match": etag,
+                                        "Accept": api.MEASURES_COLUMNAR_JSON})
+        self.assertNotEqual(etag, r.headers["ETag"])
+
+        self.app.post_json(
+            f"/v1/metric/{metric_id}/measures",
+            params=[{"timestamp": "2013-01-01 12:05:01", "value": 16}])
+        r = self.app.post_json("/v1/aggregates", params=params,
+                               headers={"If-None-Match": etag})
+        self.assertNotEqual(etag, r.headers["ETag"])
+
+    def test_get_aggregates_cached(self):
+        self.conf.set_override("driver", "memory", "aggregates_cache")
+        self.app = TestingApp(app.load_app(conf=self.conf,
+                                           not_implemented_middleware=False),
+                              chef=self.chef,
+                              auth_mode=self.auth_mode)
+        rid = str(uuid.uuid4())
+        r = self.app.post_json(
+            "/v1/resource/generic",
+            params={"id": rid,
+                    "metrics": {"disk": {"archive_policy_name": "low"}}})
+        metric_id = r.json['metrics']['disk']
+        self.app.post_json(
+            f"/v1/metric/{metric_id}/measures",
+            params=[{"timestamp": "2013-01-01 12:00:01", "value": 8}])
+
+        by_metric = {"operations": ["metric", metric_id, "mean"]}
+        by_resource = {"operations": ["metric", "disk", "mean"],
+                       "resource_type": "generic",
+                       "search": {"=": {"id": rid}}}
+        for params in (by_metric, by_resource, by_metric, by_resource):
+            r = self.app.post_json(
+                "/v1/aggregates?granularity=300", params=params)
+            self.assertEqual("application/json", r.content_type)
+        self.assertEqual(
+            [["2013-01-01T12:00:00+00:00", 300.0, 8.0]],
+            r.json["measures"][rid]["disk"]["mean"])
+        r = self.app.post_json(
+            "/v1/aggregates?granularity=300", params=by_metric,
+            headers={"Accept": api.MEASURES_COLUMNAR_JSON})
+        self.assertEqual(api.MEASURES_COLUMNAR_JSON, r.content_type)
+
+        # New measures make the cached responses stale
+        self.app.post_json(
+            f"/v1/metric/{metric_id}/measures",
+            params=[{"timestamp": "2013-01-01 12:05:01", "value": 16}])
+        r = self.app.post_json(
+            "/v1/aggregates?granularity=300", params=by_metric)
+        self.assertEqual(
+            [["2013-01-01T12:00:00+00:00", 300.0, 8.0],
+             ["2013-01-01T12:05:00+00:00", 300.0, 16.0]],
+            r.json["measures"][metric_id]["mean"])
+
+        with self.app.use_admin_user():
+            r = self.app.get("/v1/status")
+        statistics = r.json["aggregates_cache"]
+        self.assertEqual(2, statistics["hits"])
+        self.assertEqual(4, statistics["misses"])
+        self.assertEqual(1 / 3, statistics["hit_ratio"])
+        self.assertGreater(statistics["saved_time"], 0)
+
+    def test_get_aggregates_cached_absolute_timestamps_not_rounded(self):
+        self.conf.set_override("driver", "memory", "aggregates_cache")
+        self.conf.set_override("time_bucket", 3600, "aggregates_cache")
+        self.app = TestingApp(app.load_app(conf=self.conf,
+                                           not_implemented_middleware=False),
+                              chef=self.chef,
+                              auth_mode=self.auth_mode)
+        r = self.app.post_json("/v1/metric",
+                               params={"archive_policy_name": "low"})
+        metric_id = r.json['id']
+        self.app.post_json(
+            f"/v1/metric/{metric_id}/measures",
+            params=[{"timestamp": "2013-01-01 12:00:01", "value": 8},
+                    {"timestamp": "2013-01-01 12:05:01", "value": 16}])
+
+        params = {"operations": ["metric", metric_id, "mean"]}
+        r = self.app.post_json(
+            "/v1/aggregates?granularity=300&start=2013-01-01T12:00:00",
+            params=params)
+        self.assertEqual(
+            [["2013-01-01T12:00:00+00:00", 300.0, 8.0],
+             ["2013-01-01T12:05:00+00:00", 300.0, 16.0]],
+            r.json["measures"][metric_id]["mean"])
+        r = self.app.post_json(
+            "/v1/aggregates?granularity=300&start=2013-01-01T12:05:00",
+            params=params)
+        self.assertEqual(
+            [["2013-01-01T12:05:00+00:00", 300.0, 16.0]],
+            r.json["measures"][metric_id]["mean"])
+
+        with self.app.use_admin_user():
+            r = self.app.get("/v1/status")
+        statistics = r.json["aggregates_cache"]
+        self.assertEqual(0, statistics["hits"])
+        self.assertEqual(2, statistics["misses"])
+
+
+@unittest.skipUnless(api.PROMETHEUS_SUPPORTED, "Prometheus not supported")
+class PrometheusTest(RestTest):
+    def setUp(self):
+        super(PrometheusTest, self).setUp()
+        self.prefix = "prom_%s_" % uuid.uuid4().hex
+        rule = "rule-%s" % self.prefix
+        self.index.create_archive_policy_rule(
+            rule, self.prefix + "*", "low")
+        self.addCleanup(self.index.delete_archive_policy_rule, rule)
+
+    def _write(self, timeseries):
+        request = api.remote_pb2.WriteRequest()
+        for (job, instance, name), value in timeseries.items():
+            ts = request.timeseries.add()
+            ts.labels.add(name="__name__", value=self.prefix + name)
+            ts.labels.add(name="job", value=job)
+            ts.labels.add(name="instance", value=instance)
+            ts.samples.add(value=value, timestamp_ms=1506146578000)
+        with self.app.use_admin_user():
+            self.app.post(
+                "/v1/prometheus/write",
+                params=api.snappy.compress(request.SerializeToString()),
+                headers={"Content-Type": "application/x-protobuf"},
+                status=202)
+
+    @staticmethod
+    def _prometheus_calls(get_resources):
+        return [call for call in get_resources.call_args_list
+                if call[0][0] == "prometheus"]
+
+    def _get_metrics(self, job, instance):
+        with self.app.use_admin_user():
+            r = self.app.get(
+                "/v1/resource/prometheus/%s@%s" % (job, instance))
+        return r.json["metrics"]
+
+    def test_write_resources_cache(self):
+        job = str(uuid.uuid4())
+        self._write({(job, "host1", "up"): 1, (job, "host1", "load"): 2.5,
+                     (job, "host2", "up"): 0})
+        self.assertEqual({self.prefix + "up", self.prefix + "load"},
+                         set(self._get_metrics(job, "host1")))
+        self.assertEqual({self.prefix + "up"},
+                         set(self._get_metrics(job, "host2")))
+
+        with mock.patch.object(self.index, "get_resources",
+                               wraps=self.index.get_resources) as get:
+            # Resources are retrieved at once
+            self._write({(job, "host1", "up"): 1, (job, "host2", "up"): 1})
+            calls = self._prometheus_calls(get)
+            self.assertEqual(1, len(calls))
+            self.assertEqual(2, len(calls[0][0][1]))
+            # And then from the cache
+            self._write({(job, "host1", "up"): 1, (job, "host2", "up"): 1})
+            self.assertEqual(1, len(self._prometheus_calls(get)))
+
+        # New metrics are still created
+        self._write({(job, "host2", "load"): 4})
+        self.assertEqual({self.prefix + "up", self.prefix + "load"},
+                         set(self._get_metrics(job, "host2")))
+
+        metric_id = self._get_metrics(job, "host1")[self.prefix + "up"]
+        with self.app.use_admin_user():
+            r = self.app.get("/v1/metric/%s/measures?granularity=300"
+                             % metric_id)
+        self.assertEqual([["2017-09-23T06:00:00+00:00", 300.0, 1.0]],
+                         r.json)
+
+    def test_write_resources_created_in_bulk(self):
+        # Make sure the resource type exists
+        self._write({(str(uuid.uuid4()), "host1", "up"): 1})
+        job = str(uuid.uuid4())
+        with mock.patch.object(self.index, "create_resources",
+                               wraps=self.index.create_resources) as create, \
+                mock.patch.object(
+                    self.index, "append_metrics_to_resources",
+                    wraps=self.index.append_metrics_to_resources) as append, \
+                mock.patch.object(self.index, "create_resource") as one:
+            self._write({(job, "host1", "up"): 1, (job, "host2", "up"): 0})
+            self.assertEqual(1, create.call_count)
+            self.assertEqual(2, len(create.call_args[0][2]))
+            self._write({(job, "host1", "load"): 1,
+                         (job, "host2", "load"): 2})
+            self.assertEqual(1, append.call_count)
+            self.assertEqual(2, len(append.call_args[0][1]))
+            self.assertEqual(0, one.call_count)
+        for host in ("host1", "host2"):
+            self.assertEqual({self.prefix + "up", self.prefix + "load"},
+                             set(self._get_metrics(job, host)))
+
+    def test_write_resources_created_concurrently(self):
+        job = str(uuid.uuid4())
+        self._write({(job, "host1", "up"): 1})
+        with mock.patch.object(
+                self.index, "create_resources",
+                side_effect=indexer.ResourceAlreadyExists("host2")):
+            self._write({(job, "host2", "up"): 1})
+        self.assertEqual({self.prefix + "up"},
+                         set(self._get_metrics(job, "host2")))
+
+    def test_write_resources_cache_disabled(self):
+        self.conf.set_override("resources_cache_ttl", 0, "api")
+        self.app = TestingApp(app.load_app(conf=self.conf,
+                                           not_implemented_middleware=False),
+                              chef=self.chef,
+                              auth_mode=self.auth_mode)
+        job = str(uuid.uuid4())
+        self._write({(job, "host1", "up"): 1})
+        with mock.patch.object(self.index, "get_resources",
+                               wraps=self.index.get_resources) as get:
+            self._write({(job, "host1", "up"): 1})
+            self._write({(job, "host1", "up"): 1})
+            self.assertEqual(2, len(self._prometheus_calls(get)))
+
+
+class InfluxDBTest(RestTest):
+    def setUp(self):
+        super(InfluxDBTest, self).setUp()
+        self.db = "influxdb_%s" % uuid.uuid4().hex
+        prefix = "influx_%s_" % uuid.uuid4().hex
+        self.measurement = prefix + "cpu"
+        rule = "rule-%s" % prefix
+        self.index.create_archive_policy_rule(rule, prefix + "*", "low")
+        self.addCleanup(self.index.delete_archive_policy_rule, rule)
+        with self.app.use_admin_user():
+            self.app.post("/v1/influxdb/query?q=create+database+" + self.db,
+                          status=204)
+
+    def test_write_chunked_without_uwsgi(self):
+        host = str(uuid.uuid4())
+        body = "".join(
+            "%s,host=%s,cpu=%d idle=%d 150615%04d000000000\n" % (
+                self.measurement, host, i % 2, i, i)
+            for i in range(100)).encode()
+        with mock.patch.object(influxdb.InfluxDBController,
+                               "CHUNK_READ_SIZE", 100):
+            with self.app.use_admin_user():
+                self.app.post(
+                    "/v1/influxdb/write?db=" + self.db,
+                    params=body,
+                    headers={"Content-Type": "text/plain",
+                             "Transfer-Encoding": "chunked"},
+                    extra_environ={"wsgi.input_terminated": True},
+                    status=204)
+                r = self.app.get("/v1/resource/%s/%s" % (self.db, host))
+                metrics = r.json["metrics"]
+                self.assertEqual(
+                    {self.measurement + ".idle@cpu=0",
+                     self.measurement + ".idle@cpu=1"},
+                    set(metrics))
+                r = self.app.get(
+                    "/v1/metric/%s/measures?granularity=300" %
+                    metrics[self.measurement + ".idle@cpu=0"])
+        self.assertEqual([["2017-09-23T07:00:00+00:00", 300.0, 49.0]],
+                         r.json)
+
+    def test_write_invalid_line(self):
+        with self.app.use_admin_user():
+            r = self.app.post(
+                "/v1/influxdb/write?db=" + self.db,
+                params=b"%s,host=foo idle=1\n%s,host=foo idle=foo" % (
+                    self.measurement.encode(), self.measurement.encode()),
+                headers={"Content-Type": "text/plain",
+                         "Accept": "application/json"},
+                status=400)
+        self.assertEqual("Unable to parse line 2",
+                         r.json["description"]["reason"])
+
+    def test_write_before_epoch(self):
+        with self.app.use_admin_user():
+            r = self.app.post(
+                "/v1/influxdb/write?db=" + self.db,
+                params=b"%s,host=foo idle=1 -1000000000" % (
+                    self.measurement.encode()),
+                headers={"Content-Type": "text/plain",
+                         "Accept": "application/json"},
+                status=400)
+        self.assertEqual("Unable to parse line 1",
+                         r.json["description"]["reason"])
+
 
 class QueryStringSearchAttrFilterTest(tests_base.TestCase):
     def _do_test(self, expr, expected):
@@ -2116,6 +2690,22 @@ class TestMeasureQuery(tests_base.TestCase):
         q = api.SearchMetricController.MeasureQuery({})
         self.assertFalse(q(5))
         self.assertFalse(q(10))
+        numpy.testing.assert_array_equal(
+            [False, False], q.mask(numpy.array([5.0, 10.0])))
+
+    def test_mask(self):
+        q = api.SearchMetricController.MeasureQuery(
+            {
+                u"or": [
+                    {u"and": [{u">": 4}, {u"<": 10}]},
+                    {u"=": [{u"/": 0}, float("-inf")]},
+                    {u"=": [{u"%": 5}, 0]},
+                ],
+            }
+        )
+        numpy.testing.assert_array_equal(
+            [True, True, True, True, False, True, False],
+            q.mask(numpy.array([-1.0, 0.0, 5.0, 9.5, 11.0, 15.0, numpy.nan])))
 
     def test_bad_format(self):
         self.assertRaises(api.SearchMetricController.MeasureQuery.InvalidQuery,
@@ -21,6 +21,7 @@ from unittest import mock
 
 from gnocchi import archive_policy
 from gnocchi import carbonara
+from gnocchi import chef
 from gnocchi import incoming
 from gnocchi import indexer
 from gnocchi import storage
@@ -214,6 +215,31 @@ class TestStorageDriver(tests_base.TestCase):
             self.storage._get_or_create_unaggregated_timeseries(
                 [self.metric]))
 
+    def test_delete_metrics(self):
+        metric2, __ = self._create_metric()
+        metric3, __ = self._create_metric()
+        for m in (self.metric, metric2, metric3):
+            self.incoming.add_measures(m.id, [
+                incoming.Measure(datetime64(2014, 1, 1, 12, 0, 1), 69),
+            ])
+        self.trigger_processing([self.metric, metric2, metric3])
+        # A metric without any data can be deleted too
+        metric4, __ = self._create_metric()
+        self.storage.delete_metrics([self.metric, metric2, metric4])
+        self.storage.delete_metrics([])
+
+        aggregations = (
+            self.metric.archive_policy.get_aggregations_for_method("mean")
+        )
+        for m in (self.metric, metric2):
+            self.assertRaises(storage.MetricDoesNotExist,
+                              self.storage.get_aggregated_measures,
+                              {m: aggregations})
+        self.assertIn(
+            (datetime64(2014, 1, 1, 12), numpy.timedelta64(5, 'm'), 69),
+            get_measures_list(self.storage.get_aggregated_measures(
+                {metric3: aggregations})[metric3])["mean"])
+
     def test_measures_reporting_format(self):
         report = self.incoming.measures_report(True)
         self.assertIsInstance(report, dict)
@@ -507,6 +533,56 @@ class TestStorageDriver(tests_base.TestCase):
                 ]}})
         self.assertEqual({m2: {aggregation: [None, None]}}, data)
 
+    def test_list_split_keys_range(self):
+        apname = str(uuid.uuid4())
+        ap = archive_policy.ArchivePolicy(apname, 0, [(36000, 60)])
+        self.index.create_archive_policy(ap)
+        self.metric = indexer.Metric(uuid.uuid4(), ap)
+        self.index.create_metric(self.metric.id, str(uuid.uuid4()),
+                                 apname)
+
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2016, 1, 1, 12, 0, 1), 69),
+            incoming.Measure(datetime64(2016, 1, 2, 13, 7, 31), 42),
+            incoming.Measure(datetime64(2016, 1, 4, 14, 9, 31), 4),
+            incoming.Measure(datetime64(2016, 1, 6, 15, 12, 45), 44),
+        ])
+        self.trigger_processing()
+
+        agg = self.metric.archive_policy.get_aggregation(
+            "mean", numpy.timedelta64(1, 'm'))
+        keys = [carbonara.SplitKey(numpy.datetime64(ts, 's'),
+                                   numpy.timedelta64(1, 'm'))
+                for ts in (1451520000, 1451736000, 1451952000)]
+
+        self.assertEqual({self.metric: {agg: set(keys[1:])}},
+                         self.storage._list_split_keys(
+                             {self.metric: [agg]},
+                             from_timestamp=datetime64(2016, 1, 3)))
+        self.assertEqual({self.metric: {agg: set(keys[:2])}},
+                         self.storage._list_split_keys(
+                             {self.metric: [agg]},
+                             to_timestamp=datetime64(2016, 1, 3)))
+        self.assertEqual({self.metric: {agg: {keys[1]}}},
+                         self.storage._list_split_keys(
+                             {self.metric: [agg]},
+                             from_timestamp=datetime64(2016, 1, 3),
+                             to_timestamp=datetime64(2016, 1, 4)))
+        self.assertEqual({self.metric: {agg: set()}},
+                         self.storage._list_split_keys(
+                             {self.metric: [agg]},
+                             from_timestamp=datetime64(2016, 2, 1)))
+
+        self.assertEqual(
+            ("1451736000.0", "1451736000.0`"),
+            self.storage._sortable_split_keys_range(
+                [agg], datetime64(2016, 1, 3), datetime64(2016, 1, 4)))
+        # Names with less digits do not sort like the keys
+        self.assertEqual(
+            (None, None),
+            self.storage._sortable_split_keys_range(
+                [agg], datetime64(2000, 1, 3), datetime64(2016, 1, 4)))
+
     def test_rewrite_measures(self):
         # Create an archive policy that spans on several splits. Each split
         # being 3600 points, let's go for 36k points so we have 10 splits.
@@ -648,6 +724,439 @@ class TestStorageDriver(tests_base.TestCase):
         ]}, get_measures_list(self.storage.get_aggregated_measures(
             {self.metric: [aggregation]})[self.metric]))
 
+    def test_rewrite_measures_split_format_version(self):
+        apname = str(uuid.uuid4())
+        ap = archive_policy.ArchivePolicy(apname, 0, [(36000, 60)])
+        self.index.create_archive_policy(ap)
+        self.metric = indexer.Metric(uuid.uuid4(), ap)
+        self.index.create_metric(self.metric.id, str(uuid.uuid4()),
+                                 apname)
+
+        # First store some points with the version 3 format
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2016, 1, 1, 12, 0, 1), 69),
+            incoming.Measure(datetime64(2016, 1, 2, 13, 7, 31), 42),
+            incoming.Measure(datetime64(2016, 1, 4, 14, 9, 31), 4),
+            incoming.Measure(datetime64(2016, 1, 6, 15, 12, 45), 44),
+        ])
+        self.trigger_processing()
+
+        aggregation = self.metric.archive_policy.get_aggregation(
+            "mean", numpy.timedelta64(1, 'm'))
+        old_keys = {
+            carbonara.SplitKey(numpy.datetime64(1451520000, 's'),
+                               numpy.timedelta64(1, 'm')),
+            carbonara.SplitKey(numpy.datetime64(1451736000, 's'),
+                               numpy.timedelta64(1, 'm')),
+            carbonara.SplitKey(numpy.datetime64(1451952000, 's'),
+                               numpy.timedelta64(1, 'm')),
+        }
+        new_key = carbonara.SplitKey(numpy.datetime64(1452384000, 's'),
+                                     numpy.timedelta64(1, 'm'))
+
+        self.storage.split_version = 4
+
+        # Version 3 splits are still readable
+        self.assertEqual({"mean": [
+            (datetime64(2016, 1, 1, 12), numpy.timedelta64(1, 'm'), 69),
+            (datetime64(2016, 1, 2, 13, 7), numpy.timedelta64(1, 'm'), 42),
+            (datetime64(2016, 1, 4, 14, 9), numpy.timedelta64(1, 'm'), 4),
+            (datetime64(2016, 1, 6, 15, 12), numpy.timedelta64(1, 'm'), 44),
+        ]}, get_measures_list(self.storage.get_aggregated_measures(
+            {self.metric: [aggregation]})[self.metric]))
+
+        # Move the BoundTimeSerie far away so the read-only splits are
+        # rewritten with the version 4 format.
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2016, 1, 10, 16, 18, 45), 45),
+            incoming.Measure(datetime64(2016, 1, 10, 17, 12, 45), 46),
+        ])
+        self.trigger_processing()
+
+        if self.storage.WRITE_FULL:
+            expected_v4_keys = old_keys | {new_key}
+            expected_v3_keys = set()
+        else:
+            # The mutable split is still written at an offset
+            expected_v4_keys = old_keys
+            expected_v3_keys = {new_key}
+        self.assertEqual(
+            expected_v4_keys,
+            set(self.storage._list_split_keys(
+                {self.metric: [aggregation]}, 4)[self.metric][aggregation]))
+        self.assertEqual(
+            expected_v3_keys,
+            set(self.storage._list_split_keys(
+                {self.metric: [aggregation]}, 3)[self.metric][aggregation]))
+
+        self.assertEqual({"mean": [
+            (datetime64(2016, 1, 1, 12), numpy.timedelta64(1, 'm'), 69),
+            (datetime64(2016, 1, 2, 13, 7), numpy.timedelta64(1, 'm'), 42),
+            (datetime64(2016, 1, 4, 14, 9), numpy.timedelta64(1, 'm'), 4),
+            (datetime64(2016, 1, 6, 15, 12), numpy.timedelta64(1, 'm'), 44),
+            (datetime64(2016, 1, 10, 16, 18), numpy.timedelta64(1, 'm'), 45),
+            (datetime64(2016, 1, 10, 17, 12), numpy.timedelta64(1, 'm'), 46),
+        ]}, get_measures_list(self.storage.get_aggregated_measures(
+            {self.metric: [aggregation]})[self.metric]))
+
+    def test_rewrite_measures_split_format_version_batch_size(self):
+        apname = str(uuid.uuid4())
+        ap = archive_policy.ArchivePolicy(apname, 0, [(36000, 60)],
+                                          ["mean"])
+        self.index.create_archive_policy(ap)
+        self.metric = indexer.Metric(uuid.uuid4(), ap)
+        self.index.create_metric(self.metric.id, str(uuid.uuid4()),
+                                 apname)
+
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2016, 1, 1, 12, 0, 1), 69),
+            incoming.Measure(datetime64(2016, 1, 2, 13, 7, 31), 42),
+            incoming.Measure(datetime64(2016, 1, 4, 14, 9, 31), 4),
+            incoming.Measure(datetime64(2016, 1, 6, 15, 12, 45), 44),
+        ])
+        self.trigger_processing()
+
+        aggregation = self.metric.archive_policy.get_aggregation(
+            "mean", numpy.timedelta64(1, 'm'))
+
+        self.storage.split_version = 4
+        self.storage.split_rewrite_batch_size = 1
+
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2016, 1, 10, 16, 18, 45), 45),
+            incoming.Measure(datetime64(2016, 1, 10, 17, 12, 45), 46),
+        ])
+        self.trigger_processing()
+
+        # Only the oldest legacy split has been rewritten lazily
+        self.assertIn(
+            carbonara.SplitKey(numpy.datetime64(1451520000, 's'),
+                               numpy.timedelta64(1, 'm')),
+            set(self.storage._list_split_keys(
+                {self.metric: [aggregation]}, 4)[self.metric][aggregation]))
+        self.assertIn(
+            carbonara.SplitKey(numpy.datetime64(1451736000, 's'),
+                               numpy.timedelta64(1, 'm')),
+            set(self.storage._list_split_keys(
+                {self.metric: [aggregation]}, 3)[self.metric][aggregation]))
+
+        self.assertEqual({"mean": [
+            (datetime64(2016, 1, 1, 12), numpy.timedelta64(1, 'm'), 69),
+            (datetime64(2016, 1, 2, 13, 7), numpy.timedelta64(1, 'm'), 42),
+            (datetime64(2016, 1, 4, 14, 9), numpy.timedelta64(1, 'm'), 4),
+            (datetime64(2016, 1, 6, 15, 12), numpy.timedelta64(1, 'm'), 44),
+            (datetime64(2016, 1, 10, 16, 18), numpy.timedelta64(1, 'm'), 45),
+            (datetime64(2016, 1, 10, 17, 12), numpy.timedelta64(1, 'm'), 46),
+        ]}, get_measures_list(self.storage.get_aggregated_measures(
+            {self.metric: [aggregation]})[self.metric]))
+
+    def test_split_cache(self):
+        apname = str(uuid.uuid4())
+        ap = archive_policy.ArchivePolicy(apname, 0, [(36000, 60)])
+        self.index.create_archive_policy(ap)
+        self.metric = indexer.Metric(uuid.uuid4(), ap)
+        self.index.create_metric(self.metric.id, str(uuid.uuid4()),
+                                 apname)
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2016, 1, 1, 12, 0, 1), 69),
+            incoming.Measure(datetime64(2016, 1, 2, 13, 7, 31), 42),
+            incoming.Measure(datetime64(2016, 1, 4, 14, 9, 31), 4),
+            incoming.Measure(datetime64(2016, 1, 6, 15, 12, 45), 44),
+        ])
+        self.trigger_processing()
+
+        self.conf.set_override('split_cache_size', 1, 'storage')
+        driver = storage.get_driver(self.conf)
+        aggregation = self.metric.archive_policy.get_aggregation(
+            "mean", numpy.timedelta64(1, 'm'))
+        expected = {"mean": [
+            (datetime64(2016, 1, 1, 12), numpy.timedelta64(1, 'm'), 69),
+            (datetime64(2016, 1, 2, 13, 7), numpy.timedelta64(1, 'm'), 42),
+            (datetime64(2016, 1, 4, 14, 9), numpy.timedelta64(1, 'm'), 4),
+            (datetime64(2016, 1, 6, 15, 12), numpy.timedelta64(1, 'm'), 44),
+        ]}
+
+        self.assertEqual(expected, get_measures_list(
+            driver.get_aggregated_measures(
+                {self.metric: [aggregation]})[self.metric]))
+        self.assertEqual(0, driver.statistics["split cache hits"])
+        self.assertEqual(3, driver.statistics["split cache misses"])
+
+        # The last split is still mutable so it is never cached
+        self.assertEqual(expected, get_measures_list(
+            driver.get_aggregated_measures(
+                {self.metric: [aggregation]})[self.metric]))
+        self.assertEqual(2, driver.statistics["split cache hits"])
+        self.assertEqual(4, driver.statistics["split cache misses"])
+
+        driver._delete_metric_splits_of_any_version({self.metric: [(
+            carbonara.SplitKey(numpy.datetime64(1451520000, 's'),
+                               numpy.timedelta64(1, 'm')),
+            aggregation, 3)]})
+        self.assertEqual(expected["mean"][1:], get_measures_list(
+            driver.get_aggregated_measures(
+                {self.metric: [aggregation]})[self.metric])["mean"])
+        self.assertEqual(3, driver.statistics["split cache hits"])
+        self.assertEqual(5, driver.statistics["split cache misses"])
+
+        driver.delete_metric(self.metric)
+        self.assertEqual(0, len(driver._split_cache))
+
+    def test_unaggregated_timeseries_generation(self):
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 0, 1), 69),
+        ])
+        self.trigger_processing()
+        data = self.storage._get_or_create_unaggregated_timeseries(
+            [self.metric])[self.metric]
+        generation = self.storage._get_unaggregated_timeseries_generations(
+            [self.metric])[self.metric]
+        self.assertIsNotNone(generation)
+        # Storing the same content again must change the generation
+        self.storage._store_unaggregated_timeseries([(self.metric, data)])
+        self.assertNotEqual(
+            generation,
+            self.storage._get_unaggregated_timeseries_generations(
+                [self.metric])[self.metric])
+
+    def test_bound_timeserie_cache(self):
+        self.storage.enable_bound_timeserie_cache(1)
+        self.addCleanup(self.storage.enable_bound_timeserie_cache, 0)
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 0, 1), 69),
+        ])
+        self.trigger_processing()
+        self.assertEqual(0, self.storage.statistics[
+            "bound timeserie cache hits"])
+        self.assertEqual(1, self.storage.statistics[
+            "bound timeserie cache misses"])
+        self.assertEqual(1, self.storage.statistics["raw measures fetch"])
+
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 7, 31), 42),
+        ])
+        self.trigger_processing()
+        self.assertEqual(1, self.storage.statistics[
+            "bound timeserie cache hits"])
+        self.assertEqual(1, self.storage.statistics["raw measures fetch"])
+
+        # Another worker stores the timeserie: the cached one is outdated
+        raw = self.storage._get_or_create_unaggregated_timeseries(
+            [self.metric])[self.metric]
+        storage.get_driver(self.conf)._store_unaggregated_timeseries(
+            [(self.metric, raw)])
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 9, 31), 4),
+        ])
+        self.trigger_processing()
+        self.assertEqual(1, self.storage.statistics[
+            "bound timeserie cache hits"])
+        self.assertEqual(2, self.storage.statistics[
+            "bound timeserie cache misses"])
+        self.assertEqual(2, self.storage.statistics["raw measures fetch"])
+
+        self.storage.clear_bound_timeserie_cache()
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 12, 45), 44),
+        ])
+        self.trigger_processing()
+        self.assertEqual(3, self.storage.statistics["raw measures fetch"])
+
+        aggregation = self.metric.archive_policy.get_aggregation(
+            "mean", numpy.timedelta64(5, 'm'))
+        self.assertEqual({"mean": [
+            (datetime64(2014, 1, 1, 12), numpy.timedelta64(5, 'm'), 69),
+            (datetime64(2014, 1, 1, 12, 5), numpy.timedelta64(5, 'm'), 23),
+            (datetime64(2014, 1, 1, 12, 10), numpy.timedelta64(5, 'm'), 44),
+        ]}, get_measures_list(self.storage.get_aggregated_measures(
+            {self.metric: [aggregation]})[self.metric]))
+
+    def test_unaggregated_segments(self):
+        apname = str(uuid.uuid4())
+        ap = archive_policy.ArchivePolicy(apname, 2, [(60, 60)])
+        self.index.create_archive_policy(ap)
+        self.metric = indexer.Metric(uuid.uuid4(), ap)
+        self.index.create_metric(self.metric.id, str(uuid.uuid4()),
+                                 apname)
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 0, 1), 69),
+            incoming.Measure(datetime64(2014, 1, 1, 12, 1, 5), 42),
+            incoming.Measure(datetime64(2014, 1, 1, 12, 2, 10), 4),
+        ])
+        # Store the unaggregated timeserie as one object first
+        self.trigger_processing()
+
+        self.conf.set_override('unaggregated_segments', True, 'storage')
+        driver = storage.get_driver(self.conf)
+        if self.conf.storage.driver == 'redis':
+            driver.STORAGE_PREFIX = self.storage.STORAGE_PREFIX
+        self.chef = chef.Chef(self.coord, self.incoming, self.index, driver)
+        segments = [datetime64(2014, 1, 1, 12, minute) for minute in (0, 1)]
+
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 2, 20), 8),
+        ])
+        with mock.patch.object(
+                driver, '_store_unaggregated_timeseries_segments',
+                wraps=driver._store_unaggregated_timeseries_segments) as store:
+            # Reading the timeserie stored as one object does not write
+            driver.get_raw_measures({self.metric: []})
+            self.assertEqual(0, store.call_count)
+            self.trigger_processing()
+        head, listed_segments = driver._unpack_unaggregated_timeserie(
+            driver._get_or_create_unaggregated_timeseries(
+                [self.metric])[self.metric])
+        self.assertEqual(segments, listed_segments)
+        self.assertEqual(
+            [(datetime64(2014, 1, 1, 12, 2, 10), 4),
+             (datetime64(2014, 1, 1, 12, 2, 20), 8)],
+            list(carbonara.BoundTimeSerie.unserialize(
+                head, ap.max_block_size, ap.back_window)))
+        stored_segments = driver._get_unaggregated_timeseries_segments(
+            {self.metric: segments})[self.metric]
+        self.assertEqual(2, len(stored_segments))
+        self.assertTrue(all(stored_segments.values()))
+
+        # A late measure rewrites its segment and a new block drops the
+        # oldest one
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, 1, 30), 44),
+            incoming.Measure(datetime64(2014, 1, 1, 12, 3, 1), 2),
+        ])
+        self.trigger_processing()
+        stored_segments = driver._get_unaggregated_timeseries_segments(
+            {self.metric: segments})[self.metric]
+        self.assertIsNone(stored_segments[segments[0]])
+        self.assertEqual(
+            [(datetime64(2014, 1, 1, 12, 1, 5), 42),
+             (datetime64(2014, 1, 1, 12, 1, 30), 44),
+             (datetime64(2014, 1, 1, 12, 2, 10), 4),
+             (datetime64(2014, 1, 1, 12, 2, 20), 8),
+             (datetime64(2014, 1, 1, 12, 3, 1), 2)],
+            list(driver.get_raw_measures({self.metric: []})[self.metric].ts))
+
+        aggregation = ap.get_aggregation("mean", numpy.timedelta64(1, 'm'))
+        self.assertEqual({"mean": [
+            (datetime64(2014, 1, 1, 12), numpy.timedelta64(1, 'm'), 69),
+            (datetime64(2014, 1, 1, 12, 1), numpy.timedelta64(1, 'm'), 43),
+            (datetime64(2014, 1, 1, 12, 2), numpy.timedelta64(1, 'm'), 6),
+            (datetime64(2014, 1, 1, 12, 3), numpy.timedelta64(1, 'm'), 2),
+        ]}, get_measures_list(driver.get_aggregated_measures(
+            {self.metric: [aggregation]})[self.metric]))
+
+    def _get_segmented_driver(self):
+        self.conf.set_override('unaggregated_segments', True, 'storage')
+        driver = storage.get_driver(self.conf)
+        self.conf.set_override('unaggregated_segments', False, 'storage')
+        if self.conf.storage.driver == 'redis':
+            driver.STORAGE_PREFIX = self.storage.STORAGE_PREFIX
+        return driver
+
+    def _create_segmented_metric(self, driver):
+        apname = str(uuid.uuid4())
+        ap = archive_policy.ArchivePolicy(apname, 2, [(60, 60)])
+        self.index.create_archive_policy(ap)
+        self.metric = indexer.Metric(uuid.uuid4(), ap)
+        self.index.create_metric(self.metric.id, str(uuid.uuid4()),
+                                 apname)
+        driver.add_measures_to_metrics({self.metric: carbonara.make_timeseries(
+            [datetime64(2014, 1, 1, 12, minute, 1) for minute in range(3)],
+            [1, 2, 3])}, self.index)
+        return ap
+
+    def test_unaggregated_segments_disabled(self):
+        driver = self._get_segmented_driver()
+        ap = self._create_segmented_metric(driver)
+        segments = [datetime64(2014, 1, 1, 12, minute) for minute in (0, 1)]
+        self.assertTrue(all(driver._get_unaggregated_timeseries_segments(
+            {self.metric: segments})[self.metric].values()))
+
+        # The segments are still read when the option is disabled, and
+        # deleted once the timeserie is stored as one object
+        self.storage.add_measures_to_metrics({
+            self.metric: carbonara.make_timeseries(
+                [datetime64(2014, 1, 1, 12, 2, 30)], [4])}, self.index)
+        data = self.storage._get_or_create_unaggregated_timeseries(
+            [self.metric])[self.metric]
+        self.assertFalse(self.storage._is_segmented_head(data))
+        self.assertEqual(
+            [(datetime64(2014, 1, 1, 12, minute, second), value)
+             for minute, second, value in ((0, 1, 1), (1, 1, 2), (2, 1, 3),
+                                           (2, 30, 4))],
+            list(carbonara.BoundTimeSerie.unserialize(
+                data, ap.max_block_size, ap.back_window)))
+        self.assertFalse(any(driver._get_unaggregated_timeseries_segments(
+            {self.metric: segments})[self.metric].values()))
+
+    def test_unaggregated_segments_store_failure(self):
+        driver = self._get_segmented_driver()
+        self._create_segmented_metric(driver)
+        head = driver._get_or_create_unaggregated_timeseries(
+            [self.metric])[self.metric]
+        with mock.patch.object(
+                driver, '_store_unaggregated_timeserie_segment_unbatched',
+                side_effect=Exception("boom")):
+            self.assertRaises(
+                Exception, driver.add_measures_to_metrics,
+                {self.metric: carbonara.make_timeseries(
+                    [datetime64(2014, 1, 1, 12, 1, 30),
+                     datetime64(2014, 1, 1, 12, 2, 30)], [5, 6])},
+                self.index)
+        # The head listing the segments has not been stored
+        self.assertEqual(head, driver._get_or_create_unaggregated_timeseries(
+            [self.metric])[self.metric])
+
+    def test_unaggregated_segments_missing(self):
+        driver = self._get_segmented_driver()
+        self._create_segmented_metric(driver)
+        driver._delete_unaggregated_timeseries_segments(
+            {self.metric: [datetime64(2014, 1, 1, 12, 1)]})
+        self.assertRaises(storage.UnaggregatedSegmentMissing,
+                          driver.get_raw_measures, {self.metric: []})
+        self.assertRaises(storage.UnaggregatedSegmentMissing,
+                          self.storage.get_raw_measures, {self.metric: []})
+
+    def test_truncate_unaggregated_timeseries(self):
+        apname = str(uuid.uuid4())
+        ap = archive_policy.ArchivePolicy(apname, 2, [(60, 60)])
+        self.index.create_archive_policy(ap)
+        self.metric = indexer.Metric(uuid.uuid4(), ap)
+        self.index.create_metric(self.metric.id, str(uuid.uuid4()),
+                                 apname)
+        self.incoming.add_measures(self.metric.id, [
+            incoming.Measure(datetime64(2014, 1, 1, 12, minute, 1), minute)
+            for minute in range(4)
+        ])
+        self.trigger_processing()
+        empty = indexer.Metric(uuid.uuid4(), ap)
+
+        ap.back_window = 1
+        self.assertEqual([self.metric],
+                         self.storage.truncate_unaggregated_timeseries(
+                             [self.metric, empty]))
+        self.assertEqual(
+            [(datetime64(2014, 1, 1, 12, 2, 1), 2),
+             (datetime64(2014, 1, 1, 12, 3, 1), 3)],
+            list(carbonara.BoundTimeSerie.unserialize(
+                self.storage._get_or_create_unaggregated_timeseries(
+                    [self.metric])[self.metric],
+                ap.max_block_size, ap.back_window)))
+
+        self.conf.set_override('unaggregated_segments', True, 'storage')
+        driver = storage.get_driver(self.conf)
+        if self.conf.storage.driver == 'redis':
+            driver.STORAGE_PREFIX = self.storage.STORAGE_PREFIX
+        ap.back_window = 0
+        self.assertEqual([self.metric],
+                         driver.truncate_unaggregated_timeseries(
+                             [self.metric]))
+        self.assertEqual(
+            [(datetime64(2014, 1, 1, 12, 3, 1), 3)],
+            list(driver.get_raw_measures({self.metric: []})[self.metric].ts))
+        self.assertIsNone(driver._get_unaggregated_timeseries_segments(
+            {self.metric: [datetime64(2014, 1, 1, 12, 2)]}
+        )[self.metric][datetime64(2014, 1, 1, 12, 2)])
+
     def test_rewrite_measures_multiple_granularities(self):
         apname = str(uuid.uuid4())
         # Create an archive policy with two different granularities
@@ -1239,6 +1748,50 @@ class TestStorageDriver(tests_base.TestCase):
                           datetime64(2015, 1, 1),
                           resample=numpy.timedelta64(1, 'h'))
 
+    def test_add_measures_to_metrics_vectorized(self):
+        apname = str(uuid.uuid4())
+        ap = archive_policy.ArchivePolicy(
+            apname, 1, [
+                archive_policy.ArchivePolicyItem(
+                    granularity=numpy.timedelta64(1, 'm'), points=60),
+                archive_policy.ArchivePolicyItem(
+                    granularity=numpy.timedelta64(5, 'm'), points=12),
+            ], ["*"])
+        self.index.create_archive_policy(ap)
+        self.archive_policies[ap.name] = ap
+
+        rng = numpy.random.default_rng(42)
+        pairs = []
+        for ap_name in (apname, apname, "low", "high"):
+            pairs.append((self._create_metric(ap_name)[0],
+                          self._create_metric(ap_name)[0]))
+
+        for start in (datetime64(2014, 1, 1, 12), datetime64(2014, 1, 1, 13)):
+            measures = {}
+            for metric, _ in pairs:
+                offsets = numpy.unique(rng.integers(0, 3600, 50))
+                measures[metric] = carbonara.make_timeseries(
+                    start + offsets.astype('timedelta64[s]'),
+                    rng.normal(size=len(offsets)))
+                # Make sure there are some measures in the past too
+                measures[metric] = numpy.concatenate(
+                    (measures[metric][::2], measures[metric][1::2]))
+            self.storage.add_measures_to_metrics(
+                {m: measures[m] for m, _ in pairs}, self.index)
+            self.storage.add_measures_to_metrics(
+                {m: measures[ref] for ref, m in pairs}, self.index,
+                vectorized=True)
+
+        for ref, m in pairs:
+            aggregations = ref.archive_policy.aggregations
+            expected = self.storage.get_aggregated_measures(
+                {ref: aggregations})[ref]
+            result = self.storage.get_aggregated_measures(
+                {m: aggregations})[m]
+            for aggregation in aggregations:
+                self.assertEqual(expected[aggregation], result[aggregation],
+                                 aggregation)
+
     def test_get_latest_timestmap_of_measures(self):
         measures = {"timestamps": [numpy.datetime64('1976-01-01T00:00:00'), numpy.datetime64('1970-02-01T00:00:00'),
                                    numpy.datetime64('1970-01-01T00:00:00'), numpy.datetime64('2030-01-01T00:00:00')]}
@@ -1255,10 +1808,11 @@ class TestStorageDriver(tests_base.TestCase):
     def test_store_data_backend(self):
 
         with mock.patch.object(self.storage.statistics, 'time') as time_mock_method:
-            with mock.patch.object(self.storage, '_delete_metric_splits') as delete_metric_splits_mock:
+            with mock.patch.object(
+                    self.storage, '_delete_metric_splits_of_any_version') as delete_metric_splits_mock:
                 with mock.patch.object(self.storage, '_update_metric_splits') as update_metric_splits_mock:
                     with mock.patch.object(
-                            self.storage, '_store_unaggregated_timeseries') as store_unaggregated_timeseries_mock:
+                            self.storage, '_store_serialized_bound_timeseries') as store_unaggregated_timeseries_mock:
 
                         new_boundts_mock = {}
                         splits_to_delete_mock = {}
@@ -1290,19 +1844,17 @@ class TestStorageDriver(tests_base.TestCase):
         metric_mock.needs_raw_data_truncation = True
         metric_mock.resource_id = None
 
-        resource_mock = mock.Mock()
-        resource_mock.ended_at = datetime.datetime.fromisoformat('2023-11-04').replace(tzinfo=datetime.timezone.utc)
-
-        indexer_driver_mock.get_resource.return_value = resource_mock
-
         with mock.patch('gnocchi.storage.LOG') as log_mock:
-            self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, measures, metric_mock)
+            self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, {metric_mock: measures})
 
-            indexer_driver_mock.update_needs_raw_data_truncation.assert_has_calls([mock.call(metric_mock.id)])
-            indexer_driver_mock.update_last_measure_timestamp.assert_has_calls([mock.call(metric_mock.id)])
+            indexer_driver_mock.update_needs_raw_data_truncation_for_metrics.assert_has_calls([
+                mock.call([metric_mock.id])])
+            indexer_driver_mock.update_last_measure_timestamp_for_metrics.assert_has_calls([
+                mock.call([metric_mock.id])])
 
-            self.assertEqual(1, indexer_driver_mock.update_needs_raw_data_truncation.call_count)
-            self.assertEqual(1, indexer_driver_mock.update_last_measure_timestamp.call_count)
+            self.assertEqual(1, indexer_driver_mock.update_needs_raw_data_truncation_for_metrics.call_count)
+            self.assertEqual(1, indexer_driver_mock.update_last_measure_timestamp_for_metrics.call_count)
+            self.assertEqual(0, indexer_driver_mock.get_resources.call_count)
 
             log_mock.debug.assert_has_calls([
                 mock.call("Metric [%s] does not have a resource assigned to it.", metric_mock)])
@@ -1319,17 +1871,13 @@ class TestStorageDriver(tests_base.TestCase):
         metric_mock.needs_raw_data_truncation = False
         metric_mock.resource_id = None
 
-        resource_mock = mock.Mock()
-        resource_mock.ended_at = datetime.datetime.fromisoformat('2023-11-04').replace(tzinfo=datetime.timezone.utc)
-
-        indexer_driver_mock.get_resource.return_value = resource_mock
-
         with mock.patch('gnocchi.storage.LOG') as log_mock:
-            self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, measures, metric_mock)
-            indexer_driver_mock.update_last_measure_timestamp.assert_has_calls([mock.call(metric_mock.id)])
+            self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, {metric_mock: measures})
+            indexer_driver_mock.update_last_measure_timestamp_for_metrics.assert_has_calls([
+                mock.call([metric_mock.id])])
 
-            self.assertEqual(1, indexer_driver_mock.update_last_measure_timestamp.call_count)
-            self.assertEqual(0, indexer_driver_mock.update_needs_raw_data_truncation.call_count)
+            self.assertEqual(1, indexer_driver_mock.update_last_measure_timestamp_for_metrics.call_count)
+            self.assertEqual(0, indexer_driver_mock.update_needs_raw_data_truncation_for_metrics.call_count)
 
             log_mock.debug.assert_has_calls([
                 mock.call("Metric [%s] does not have a resource assigned to it.", metric_mock)])
@@ -1354,21 +1902,25 @@ class TestStorageDriver(tests_base.TestCase):
         metric_mock.resource_id = resource_id
 
         resource_mock = mock.Mock()
+        resource_mock.id = resource_id
         resource_mock.ended_at = datetime.datetime.fromisoformat('2023-11-04').replace(tzinfo=datetime.timezone.utc)
 
-        indexer_driver_mock.get_resource.return_value = resource_mock
+        indexer_driver_mock.get_resources.return_value = [resource_mock]
 
         with mock.patch('gnocchi.storage.LOG') as log_mock:
-            self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, measures, metric_mock)
+            self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, {metric_mock: measures})
 
-            indexer_driver_mock.update_needs_raw_data_truncation.assert_has_calls([mock.call(metric_mock.id)])
-            indexer_driver_mock.update_last_measure_timestamp.assert_has_calls([mock.call(metric_mock.id)])
+            indexer_driver_mock.update_needs_raw_data_truncation_for_metrics.assert_has_calls([
+                mock.call([metric_mock.id])])
+            indexer_driver_mock.update_last_measure_timestamp_for_metrics.assert_has_calls([
+                mock.call([metric_mock.id])])
+            indexer_driver_mock.get_resources.assert_has_calls([mock.call('generic', [resource_id])])
 
             indexer_driver_mock.update_resource.assert_has_calls([
                 mock.call(resource_mock.type, resource_id, ended_at=None)])
 
-            self.assertEqual(1, indexer_driver_mock.update_needs_raw_data_truncation.call_count)
-            self.assertEqual(1, indexer_driver_mock.update_last_measure_timestamp.call_count)
+            self.assertEqual(1, indexer_driver_mock.update_needs_raw_data_truncation_for_metrics.call_count)
+            self.assertEqual(1, indexer_driver_mock.update_last_measure_timestamp_for_metrics.call_count)
             self.assertEqual(1, indexer_driver_mock.update_resource.call_count)
 
             log_mock.info.assert_has_calls([
@@ -1396,21 +1948,24 @@ class TestStorageDriver(tests_base.TestCase):
         metric_mock.resource_id = resource_id
 
         resource_mock = mock.Mock()
+        resource_mock.id = resource_id
         resource_mock.ended_at = datetime.datetime.fromisoformat('2023-11-04').replace(tzinfo=datetime.timezone.utc)
 
-        indexer_driver_mock.get_resource.return_value = resource_mock
+        indexer_driver_mock.get_resources.return_value = [resource_mock]
 
         latest_timestamp_in_measurements = datetime.datetime.fromisoformat('2022-01-01').replace(
             tzinfo=datetime.timezone.utc)
 
         with mock.patch('gnocchi.storage.LOG') as log_mock:
-            self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, measures, metric_mock)
+            self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, {metric_mock: measures})
 
-            indexer_driver_mock.update_needs_raw_data_truncation.assert_has_calls([mock.call(metric_mock.id)])
-            indexer_driver_mock.update_last_measure_timestamp.assert_has_calls([mock.call(metric_mock.id)])
+            indexer_driver_mock.update_needs_raw_data_truncation_for_metrics.assert_has_calls([
+                mock.call([metric_mock.id])])
+            indexer_driver_mock.update_last_measure_timestamp_for_metrics.assert_has_calls([
+                mock.call([metric_mock.id])])
 
-            self.assertEqual(1, indexer_driver_mock.update_needs_raw_data_truncation.call_count)
-            self.assertEqual(1, indexer_driver_mock.update_last_measure_timestamp.call_count)
+            self.assertEqual(1, indexer_driver_mock.update_needs_raw_data_truncation_for_metrics.call_count)
+            self.assertEqual(1, indexer_driver_mock.update_last_measure_timestamp_for_metrics.call_count)
             self.assertEqual(0, indexer_driver_mock.update_resource.call_count)
 
             log_mock.info.assert_has_calls([
@@ -1427,6 +1982,45 @@ class TestStorageDriver(tests_base.TestCase):
             self.assertEqual(1, log_mock.info.call_count)
             self.assertEqual(1, log_mock.debug.call_count)
 
+    def test_execute_metadata_updates_if_needed_batched(self):
+        old_measures = {"timestamps": [numpy.datetime64('2022-01-01T00:00:00')]}
+        new_measures = {"timestamps": [numpy.datetime64('2030-01-01T00:00:00')]}
+
+        indexer_driver_mock = mock.Mock()
+
+        resource_mock = mock.Mock()
+        resource_mock.id = 1
+        resource_mock.ended_at = datetime.datetime.fromisoformat('2023-11-04').replace(tzinfo=datetime.timezone.utc)
+        indexer_driver_mock.get_resources.return_value = [resource_mock]
+
+        metric_mocks = [mock.Mock(), mock.Mock(), mock.Mock()]
+        metric_mocks[0].needs_raw_data_truncation = True
+        metric_mocks[1].needs_raw_data_truncation = False
+        metric_mocks[2].needs_raw_data_truncation = False
+        metric_mocks[0].resource_id = resource_mock.id
+        metric_mocks[1].resource_id = resource_mock.id
+        metric_mocks[2].resource_id = None
+
+        self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, {
+            metric_mocks[0]: old_measures,
+            metric_mocks[1]: new_measures,
+            metric_mocks[2]: new_measures,
+        })
+
+        indexer_driver_mock.update_needs_raw_data_truncation_for_metrics.assert_called_once_with(
+            [metric_mocks[0].id])
+        indexer_driver_mock.update_last_measure_timestamp_for_metrics.assert_called_once_with(
+            [m.id for m in metric_mocks])
+        indexer_driver_mock.get_resources.assert_called_once_with('generic', [resource_mock.id])
+        # The most recent measure of all the resource metrics is used
+        indexer_driver_mock.update_resource.assert_called_once_with(
+            resource_mock.type, resource_mock.id, ended_at=None)
+
+    def test_execute_metadata_updates_if_needed_no_metrics(self):
+        indexer_driver_mock = mock.Mock()
+        self.storage.execute_metadata_updates_if_needed(indexer_driver_mock, {})
+        self.assertEqual([], indexer_driver_mock.mock_calls)
+
     def test_add_measures_to_metrics(self):
         raw_measures_mock = mock.Mock()
 
@@ -1442,6 +2036,9 @@ class TestStorageDriver(tests_base.TestCase):
                         with mock.patch("numpy.sort", return_value=measures_to_use) as numpy_sort_mock:
                             indexer_driver_mock = mock.Mock()
                             metrics_and_measures = {"metric1": measures_to_use}
+                            calls = mock.Mock()
+                            calls.attach_mock(store_data_backend_mock, "store")
+                            calls.attach_mock(execute_metadata_updates_if_needed_mock, "metadata")
 
                             self.storage.add_measures_to_metrics(metrics_and_measures, indexer_driver_mock)
 
@@ -1453,10 +2050,13 @@ class TestStorageDriver(tests_base.TestCase):
 
                             get_raw_measures_mock.assert_has_calls([mock.call(metrics_and_measures)])
                             store_data_backend_mock.assert_has_calls([mock.call([], {}, {})])
+                            execute_metadata_updates_if_needed_mock.assert_has_calls(
+                                [mock.call(indexer_driver_mock, {"metric1": measures_to_use})])
+
+                            self.assertEqual(["store", "metadata"],
+                                             [name for name, args, kwargs in calls.mock_calls])
 
                             for metric, measures in metrics_and_measures.items():
                                 numpy_sort_mock.assert_has_calls([mock.call(measures, order='timestamps')])
                                 execute_data_processing_mock.assert_has_calls(
                                     [mock.call(measures, metric, [], raw_measures_mock, {}, {})])
-                                execute_metadata_updates_if_needed_mock.assert_has_calls(
-                                    [mock.call(indexer_driver_mock, measures_to_use, metric)])
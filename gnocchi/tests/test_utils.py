@@ -162,6 +162,43 @@ class ParallelMap(tests_base.TestCase):
                                                 [[1], [2], [3]]))
             sm.assert_not_called()
 
+    def test_parallel_executor(self):
+        executor = utils.ParallelExecutor("test", 4, max_queue_size=1)
+
+        def double(x):
+            return x * 2
+
+        self.assertEqual([2, 4, 6], executor.map(double, [[1], [2], [3]]))
+        self.assertEqual([2], executor.map(double, [[1]]))
+        self.assertEqual(4, executor.statistics["double calls"])
+        self.assertEqual(0, executor.statistics["double in flight"])
+        self.assertGreater(executor.statistics["double run time"], 0)
+        self.assertIn("double queue wait time", executor.statistics)
+        # Threads are kept between calls
+        first_executor = executor._executor
+        executor.map(double, [[1]])
+        self.assertIs(first_executor, executor._executor)
+
+    def test_parallel_executor_nested(self):
+        executor = utils.ParallelExecutor("test", 2)
+
+        def nested(x):
+            return sum(executor.map(lambda y: y, [[x]] * 4))
+
+        self.assertEqual([4, 8, 12],
+                         executor.map(nested, [[1], [2], [3]]))
+
+    def test_parallel_map_executor(self):
+        utils.parallel_map.MAX_WORKERS = 4
+        name = str(uuid.uuid4())
+        self.assertEqual([1, 2, 3],
+                         utils.parallel_map(lambda x: x, [[1], [2], [3]],
+                                            executor=name))
+        self.assertIs(utils.get_executor(name), utils.get_executor(name))
+        self.assertEqual(
+            3, utils.get_executors_statistics()[
+                name + " executor <lambda> calls"])
+
 
 class ReturnNoneOnFailureTest(tests_base.TestCase):
     def test_works(self):
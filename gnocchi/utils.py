@@ -14,12 +14,14 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import collections
 import datetime
 import errno
 import functools
 import itertools
 import multiprocessing
 import os
+import threading
 import uuid
 import warnings
 
@@ -299,20 +301,145 @@ def sequencial_map(fn, list_of_args):
     return list(itertools.starmap(fn, list_of_args))
 
 
-def parallel_map(fn, list_of_args):
-    """Run a function in parallel."""
+class ParallelExecutor(object):
+    """A long-lived pool of threads running functions in parallel.
 
-    if parallel_map.MAX_WORKERS == 1:
-        return sequencial_map(fn, list_of_args)
+    Threads are started on first use and kept for the following calls. The
+    number of calls waiting for a thread can be bounded, in which case
+    submitting more calls blocks until some are done.
+
+    The time spent waiting for a thread, the time spent running and the
+    number of calls in flight are recorded for each function name in
+    `statistics'.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, name, max_workers, max_queue_size=0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.statistics = collections.defaultdict(lambda: 0)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+
+    def _mark_worker(self):
+        self._local.executor = self
+
+    def _get_executor(self):
+        with self._lock:
+            # Threads do not survive a fork, start new ones in the child
+            # process.
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="gnocchi-%s" % self.name,
+                    initializer=self._mark_worker)
+                if self.max_queue_size:
+                    self._slots = threading.BoundedSemaphore(
+                        self.max_workers + self.max_queue_size)
+                else:
+                    self._slots = None
+                self._pid = os.getpid()
+            return self._executor, self._slots
 
-    with futures.ThreadPoolExecutor(
-            max_workers=parallel_map.MAX_WORKERS) as executor:
+    def _run(self, slots, operation, submitted_at, fn, args):
+        started_at = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            ended_at = time.monotonic()
+            with self._lock:
+                self.statistics[operation + " queue wait time"] += (
+                    started_at - submitted_at)
+                self.statistics[operation + " run time"] += (
+                    ended_at - started_at)
+                self.statistics[operation + " in flight"] -= 1
+            if slots is not None:
+                slots.release()
+
+    def map(self, fn, list_of_args):
+        """Run a function in parallel.
+
+        :param fn: The function to run.
+        :param list_of_args: An iterable of arguments lists to call `fn'
+                             with.
+        :return: The list of results, in the order of `list_of_args'.
+        """
+        # Waiting for calls submitted from one of our threads could block all
+        # of them, run those in the calling thread.
+        if (self.max_workers == 1
+           or getattr(self._local, "executor", None) is self):
+            return sequencial_map(fn, list_of_args)
+
+        operation = getattr(fn, "__name__", "unknown")
+        executor, slots = self._get_executor()
+        fs = []
+        for args in list_of_args:
+            if slots is not None:
+                slots.acquire()
+            with self._lock:
+                self.statistics[operation + " calls"] += 1
+                self.statistics[operation + " in flight"] += 1
+            fs.append(executor.submit(
+                self._run, slots, operation, time.monotonic(), fn, args))
         # We use 'list' to iterate all threads here to raise the first
         # exception now, not much choice
-        return list(executor.map(lambda args: fn(*args), list_of_args))
+        return [f.result() for f in fs]
+
+
+_EXECUTORS = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def get_executor(name):
+    """Return the shared executor with this name, creating it if needed.
+
+    Its number of threads is set by `parallel_map.MAX_WORKERS_BY_EXECUTOR',
+    or `parallel_map.MAX_WORKERS' by default.
+    """
+    with _EXECUTORS_LOCK:
+        try:
+            return _EXECUTORS[name]
+        except KeyError:
+            executor = _EXECUTORS[name] = ParallelExecutor(
+                name,
+                parallel_map.MAX_WORKERS_BY_EXECUTOR.get(
+                    name, parallel_map.MAX_WORKERS),
+                parallel_map.MAX_QUEUE_SIZE)
+            return executor
+
+
+def get_executors_statistics():
+    """Return the statistics of all the executors, prefixed by their name."""
+    with _EXECUTORS_LOCK:
+        executors = list(_EXECUTORS.values())
+    statistics = {}
+    for executor in executors:
+        with executor._lock:
+            for key, value in executor.statistics.items():
+                statistics["%s executor %s" % (executor.name, key)] = value
+    return statistics
+
+
+def parallel_map(fn, list_of_args, executor="default"):
+    """Run a function in parallel.
+
+    :param executor: The name of the shared executor to use.
+    """
+
+    if parallel_map.MAX_WORKERS_BY_EXECUTOR.get(
+            executor, parallel_map.MAX_WORKERS) == 1:
+        return sequencial_map(fn, list_of_args)
+
+    return get_executor(executor).map(fn, list_of_args)
 
 
 parallel_map.MAX_WORKERS = get_default_workers()
+parallel_map.MAX_WORKERS_BY_EXECUTOR = {}
+parallel_map.MAX_QUEUE_SIZE = 0
 
 
 def return_none_on_failure(f):